@@ -0,0 +1,294 @@
+"""
+Benchmark the backend under load. Run `python3 -m benchmarks --help` in `backend` for the options.
+
+The benchmark creates a SQLite database with one user per virtual user, starts fake Canvas and
+Todoist servers, serves the backend with server.py like the Docker image, or with waitress to
+compare, and runs the student journey from benchmarks/journeys.py for every user concurrently. It
+reports the p50, p95, and p99 latency of every step and the requests per second, and compares them
+to a stored baseline.
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+from pathlib import Path  # noqa: E402
+import socket  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+from gevent.pool import Pool  # noqa: E402
+import requests  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+SRC_DIR = BACKEND_DIR / 'src'
+SECRETS_DIR = BACKEND_DIR.parent / 'secrets.example'
+sys.path.insert(0, str(SRC_DIR))
+
+from benchmarks.fake_servers import FakeCanvasData, create_canvas_app, create_todoist_app, \
+    start_server  # noqa: E402
+from benchmarks.journeys import BenchmarkClient, JourneyError, Results, \
+    student_journey  # noqa: E402
+
+DEFAULT_BASELINES = BACKEND_DIR / 'benchmarks' / 'baselines.json'
+PASSWORD = 'benchmarkpassword'
+
+
+#################################################################
+#                                                               #
+#                             SETUP                             #
+#                                                               #
+#################################################################
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def create_database(directory: str, users: int) -> str:
+    """
+    Create an up to date SQLite database with a user for every virtual user. Users are created
+    directly because signing up checks the Todoist token against the real Todoist API.
+
+    :param directory: The directory to create the database in.
+    :param users: The number of users to create.
+    :return str: The path of a file with the connection string, for DB_CONN_FILE.
+    """
+    from migrations import runner
+    from utils.crypto import encrypt_str, get_todo_secret, KDF_HKDF
+    import utils.models as models
+
+    uri = f'sqlite:///{os.path.join(directory, "benchmark.db")}'
+    engine = create_engine(uri)
+    runner.upgrade(engine)
+
+    password_hash = models.password_hasher.hash(PASSWORD)
+    with Session(engine) as session:
+        for i in range(users):
+            session.add(models.User(
+                login_id=f'BENCH{i:03d}', username=f'bench{i}', password=password_hash,
+                canvas_id=str(i), canvas_name=f'Student {i}',
+                canvas_token_password=encrypt_str(f'canvas-token-{i}', PASSWORD).to_bytes(),
+                # Encrypted like add_user does, so that signing in doesn't upgrade the token
+                todoist_token_password=encrypt_str(f'todoist-token-{i}', get_todo_secret(),
+                                                   KDF_HKDF).to_bytes(),
+            ))
+        session.commit()
+    engine.dispose()
+
+    conn_file = os.path.join(directory, 'connection_string.txt')
+    with open(conn_file, 'w') as file:
+        file.write(uri)
+    return conn_file
+
+
+def server_command(server: str, port: int, threads: int, workers: int) -> list[str]:
+    """
+    Get the command that serves the backend.
+
+    :param server: 'gevent' for server.py, which the Docker image uses, or 'waitress'.
+    :param port: The port to serve the backend on.
+    :param threads: The number of waitress threads.
+    :param workers: The number of server.py worker processes.
+    :return list[str]: The command.
+    """
+    if server == 'waitress':
+        return [sys.executable, '-m', 'waitress', '--host=127.0.0.1', f'--port={port}',
+                f'--threads={threads}', '--call', 'app:create_app']
+    return [sys.executable, '-m', 'server', '--host=127.0.0.1', f'--port={port}',
+            f'--workers={workers}']
+
+
+def start_backend(command: list[str], env: dict, port: int, timeout: float = 30):
+    """
+    Start the backend and wait until it accepts requests.
+
+    :return Popen: The backend process.
+    """
+    process = subprocess.Popen(command, cwd=SRC_DIR, env=env)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'The backend exited with {process.returncode}')
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/auth/status', timeout=5)
+            return process
+        except requests.RequestException:
+            gevent.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError('The backend did not start in time')
+
+
+#################################################################
+#                                                               #
+#                           BASELINES                           #
+#                                                               #
+#################################################################
+
+
+def compare(summary: dict, baseline: dict, tolerance: float, noise_ms: float = 5.0) -> list[str]:
+    """
+    Compare a summary to a baseline.
+
+    :param summary: The summary of this run, see Results.summary.
+    :param baseline: The summary of the baseline run.
+    :param tolerance: The fraction by which a latency may grow or the requests per second may drop.
+    :param noise_ms: Latencies that grew by fewer milliseconds than this are never regressions.
+    :return list[str]: A description of every regression.
+    """
+    regressions = []
+    for step, expected in baseline.items():
+        actual = summary.get(step)
+        if actual is None:
+            continue
+
+        for key in ('p50', 'p95', 'p99'):
+            if actual[key] > expected[key] * (1 + tolerance) \
+                    and actual[key] - expected[key] > noise_ms:
+                regressions.append(f'{step} {key}: {actual[key]} ms, baseline {expected[key]} ms')
+
+        if 'rps' in expected and actual['rps'] < expected['rps'] * (1 - tolerance):
+            regressions.append(f'{step} requests/s: {actual["rps"]}, baseline {expected["rps"]}')
+    return regressions
+
+
+def print_summary(summary: dict):
+    print(f'{"step":<28}{"count":>8}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for step, stats in summary.items():
+        print(f'{step:<28}{stats["count"]:>8}{stats["errors"]:>8}{stats["p50"]:>10}'
+              f'{stats["p95"]:>10}{stats["p99"]:>10}')
+    print(f'requests/s: {summary["total"]["rps"]}')
+
+
+#################################################################
+#                                                               #
+#                              RUN                              #
+#                                                               #
+#################################################################
+
+
+def run_journeys(base_url: str, users: int, iterations: int, canvas_id: int) -> Results:
+    """
+    Run the student journey for every user concurrently.
+
+    :param base_url: The URL of the backend.
+    :param users: The number of concurrent virtual users.
+    :param iterations: The number of journeys each user makes.
+    :param canvas_id: The Canvas ID of an assignment every user can add a subtask to.
+    :return Results: The latency of every request.
+    """
+    results = Results()
+
+    def run_user(i: int):
+        client = BenchmarkClient(base_url, results)
+        state = {'canvas_id': canvas_id}
+        for _ in range(iterations):
+            try:
+                student_journey(client, f'bench{i}', PASSWORD, state)
+            except JourneyError as ex:
+                print(f'bench{i}: {ex}', file=sys.stderr)
+                client.session_cookie = None
+
+    pool = Pool(users)
+    for i in range(users):
+        pool.spawn(run_user, i)
+    pool.join()
+
+    results.finish()
+    return results
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='benchmarks', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=3, help='journeys per user')
+    parser.add_argument('--canvas-latency', type=float, default=0.05,
+                        help='seconds the fake Canvas server waits before every response')
+    parser.add_argument('--todoist-latency', type=float, default=0.05,
+                        help='seconds the fake Todoist server waits before every response')
+    parser.add_argument('--page-size', type=int, default=10, help='largest Canvas page')
+    parser.add_argument('--courses', type=int, default=5, help='courses per user')
+    parser.add_argument('--assignments', type=int, default=20, help='assignments per course')
+    parser.add_argument('--server', choices=('gevent', 'waitress'), default='gevent',
+                        help='serve the backend with server.py or with waitress')
+    parser.add_argument('--threads', type=int, default=4, help='waitress threads')
+    parser.add_argument('--workers', type=int, default=1, help='server.py worker processes')
+    parser.add_argument('--scenario', help='name of the baseline, derived from the options if '
+                                           'not set')
+    parser.add_argument('--baselines', type=Path, default=DEFAULT_BASELINES,
+                        help='JSON file with the baseline of every scenario')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store this run as the baseline of the scenario')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction by which results may be worse than the baseline')
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = get_parser().parse_args(argv)
+    scenario = args.scenario or f'{args.server}-{args.users}u-{args.iterations}i-' \
+                                f'{args.canvas_latency}s-{args.courses}c{args.assignments}a'
+
+    from api.v1.courses import get_term
+    semester, year = get_term()
+    data = FakeCanvasData(courses=args.courses, assignments_per_course=args.assignments,
+                          term=f'{year}{semester}')
+    canvas = start_server(create_canvas_app(data, args.canvas_latency, args.page_size))
+    todoist = start_server(create_todoist_app(args.todoist_latency))
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['TODO_SECRET_FILE'] = str(SECRETS_DIR / 'todoist_secret_encrypt.txt')
+        conn_file = create_database(directory, args.users)
+
+        port = get_free_port()
+        env = {
+            **os.environ,
+            'DB_CONN_FILE': conn_file,
+            'SESSION_SECRET_FILE': str(SECRETS_DIR / 'session_secret.txt'),
+            'TODOIST_SECRET': str(SECRETS_DIR / 'todoist_secret.txt'),
+            'CSRF': 'OFF',
+            'CANVAS_BASE_URL': f'http://127.0.0.1:{canvas.server_port}',
+            'TODOIST_BASE_URL': f'http://127.0.0.1:{todoist.server_port}',
+        }
+        command = server_command(args.server, port, args.threads, args.workers)
+        backend = start_backend(command, env, port)
+        try:
+            results = run_journeys(f'http://127.0.0.1:{port}', args.users, args.iterations,
+                                   canvas_id=data.assignment(data.course_ids()[0], 0)['id'])
+        finally:
+            backend.terminate()
+            backend.wait()
+            canvas.stop()
+            todoist.stop()
+
+    summary = results.summary()
+    print(f'Scenario {scenario}')
+    print_summary(summary)
+
+    baselines = json.loads(args.baselines.read_text()) if args.baselines.exists() else {}
+    if args.save_baseline:
+        baselines[scenario] = summary
+        args.baselines.write_text(json.dumps(baselines, indent=2) + '\n')
+        print(f'Saved the baseline of {scenario} to {args.baselines}')
+    elif scenario in baselines:
+        regressions = compare(summary, baselines[scenario], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+
+    return 1 if summary['total']['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
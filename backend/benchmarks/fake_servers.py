@@ -0,0 +1,231 @@
+"""
+This file provides local stand-ins for the Canvas and Todoist APIs so that the backend can be
+benchmarked without real accounts. They implement the endpoints the backend calls, return
+deterministic data, and add a configurable latency to every response. Canvas lists are paginated
+with `Link` headers like the real API.
+"""
+
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import itertools
+import json
+from urllib.parse import urlencode
+import uuid
+
+from flask import Flask, jsonify, request
+import gevent
+from gevent.pywsgi import WSGIServer
+
+
+@dataclass
+class FakeCanvasData:
+    """
+    The courses and assignments every user of the fake Canvas server is enrolled in.
+
+    :param courses: The number of active courses.
+    :param assignments_per_course: The number of assignments in each course.
+    :param term: The term prefix of course names, such as '2024FA'. The backend only shows courses
+    of the current term, see api.v1.courses.get_term.
+    """
+    courses: int = 5
+    assignments_per_course: int = 20
+    term: str = ''
+
+    def __post_init__(self):
+        # Due dates are fixed when the server starts so that syncing is deterministic
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def course_ids(self) -> list[int]:
+        return [1000 + i for i in range(self.courses)]
+
+    def course(self, course_id: int) -> dict:
+        return {
+            'id': course_id,
+            'name': f'{self.term}-ITSC-{course_id}',
+            'course_code': f'ITSC-{course_id}',
+            'uuid': str(uuid.uuid5(uuid.NAMESPACE_URL, f'course-{course_id}')),
+            'concluded': False,
+            'calendar': {'ics': ''},
+            'enrollments': [{'type': 'student', 'computed_current_score': 90.0}],
+            'term': {'id': 1, 'name': self.term},
+            'image_download_url': None,
+        }
+
+    def assignment(self, course_id: int, index: int) -> dict:
+        assignment_id = course_id * 1000 + index
+        due_at = self.now + timedelta(days=1 + index % 28, hours=index % 24)
+        return {
+            'id': assignment_id,
+            'name': f'Assignment {index} of {course_id}',
+            'description': f'<p>Complete assignment {index}.</p>',
+            'due_at': due_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'lock_at': None,
+            'course_id': course_id,
+            'html_url': f'https://canvas.test/courses/{course_id}/assignments/{assignment_id}',
+            'points_possible': 10,
+            'submission_types': ['online_upload'],
+            'graded_submissions_exist': False,
+            'published': True,
+            'workflow_state': 'published',
+        }
+
+    def assignments(self, course_id: int) -> list[dict]:
+        return [self.assignment(course_id, index) for index in range(self.assignments_per_course)]
+
+
+def _paginate(items: list[dict], page_size: int):
+    """
+    Return a page of items, with a `Link` header to the next page like the Canvas API.
+
+    :param items: Every item of the list.
+    :param page_size: The largest page the server returns, whatever per_page is requested.
+    """
+    per_page = min(request.args.get('per_page', 10, type=int), page_size)
+    page = request.args.get('page', 1, type=int)
+    response = jsonify(items[(page - 1) * per_page:page * per_page])
+
+    if page * per_page < len(items):
+        args = request.args.to_dict(flat=False)
+        args['page'] = [str(page + 1)]
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args, doseq=True)}>; rel="next"'
+    return response
+
+
+def create_canvas_app(data: FakeCanvasData, latency: float = 0.0, page_size: int = 10) -> Flask:
+    """
+    Create a stand-in for the Canvas REST API.
+
+    :param data: The courses and assignments to return.
+    :param latency: The number of seconds to wait before every response.
+    :param page_size: The largest page of a paginated list.
+    :return Flask: The WSGI app.
+    """
+    app = Flask('fake_canvas')
+
+    @app.before_request
+    def wait():
+        gevent.sleep(latency)
+
+    @app.get('/api/v1/users/self')
+    @app.get('/api/v1/users/self/profile')
+    def get_current_user():
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        user_id = int(uuid.uuid5(uuid.NAMESPACE_URL, token).int % 100000)
+        return jsonify({'id': user_id, 'name': f'Student {user_id}', 'primary_email': None})
+
+    @app.get('/api/v1/courses')
+    def get_courses():
+        return _paginate([data.course(course_id) for course_id in data.course_ids()], page_size)
+
+    @app.get('/api/v1/courses/<int:course_id>')
+    def get_course(course_id: int):
+        return jsonify(data.course(course_id))
+
+    @app.get('/api/v1/courses/<int:course_id>/assignments')
+    def get_assignments(course_id: int):
+        return _paginate(data.assignments(course_id), page_size)
+
+    @app.get('/api/v1/courses/<int:course_id>/assignments/<int:assignment_id>')
+    def get_assignment(course_id: int, assignment_id: int):
+        return jsonify(data.assignment(course_id, assignment_id % 1000))
+
+    @app.get('/api/v1/calendar_events')
+    def get_calendar_events():
+        context_codes = request.args.getlist('context_codes[]')
+        course_ids = [int(code.removeprefix('course_')) for code in context_codes]
+        if request.args.get('type') != 'assignment':
+            return _paginate([], page_size)
+
+        events = [
+            {
+                'id': f'assignment_{assignment["id"]}',
+                'title': assignment['name'],
+                'description': assignment['description'],
+                'type': 'assignment',
+                'start_at': assignment['due_at'],
+                'end_at': assignment['due_at'],
+                'html_url': assignment['html_url'],
+                'context_code': f'course_{course_id}',
+                'context_name': data.course(course_id)['name'],
+                'assignment': assignment,
+            }
+            for course_id in course_ids for assignment in data.assignments(course_id)
+        ]
+        return _paginate(events, page_size)
+
+    return app
+
+
+def create_todoist_app(latency: float = 0.0) -> Flask:
+    """
+    Create a stand-in for the Todoist sync and REST APIs. Tasks are kept in memory for each token.
+
+    :param latency: The number of seconds to wait before every response.
+    :return Flask: The WSGI app.
+    """
+    app = Flask('fake_todoist')
+    # Token -> task ID -> whether the task is checked
+    items = {}
+    ids = itertools.count(1)
+
+    def get_items() -> dict:
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        return items.setdefault(token, {})
+
+    @app.before_request
+    def wait():
+        gevent.sleep(latency)
+
+    @app.post('/sync/v9/sync')
+    def sync():
+        user_items = get_items()
+        temp_id_mapping = {}
+        # The backend sends the commands as a JSON string in a form field
+        for command in json.loads(request.form.get('commands', '[]')):
+            if command['type'] == 'item_add':
+                task_id = str(next(ids))
+                user_items[task_id] = False
+                temp_id_mapping[command['temp_id']] = task_id
+
+        return jsonify({
+            'sync_token': uuid.uuid4().hex,
+            'temp_id_mapping': temp_id_mapping,
+            'items': [{'id': task_id, 'checked': checked}
+                      for task_id, checked in user_items.items()],
+        })
+
+    @app.post('/rest/v2/tasks')
+    def add_task():
+        task_id = str(next(ids))
+        get_items()[task_id] = False
+        return jsonify({'id': task_id, **(request.get_json(silent=True) or {})})
+
+    @app.post('/rest/v2/tasks/<task_id>')
+    def update_task(task_id: str):
+        return jsonify({'id': task_id})
+
+    @app.post('/rest/v2/tasks/<task_id>/close')
+    def close_task(task_id: str):
+        get_items()[task_id] = True
+        return '', 204
+
+    @app.post('/rest/v2/tasks/<task_id>/reopen')
+    def reopen_task(task_id: str):
+        get_items()[task_id] = False
+        return '', 204
+
+    return app
+
+
+def start_server(app: Flask, port: int = 0) -> WSGIServer:
+    """
+    Serve an app in the background of the current process. Requires gevent's monkey patching.
+
+    :param app: The app to serve.
+    :param port: The port to listen on. Defaults to any free port.
+    :return WSGIServer: The started server. Its URL is `f'http://127.0.0.1:{server.server_port}'`.
+    """
+    server = WSGIServer(('127.0.0.1', port), app, log=None)
+    server.start()
+    return server
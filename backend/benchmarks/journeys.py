@@ -0,0 +1,168 @@
+"""
+This file provides the scripted user journeys that the benchmark drives against the backend, and
+collects the latency of every request they make.
+"""
+
+
+from collections import defaultdict
+from datetime import date, timedelta
+import math
+import time
+
+import requests
+
+
+class JourneyError(Exception):
+    """Raised when a request of a journey fails, which ends that journey."""
+    pass
+
+
+class Results:
+    """
+    The latencies and errors of every request, grouped by step.
+    """
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.start = time.perf_counter()
+        self.end = None
+
+    def record(self, step: str, seconds: float, ok: bool):
+        """
+        Record a request.
+
+        :param step: The name of the step that made the request.
+        :param seconds: How long the request took.
+        :param ok: False if the request failed.
+        """
+        self.latencies[step].append(seconds)
+        if not ok:
+            self.errors[step] += 1
+
+    def finish(self):
+        """Stop the clock for the requests per second."""
+        self.end = time.perf_counter()
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Summarize the results. Latencies are in milliseconds.
+
+        :return dict: The count, errors, p50, p95, and p99 of every step and of all requests, as
+        well as the requests per second of all requests under 'total'.
+        """
+        elapsed = (self.end or time.perf_counter()) - self.start
+        summary = {step: _summarize(latencies, self.errors[step])
+                   for step, latencies in self.latencies.items()}
+
+        all_latencies = [latency for latencies in self.latencies.values() for latency in latencies]
+        summary['total'] = _summarize(all_latencies, sum(self.errors.values()))
+        summary['total']['rps'] = round(len(all_latencies) / elapsed, 2) if elapsed else 0.0
+        return summary
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """
+    Get a percentile of a list of values with the nearest-rank method.
+
+    :param values: The values, in any order.
+    :param pct: The percentile, between 0 and 100.
+    :return float: The value at the percentile, or 0 if there are no values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def _summarize(latencies: list[float], errors: int) -> dict[str, float]:
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'p50': round(percentile(latencies, 50) * 1000, 1),
+        'p95': round(percentile(latencies, 95) * 1000, 1),
+        'p99': round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+class BenchmarkClient:
+    """
+    An HTTP client for one virtual user that records the latency of every request.
+
+    :param base_url: The URL of the backend, such as 'http://127.0.0.1:5000'.
+    :param results: Where to record the requests.
+    """
+    def __init__(self, base_url: str, results: Results):
+        self.base_url = base_url
+        self.results = results
+        self.http = requests.Session()
+        self.session_cookie = None
+
+    def request(self, step: str, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request to the backend and record its latency under a step.
+
+        :param step: The name of the step.
+        :param method: The HTTP method.
+        :param path: The path of the endpoint.
+        :raises JourneyError: If the request fails or the backend returns an error.
+        :return Response: The response.
+        """
+        # The session cookie is marked Secure, so requests won't send it back over plain HTTP
+        headers = kwargs.pop('headers', {})
+        if self.session_cookie is not None:
+            headers['Cookie'] = f'session={self.session_cookie}'
+
+        start = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, headers=headers, timeout=120,
+                                         **kwargs)
+        except requests.RequestException as ex:
+            self.results.record(step, time.perf_counter() - start, ok=False)
+            raise JourneyError(f'{step}: {ex}')
+
+        self.results.record(step, time.perf_counter() - start, ok=response.ok)
+        if 'session' in response.cookies:
+            self.session_cookie = response.cookies['session']
+        if not response.ok:
+            raise JourneyError(f'{step}: {method} {path} returned {response.status_code}')
+        return response
+
+
+def student_journey(client: BenchmarkClient, username: str, password: str, state: dict):
+    """
+    Sign in, open the dashboard and the calendar, sync with Todoist, toggle a subtask, and sign out,
+    like a student checking their work for the week.
+
+    :param client: The client of the virtual user.
+    :param username: The username of the user.
+    :param password: The password of the user.
+    :param state: Kept between the journeys of the same user, to remember the subtask to toggle.
+    """
+    client.request('login', 'POST', '/api/auth/login',
+                   json={'username': username, 'password': password})
+
+    client.request('dashboard: courses', 'GET', '/api/v1/courses/all')
+    client.request('dashboard: due soon', 'GET', '/api/v1/user/due_soon')
+    client.request('dashboard: notifications', 'GET', '/api/v1/user/get_notifications')
+
+    today = date.today()
+    client.request('calendar', 'GET', '/api/v1/user/calendar_events',
+                   params={'start_date': today.isoformat(),
+                           'end_date': (today + timedelta(days=35)).isoformat()})
+
+    client.request('sync', 'POST', '/api/v1/tasks/update')
+
+    # Subtasks can only be added to assignments that were synced
+    if 'subtask' not in state:
+        response = client.request('add subtask', 'POST', '/api/v1/tasks/add_subtask', json={
+            'canvas_id': state['canvas_id'],
+            'name': 'Read the instructions',
+            'status': 0,
+            'due_date': (today + timedelta(days=7)).isoformat(),
+        })
+        state['subtask'] = response.json()['todoist_id']
+    client.request('toggle subtask', 'POST', f'/api/v1/tasks/{state["subtask"]}/toggle')
+
+    client.request('logout', 'POST', '/api/auth/logout')
+    client.session_cookie = None
@@ -0,0 +1,43 @@
+from flask import Blueprint, Response, abort, jsonify, request, send_file
+from http import HTTPStatus
+import hmac
+
+from utils.metrics import render
+from utils.profiling import list_profile_ids, get_profile_metadata, get_profile_path
+from utils.settings import get_admin_token
+
+
+admin = Blueprint('admin', __name__)
+
+
+# Admin endpoints are not tied to a user. They require the token in ADMIN_TOKEN_FILE and don't
+# exist if it isn't configured.
+@admin.before_request
+def ensure_admin_token():
+    token = get_admin_token()
+    if token is None:
+        abort(HTTPStatus.NOT_FOUND)
+
+    authorization = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        abort(HTTPStatus.UNAUTHORIZED)
+
+
+@admin.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+# Profiles of requests with the admin token in the X-Profile header, see utils.profiling
+@admin.route('/admin/profiles', methods=['GET'])
+def get_profiles():
+    profiles = [get_profile_metadata(profile_id) for profile_id in reversed(list_profile_ids())]
+    return jsonify([profile for profile in profiles if profile is not None])
+
+
+@admin.route('/admin/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id: str):
+    path = get_profile_path(profile_id)
+    if path is None:
+        abort(HTTPStatus.NOT_FOUND)
+    return send_file(path, as_attachment=True)
@@ -1,17 +1,18 @@
 from argon2.exceptions import VerifyMismatchError
-from flask import Blueprint, request, abort, Request, jsonify, session
+from flask import Blueprint, request, abort, Request, current_app, jsonify, session
 from flask_login import LoginManager, login_required, login_user, logout_user, current_user
 from flask_wtf import CSRFProtect
 from api.auth.todoist import todoist, exchange_token
 from flask_wtf.csrf import generate_csrf
 from http import HTTPStatus
-from lru import LRU
-from utils.settings import time_it
+from utils.settings import time_it, is_background_sync_enabled
 
 from utils.queries import get_user_by_username, get_user_by_login_id, add_user, update_password, \
-    does_username_exists
-from utils.crypto import reencrypt_str, get_todo_secret
+    does_username_exists, get_sync_state, store_sync_credentials, store_server_tokens
+from utils.crypto import decrypt_str, decrypt_str_upgrade, encrypt_str, get_todo_secret, KDF_HKDF
 from utils.models import User, password_hasher
+from utils.passwords import rehash_in_background
+from utils.session import store_api_keys, load_api_keys, remove_api_keys
 
 
 auth = Blueprint('authentication', __name__)
@@ -20,8 +21,6 @@ auth.register_blueprint(todoist, url_prefix='/todoist')
 
 login_manager = LoginManager()
 csrf = CSRFProtect()
-# This value effectively limits the maximum number of concurrent sessions
-api_key_cache = LRU(50)
 
 
 class TodoistAuthInfo:
@@ -65,20 +64,13 @@ def user_loader(login_id):
     if db_user is None:
         return None
 
-    # Try to get the re-encrypted API keys
-    # If they don't exist, invalidate the session
-    if session['_id'] not in api_key_cache:
-        # ATTENTION: If the session id is not saved in the api_key_cache, the user will need to
-        # login again so that the session id and the tokens encryped with the session id can be
-        # stored in the cache. Otherwise the user won't be able to use any endpoint as they would be
-        # logged in but without tokens in the cache.
+    # Load the API keys re-encrypted for this session, which any worker can read
+    # If they don't exist or expired, invalidate the session
+    if not load_api_keys(db_user):
+        # ATTENTION: Without the tokens encrypted with the session's secret, the user would be
+        # logged in but unable to use any endpoint, so they need to login again.
         return None
 
-    # Load cached values for the API tokens
-    canvas_key, todoist_key = api_key_cache[session['_id']]
-    db_user.canvas_token_session = canvas_key
-    db_user.todoist_token_session = todoist_key
-
     return db_user
 
 #################################################################
@@ -122,22 +114,33 @@ def login():
                 abort(HTTPStatus.UNAUTHORIZED)
                 return
 
+            # Hashes made with outdated argon2 parameters are replaced after the response
+            if password_hasher.check_needs_rehash(db_user.password):
+                rehash_in_background(current_app._get_current_object(), db_user.id,
+                                     db_user.password, password)
+
             # Update the session for the user using the User's login_id
             login_user(db_user)
 
         with time_it('Decrypting and Encrypting tokens:'):
-            # Get the session identifier from the session
-            # This is provided by Flask-Login as a unique identifer
-            session_id = session['_id']
-
-            # Decrypt tokens with password and re-encrypt with session_id
-            session_canvas_token = reencrypt_str(db_user.canvas_token_password, password,
-                                                 session_id)
-            session_todoist_token = reencrypt_str(db_user.todoist_token_password, get_todo_secret(),
-                                                  session_id)
+            # Decrypt tokens with password, they are re-encrypted with the session's secret
+            canvas_token = decrypt_str(db_user.canvas_token_password, password)
+            todoist_token, upgraded = decrypt_str_upgrade(db_user.todoist_token_password,
+                                                          get_todo_secret(), KDF_HKDF)
+            # Tokens encrypted before the server secret used HKDF are replaced on first use
+            if upgraded is not None:
+                store_server_tokens(db_user, todoist_token_password=upgraded.to_bytes())
+
+            # Store the re-encrypted tokens for future requests, whichever worker serves them
+            if not store_api_keys(db_user, canvas_token, todoist_token):
+                logout_user()
+                abort(HTTPStatus.INTERNAL_SERVER_ERROR)
+                return
 
-            # Cache API re-encrypted tokens for future requests
-            api_key_cache[session_id] = (session_canvas_token, session_todoist_token)
+            # Keep a copy of the Canvas token the server can decrypt so that the sync daemon can
+            # sync this user while they are signed out
+            if is_background_sync_enabled():
+                _store_sync_credentials(db_user, canvas_token)
 
     # Respond that the user was authenticated
     return jsonify({'success': True, 'message': f"Logged in as {db_user.username}"})
@@ -223,10 +226,8 @@ def change_password():
     # Update database with new password, rencrypt tokens, and new login id
     update_password(current_user, new_password, old_password)
 
-    # Delete old session information from cache
-    old_session_id = session.get('_id')
-    if old_session_id:
-        del api_key_cache[old_session_id]
+    # The new login id signs out every session, so delete the tokens of all of them
+    remove_api_keys(current_user, every_session=True)
 
     # Logout User
     logout_user()
@@ -237,6 +238,7 @@ def change_password():
 @auth.route('/logout', methods=['POST'])
 @login_required
 def logout():
+    remove_api_keys(current_user)
     logout_user()
     return jsonify({'success': True, 'message': 'Logged out successfully'}), 200
 
@@ -315,6 +317,19 @@ def _get_authentication_params(request: Request, include_tokens: bool = False)\
     return params
 
 
+def _store_sync_credentials(user: User, canvas_token: str):
+    """
+    Store the user's Canvas token encrypted with the server secret, unless it is already stored.
+
+    :param user: The user that signed in.
+    :param canvas_token: The user's Canvas API key.
+    """
+    state = get_sync_state(user)
+    if state is None or state.canvas_token_server is None:
+        store_sync_credentials(user, encrypt_str(canvas_token, get_todo_secret(),
+                                                 KDF_HKDF).to_bytes())
+
+
 def _is_valid_username(username: str) -> bool:
     """
     Determines if a given username complies with the username requirements for the site.
@@ -1,14 +1,15 @@
 from flask import request, abort, session, redirect, render_template_string, Blueprint
 from flask_login import current_user
-from utils.settings import generate_random_string, get_frontend_url
+import utils.deadlines as deadlines
+from utils.instrumentation import record_call
+from utils.settings import generate_random_string, get_frontend_url, get_todoist_client_secret
 import os
 import requests
 
 
 # Todoist OAuth 2.0 Secret
 TODOIST_CLIENT = os.environ.get('TODOIST_CLIENT', '033c2a73ad3347609e9cf6ed1b0cd3fa')
-with open(os.environ.get('TODOIST_SECRET', '../../secrets/todoist_secret.txt'), 'r') as file:
-    TODOIST_SECRET = file.readline().strip()
+TODOIST_SECRET = get_todoist_client_secret()
 
 
 todoist = Blueprint('todoist', __name__)
@@ -94,7 +95,10 @@ def exchange_token(code: str, state: str, session):
         'client_secret': TODOIST_SECRET,
         'code': code
     }
-    response = requests.post(todoist_token_url, data=body)
+    with record_call('todoist', todoist_token_url) as call:
+        response = requests.post(todoist_token_url, data=body,
+                                 timeout=deadlines.get_timeout('todoist'))
+        call.status = response.status_code
     response_data = response.json()
 
     if response_data.get('error'):
@@ -1,18 +1,20 @@
-import canvasapi.exceptions
 from datetime import datetime
 from flask import Blueprint, jsonify, request, send_file, after_this_request
 from flask_login import current_user
+import math
 import os
 
 import utils.canvas as canvas_api
 import utils.files as files
+import utils.grades as grades
 import utils.queries as queries
 from utils.session import decrypt_canvas_key
-from utils.settings import get_canvas_url
+from utils.settings import parse_local_date, format_local_date
 
 
 courses = Blueprint('courses', __name__)
-BASE_URL = get_canvas_url()
+# The most what-if scenarios a single request may simulate
+MAX_SCENARIOS = 50
 
 # Custom parameters to get from the Canvas API for course requests
 # Specified here to ensure standardization.
@@ -109,6 +111,8 @@ def get_course(courseid):
 
 @courses.get('/<courseid>/submissions')
 def get_course_submissions(courseid):
+    # canvasapi is imported when the first Canvas client is created
+    import canvasapi.exceptions
     canvas_key = decrypt_canvas_key()
 
     try:
@@ -173,8 +177,9 @@ def get_undated_assignments(courseid):
             [assignment['id'] for assignment in assignments if assignment['id'] is not None]
         )
         for assignment in assignments:
+            # Formatted for the datetime-local input used to edit it
             due_date = due_date_lookup.get(assignment['id'], None)
-            assignment['due_at'] = due_date
+            assignment['due_at'] = format_local_date(due_date, '%Y-%m-%dT%H:%M')
 
         for assignment in assignments:
             # Translate 'name' to 'title' for the API
@@ -288,8 +293,10 @@ def set_custom_due_date(courseid, assignmentid):
     due_date = request.json.get('due_date', None)
     if due_date is None or type(due_date) is not str:
         return jsonify({'success': False, 'message': 'Missing or invalid due_date.'}), 400
-    if len(due_date) > 20:
-        return jsonify({'success': False, 'message': 'due_date is 20 characters at most.'}), 400
+
+    due_date = parse_local_date(due_date)
+    if due_date is None:
+        return jsonify({'success': False, 'message': 'Missing or invalid due_date.'}), 400
 
     try:
         canvas_key = decrypt_canvas_key()
@@ -331,17 +338,19 @@ def get_grade_simulation(courseid):
         grade_log = []
         for section in grade_weight_group:
             grade_section = {
-                'name': getattr(section, 'name', None),
-                'weight': getattr(section, 'group_weight', None),
+                'name': section.name,
+                'weight': section.weight,
                 'assignments': [
                     {
-                        'name': assignment.get('name', None),
-                        'max_score': assignment.get('points_possible', None),
-                        'score': assignment.get('submission', {}).get('score', None)
-                        if assignment.get('submission') else None,
-                        'omit_from_final_grade': assignment.get('omit_from_final_grade', None)
+                        'id': assignment_id,
+                        'name': name,
+                        'max_score': None if math.isnan(max_score) else max_score,
+                        'score': None if math.isnan(score) else score,
+                        'omit_from_final_grade': bool(omit)
                     }
-                    for assignment in getattr(section, 'assignments', [])
+                    for assignment_id, name, max_score, score, omit
+                    in zip(section.ids, section.names, section.max_scores, section.scores,
+                           section.omit)
                 ]
             }
             grade_log.append(grade_section)
@@ -351,3 +360,60 @@ def get_grade_simulation(courseid):
     except AttributeError:
         return 'Unable to get field for assignment', 404
     return jsonify(grade_log), 200
+
+
+@courses.route('/<courseid>/grades', methods=['GET'])
+def get_grade_summary(courseid):
+    canvas_key = decrypt_canvas_key()
+
+    try:
+        course_grades = grades.get_course_grades(canvas_key, courseid)
+    except Exception:
+        return 'Unable to make request to Canvas API', 400
+    if course_grades is None:
+        return "Invalid course id", 400
+
+    return jsonify(course_grades.summary()), 200
+
+
+@courses.post('/<courseid>/grades/simulate')
+def simulate_grades(courseid):
+    overrides = _get_scenarios(request.json)
+    if overrides is None:
+        return jsonify({'success': False, 'message': 'Missing or invalid scenarios.'}), 400
+
+    canvas_key = decrypt_canvas_key()
+    try:
+        course_grades = grades.get_course_grades(canvas_key, courseid)
+    except Exception:
+        return 'Unable to make request to Canvas API', 400
+    if course_grades is None:
+        return "Invalid course id", 400
+
+    return jsonify(course_grades.summarize(overrides)), 200
+
+
+def _get_scenarios(body: dict | None) -> list[dict[int, float | None]] | None:
+    """
+    Get the what-if scenarios from the body of a request to simulate grades.
+
+    :param body: The body of the request. 'scenarios' is a list of objects that map assignment IDs
+    to scores, or to null to remove a score.
+    :return list[dict[int, float | None]] | None: The scores of every scenario by assignment ID, or
+    None if the scenarios are missing or invalid.
+    """
+    scenarios = (body or {}).get('scenarios')
+    if type(scenarios) is not list or not 0 < len(scenarios) <= MAX_SCENARIOS:
+        return None
+
+    overrides = []
+    for scenario in scenarios:
+        if type(scenario) is not dict or any(score is not None and type(score) not in (int, float)
+                                             for score in scenario.values()):
+            return None
+        try:
+            overrides.append({int(assignment_id): score
+                              for assignment_id, score in scenario.items()})
+        except ValueError:
+            return None
+    return overrides
@@ -1,17 +1,15 @@
-from datetime import datetime
 from flask import Blueprint, jsonify, request
 from flask_login import current_user
 
 import utils.session as session
 import utils.todoist as todoist
-from utils.settings import get_canvas_url
+from utils.settings import parse_local_date
 
 import utils.models as models
 import utils.queries as queries
 
 
 tasks = Blueprint('tasks', __name__)
-BASE_URL = get_canvas_url()
 
 # ENDPOINT: /api/v1/tasks
 
@@ -47,10 +45,11 @@ def add_task_user():
         return jsonify({'success': False, 'message': 'Missing due_at'}), 400
 
     name = data['name']
-    due_at = data['due_at']
 
-    # Convert due_at to be a standard time
-    due_at = datetime.strptime(due_at, '%Y-%m-%dT%H:%M').strftime('%Y-%m-%d %H:%M:%S')
+    # Convert due_at from the user's local time to UTC
+    due_at = parse_local_date(data['due_at'])
+    if due_at is None:
+        return jsonify({'success': False, 'message': 'Invalid due_at'}), 400
 
     if len(name) == 0 or len(name) > 100:
         return jsonify({'success': False, 'message': 'Invalid name'}), 400
@@ -99,6 +98,42 @@ def add_subtask_user():
         return jsonify({'success': False, 'message': 'Unable to create subtask'}), 400
 
 
+# Creates up to todoist.MAX_BULK_SUBTASKS subtasks with a single Todoist request
+@tasks.post('/subtasks/bulk')
+def add_subtasks_user():
+    try:
+        todoist_token = session.decrypt_todoist_key()
+        data = request.json
+        if not isinstance(data.get('subtasks'), list) or not data['subtasks'] \
+                or len(data['subtasks']) > todoist.MAX_BULK_SUBTASKS:
+            return jsonify({'success': False, 'message': 'Invalid subtasks'}), 400
+
+        subtasks = []
+        for subtask in data['subtasks']:
+            canvas_id = subtask.get('canvas_id')
+            subtask_name = subtask.get('name').strip()
+            subtask_status = models.TaskStatus.from_integer(subtask.get('status'))
+            if not canvas_id or not subtask_name or not subtask_status:
+                return jsonify({'success': False, 'message': 'Invalid subtask parameters'}), 400
+            subtasks.append({'canvas_id': canvas_id, 'name': subtask_name,
+                             'description': subtask.get('description'),
+                             'status': subtask_status, 'due_date': subtask.get('due_date')})
+
+        results = todoist.add_subtasks(current_user, todoist_token, subtasks)
+        if results is False:
+            return jsonify({'success': False, 'message': 'Failed to create subtasks'}), 400
+
+        # The IDs are in the order the subtasks were given, None if Todoist refused the subtask
+        return jsonify({
+            'success': all(result is not None for result in results),
+            'subtasks': [{'id': result[0], 'todoist_id': result[1], 'author': True}
+                         if result is not None else None for result in results]
+        }), 200
+    except Exception:
+
+        return jsonify({'success': False, 'message': 'Unable to create subtasks'}), 400
+
+
 @tasks.post('/get_subtasks')
 def get_subtasks():
     try:
@@ -147,6 +182,32 @@ def toggle_task(task_id: str):
     return jsonify({'success': False, 'message': f'Unable to open {task_id}'}), 400
 
 
+# Sets the status of up to todoist.MAX_BULK_STATUSES tasks and subtasks with a single Todoist
+# request, such as marking every task of a course as done
+@tasks.post('/status/bulk')
+def set_statuses():
+    try:
+        todoist_token = session.decrypt_todoist_key()
+        data = request.json
+        if not isinstance(data.get('tasks'), list) or not data['tasks'] \
+                or len(data['tasks']) > todoist.MAX_BULK_STATUSES:
+            return jsonify({'success': False, 'message': 'Invalid tasks'}), 400
+
+        statuses = {}
+        for task in data['tasks']:
+            todoist_id = task.get('todoist_id')
+            status = models.TaskStatus.from_integer(task.get('status'))
+            if not todoist_id or not status:
+                return jsonify({'success': False, 'message': 'Invalid task parameters'}), 400
+            statuses[str(todoist_id)] = status
+
+        results = todoist.set_statuses(current_user, todoist_token, statuses)
+        return jsonify({'success': all(results.values()), 'tasks': results}), 200
+    except Exception:
+
+        return jsonify({'success': False, 'message': 'Unable to set statuses'}), 400
+
+
 @tasks.patch('/<task_id>/description')
 def update_description(task_id: str):
     # Ensure that a description was provided
@@ -1,16 +1,17 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request
 from flask_login import current_user
-from datetime import datetime
+from dateutil.relativedelta import relativedelta
 import utils.canvas as canvas_api
+import utils.events as events
 from utils.session import decrypt_canvas_key, decrypt_todoist_key
-from utils.settings import get_canvas_url, get_date_range, localize_date, date_passed
+from utils.settings import get_date_range, utc_now, parse_canvas_date, format_local_date
 from utils.todoist import add_shared_subtask
 import utils.queries as queries
+import utils.sharing as sharing
 import utils.models as models
 
 
 user = Blueprint('user', __name__)
-BASE_URL = get_canvas_url()
 
 # ENDPOINT: /api/v1/user/
 
@@ -48,9 +49,11 @@ def get_assignments_due_soon():  # noqa: C901
         start_date, end_date = get_date_range(months=1)
 
         assignments_due_soon = []
+        now = utc_now()
 
-        # Get non-Canvas tasks
-        tasks: list[models.Task] = queries.get_non_canvas_tasks(current_user)
+        # Get non-Canvas tasks due within the next month
+        tasks: list[models.Task] = queries.get_non_canvas_tasks(
+            current_user, until=now + relativedelta(months=1))
         for task in tasks:
             data = {
                 'db_id': task.id,
@@ -59,7 +62,7 @@ def get_assignments_due_soon():  # noqa: C901
                 'type': 'assignment',
                 'submission_types': [],
                 'graded_submissions_exist': False,
-                'due_at': task.due_date,
+                'due_at': format_local_date(task.due_date),
                 'subtasks': []
             }
             assignments_due_soon.append(data)
@@ -90,12 +93,12 @@ def get_assignments_due_soon():  # noqa: C901
                 if not due_date:
                     continue
 
-                parsed_due_date = localize_date(datetime.strptime(due_date, "%Y-%m-%dT%H:%M:%SZ"))
-                # Skip to the next iteration if the due date is older than yesterday
-                if date_passed(parsed_due_date):
+                # Skip to the next iteration if the due date has already passed
+                parsed_due_date = parse_canvas_date(due_date)
+                if parsed_due_date <= now:
                     continue
 
-                one_assignment['due_at'] = parsed_due_date.strftime('%Y-%m-%d %H:%M:%S')
+                one_assignment['due_at'] = format_local_date(parsed_due_date)
             assignments_due_soon.append(one_assignment)
 
         # Get all assignments that come from Canvas (i.e., have a Canvas ID)
@@ -287,17 +290,37 @@ def get_conversations(canvas_id):
 @user.route('/get_notifications', methods=['GET'])
 def get_notifications():
     try:
-        invitations = queries.get_subtask_invitations(current_user)
         invitations_list = {'invitation': [], 'simple': []}
-
-        if invitations:
-            invitations_list['invitation'] = queries.compose_invitations(invitations)
+        invitations_list['invitation'] = sharing.get_invitation_notifications(current_user)
 
     except Exception:
         return 'Unable to retrieve notifications', 400
     return jsonify(invitations_list), 200
 
 
+# Server-sent events for the dashboard. Browsers send the ID of the last event they received when
+# they reconnect, so that the events published in between are sent first.
+@user.route('/events', methods=['GET'])
+def stream_events():
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+        missed = events.get_missed_events(current_user.id, last_event_id)
+    except ValueError:
+        missed = []
+
+    try:
+        queue = events.hub.subscribe(current_app._get_current_object(), current_user.id)
+    except events.StreamLimitReached:
+        return 'Too many open event streams', 503, {'Retry-After': '30'}
+
+    text = events.stream(current_user.id, queue, [events.format_event(event) for event in missed])
+    return Response(text, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+
 @user.route('/send_invitation', methods=['POST'])
 def send_invitation():
     try:
@@ -316,9 +339,10 @@ def send_invitation():
         if invited_user.id == current_user.id:
             return 'You cannot invite yourself', 400
 
-        sent = queries.send_subtask_invitation(current_user, invited_user, subtask_id)
+        sent = sharing.send_subtask_invitation(current_user, invited_user, subtask_id)
         if not sent:
             return 'Unable to send invitation', 400
+        events.publish([invited_user.id], 'invitation', {'subtask_id': subtask_id})
 
     except Exception:
         return 'Error while sending invitation', 400
@@ -0,0 +1,63 @@
+from flask import Blueprint, abort, jsonify, request
+from http import HTTPStatus
+import hmac
+
+from utils.settings import get_canvas_webhook_secret, get_todoist_client_secret, \
+    is_todoist_webhook_enabled
+from utils.webhooks import apply_canvas_change, apply_todoist_event, parse_canvas_events, \
+    verify_todoist_signature
+
+
+webhooks = Blueprint('webhooks', __name__)
+
+
+# Webhooks are called by Canvas rather than by a user. They require the secret in
+# CANVAS_WEBHOOK_SECRET_FILE and don't exist if it isn't configured.
+@webhooks.route('/canvas', methods=['POST'])
+def receive_canvas_events():
+    secret = get_canvas_webhook_secret()
+    if secret is None:
+        abort(HTTPStatus.NOT_FOUND)
+
+    authorization = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(authorization.encode(), f'Bearer {secret}'.encode()):
+        abort(HTTPStatus.UNAUTHORIZED)
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, (dict, list)):
+        return 'Invalid event payload', 400
+
+    changes = parse_canvas_events(payload)
+    invalidated, scheduled = 0, 0
+    for change in changes:
+        removed, users = apply_canvas_change(change)
+        invalidated += removed
+        scheduled += users
+
+    return jsonify({
+        'events': len(changes),
+        'invalidated': invalidated,
+        'scheduled': scheduled
+    }), 200
+
+
+# Todoist signs its webhook requests with the app's client secret. The webhook only exists if
+# TODOIST_WEBHOOK is ON.
+@webhooks.route('/todoist', methods=['POST'])
+def receive_todoist_event():
+    if not is_todoist_webhook_enabled():
+        abort(HTTPStatus.NOT_FOUND)
+
+    signature = request.headers.get('X-Todoist-Hmac-SHA256', '')
+    if not verify_todoist_signature(request.get_data(), signature, get_todoist_client_secret()):
+        abort(HTTPStatus.UNAUTHORIZED)
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return 'Invalid event payload', 400
+
+    result = apply_todoist_event(payload, request.headers.get('X-Todoist-Delivery-ID'))
+    # Todoist retries deliveries that don't succeed
+    if result == 'error':
+        return jsonify({'result': result}), 500
+    return jsonify({'result': result}), 200
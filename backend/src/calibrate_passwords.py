@@ -0,0 +1,52 @@
+"""
+Measures how long hashing a password with argon2 takes on this machine, and recommends the
+ARGON2_TIME_COST that fits a latency budget. Run it from `backend/src` on the production hardware
+with `python -m calibrate_passwords`, for example with `--budget 0.25`.
+
+Every sign in hashes the password once, so the budget is the CPU time a sign in may cost. The memory
+cost and parallelism are not searched: choose them from the memory and cores that every concurrent
+sign in may use, then let this command choose the time cost.
+"""
+
+
+import argparse
+import sys
+
+from utils.passwords import calibrate
+from utils.settings import get_argon2_memory_cost, get_argon2_parallelism
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m calibrate_passwords',
+                                     description='Choose the argon2 time cost for a latency '
+                                     'budget on this machine.')
+    parser.add_argument('--budget', type=float, default=0.25,
+                        help='the longest hashing a password may take in seconds (default: 0.25)')
+    parser.add_argument('--memory-cost', type=int, default=None,
+                        help='the memory to use in KiB (default: ARGON2_MEMORY_COST)')
+    parser.add_argument('--parallelism', type=int, default=None,
+                        help='the number of threads to use (default: ARGON2_PARALLELISM)')
+    parser.add_argument('--samples', type=int, default=5,
+                        help='hashes to time for each time cost (default: 5)')
+    args = parser.parse_args(argv)
+
+    memory_cost = args.memory_cost if args.memory_cost is not None else get_argon2_memory_cost()
+    parallelism = args.parallelism if args.parallelism is not None else get_argon2_parallelism()
+
+    time_cost, measurements = calibrate(args.budget, memory_cost, parallelism, args.samples)
+    for measured_time_cost, duration in measurements:
+        print(f'time_cost={measured_time_cost:<3} {duration * 1000:8.1f} ms')
+
+    if measurements[0][1] > args.budget:
+        print(f'Even a time cost of 1 takes longer than {args.budget} seconds, lower '
+              'ARGON2_MEMORY_COST instead')
+        return 1
+
+    print(f'ARGON2_TIME_COST={time_cost}')
+    print(f'ARGON2_MEMORY_COST={memory_cost}')
+    print(f'ARGON2_PARALLELISM={parallelism}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+The command line interface for schema migrations. Run it from `backend/src`, for example with
+`python -m migrations upgrade`. The database is chosen the same way as for the app.
+"""
+
+
+import argparse
+import logging
+import sys
+from sqlalchemy import create_engine
+
+from migrations import runner
+from utils.settings import get_database_uri
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m migrations',
+                                     description='Manage the database schema version.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    upgrade_parser = commands.add_parser('upgrade', help='apply every pending migration')
+    upgrade_parser.add_argument('--to', type=int, default=None,
+                                help='the version to upgrade to (default: the latest version)')
+    commands.add_parser('current', help='print the schema version of the database')
+    commands.add_parser('history', help='list every migration and if it was applied')
+    commands.add_parser('check', help='exit with status 1 if any migration is pending')
+    stamp_parser = commands.add_parser('stamp', help='mark migrations as applied without running '
+                                       'them')
+    stamp_parser.add_argument('version', type=int, help='the version to mark the database as')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    engine = create_engine(get_database_uri())
+
+    match args.command:
+        case 'upgrade':
+            applied = runner.upgrade(engine, args.to)
+            print(f'Applied {len(applied)} migrations')
+        case 'current':
+            with engine.connect() as conn:
+                print(runner.get_current_version(conn))
+        case 'history':
+            with engine.connect() as conn:
+                applied = runner.get_applied_migrations(conn)
+            for migration in runner.load_migrations():
+                status = f'applied {applied[migration.version][1]}'\
+                    if migration.version in applied else 'pending'
+                print(f'{migration.version:4} {migration.description} ({status})')
+        case 'check':
+            try:
+                runner.check_version(engine)
+            except runner.SchemaVersionError as ex:
+                print(ex)
+                return 1
+            print('The database schema is up to date')
+        case 'stamp':
+            runner.stamp(engine, args.version)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
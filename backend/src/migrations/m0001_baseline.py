@@ -0,0 +1,101 @@
+"""
+Creates the tables that the app had before migrations existed. Back then the app created its tables
+with `db.create_all()` at startup, so existing databases already have them.
+
+The tables are defined here as they were at the time rather than taken from utils.models, so that
+this migration always creates the same schema. Every later change to them belongs to a later
+migration.
+"""
+
+
+from sqlalchemy import JSON, Column, Enum, ForeignKey, Index, Integer, MetaData, String, Table, \
+    UniqueConstraint
+from sqlalchemy.engine import Connection
+
+
+VERSION = 1
+DESCRIPTION = 'Create missing tables'
+
+metadata = MetaData()
+
+Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('login_id', String(100), unique=True, nullable=False),
+    Column('username', String(100), unique=True, nullable=False),
+    Column('password', String(100), nullable=False),
+    Column('canvas_id', String(150), nullable=False),
+    Column('canvas_name', String(150), nullable=False),
+    Column('canvas_token_password', String(200), nullable=False),
+    Column('todoist_token_password', String(200), nullable=False),
+)
+
+Table(
+    'tasks', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id'), nullable=False),
+    Column('task_type', Enum('assignment', name='tasktype'), nullable=False),
+    Column('canvas_id', Integer, nullable=True),
+    Column('todoist_id', String(15), nullable=True),
+    # Due dates were strings in Charlotte's local time, see m0003_due_date_datetimes
+    Column('due_date', String(12), nullable=True),
+    Column('status', Enum('Incomplete', 'Completed', name='taskstatus'), nullable=False),
+    Column('custom_due_date', String(20), nullable=True),
+    Column('name', String(100), nullable=True),
+    Column('description', String(500), nullable=True),
+    Index('idx_canvas_owner', 'canvas_id', 'owner'),
+)
+
+Table(
+    'subtasks', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id'), nullable=False),
+    Column('task_id', Integer, ForeignKey('tasks.id'), nullable=False),
+    Column('todoist_id', String(15), nullable=True),
+    Column('name', String(150), nullable=False),
+    Column('description', String(500), nullable=True),
+    Column('status', Enum('Incomplete', 'Completed', name='taskstatus'), nullable=False),
+    Column('due_date', String(12), nullable=True),
+    Column('shared_with', JSON, nullable=True),
+    Index('idx_task_id_owner', 'task_id', 'owner'),
+)
+
+Table(
+    'shared_subtasks', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id'), nullable=False),
+    Column('subtask_id', Integer, ForeignKey('subtasks.id', ondelete='CASCADE'), nullable=False),
+    Column('todoist_original', String(15), nullable=False),
+    Column('todoist_id', String(15), nullable=False),
+    Index('idx_owner_subtask_id', 'subtask_id', 'owner'),
+)
+
+Table(
+    'conversations', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id'), nullable=False),
+    Column('conversation_id', Integer, nullable=False),
+    Column('canvas_id', Integer, nullable=False),
+    Index('idx_conv_owner', 'canvas_id', 'owner'),
+)
+
+Table(
+    'subtask_invitations', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    Column('recipient_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    Column('subtask_id', Integer, ForeignKey('subtasks.id', ondelete='SET NULL'), nullable=True),
+    Index('idx_task_id_recipient', 'subtask_id', 'recipient_id'),
+)
+
+Table(
+    'filters', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id'), nullable=False),
+    Column('filter', String(50), nullable=False),
+    UniqueConstraint('owner', 'filter'),
+)
+
+
+def upgrade(conn: Connection):
+    metadata.create_all(conn)
@@ -0,0 +1,30 @@
+"""
+Adds the owner-leading indexes used by the task and subtask hot paths.
+"""
+
+
+from sqlalchemy.engine import Connection
+
+from migrations.operations import create_index
+
+
+VERSION = 2
+DESCRIPTION = 'Add owner-leading indexes for tasks and subtasks'
+
+INDEXES = [
+    # Lookups by Todoist ID, such as toggling a task
+    ('idx_task_owner_todoist', 'tasks', ['owner', 'todoist_id']),
+    # Lookups of a user's Canvas tasks, such as descriptions and custom due dates
+    ('idx_task_owner_canvas', 'tasks', ['owner', 'canvas_id']),
+    # Due date ranges, such as upcoming non-Canvas tasks
+    ('idx_task_owner_due', 'tasks', ['owner', 'due_date']),
+    # Lookups by Todoist ID and syncing a user's subtasks
+    ('idx_subtask_owner_todoist', 'subtasks', ['owner', 'todoist_id']),
+    # Lookups of every subtask shared with a user
+    ('idx_shared_owner_subtask', 'shared_subtasks', ['owner', 'subtask_id']),
+]
+
+
+def upgrade(conn: Connection):
+    for name, table, columns in INDEXES:
+        create_index(conn, name, table, columns)
@@ -0,0 +1,105 @@
+"""
+Converts the due date columns from strings in Charlotte's local time to DATETIME columns in UTC.
+Changing a column's type rebuilds the table on MariaDB, so writes to `tasks` and `subtasks` are
+blocked while this runs.
+"""
+
+
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from migrations.operations import get_column_type, is_mariadb
+from utils.settings import parse_local_date, to_utc
+
+
+VERSION = 3
+DESCRIPTION = 'Store due dates as UTC DATETIME columns'
+
+# Every column that used to store a local time string
+DUE_DATE_COLUMNS = [
+    ('tasks', 'due_date'),
+    ('tasks', 'custom_due_date'),
+    ('subtasks', 'due_date'),
+]
+
+# How SQLAlchemy stores DateTime values in SQLite, used to recognize rows that were converted
+SQLITE_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def convert_due_date(value: str) -> datetime | None:
+    """
+    Convert a due date that was stored as a local time string to a naive UTC datetime. MariaDB
+    truncated some due dates to 12 characters, so those fall back to the end of their day.
+
+    :param value: The stored due date.
+    :return datetime | None: The due date in UTC, or None if it could not be understood.
+    """
+    due_date = parse_local_date(value)
+    if due_date is not None:
+        return due_date
+
+    try:
+        return to_utc(datetime.strptime(value[:10], '%Y-%m-%d').replace(hour=23, minute=59))
+    except ValueError:
+        return None
+
+
+def backfill_column(conn: Connection, table: str, column: str) -> int:
+    """
+    Rewrite every value in a column as a UTC date string that the database understands as a
+    DATETIME.
+
+    :return int: The number of rows that were rewritten.
+    """
+    sqlite = conn.dialect.name == 'sqlite'
+    rows = conn.execute(
+        text(f'SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL')
+    ).all()
+
+    updates = []
+    for row_id, value in rows:
+        if sqlite:
+            try:
+                datetime.strptime(value, SQLITE_DATETIME_FORMAT)
+                continue
+            except ValueError:
+                pass
+
+        due_date = convert_due_date(value)
+        if due_date is not None:
+            due_date = due_date.strftime(SQLITE_DATETIME_FORMAT if sqlite else '%Y-%m-%d %H:%M:%S')
+        updates.append({'id': row_id, 'due_date': due_date})
+
+    if updates:
+        conn.execute(text(f'UPDATE {table} SET {column} = :due_date WHERE id = :id'), updates)
+    return len(updates)
+
+
+def convert_due_dates(conn: Connection) -> int:
+    """
+    Convert every due date column to a UTC DATETIME column. SQLite doesn't enforce column types, so
+    its columns are converted row by row instead.
+
+    :param conn: A connection to the database.
+    :return int: The number of rows that were rewritten.
+    """
+    converted = 0
+    for table, column in DUE_DATE_COLUMNS:
+        if is_mariadb(conn) and 'DATETIME' in get_column_type(conn, table, column):
+            continue
+
+        if is_mariadb(conn):
+            # Some columns were too short for the dates they held, widen them before rewriting
+            conn.execute(text(f'ALTER TABLE {table} MODIFY {column} VARCHAR(32) NULL'))
+
+        converted += backfill_column(conn, table, column)
+
+        if is_mariadb(conn):
+            conn.execute(text(f'ALTER TABLE {table} MODIFY {column} DATETIME NULL'))
+
+    return converted
+
+
+def upgrade(conn: Connection):
+    convert_due_dates(conn)
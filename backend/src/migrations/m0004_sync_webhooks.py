@@ -0,0 +1,48 @@
+"""
+Adds what Canvas webhooks need to schedule background syncs: when a user's courses last changed,
+and which courses each synced user is in. Databases that were created before the sync daemon don't
+have its `sync_states` table yet, so it is created first.
+"""
+
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, \
+    UniqueConstraint
+from sqlalchemy.engine import Connection
+
+from migrations.operations import add_column
+
+
+VERSION = 4
+DESCRIPTION = 'Schedule syncs from Canvas webhooks'
+
+metadata = MetaData()
+# Only referenced by the foreign keys, the table exists already
+Table('users', metadata, Column('id', Integer, primary_key=True))
+
+# The table as the sync daemon first created it, pending_at is added below
+sync_states = Table(
+    'sync_states', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id', ondelete='CASCADE'), unique=True,
+           nullable=False),
+    Column('canvas_token_server', String(200), nullable=True),
+    Column('last_synced_at', DateTime, nullable=True),
+    Column('last_change_at', DateTime, nullable=True),
+    Column('next_due_at', DateTime, nullable=True),
+    Column('last_error', String(200), nullable=True),
+)
+
+sync_courses = Table(
+    'sync_courses', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    Column('course_id', Integer, nullable=False),
+    UniqueConstraint('owner', 'course_id'),
+    Index('idx_sync_course', 'course_id'),
+)
+
+
+def upgrade(conn: Connection):
+    sync_states.create(conn, checkfirst=True)
+    add_column(conn, 'sync_states', 'pending_at', 'DATETIME NULL')
+    sync_courses.create(conn, checkfirst=True)
@@ -0,0 +1,24 @@
+"""
+Adds indexes for looking up tasks, subtasks, and shared subtasks by their Todoist ID alone. The
+Todoist webhook only knows the ID of the item that changed, not which user it belongs to.
+"""
+
+
+from sqlalchemy.engine import Connection
+
+from migrations.operations import create_index
+
+
+VERSION = 5
+DESCRIPTION = 'Add Todoist ID indexes for the Todoist webhook'
+
+INDEXES = [
+    ('idx_task_todoist', 'tasks', ['todoist_id']),
+    ('idx_subtask_todoist', 'subtasks', ['todoist_id']),
+    ('idx_shared_todoist', 'shared_subtasks', ['todoist_id']),
+]
+
+
+def upgrade(conn: Connection):
+    for name, table, columns in INDEXES:
+        create_index(conn, name, table, columns)
@@ -0,0 +1,30 @@
+"""
+Adds the table of dashboard events, which the event streams of every worker read.
+"""
+
+
+from sqlalchemy import JSON, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table
+from sqlalchemy.engine import Connection
+
+
+VERSION = 6
+DESCRIPTION = 'Store dashboard events for event streams'
+
+metadata = MetaData()
+# Only referenced by the foreign key, the table exists already
+Table('users', metadata, Column('id', Integer, primary_key=True))
+
+user_events = Table(
+    'user_events', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    Column('kind', String(20), nullable=False),
+    Column('data', JSON, nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    Index('idx_user_event_owner', 'owner', 'id'),
+    Index('idx_user_event_created', 'created_at'),
+)
+
+
+def upgrade(conn: Connection):
+    user_events.create(conn, checkfirst=True)
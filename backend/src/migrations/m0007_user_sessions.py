@@ -0,0 +1,31 @@
+"""
+Adds the table of signed in sessions, so that every worker can read the API keys of every session.
+"""
+
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table
+from sqlalchemy.engine import Connection
+
+
+VERSION = 7
+DESCRIPTION = 'Store the API keys of signed in sessions'
+
+metadata = MetaData()
+# Only referenced by the foreign key, the table exists already
+Table('users', metadata, Column('id', Integer, primary_key=True))
+
+user_sessions = Table(
+    'user_sessions', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    Column('secret_hash', String(64), unique=True, nullable=False),
+    Column('canvas_token_session', String(200), nullable=False),
+    Column('todoist_token_session', String(200), nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    Index('idx_user_session_owner', 'owner'),
+    Index('idx_user_session_created', 'created_at'),
+)
+
+
+def upgrade(conn: Connection):
+    user_sessions.create(conn, checkfirst=True)
@@ -0,0 +1,27 @@
+"""
+Adds the table of Canvas cache invalidations, which every server process reads to remove the cached
+results that the Canvas webhook invalidated in another process.
+"""
+
+
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, MetaData, Table
+from sqlalchemy.engine import Connection
+
+
+VERSION = 8
+DESCRIPTION = 'Share Canvas cache invalidations between server processes'
+
+metadata = MetaData()
+
+cache_invalidations = Table(
+    'cache_invalidations', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('course_id', Integer, nullable=False),
+    Column('assignments', Boolean, nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    Index('idx_cache_invalidation_created', 'created_at'),
+)
+
+
+def upgrade(conn: Connection):
+    cache_invalidations.create(conn, checkfirst=True)
@@ -0,0 +1,76 @@
+"""
+Helpers for writing migrations that are safe to run more than once and that avoid locking tables
+on the production MariaDB database.
+"""
+
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+
+def is_mariadb(conn: Connection) -> bool:
+    """Returns True if the connection is to MariaDB or MySQL."""
+    return conn.dialect.name in ('mysql', 'mariadb')
+
+
+def has_index(conn: Connection, table: str, name: str) -> bool:
+    """Returns True if the table has an index with the given name."""
+    return any(index['name'] == name for index in inspect(conn).get_indexes(table))
+
+
+def get_column_type(conn: Connection, table: str, column: str) -> str | None:
+    """
+    Get the type of a column as the database reports it.
+
+    :return str | None: The upper case name of the column's type, or None if the column doesn't
+    exist.
+    """
+    for info in inspect(conn).get_columns(table):
+        if info['name'] == column:
+            return str(info['type']).upper()
+    return None
+
+
+def create_index(conn: Connection, name: str, table: str, columns: list[str]) -> bool:
+    """
+    Create an index if it doesn't exist yet. On MariaDB the index is built in place without locking
+    the table, so the app can keep reading and writing while it is created.
+
+    :param conn: A connection to the database.
+    :param name: The name of the index.
+    :param table: The table to index.
+    :param columns: The columns of the index, in order.
+    :return bool: True if the index was created, False if it already existed.
+    """
+    if has_index(conn, table, name):
+        return False
+
+    column_list = ', '.join(columns)
+    if is_mariadb(conn):
+        conn.execute(text(f'CREATE INDEX {name} ON {table} ({column_list}) '
+                          'ALGORITHM=INPLACE LOCK=NONE'))
+    else:
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({column_list})'))
+    return True
+
+
+def add_column(conn: Connection, table: str, column: str, definition: str) -> bool:
+    """
+    Add a column if it doesn't exist yet. On MariaDB the column is added in place without locking
+    the table.
+
+    :param conn: A connection to the database.
+    :param table: The table to add the column to.
+    :param column: The name of the column.
+    :param definition: The type and constraints of the column, such as 'DATETIME NULL'.
+    :return bool: True if the column was added, False if it already existed.
+    """
+    if get_column_type(conn, table, column) is not None:
+        return False
+
+    if is_mariadb(conn):
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}, '
+                          'ALGORITHM=INPLACE, LOCK=NONE'))
+    else:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+    return True
@@ -0,0 +1,228 @@
+"""
+A small versioned schema migration system. Every migration is a module in this package with a
+`VERSION`, a `DESCRIPTION`, and an `upgrade(conn)` function, and is listed in `MIGRATIONS` in the
+order it must be applied. Every applied migration is recorded in the `schema_version` table.
+
+Databases that were created with `db.create_all()` before migrations existed have no version, so
+every migration must be safe to run on a schema that already contains its changes. Migrations
+define the tables they create themselves rather than using utils.models, so that what a migration
+does doesn't change when the models do.
+
+Run `python -m migrations upgrade` from `backend/src` to bring a database up to date.
+"""
+
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+import importlib
+import logging
+from types import ModuleType
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, \
+    text
+from sqlalchemy.engine import Connection, Engine
+
+from utils.settings import utc_now
+
+
+logger = logging.getLogger('migrations')
+
+# Every migration, in the order it must be applied
+MIGRATIONS = [
+    'migrations.m0001_baseline',
+    'migrations.m0002_hot_path_indexes',
+    'migrations.m0003_due_date_datetimes',
+    'migrations.m0004_sync_webhooks',
+    'migrations.m0005_todoist_id_indexes',
+    'migrations.m0006_user_events',
+    'migrations.m0007_user_sessions',
+    'migrations.m0008_cache_invalidations',
+]
+
+# How long to wait for another process that is migrating the same database, in seconds
+LOCK_TIMEOUT = 600
+
+metadata = MetaData()
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+class SchemaVersionError(Exception):
+    """Raised when the database schema is older than the code that is using it."""
+
+
+@dataclass
+class Migration:
+    """
+    A single schema migration.
+
+    :param version: The schema version after the migration is applied.
+    :param description: A short description of what the migration changes.
+    :param module: The module that contains the migration's `upgrade` function.
+    """
+    version: int
+    description: str
+    module: ModuleType
+
+    def upgrade(self, conn: Connection):
+        self.module.upgrade(conn)
+
+
+def load_migrations() -> list[Migration]:
+    """
+    Import every migration in `MIGRATIONS`.
+
+    :return list[Migration]: The migrations, in the order they must be applied.
+    :raises ValueError: If the migrations are not numbered 1, 2, 3, ... in order.
+    """
+    migrations = []
+    for number, name in enumerate(MIGRATIONS, start=1):
+        module = importlib.import_module(name)
+        if module.VERSION != number:
+            raise ValueError(f'{name} has version {module.VERSION}, expected {number}')
+        migrations.append(Migration(module.VERSION, module.DESCRIPTION, module))
+    return migrations
+
+
+def get_latest_version() -> int:
+    """Returns the schema version that the code expects."""
+    return len(MIGRATIONS)
+
+
+def get_current_version(conn: Connection) -> int:
+    """
+    Get the schema version of a database.
+
+    :param conn: A connection to the database.
+    :return int: The version of the last applied migration, or 0 if no migration was applied.
+    """
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def get_applied_migrations(conn: Connection) -> dict[int, tuple]:
+    """
+    Get every migration that was applied to a database.
+
+    :param conn: A connection to the database.
+    :return dict[int, tuple]: A dict that maps each applied version to its description and when it
+    was applied.
+    """
+    if not inspect(conn).has_table(schema_version.name):
+        return {}
+    rows = conn.execute(select(schema_version)).all()
+    return {version: (description, applied_at) for version, description, applied_at in rows}
+
+
+def upgrade(engine: Engine, target: int | None = None) -> list[Migration]:
+    """
+    Apply every migration that has not been applied yet, up to and including the target version.
+    Each migration is applied and recorded in its own transaction.
+
+    :param engine: The engine for the database to upgrade.
+    :param target: The version to upgrade to. Defaults to the latest version.
+    :return list[Migration]: The migrations that were applied.
+    """
+    if target is None:
+        target = get_latest_version()
+
+    applied = []
+    with engine.connect() as conn, _migration_lock(conn):
+        with conn.begin():
+            metadata.create_all(conn)
+            current = get_current_version(conn)
+
+        for migration in load_migrations():
+            if migration.version <= current or migration.version > target:
+                continue
+
+            logger.info('Applying migration %d: %s', migration.version, migration.description)
+            with conn.begin():
+                migration.upgrade(conn)
+                _record(conn, migration)
+            applied.append(migration)
+
+    return applied
+
+
+def stamp(engine: Engine, version: int) -> None:
+    """
+    Mark every migration up to a version as applied without running it. This is meant for
+    databases whose schema was already updated by hand.
+
+    :param engine: The engine for the database to stamp.
+    :param version: The version to mark the database as.
+    """
+    with engine.connect() as conn, _migration_lock(conn):
+        with conn.begin():
+            metadata.create_all(conn)
+            current = get_current_version(conn)
+            for migration in load_migrations():
+                if current < migration.version <= version:
+                    _record(conn, migration)
+
+
+def check_version(engine: Engine) -> None:
+    """
+    Check that a database has every migration applied. This only reads the schema version, so it is
+    cheap enough to run at startup.
+
+    :param engine: The engine for the database to check.
+    :raises SchemaVersionError: If the database is missing migrations.
+    """
+    with engine.connect() as conn:
+        current = get_current_version(conn)
+
+    latest = get_latest_version()
+    if current < latest:
+        raise SchemaVersionError(f'The database schema is at version {current} but version '
+                                 f'{latest} is required. Run `python -m migrations upgrade`.')
+    if current > latest:
+        logger.warning('The database schema is at version %d, which is newer than this code '
+                       '(version %d)', current, latest)
+
+
+def check_schema(engine: Engine) -> None:
+    """
+    Check the schema version of the app's database at startup. SQLite databases are only used for
+    local development and tests, such as the `database/canvas_hub.db` file that is used when
+    DB_CONN_FILE isn't set, so they are upgraded instead.
+
+    :param engine: The engine for the app's database.
+    :raises SchemaVersionError: If the database is missing migrations.
+    """
+    if engine.dialect.name == 'sqlite':
+        upgrade(engine)
+    else:
+        check_version(engine)
+
+
+def _record(conn: Connection, migration: Migration):
+    conn.execute(schema_version.insert().values(version=migration.version,
+                                                description=migration.description[:200],
+                                                applied_at=utc_now()))
+
+
+@contextmanager
+def _migration_lock(conn: Connection):
+    """
+    Hold a named lock on MariaDB while migrating, so that two processes that start at the same time
+    don't apply the same migration twice. SQLite locks the whole database file while writing.
+    """
+    if conn.dialect.name not in ('mysql', 'mariadb'):
+        yield
+        return
+
+    if conn.execute(text('SELECT GET_LOCK(:name, :timeout)'),
+                    {'name': 'schema_migrations', 'timeout': LOCK_TIMEOUT}).scalar() != 1:
+        raise SchemaVersionError('Timed out waiting for another migration to finish')
+    conn.commit()
+    try:
+        yield
+    finally:
+        conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': 'schema_migrations'})
+        conn.commit()
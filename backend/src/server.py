@@ -0,0 +1,288 @@
+"""
+The production server of the backend. Run it from `backend/src` with `python -m server`.
+
+Requests are served by gevent's WSGI server, so every connection runs in its own greenlet and
+waiting on Canvas, Todoist, or the database never holds a thread. The master process binds the
+port and forks SERVER_WORKERS worker processes, which accept connections from the shared socket.
+Each worker handles at most SERVER_CONNECTIONS connections at once, the rest wait in the backlog.
+
+Send SIGHUP to the master to reload: new workers import the current code, and the old workers stop
+accepting connections and finish their requests before they exit. SIGTERM and SIGINT stop the
+server the same way. Workers still busy after SERVER_GRACEFUL_TIMEOUT seconds are killed.
+"""
+
+
+from gevent import monkey
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import logging  # noqa: E402
+import os  # noqa: E402
+import signal  # noqa: E402
+import socket  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+from gevent.pool import Pool  # noqa: E402
+from gevent.pywsgi import WSGIHandler, WSGIServer  # noqa: E402
+
+from utils.settings import get_server_connections, get_server_graceful_timeout, \
+    get_server_workers  # noqa: E402
+
+
+logger = logging.getLogger('server')
+
+# Exit code of a worker that could not create the app, which stops the master
+BOOT_ERROR = 3
+
+
+#################################################################
+#                                                               #
+#                            WORKERS                            #
+#                                                               #
+#################################################################
+
+
+class _Handler(WSGIHandler):
+    """
+    Handles the connections of a worker. Keep-alive connections wait for their next request in
+    `read_requestline`, so the worker tracks them to close them when it stops, instead of waiting
+    for clients that have nothing more to send.
+    """
+    def read_requestline(self):
+        if self.server.closed:
+            return None
+
+        current = gevent.getcurrent()
+        self.server.idle.add(current)
+        try:
+            return super().read_requestline()
+        finally:
+            self.server.idle.discard(current)
+
+
+class _Server(WSGIServer):
+    handler_class = _Handler
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Greenlets of connections that are waiting for a request
+        self.idle = set()
+
+    def close(self):
+        super().close()
+        for glet in list(self.idle):
+            glet.kill(block=False)
+
+
+def run_worker(listener: socket.socket, connections: int, graceful_timeout: float):
+    """
+    Serve the app on a listening socket until SIGTERM or SIGINT. Runs in a worker process.
+
+    :param listener: The socket shared by every worker.
+    :param connections: The maximum number of connections to handle at once.
+    :param graceful_timeout: How long to wait for requests to finish after being stopped.
+    """
+    # Reset the master's handlers, reloading is up to the master
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # The app is created after forking so that reloading picks up code changes, and so that every
+    # worker opens its own database connections
+    try:
+        from app import create_app
+        app = create_app()
+    except Exception:
+        logger.exception(f'Worker {os.getpid()} failed to create the app')
+        os._exit(BOOT_ERROR)
+
+    server = _Server(listener, app, spawn=Pool(connections), log=None)
+    gevent.signal_handler(signal.SIGTERM, server.close)
+    gevent.signal_handler(signal.SIGINT, server.close)
+
+    logger.info(f'Worker {os.getpid()} started')
+    server.serve_forever(stop_timeout=graceful_timeout)
+    logger.info(f'Worker {os.getpid()} stopped')
+
+
+#################################################################
+#                                                               #
+#                             MASTER                            #
+#                                                               #
+#################################################################
+
+
+def create_listener(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """
+    Bind the socket that every worker accepts connections from.
+
+    :param host: The address to listen on.
+    :param port: The port to listen on, or 0 for any free port.
+    :param backlog: The number of connections that may wait to be accepted.
+    :return socket: The listening socket.
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    return listener
+
+
+class Master:
+    """
+    Forks the workers, replaces workers that exit, and reloads or stops them on signals.
+
+    :param listener: The socket shared by every worker.
+    :param workers: The number of worker processes.
+    :param connections: The maximum number of connections per worker. Defaults to
+    SERVER_CONNECTIONS.
+    :param graceful_timeout: How long stopping workers may take before they are killed. Defaults to
+    SERVER_GRACEFUL_TIMEOUT.
+    """
+    def __init__(self, listener: socket.socket, workers: int, connections: int | None = None,
+                 graceful_timeout: float | None = None):
+        self.listener = listener
+        self.num_workers = workers
+        self.connections = connections or get_server_connections()
+        self.graceful_timeout = graceful_timeout if graceful_timeout is not None \
+            else get_server_graceful_timeout()
+
+        # PIDs of the workers serving the current code
+        self.workers = set()
+        # PID -> when to kill a worker that was told to stop
+        self.stopping_workers = {}
+        self.reload_requested = False
+        self.stop_requested = False
+        self.exit_code = 0
+
+    def spawn_worker(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                run_worker(self.listener, self.connections, self.graceful_timeout)
+            except BaseException:
+                logger.exception(f'Worker {os.getpid()} crashed')
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        self.workers.add(pid)
+        return pid
+
+    def stop_workers(self, pids: set[int]):
+        """
+        Tell workers to finish their requests and exit.
+
+        :param pids: The PIDs of the workers.
+        """
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        for pid in pids:
+            self.workers.discard(pid)
+            self.stopping_workers.setdefault(pid, deadline)
+            self._kill(pid, signal.SIGTERM)
+
+    def reload(self):
+        """Start workers with the current code, then stop the old workers."""
+        logger.info('Reloading')
+        old_workers = set(self.workers)
+        self.workers.clear()
+        for _ in range(self.num_workers):
+            self.spawn_worker()
+        self.stop_workers(old_workers)
+
+    def reap_workers(self):
+        """Collect the workers that exited, and kill stopping workers that are past their time."""
+        for pid in list(self.workers) + list(self.stopping_workers):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if not done:
+                continue
+
+            exit_code = os.waitstatus_to_exitcode(status)
+            if pid in self.workers:
+                logger.warning(f'Worker {pid} exited with {exit_code}')
+                self.workers.discard(pid)
+                if exit_code == BOOT_ERROR:
+                    self.exit_code = BOOT_ERROR
+                    self.stop_requested = True
+            self.stopping_workers.pop(pid, None)
+
+        now = time.monotonic()
+        for pid, deadline in self.stopping_workers.items():
+            if now > deadline:
+                logger.warning(f'Killing worker {pid}')
+                self._kill(pid, signal.SIGKILL)
+
+    def run(self, poll: float = 0.2) -> int:
+        """
+        Run the workers until the master is stopped.
+
+        :param poll: Seconds between two checks of the workers.
+        :return int: The exit code of the server.
+        """
+        signal.signal(signal.SIGHUP, self._request_reload)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        while not self.stop_requested:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+
+            # Replace workers that crashed
+            while len(self.workers) < self.num_workers:
+                self.spawn_worker()
+
+            gevent.sleep(poll)
+            self.reap_workers()
+
+        logger.info('Stopping')
+        self.stop_workers(set(self.workers))
+        while self.stopping_workers:
+            gevent.sleep(poll)
+            self.reap_workers()
+
+        self.listener.close()
+        return self.exit_code
+
+    def _request_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _request_stop(self, signum, frame):
+        self.stop_requested = True
+
+    @staticmethod
+    def _kill(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Serve the backend with gevent worker processes.')
+    parser.add_argument('--host', default='0.0.0.0', help='address to listen on')
+    parser.add_argument('--port', type=int, default=5000, help='port to listen on')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: SERVER_WORKERS)')
+    parser.add_argument('--connections', type=int, default=None,
+                        help='connections each worker handles at once (default: '
+                             'SERVER_CONNECTIONS)')
+    parser.add_argument('--backlog', type=int, default=2048,
+                        help='connections that may wait to be accepted')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    listener = create_listener(args.host, args.port, args.backlog)
+    logger.info(f'Listening on {args.host}:{listener.getsockname()[1]}')
+
+    master = Master(listener, args.workers or get_server_workers(), args.connections)
+    return master.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+A standalone daemon that periodically syncs Canvas assignments to Todoist for every user that has
+opted into background syncing. Run it from `backend/src` with `python -m sync_daemon`.
+
+Users are scheduled with a priority queue. Users with an assignment due soon, or whose last sync
+changed something, are synced more often and ahead of everyone else.
+"""
+
+
+# Importing the app first ensures that gevent has monkey-patched everything
+from app import create_app
+
+import argparse  # noqa: E402
+import heapq  # noqa: E402
+import logging  # noqa: E402
+import time  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+from flask import Flask  # noqa: E402
+from gevent.pool import Pool  # noqa: E402
+
+import api.v1.courses as courses  # noqa: E402
+import utils.canvas as canvas  # noqa: E402
+import utils.events as events  # noqa: E402
+import utils.queries as queries  # noqa: E402
+import utils.todoist as todoist  # noqa: E402
+from utils.crypto import decrypt_str_upgrade, get_todo_secret, KDF_HKDF  # noqa: E402
+from utils.models import db, User, SyncState  # noqa: E402
+from utils.settings import get_sync_interval, get_sync_workers, utc_now  # noqa: E402
+
+
+logger = logging.getLogger('sync_daemon')
+
+# Users with an assignment due within this window are synced more often
+DUE_SOON_WINDOW = timedelta(days=1)
+
+
+class SyncJob:
+    """
+    A scheduled background sync for a single user. Jobs are ordered by the due date of the user's
+    next assignment, then by how recently the user's tasks last changed.
+
+    :param user_id: The ID of the User to sync.
+    :param run_at: When the sync should run, as a naive UTC datetime.
+    :param next_due_at: The due date of the user's next assignment, if one is known.
+    :param last_change_at: When a sync last changed the user's tasks, if ever.
+    """
+    def __init__(self, user_id: int, run_at: datetime, next_due_at: datetime | None = None,
+                 last_change_at: datetime | None = None):
+        self.user_id = user_id
+        self.run_at = run_at
+        self.next_due_at = next_due_at
+        self.last_change_at = last_change_at
+
+    def priority(self) -> tuple:
+        # Sooner due dates first, then the most recently changed users, then the oldest user
+        next_due = self.next_due_at or datetime.max
+        last_change = self.last_change_at.timestamp() if self.last_change_at else 0
+        return (next_due, -last_change, self.user_id)
+
+    def __lt__(self, other):
+        return self.priority() < other.priority()
+
+
+class SyncStats:
+    """
+    Aggregates the outcome of background syncs so that throughput, lag, and error rates can be
+    reported.
+    """
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.synced = 0
+        self.changed = 0
+        self.errors = 0
+        self.lags: list[float] = []
+
+    def record(self, lag: float, changed: bool, failed: bool):
+        """
+        Record the outcome of a single sync.
+
+        :param lag: How many seconds late the sync started compared to when it was scheduled.
+        :param changed: If the sync changed anything in Todoist.
+        :param failed: If the sync failed.
+        """
+        self.synced += 1
+        self.lags.append(max(lag, 0.0))
+        if changed:
+            self.changed += 1
+        if failed:
+            self.errors += 1
+
+    def throughput(self) -> float:
+        """Returns the number of users synced per minute."""
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        return self.synced / elapsed * 60
+
+    def error_rate(self) -> float:
+        """Returns the fraction of syncs that failed."""
+        if self.synced == 0:
+            return 0.0
+        return self.errors / self.synced
+
+    def report(self) -> dict:
+        """
+        Summarize the recorded syncs.
+
+        :return dict: The number of users synced, changed, and failed, the throughput in users per
+        minute, the error rate, and the average and maximum lag in seconds.
+        """
+        return {
+            'synced': self.synced,
+            'changed': self.changed,
+            'errors': self.errors,
+            'users_per_minute': self.throughput(),
+            'error_rate': self.error_rate(),
+            'avg_lag': sum(self.lags) / len(self.lags) if self.lags else 0.0,
+            'max_lag': max(self.lags, default=0.0),
+        }
+
+
+class SyncScheduler:
+    """
+    Schedules and runs background syncs for every user with stored tokens.
+
+    :param app: The Flask app whose database should be used.
+    :param interval: The base number of seconds between two syncs of the same user. Defaults to
+    utils.settings.get_sync_interval.
+    :param workers: The number of users that may be synced concurrently. Defaults to
+    utils.settings.get_sync_workers.
+    """
+    def __init__(self, app: Flask, interval: int | None = None, workers: int | None = None):
+        self.app = app
+        self.interval = interval if interval is not None else get_sync_interval()
+        self.workers = workers if workers is not None else get_sync_workers()
+        self.pool = Pool(self.workers)
+
+    def next_run_at(self, state: SyncState, now: datetime) -> datetime:
+        """
+        Determine when a user should be synced next. Users that were never synced, or whose courses
+        changed since their last sync according to a Canvas webhook, are due immediately. Users
+        with an assignment due soon are synced four times as often, and users whose last sync
+        changed something are synced twice as often.
+
+        :param state: The user's sync state.
+        :param now: The current time as a naive UTC datetime.
+        :return datetime: When the user should be synced next, as a naive UTC datetime.
+        """
+        if state.last_synced_at is None or is_pending(state):
+            return now
+
+        interval = self.interval
+        if state.next_due_at is not None and state.next_due_at - now < DUE_SOON_WINDOW:
+            interval /= 4
+        elif state.last_change_at is not None and state.last_change_at >= state.last_synced_at:
+            interval /= 2
+
+        return state.last_synced_at + timedelta(seconds=interval)
+
+    def due_jobs(self, now: datetime | None = None) -> list[SyncJob]:
+        """
+        Build the queue of users that are due for a sync, in the order they should be synced.
+
+        :param now: The current time as a naive UTC datetime. Defaults to the current time.
+        :return list[SyncJob]: The jobs that are due, highest priority first.
+        """
+        if now is None:
+            now = utc_now()
+
+        queue = []
+        for user, state in queries.get_sync_candidates():
+            run_at = self.next_run_at(state, now)
+            if run_at <= now:
+                heapq.heappush(queue, SyncJob(user.id, run_at, state.next_due_at,
+                                              state.last_change_at))
+
+        return [heapq.heappop(queue) for _ in range(len(queue))]
+
+    def run_once(self, now: datetime | None = None) -> SyncStats:
+        """
+        Sync every user that is currently due, using the worker pool.
+
+        :param now: The current time as a naive UTC datetime. Defaults to the current time.
+        :return SyncStats: The outcome of the syncs.
+        """
+        stats = SyncStats()
+        with self.app.app_context():
+            jobs = self.due_jobs(now)
+
+        for job in jobs:
+            self.pool.spawn(self.sync_user, job, stats)
+        self.pool.join()
+
+        return stats
+
+    def run_forever(self, poll: int = 60):
+        """
+        Repeatedly sync every user that is due, reporting statistics after each pass.
+
+        :param poll: The number of seconds to wait between two scheduling passes.
+        """
+        while True:
+            stats = self.run_once()
+            if stats.synced:
+                _log_report(stats)
+            time.sleep(poll)
+
+    def sync_user(self, job: SyncJob, stats: SyncStats):
+        """
+        Sync a single user's Canvas assignments to Todoist. Each sync runs in its own app context so
+        that every worker has its own database session.
+
+        :param job: The job describing the user to sync.
+        :param stats: The statistics to record the outcome in.
+        """
+        started_at = utc_now()
+        lag = (started_at - job.run_at).total_seconds()
+
+        with self.app.app_context():
+            user = db.session.get(User, job.user_id)
+            state = queries.get_sync_state(user) if user else None
+            if user is None or state is None or state.canvas_token_server is None:
+                return
+
+            changed = 0
+            error = None
+            try:
+                canvas_key, canvas_upgraded = decrypt_str_upgrade(state.canvas_token_server,
+                                                                  get_todo_secret(), KDF_HKDF)
+                todoist_key, todoist_upgraded = decrypt_str_upgrade(user.todoist_token_password,
+                                                                    get_todo_secret(), KDF_HKDF)
+                # Tokens encrypted before the server secret used HKDF are replaced on first use
+                if canvas_upgraded is not None or todoist_upgraded is not None:
+                    queries.store_server_tokens(
+                        user, todoist_upgraded and todoist_upgraded.to_bytes(),
+                        canvas_upgraded and canvas_upgraded.to_bytes())
+                # The webhook was received by the backend, so this process may still have the
+                # user's old Canvas results cached
+                if is_pending(state):
+                    canvas.invalidate_key(canvas_key)
+
+                changed = todoist.add_update_tasks(user.id, canvas_key, todoist_key)
+                todoist.sync_task_status(user, todoist_key)
+                queries.update_sync_courses(user, [course['id'] for course
+                                                   in courses.get_all_courses(canvas_key)])
+            except Exception as ex:
+                error = f'{type(ex).__name__}: {ex}'
+                logger.warning('Sync failed for user %s: %s', user.id, error)
+
+            # A webhook received while syncing is after the start, so the user is synced again
+            queries.update_sync_state(user, started_at, changed > 0,
+                                      queries.get_next_due_date(user), error)
+            # Reload the user's dashboard if it is open
+            if changed > 0:
+                events.publish([user.id], 'sync', {'changed': changed})
+            stats.record(lag, changed > 0, error is not None)
+
+
+def is_pending(state: SyncState) -> bool:
+    """Returns True if a Canvas webhook reported a change for the user since their last sync."""
+    return state.pending_at is not None and \
+        (state.last_synced_at is None or state.pending_at > state.last_synced_at)
+
+
+def _log_report(stats: SyncStats):
+    report = stats.report()
+    logger.info('Synced %d users (%.1f users/min), %d changed, %d errors (%.1f%%), '
+                'lag avg %.1fs max %.1fs, %d courses skipped, %d courses processed',
+                report['synced'], report['users_per_minute'], report['changed'],
+                report['errors'], report['error_rate'] * 100, report['avg_lag'],
+                report['max_lag'], todoist.course_fingerprints.skipped,
+                todoist.course_fingerprints.processed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Periodically sync Canvas assignments to Todoist.')
+    parser.add_argument('--once', action='store_true',
+                        help='sync every user that is due once, then exit')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of users to sync concurrently (default: SYNC_WORKERS)')
+    parser.add_argument('--interval', type=int, default=None,
+                        help='base seconds between syncs of one user (default: SYNC_INTERVAL)')
+    parser.add_argument('--poll', type=int, default=60,
+                        help='seconds between two scheduling passes')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    scheduler = SyncScheduler(create_app(), interval=args.interval, workers=args.workers)
+    if args.once:
+        _log_report(scheduler.run_once())
+    else:
+        scheduler.run_forever(args.poll)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,24 @@
 import pytest
 import os
 
+from app import create_app
+
 os.environ['TODOIST_SECRET'] = 'secrets.example/todoist_secret.txt'
-os.environ['DB_CONN_FILE'] = 'secrets.example/connection_string.txt'
+# TEST_DB_CONN_FILE allows running the tests against another database, such as MariaDB
+os.environ['DB_CONN_FILE'] = os.environ.get(
+    'TEST_DB_CONN_FILE', 'secrets.example/connection_string.txt')
 os.environ['SESSION_SECRET_FILE'] = 'secrets.example/session_secret.txt'
 os.environ['TODO_SECRET_FILE'] = 'secrets.example/todoist_secret_encrypt.txt'
 os.environ['CSRF'] = 'OFF'
 
-import app as app_mod  # noqa: E402
+
+@pytest.fixture(scope='session')
+def backend_app():
+    # Every test shares one app, and so one in-memory database
+    return create_app()
 
 
 @pytest.fixture
-def app():
-    app_mod.app.debug = True
-    return app_mod.app
+def app(backend_app):
+    backend_app.debug = True
+    return backend_app
@@ -0,0 +1,75 @@
+"""
+A series of tests for creating the app and how long it takes.
+"""
+
+import json
+from pathlib import Path
+import subprocess
+import sys
+
+from app import create_app
+import utils.canvas as utils_canvas
+
+from .test_server import server_env  # noqa: F401
+
+SRC_DIR = Path(__file__).resolve().parents[1]
+
+# Importing and creating the app takes about 1 second on a development machine. The budget leaves
+# room for slower machines, while catching an SDK or a slow setup step being added to every start.
+COLD_START_BUDGET = 3.0
+
+# SDKs that are only imported once they are used
+LAZY_MODULES = ['canvasapi', 'todoist_api_python']
+
+COLD_START_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+create_app()
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'loaded': [name for name in {LAZY_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_create_app_config():
+    app = create_app({'SECRET_KEY': 'test secret', 'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+
+    assert app.config['SECRET_KEY'] == 'test secret'
+    assert app.config['WTF_CSRF_SECRET_KEY'] == 'test secret'
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {}
+    with app.test_client() as client:
+        assert client.get('/api/auth/status').status_code == 200
+
+
+def test_create_app_canvas_config(monkeypatch):
+    # Keep the Canvas settings of the other tests' app
+    monkeypatch.setattr(utils_canvas, '_config', {})
+    create_app({'SECRET_KEY': 'test secret', 'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                'CANVAS_BASE_URL': 'https://canvas.test', 'CANVAS_CONVERSATION_CACHE_TIME': 0})
+
+    assert utils_canvas.get_setting('CANVAS_BASE_URL') == 'https://canvas.test'
+    # Caches read their time to live when a result is stored, which expires it right away here
+    utils_canvas.conversation_cache[('ctoken', 1)] = (None, None)
+    assert ('ctoken', 1) not in utils_canvas.conversation_cache
+
+    # Settings that aren't in the config are read from the environment whenever they are used
+    monkeypatch.setenv('CANVAS_API_CACHE_TIME', '7')
+    assert utils_canvas.get_setting('CANVAS_API_CACHE_TIME') == 7
+
+
+def test_cold_start(server_env):  # noqa: F811
+    output = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT], cwd=SRC_DIR, env=server_env,
+                            capture_output=True, text=True, timeout=60, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    assert result['loaded'] == []
+    assert result['seconds'] < COLD_START_BUDGET
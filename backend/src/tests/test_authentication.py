@@ -2,7 +2,7 @@ import argon2
 import flask_login.utils
 import pytest
 
-from utils.crypto import encrypt_str, get_todo_secret
+from utils.crypto import encrypt_str, get_todo_secret, KDF_HKDF
 
 #################################################################
 #                                                               #
@@ -42,9 +42,9 @@ class MockUser:
         else:
             self.canvas_token_password = encrypt_str(ctoken, password)
         if ttoken is None:
-            self.todoist_token_password = encrypt_str('a'*40, get_todo_secret())
+            self.todoist_token_password = encrypt_str('a'*40, get_todo_secret(), KDF_HKDF)
         else:
-            self.todoist_token_password = encrypt_str(ttoken, get_todo_secret())
+            self.todoist_token_password = encrypt_str(ttoken, get_todo_secret(), KDF_HKDF)
 
     # Allow conversion to dict
     def __iter__(self):
@@ -60,6 +60,9 @@ class MockPasswordHasher:
 
         raise argon2.exceptions.VerifyMismatchError
 
+    def check_needs_rehash(self, hash: str | bytes):
+        return False
+
     def hash(self, password: str | bytes, salt: bytes | None = None):
         return password
 
@@ -276,6 +279,7 @@ def test_login(monkeypatch):
     monkeypatch.setattr(authentication, "password_hasher", MockPasswordHasher())
     monkeypatch.setattr(authentication, "login_user", mock_login_user)
     monkeypatch.setattr(authentication, "session", MockSession())
+    monkeypatch.setattr(authentication, "store_api_keys", lambda user, ctoken, ttoken: True)
     # Return objects as objects not strs
     monkeypatch.setattr(authentication, "jsonify", lambda x: x)
     monkeypatch.setattr(authentication, "abort", mock_abort)
@@ -0,0 +1,221 @@
+"""
+A series of tests for the Canvas and Todoist circuit breakers and the stale cache fallback.
+"""
+
+from cachetools import cached, TTLCache
+import gevent
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+import utils.breakers as breakers
+import utils.canvas as canvas
+import utils.deadlines as deadlines
+import utils.todoist as todoist
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+def make_breaker(**kwargs) -> breakers.CircuitBreaker:
+    options = {'window': 60, 'min_calls': 4, 'failure_rate': 0.5, 'reset_timeout': 0.1}
+    options.update(kwargs)
+    return breakers.CircuitBreaker('test', **options)
+
+
+def fail(breaker: breakers.CircuitBreaker, times: int = 1):
+    for _ in range(times):
+        breaker.before_call()
+        breaker.record(True)
+
+
+def succeed(breaker: breakers.CircuitBreaker, times: int = 1):
+    for _ in range(times):
+        breaker.before_call()
+        breaker.record(False)
+
+
+class FailingRequests:
+    """Stands in for the requests module, and fails the test if Todoist is called."""
+    def post(self, *args, **kwargs):
+        raise AssertionError('Todoist should not be called')
+
+
+class UnavailableCanvas:
+    """Lists calendar events lazily like canvasapi, and loses its connection after one list."""
+    listings = 0
+
+    def __init__(self, base_url: str, access_token: str):
+        pass
+
+    def get_calendar_events(self, **kwargs):
+        def events():
+            UnavailableCanvas.listings += 1
+            if UnavailableCanvas.listings > 1:
+                raise requests.ConnectionError('Canvas is unavailable')
+            yield 'event'
+        return events()
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_opens_at_failure_rate():
+    breaker = make_breaker()
+
+    # Failures below the minimum number of calls don't open the breaker
+    fail(breaker, 3)
+    assert breaker.state == breakers.CLOSED
+
+    fail(breaker)
+    assert breaker.state == breakers.OPEN
+    with pytest.raises(breakers.CircuitOpen):
+        breaker.before_call()
+    assert breakers.BREAKER_STATE.get('test') == breakers.STATE_VALUES[breakers.OPEN]
+
+
+def test_stays_closed_below_failure_rate():
+    breaker = make_breaker()
+
+    succeed(breaker, 3)
+    fail(breaker)
+    succeed(breaker, 3)
+    fail(breaker)
+    assert breaker.state == breakers.CLOSED
+
+
+def test_window_forgets_old_calls():
+    breaker = make_breaker(window=0.05)
+
+    fail(breaker, 3)
+    gevent.sleep(0.1)
+    fail(breaker)
+    assert breaker.state == breakers.CLOSED
+    assert len(breaker.outcomes) == 1
+
+
+def test_half_open_probe():
+    breaker = make_breaker()
+    fail(breaker, 4)
+    gevent.sleep(0.15)
+
+    # A single call probes the API, others are rejected until it returns
+    breaker.before_call()
+    assert breaker.state == breakers.HALF_OPEN
+    with pytest.raises(breakers.CircuitOpen):
+        breaker.before_call()
+
+    breaker.record(False)
+    assert breaker.state == breakers.CLOSED
+    succeed(breaker)
+
+
+def test_failed_probe_reopens():
+    breaker = make_breaker()
+    fail(breaker, 4)
+    gevent.sleep(0.15)
+
+    fail(breaker)
+    assert breaker.state == breakers.OPEN
+    with pytest.raises(breakers.CircuitOpen):
+        breaker.before_call()
+
+
+def test_call_outcomes():
+    breaker = make_breaker(min_calls=1)
+
+    # Client errors and errors that aren't from requests don't count against the API
+    with breaker.call() as outcome:
+        outcome.status = 404
+    with pytest.raises(ValueError):
+        with breaker.call():
+            raise ValueError
+    assert breaker.state == breakers.CLOSED
+
+    with pytest.raises(requests.ConnectionError):
+        with breaker.call():
+            raise requests.ConnectionError
+    assert breaker.state == breakers.OPEN
+
+
+def test_breaker_adapter(monkeypatch):
+    statuses = iter([200, 503, 503])
+
+    def fake_send(self, request, timeout=None, **kwargs):
+        response = requests.Response()
+        response.status_code = next(statuses)
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, 'send', fake_send)
+    breaker = make_breaker(min_calls=3)
+    session = requests.Session()
+    breakers.guard_session(session, breaker)
+
+    for _ in range(3):
+        session.get('https://canvas.example/api/v1/courses')
+    assert breaker.state == breakers.OPEN
+
+    with pytest.raises(breakers.CircuitOpen):
+        session.get('https://canvas.example/api/v1/courses')
+
+
+def test_stale_fallback():
+    results = iter(['first', breakers.CircuitOpen(), breakers.CircuitOpen()])
+
+    @breakers.stale_fallback
+    @cached(cache=TTLCache(maxsize=8, ttl=60), info=True)
+    def get_value(key: str) -> str:
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert get_value('a') == 'first'
+    assert get_value.cache_info().currsize == 1
+
+    # Once the cached result expires, the last result is used while the API is unavailable
+    get_value.cache_clear()
+    with deadlines.budget(5):
+        assert get_value('a') == 'first'
+        assert deadlines._current_budget.get().partial
+
+    with pytest.raises(breakers.CircuitOpen):
+        get_value('b')
+
+
+def test_stale_fallback_lazy_results(monkeypatch):
+    UnavailableCanvas.listings = 0
+    monkeypatch.setattr(canvas, 'Canvas', UnavailableCanvas)
+    monkeypatch.setattr(canvas, 'get_all_courses', lambda canvas_key: [])
+    canvas.get_calendar_events.cache.clear()
+    canvas.get_calendar_events.stale.clear()
+
+    assert canvas.get_calendar_events('ctoken', '2024-01-01', '2024-02-01') == ['event']
+
+    # Canvas is only called once the events are listed, which must happen while the fallback can
+    # still catch the error
+    canvas.get_calendar_events.cache.clear()
+    with deadlines.budget(5):
+        assert canvas.get_calendar_events('ctoken', '2024-01-01', '2024-02-01') == ['event']
+        assert deadlines._current_budget.get().partial
+    assert UnavailableCanvas.listings == 2
+
+    canvas.get_calendar_events.cache.clear()
+    canvas.get_calendar_events.stale.clear()
+
+
+def test_todoist_breaker(monkeypatch):
+    breaker = make_breaker()
+    fail(breaker, 4)
+    monkeypatch.setattr(breakers, 'TODOIST', breaker)
+    monkeypatch.setattr(todoist, 'requests', FailingRequests())
+
+    with pytest.raises(breakers.CircuitOpen):
+        todoist._post('https://todoist.example/rest/v2/tasks')
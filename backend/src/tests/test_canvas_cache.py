@@ -0,0 +1,153 @@
+"""
+A series of tests for the caching of course rosters and conversations.
+"""
+
+import gevent
+import pytest
+
+import utils.canvas as utils_canvas
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+class MockUser:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+
+
+class MockCourse:
+    def __init__(self, canvas, id: str):
+        self.canvas = canvas
+        self.id = id
+
+    def get_users(self, enrollment_type: list[str]):
+        self.canvas.roster_fetches += 1
+        return [MockUser(1, 'Professor'), MockUser(2, 'TA')]
+
+
+class MockConversation:
+    def __init__(self, id: int, last_message_at: str, messages: list | None = None):
+        self.id = id
+        self.subject = f'Conversation {id}'
+        self.last_message_at = last_message_at
+        self.messages = messages
+        self.participants = [{'id': 1, 'name': 'Professor'}] if messages else None
+
+    def add_message(self, body: str):
+        return MockConversation(self.id, self.last_message_at)
+
+
+class MockMessagingCanvas:
+    """Counts the requests made to Canvas, for every API key."""
+    roster_fetches = 0
+    listings = 0
+    fetches = []
+    active = 0
+    most_active = 0
+    last_message_at = {}
+
+    def __init__(self, base_url: str, access_token: str):
+        self.access_token = access_token
+
+    def get_course(self, course_id):
+        return MockCourse(MockMessagingCanvas, course_id)
+
+    def get_conversations(self, per_page: int):
+        MockMessagingCanvas.listings += 1
+        return [MockConversation(id, last_message_at)
+                for id, last_message_at in MockMessagingCanvas.last_message_at.items()]
+
+    def get_conversation(self, id: int):
+        MockMessagingCanvas.fetches.append(id)
+        MockMessagingCanvas.active += 1
+        MockMessagingCanvas.most_active = max(MockMessagingCanvas.most_active,
+                                              MockMessagingCanvas.active)
+        gevent.sleep(0.01)
+        MockMessagingCanvas.active -= 1
+        # Conversation 3 has no messages left
+        messages = [{'body': 'Hello'}] if id != 3 else []
+        return MockConversation(id, MockMessagingCanvas.last_message_at.get(id), messages)
+
+
+@pytest.fixture(autouse=True)
+def mock_canvas(monkeypatch):
+    MockMessagingCanvas.roster_fetches = 0
+    MockMessagingCanvas.listings = 0
+    MockMessagingCanvas.fetches = []
+    MockMessagingCanvas.most_active = 0
+    MockMessagingCanvas.last_message_at = {id: '2024-11-01T12:00:00Z' for id in range(1, 6)}
+    monkeypatch.setattr(utils_canvas, 'Canvas', MockMessagingCanvas)
+    # Every key is enrolled in course 1 only
+    monkeypatch.setattr(utils_canvas, 'get_all_courses', lambda canvas_key: ['1'])
+    utils_canvas.get_course_roster.cache.clear()
+    utils_canvas.conversation_cache.clear()
+    yield MockMessagingCanvas
+    utils_canvas.get_course_roster.cache.clear()
+    utils_canvas.conversation_cache.clear()
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_roster_is_shared(mock_canvas):
+    roster = utils_canvas.get_professor_info('ctoken', '1')
+    assert roster == [{'id': 1, 'name': 'Professor'}, {'id': 2, 'name': 'TA'}]
+
+    # Every user of the course gets the cached roster
+    assert utils_canvas.get_professor_info('other_ctoken', 1) == roster
+    assert mock_canvas.roster_fetches == 1
+
+    # Users that aren't enrolled in the course fetch it with their own key every time
+    utils_canvas.get_professor_info('ctoken', '2')
+    utils_canvas.get_professor_info('ctoken', '2')
+    assert mock_canvas.roster_fetches == 3
+
+
+def test_conversations_are_cached(mock_canvas):
+    conversations = utils_canvas.get_conversations_from_ids('ctoken', [2, 1, 3])
+    assert [conversation['id'] for conversation in conversations] == [2, 1]
+    assert conversations[0]['messages'] == [{'body': 'Hello'}]
+    # Nothing was cached yet, so the recent conversations weren't listed
+    assert mock_canvas.listings == 0
+    assert sorted(mock_canvas.fetches) == [1, 2, 3]
+
+    # Conversations without a new message are reused, including the ones that were left out
+    mock_canvas.fetches = []
+    conversations = utils_canvas.get_conversations_from_ids('ctoken', [2, 1, 3, 4])
+    assert [conversation['id'] for conversation in conversations] == [2, 1, 4]
+    assert mock_canvas.fetches == [4]
+    assert mock_canvas.listings == 1
+
+    # Conversations are cached for each key, since Canvas decides who may see them
+    utils_canvas.get_conversations_from_ids('other_ctoken', [1])
+    assert mock_canvas.fetches == [4, 1]
+
+
+def test_new_messages_are_fetched(mock_canvas):
+    utils_canvas.get_conversations_from_ids('ctoken', [1, 2])
+
+    mock_canvas.fetches = []
+    mock_canvas.last_message_at[2] = '2024-11-02T12:00:00Z'
+    utils_canvas.get_conversations_from_ids('ctoken', [1, 2])
+    assert mock_canvas.fetches == [2]
+
+    # Replying to a conversation removes it from the cache
+    mock_canvas.fetches = []
+    utils_canvas.send_reply('ctoken', 1, 'Thanks')
+    utils_canvas.get_conversations_from_ids('ctoken', [1, 2])
+    assert mock_canvas.fetches == [1, 1]
+
+
+def test_conversations_are_fetched_concurrently(mock_canvas, monkeypatch):
+    monkeypatch.setenv('CANVAS_CONVERSATION_FETCHES', '2')
+    conversations = utils_canvas.get_conversations_from_ids('ctoken', [5, 4, 2, 1])
+    assert [conversation['id'] for conversation in conversations] == [5, 4, 2, 1]
+    assert mock_canvas.most_active == 2
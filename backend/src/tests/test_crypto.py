@@ -68,3 +68,54 @@ def test_encrypt_decrypt_empty():
     ciphertext = crypto.encrypt_str("data", "")
     data = crypto.decrypt_str(ciphertext, "")
     assert data == "data"
+
+
+def test_encrypt_decrypt_hkdf():
+    # Test encryption with a key derived with HKDF
+    ciphertext = crypto.encrypt_str("data", "secret", crypto.KDF_HKDF)
+    assert ciphertext.kdf == crypto.KDF_HKDF
+    assert bytes(ciphertext)[:2] == bytes((crypto.FORMAT_VERSION, crypto.KDF_HKDF))
+
+    # The KDF is read from the bytes, so the caller doesn't have to know it
+    data = crypto.decrypt_str(bytes(ciphertext), "secret")
+    assert data == "data"
+
+    with pytest.raises(ValueError):
+        crypto.decrypt_str(bytes(ciphertext), "wrong")
+
+
+def test_decrypt_legacy():
+    # Ciphertexts without a header are still decrypted with scrypt
+    legacy = bytes(crypto.encrypt_str("data", "password"))[2:]
+    assert crypto.Ciphertext.from_bytes(legacy).kdf == crypto.KDF_LEGACY
+    assert crypto.decrypt_str(legacy, "password") == "data"
+
+
+def test_decrypt_legacy_like_header(monkeypatch):
+    # With a fixed key, it is cheap to find a legacy ciphertext whose tag looks like a header
+    key = bytes(32)
+    monkeypatch.setattr(crypto, 'scrypt', lambda *args, **kwargs: key)
+    header = bytes((crypto.FORMAT_VERSION, crypto.KDF_HKDF))
+    tag = b''
+    while not tag.startswith(header):
+        cipher = crypto.AES.new(key, crypto.AES.MODE_OCB)
+        ciphertext, tag = cipher.encrypt_and_digest(b"data")
+    legacy = bytes(crypto.Ciphertext(tag, cipher.nonce, bytes(16), ciphertext))
+
+    # It is read as a versioned ciphertext first, then as a legacy one once that fails
+    assert crypto.Ciphertext.from_bytes(legacy).kdf == crypto.KDF_HKDF
+    assert crypto.decrypt_str(legacy, "password") == "data"
+
+
+def test_decrypt_str_upgrade():
+    # Legacy ciphertexts are re-encrypted with the requested KDF
+    legacy = bytes(crypto.encrypt_str("data", "secret"))[2:]
+    data, upgraded = crypto.decrypt_str_upgrade(legacy, "secret", crypto.KDF_HKDF)
+    assert data == "data"
+    assert upgraded.kdf == crypto.KDF_HKDF
+    assert crypto.decrypt_str(bytes(upgraded), "secret") == "data"
+
+    # Ciphertexts that already use it are left alone
+    data, upgraded = crypto.decrypt_str_upgrade(bytes(upgraded), "secret", crypto.KDF_HKDF)
+    assert data == "data"
+    assert upgraded is None
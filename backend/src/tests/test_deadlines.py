@@ -0,0 +1,178 @@
+"""
+A series of tests for the request time budgets and the timeouts of outbound calls.
+"""
+
+from types import SimpleNamespace
+from flask import url_for
+import gevent
+import pytest
+import requests
+import time
+from requests.adapters import HTTPAdapter
+
+import api.v1.user as user
+import utils.canvas as canvas
+import utils.deadlines as deadlines
+import utils.queries as queries
+
+from .test_courses import fake_login, mock_decrypt_canvas_key, MockCanvas, MockTodoistAPI
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(queries, 'Canvas', MockCanvas)
+    monkeypatch.setattr(queries, 'TodoistAPI', MockTodoistAPI)
+    monkeypatch.setenv('OUTBOUND_TIMEOUT', '5')
+
+
+class LazyCalendarCanvas:
+    """Lists calendar events like canvasapi, whose PaginatedList only calls Canvas when iterated."""
+    def __init__(self, base_url: str, access_token: str):
+        pass
+
+    def get_calendar_events(self, type: str = 'assignment', **kwargs):
+        def events():
+            # Events of other types take longer than any budget in these tests
+            if type != 'assignment':
+                gevent.sleep(10)
+            yield SimpleNamespace(id=1, title='Homework', type=type,
+                                  start_at='2024-01-01T00:00:00Z')
+        return events()
+
+
+class SlowTodoistAPI:
+    def __init__(self, todoist_token):
+        pass
+
+    def get_task(self, task_id):
+        gevent.sleep(10)
+
+
+@pytest.fixture
+def lazy_canvas(monkeypatch):
+    monkeypatch.setattr(canvas, 'Canvas', LazyCalendarCanvas)
+    monkeypatch.setattr(canvas, 'get_all_courses', lambda canvas_key: [SimpleNamespace(id=1)])
+    canvas.get_calendar_events.cache.clear()
+    yield
+    canvas.get_calendar_events.cache.clear()
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_timeout_without_budget():
+    assert deadlines.remaining() is None
+    assert deadlines.get_timeout() == 5
+
+
+def test_timeout_with_budget():
+    with deadlines.budget(2):
+        assert 0 < deadlines.get_timeout() <= 2
+    with deadlines.budget(60):
+        assert deadlines.get_timeout() == 5
+
+
+def test_budget_exceeded():
+    with deadlines.budget(0):
+        with pytest.raises(deadlines.DeadlineExceeded):
+            deadlines.get_timeout('canvas')
+
+
+def test_join_partial():
+    with deadlines.budget(0.2):
+        fast = gevent.spawn(lambda: 'fast')
+        slow = gevent.spawn(gevent.sleep, 10)
+        assert deadlines.join([fast, slow]) == [fast]
+        assert deadlines._current_budget.get().partial
+    gevent.sleep(0)
+    assert slow.dead
+
+
+def test_join_complete():
+    with deadlines.budget(5):
+        greenlets = [gevent.spawn(lambda: 'done') for _ in range(3)]
+        assert deadlines.join(greenlets) == greenlets
+        assert not deadlines._current_budget.get().partial
+
+
+def test_timeout_adapter(monkeypatch):
+    timeouts = []
+
+    def fake_send(self, request, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, 'send', fake_send)
+    session = requests.Session()
+    deadlines.limit_session(session, 'canvas')
+
+    session.get('https://canvas.example/api/v1/courses')
+    session.get('https://canvas.example/api/v1/courses', timeout=1)
+    with deadlines.budget(2):
+        session.get('https://canvas.example/api/v1/courses')
+    with deadlines.budget(0):
+        with pytest.raises(deadlines.DeadlineExceeded):
+            session.get('https://canvas.example/api/v1/courses')
+
+    assert timeouts[:2] == [5, 1]
+    assert 0 < timeouts[2] <= 2
+    assert len(timeouts) == 3
+
+
+#################################################################
+#                                                               #
+#                        ENDPOINT TESTS                         #
+#                                                               #
+#################################################################
+
+
+def test_partial_response(client, monkeypatch, lazy_canvas):
+    fake_login(client)
+    monkeypatch.setattr(user, 'decrypt_canvas_key', mock_decrypt_canvas_key)
+    monkeypatch.setenv('REQUEST_BUDGET', '0.5')
+
+    start = time.perf_counter()
+    resp = client.get(url_for('api_v1.user.get_calendar_events'),
+                      query_string={'start_date': '2024-01-01', 'end_date': '2024-02-01'})
+
+    # The events are fetched in the greenlets the budget applies to, not while merging them
+    assert time.perf_counter() - start < 5
+    assert resp.status_code == 200
+    assert resp.headers.get(deadlines.PARTIAL_HEADER) == 'true'
+    assert [event['type'] for event in resp.json] == ['assignment']
+
+
+def test_complete_response(client):
+    fake_login(client)
+
+    resp = client.get(url_for('authentication.auth_status'))
+
+    assert resp.status_code == 200
+    assert deadlines.PARTIAL_HEADER not in resp.headers
+
+
+def test_sign_up_budget(client, monkeypatch):
+    monkeypatch.setenv('REQUEST_BUDGET', '0.5')
+    monkeypatch.setattr(queries, 'TodoistAPI', SlowTodoistAPI)
+
+    start = time.perf_counter()
+    resp = client.post(url_for('authentication.sign_up'),
+                       json={'username': 'slow_todoist', 'password': 'slowslowslowslow',
+                             'canvasToken': 'ctoken', 'todoistToken': 'ttoken'})
+
+    # Checking the Todoist token is bounded by the budget like other Todoist calls
+    assert time.perf_counter() - start < 5
+    assert resp.status_code == 500
+    assert queries.get_user_by_username('slow_todoist') is None
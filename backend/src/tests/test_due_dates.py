@@ -0,0 +1,98 @@
+"""
+A series of tests for storing due dates in UTC and converting older databases.
+"""
+
+from datetime import datetime
+import pytest
+from sqlalchemy import text
+
+import migrations.m0003_due_date_datetimes as due_date_migration
+import utils.models as models
+import utils.queries as queries
+from utils.settings import parse_local_date, format_local_date
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+# An owner that is only used by these tests
+OWNER = 7101
+
+
+class MockOwner:
+    def __init__(self, id: int):
+        self.id = id
+
+
+@pytest.fixture(autouse=True)
+def cleanup(app):
+    yield
+
+    # Remove the rows again so that other tests start from an empty database
+    models.db.session.rollback()
+    models.SubTask.query.filter(models.SubTask.owner == OWNER).delete()
+    models.Task.query.filter(models.Task.owner == OWNER).delete()
+    models.db.session.commit()
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_local_dates():
+    # Eastern Daylight Time is UTC-4 and Eastern Standard Time is UTC-5
+    assert parse_local_date('2024-07-01T12:00') == datetime(2024, 7, 1, 16)
+    assert parse_local_date('2024-12-01 12:00:00') == datetime(2024, 12, 1, 17)
+    assert parse_local_date('not a date') is None
+    assert parse_local_date('2024-13-01T12:00') is None
+
+    assert format_local_date(datetime(2024, 7, 1, 16)) == '2024-07-01 12:00:00'
+    assert format_local_date(datetime(2024, 12, 1, 17), '%Y-%m-%dT%H:%M') == '2024-12-01T12:00'
+    assert format_local_date(None) is None
+
+
+def test_due_window():
+    owner = MockOwner(OWNER)
+    for day in (1, 15, 28):
+        queries.add_or_return_task(owner, None, f'window-{day}', datetime(2999, 1, day, 12),
+                                   f'task {day}')
+
+    tasks = queries.get_non_canvas_tasks(owner, until=datetime(2999, 1, 20))
+    assert [task.todoist_id for task in tasks] == ['window-1', 'window-15']
+    assert len(queries.get_non_canvas_tasks(owner)) == 3
+
+
+def test_migrate_due_dates():
+    # Rows written by older versions store local time strings
+    with models.db.engine.begin() as conn:
+        task_id = conn.execute(text(
+            "INSERT INTO tasks (owner, task_type, status, due_date, custom_due_date) "
+            "VALUES (:owner, 'assignment', 'Incomplete', '2024-11-01 12:00:00', '2024-12-01T09:30')"
+        ), {'owner': OWNER}).lastrowid
+        conn.execute(text(
+            "INSERT INTO tasks (owner, task_type, status, due_date) "
+            "VALUES (:owner, 'assignment', 'Incomplete', '2024-11-01 1')"
+        ), {'owner': OWNER})
+        conn.execute(text(
+            "INSERT INTO subtasks (owner, task_id, name, status, due_date) "
+            "VALUES (:owner, :task_id, 'subtask', 'Incomplete', '2024-11-01 12:00')"
+        ), {'owner': OWNER, 'task_id': task_id})
+
+    with models.db.engine.begin() as conn:
+        assert due_date_migration.convert_due_dates(conn) == 4
+
+    tasks = models.Task.query.filter_by(owner=OWNER).order_by(models.Task.id).all()
+    assert tasks[0].due_date == datetime(2024, 11, 1, 16)
+    assert tasks[0].custom_due_date == datetime(2024, 12, 1, 14, 30)
+    # Truncated due dates fall back to the end of the day
+    assert tasks[1].due_date == datetime(2024, 11, 2, 3, 59)
+    assert models.SubTask.query.filter_by(owner=OWNER).one().due_date == datetime(2024, 11, 1, 16)
+
+    # Converted rows are left alone
+    with models.db.engine.begin() as conn:
+        assert due_date_migration.convert_due_dates(conn) == 0
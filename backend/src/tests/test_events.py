@@ -0,0 +1,143 @@
+"""
+A series of tests for the dashboard's event streams.
+"""
+
+from datetime import timedelta
+from flask import url_for
+import gevent
+import pytest
+
+import utils.events as events
+import utils.models as models
+import utils.queries as queries
+from utils.settings import utc_now
+
+from .test_courses import fake_login, MockCanvas, MockTodoistAPI
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+# Users that are only used by these tests
+USER = 7401
+OTHER_USER = 7402
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(queries, 'Canvas', MockCanvas)
+    monkeypatch.setattr(queries, 'TodoistAPI', MockTodoistAPI)
+
+
+@pytest.fixture
+def hub(app, monkeypatch):
+    hub = events.EventHub(limit=2, poll_interval=0.01)
+    monkeypatch.setattr(events, 'hub', hub)
+    yield hub
+
+    for user_id, queues in list(hub.channels.items()):
+        for queue in list(queues):
+            hub.unsubscribe(user_id, queue)
+    models.UserEvent.query.delete()
+    models.db.session.commit()
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_publish_to_subscribers(app, hub):
+    queue = hub.subscribe(app, USER)
+    hub.poller.kill()
+
+    events.publish([USER, OTHER_USER], 'subtask', {'id': 1, 'status': 1})
+    assert hub.poll() == 2
+
+    # Only the streams of the event's users receive it
+    text = queue.get_nowait()
+    assert text.endswith('event: subtask\ndata: {"id": 1, "status": 1}\n\n')
+    assert queue.empty()
+    assert hub.poll() == 0
+
+
+def test_stream_limit(app, hub):
+    first = hub.subscribe(app, USER)
+    hub.subscribe(app, OTHER_USER)
+
+    with pytest.raises(events.StreamLimitReached):
+        hub.subscribe(app, USER)
+
+    hub.unsubscribe(USER, first)
+    hub.subscribe(app, USER)
+
+
+def test_stream(app, hub):
+    queue = hub.subscribe(app, USER)
+    stream = events.stream(USER, queue, ['id: 1\nevent: sync\ndata: {}\n\n'], heartbeat=0.01)
+
+    assert next(stream) == f'retry: {events.RETRY_MS}\n\n'
+    # Missed events are sent first, then a heartbeat while nothing happens
+    assert next(stream).startswith('id: 1\n')
+    assert next(stream) == ': heartbeat\n\n'
+
+    events.publish([USER], 'invitation', {'subtask_id': 3})
+    assert 'event: invitation' in next(stream)
+
+    stream.close()
+    assert hub.channels == {}
+
+
+def test_missed_and_expired_events(app, hub):
+    events.publish([USER], 'sync', {'changed': 1})
+    events.publish([USER], 'sync', {'changed': 2})
+    first, second = models.UserEvent.query.filter_by(owner=USER).order_by(models.UserEvent.id)
+
+    assert [event.id for event in events.get_missed_events(USER, first.id)] == [second.id]
+
+    first.created_at = utc_now() - timedelta(days=1)
+    models.db.session.commit()
+    assert events.prune() == 1
+
+
+#################################################################
+#                                                               #
+#                        ENDPOINT TESTS                         #
+#                                                               #
+#################################################################
+
+
+def test_events_endpoint(client, hub):
+    fake_login(client)
+    user_id = queries.get_user_by_username('test').id
+    events.publish([user_id], 'sync', {'changed': 1})
+    missed = models.UserEvent.query.filter_by(owner=user_id).one()
+
+    resp = client.get(url_for('api_v1.user.stream_events'),
+                      headers={'Last-Event-ID': str(missed.id - 1)})
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/event-stream'
+
+    body = iter(resp.response)
+    assert next(body).startswith(b'retry:')
+    assert next(body).startswith(f'id: {missed.id}\n'.encode())
+
+    events.publish([user_id], 'subtask', {'id': 2, 'status': 0})
+    with gevent.Timeout(1):
+        assert b'event: subtask' in next(body)
+
+    resp.close()
+    assert hub.channels == {}
+
+
+def test_events_endpoint_limit(client, hub):
+    fake_login(client)
+    hub.limit = 0
+
+    resp = client.get(url_for('api_v1.user.stream_events'))
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '30'
@@ -0,0 +1,244 @@
+"""
+A series of tests for the server-side grade simulator.
+"""
+
+from flask import url_for
+import numpy as np
+import pytest
+
+import api.v1.courses as courses
+import utils.canvas as utils_canvas
+import utils.grades as grades
+import utils.queries as queries
+
+from .test_courses import fake_login, mock_decrypt_canvas_key, MockCanvas, MockTodoistAPI
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(queries, 'Canvas', MockCanvas)
+    monkeypatch.setattr(queries, 'TodoistAPI', MockTodoistAPI)
+    monkeypatch.setattr(courses, 'decrypt_canvas_key', mock_decrypt_canvas_key)
+
+
+class MockAssignmentGroup:
+    def __init__(self, name: str, group_weight: float, assignments: list[dict]):
+        self.name = name
+        self.group_weight = group_weight
+        self.assignments = assignments
+
+
+def mock_assignment(id: int, score: float | None, max_score: float = 100, omit: bool = False):
+    return {'id': id, 'name': str(id), 'points_possible': max_score,
+            'omit_from_final_grade': omit,
+            'submission': {'score': score} if score is not None else None}
+
+
+mock_groups = [
+    MockAssignmentGroup('Homework', 50, [mock_assignment(1, 90), mock_assignment(2, 80),
+                                         mock_assignment(3, None)]),
+    MockAssignmentGroup('Exams', 50, [mock_assignment(4, 70), mock_assignment(5, None),
+                                      mock_assignment(6, 0, max_score=10, omit=True)]),
+]
+
+
+class MockSubmission:
+    def __init__(self, graded_at: str):
+        self.graded_at = graded_at
+
+
+class MockGradedCourse:
+    """Lists the graded submissions of a course, and the parameters they were listed with."""
+    def __init__(self, submissions: list[MockSubmission]):
+        self.submissions = submissions
+        self.listings = []
+
+    def get_course(self, course_id):
+        return self
+
+    def get_multiple_submissions(self, **kwargs):
+        self.listings.append(kwargs)
+        since = kwargs.get('graded_since', '')
+        return [submission for submission in self.submissions if submission.graded_at > since]
+
+
+class MockGradedCanvas:
+    """Counts the fetches of assignment groups, and reports when the course was last graded."""
+    def __init__(self):
+        self.fetches = 0
+        self.graded_at = '2024-11-01T12:00:00Z'
+
+    def get_last_graded_at(self, canvas_key, course_id):
+        return self.graded_at
+
+    def get_assignment_groups(self, canvas_key, course_id):
+        self.fetches += 1
+        return mock_groups if course_id == '1' else None
+
+
+@pytest.fixture
+def mock_canvas(monkeypatch):
+    mock_canvas = MockGradedCanvas()
+    monkeypatch.setattr(utils_canvas, 'get_last_graded_at_no_cache',
+                        mock_canvas.get_last_graded_at)
+    monkeypatch.setattr(utils_canvas, 'get_weighted_graded_assignments_for_course_no_cache',
+                        mock_canvas.get_assignment_groups)
+    utils_canvas.get_graded_groups.cache.clear()
+    utils_canvas.get_last_graded_at.cache.clear()
+    yield mock_canvas
+    utils_canvas.get_graded_groups.cache.clear()
+    utils_canvas.get_last_graded_at.cache.clear()
+
+
+@pytest.fixture
+def course_grades(mock_canvas):
+    return grades.get_course_grades('ctoken', '1')
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_grades(course_grades):
+    # Assignments without a score and omitted assignments don't count
+    grade, percents = course_grades.grades(course_grades.scores[None, :])
+    assert grade.tolist() == [77.5]
+    assert percents.tolist() == [[85.0, 70.0]]
+
+    # Groups without a counted assignment don't count either
+    only_homework = course_grades.scenarios([{4: None}])
+    grade, percents = course_grades.grades(only_homework)
+    assert grade.tolist() == [85.0]
+    assert np.isnan(percents[0, 1])
+
+
+def test_scenarios_are_batched(course_grades):
+    overrides = [{}, {3: 100}, {5: 100, 3: 0}, {'unknown': 50}]
+    batched, _ = course_grades.grades(course_grades.scenarios(overrides))
+    one_by_one = [course_grades.grades(course_grades.scenarios([override]))[0][0]
+                  for override in overrides]
+    assert batched.tolist() == one_by_one
+    assert batched.tolist() == pytest.approx([77.5, 80.0, 70.835, 77.5], abs=0.01)
+
+
+def test_needed(course_grades):
+    # Scoring 0 on assignments 3 and 5 gives 45.84, scoring 100 on them gives 87.5
+    needed = course_grades.needed(course_grades.scores[None, :], [90, 80, 40])
+    assert needed[0, 0] > 100
+    assert needed[0, 1] == pytest.approx(82.0, abs=0.1)
+    assert needed[0, 2] == 0
+
+    # Nothing is needed once every assignment has a score
+    graded = course_grades.scenarios([{3: 100, 5: 100}])
+    assert np.isnan(course_grades.needed(graded, [90])).all()
+
+
+def test_summary(course_grades):
+    summary = course_grades.summary()
+    assert summary['grade'] == 77.5
+    assert summary['groups'] == [
+        {'name': 'Homework', 'weight': 50.0, 'percent': 85.0, 'contribution': 42.5},
+        {'name': 'Exams', 'weight': 50.0, 'percent': 70.0, 'contribution': 35.0},
+    ]
+    assert [needed['letter'] for needed in summary['needed']] == ['A', 'B', 'C', 'D']
+    assert summary['needed'][0]['reached'] is False
+    assert summary['needed'][1]['percent'] == 82.0
+
+
+def test_graded_groups(mock_canvas):
+    groups = utils_canvas.get_weighted_graded_assignments_for_course('ctoken', '1')
+    assert [group.name for group in groups] == ['Homework', 'Exams']
+    assert list(groups[0].ids) == [1, 2, 3]
+    assert list(groups[0].scores)[:2] == [90, 80]
+    assert np.isnan(groups[0].scores[2])
+    assert groups[1].omit == bytes([0, 0, 1])
+
+
+def test_graded_groups_cache(mock_canvas):
+    grades.get_course_grades('ctoken', '1')
+    grades.get_course_grades('ctoken', '1')
+    assert mock_canvas.fetches == 1
+
+    # A new grade is fetched once the last check for new grades expires
+    mock_canvas.graded_at = '2024-11-02T12:00:00Z'
+    grades.get_course_grades('ctoken', '1')
+    assert mock_canvas.fetches == 1
+    utils_canvas.get_last_graded_at.cache.clear()
+    grades.get_course_grades('ctoken', '1')
+    assert mock_canvas.fetches == 2
+
+    # The groups are removed with the Canvas results of their course
+    assert utils_canvas.invalidate_course(1) >= 1
+    grades.get_course_grades('ctoken', '1')
+    assert mock_canvas.fetches == 3
+
+
+def test_last_graded_at(monkeypatch):
+    course = MockGradedCourse([MockSubmission('2024-10-01T12:00:00Z'),
+                               MockSubmission('2024-11-01T12:00:00Z')])
+    monkeypatch.setattr(utils_canvas, 'connect', lambda canvas_key: course)
+    utils_canvas.last_graded.clear()
+
+    assert utils_canvas.get_last_graded_at_no_cache('ctoken', '1') == '2024-11-01T12:00:00Z'
+
+    # Later checks only list the submissions graded since the last one
+    assert utils_canvas.get_last_graded_at_no_cache('ctoken', '1') == '2024-11-01T12:00:00Z'
+    course.submissions.append(MockSubmission('2024-11-02T12:00:00Z'))
+    assert utils_canvas.get_last_graded_at_no_cache('ctoken', '1') == '2024-11-02T12:00:00Z'
+    assert [listing.get('graded_since') for listing in course.listings] == \
+        [None, '2024-11-01T12:00:00Z', '2024-11-01T12:00:00Z']
+    utils_canvas.last_graded.clear()
+
+#################################################################
+#                                                               #
+#                        ENDPOINT TESTS                         #
+#                                                               #
+#################################################################
+
+
+def test_get_grade_summary(client, course_grades):
+    resp = client.get(url_for('api_v1.courses.get_grade_summary', courseid='1'))
+    assert resp.status_code == 401
+
+    fake_login(client)
+    resp = client.get(url_for('api_v1.courses.get_grade_summary', courseid='1'))
+    assert resp.status_code == 200
+    assert resp.json == course_grades.summary()
+
+    resp = client.get(url_for('api_v1.courses.get_grade_summary', courseid='2'))
+    assert resp.status_code == 400
+
+
+def test_get_grade_simulation(client, mock_canvas):
+    fake_login(client)
+
+    resp = client.get(url_for('api_v1.courses.get_grade_simulation', courseid='1'))
+    assert resp.status_code == 200
+    assert [group['name'] for group in resp.json] == ['Homework', 'Exams']
+    assert resp.json[0]['weight'] == 50
+    assert resp.json[0]['assignments'][2] == {'id': 3, 'name': '3', 'max_score': 100, 'score': None,
+                                              'omit_from_final_grade': False}
+    assert resp.json[1]['assignments'][2]['omit_from_final_grade'] is True
+
+
+def test_simulate_grades(client, course_grades):
+    fake_login(client)
+
+    resp = client.post(url_for('api_v1.courses.simulate_grades', courseid='1'),
+                       json={'scenarios': [{'3': 100}, {'5': 100, '3': 0}]})
+    assert resp.status_code == 200
+    assert [scenario['grade'] for scenario in resp.json] == pytest.approx([80.0, 70.835], abs=0.01)
+
+    # Scenarios must map assignment IDs to numbers
+    for body in [{}, {'scenarios': []}, {'scenarios': [{'3': 'A'}]}, {'scenarios': [{'x': 1}]},
+                 {'scenarios': [{}] * (courses.MAX_SCENARIOS + 1)}]:
+        resp = client.post(url_for('api_v1.courses.simulate_grades', courseid='1'), json=body)
+        assert resp.status_code == 400
@@ -0,0 +1,216 @@
+"""
+A series of tests that check that the hot task and subtask queries are served by indexes. The query
+plans are read with `EXPLAIN`, so these tests work on both SQLite and MariaDB. To run them against
+MariaDB, set TEST_DB_CONN_FILE to a file containing a MariaDB connection string.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import pytest
+from sqlalchemy import event
+
+import utils.models as models
+import utils.queries as queries
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+# Owners that are only used by these tests
+OWNERS = range(7001, 7021)
+
+# Every index on tasks that starts with the owner
+OWNER_TASK_INDEXES = {'idx_task_owner_todoist', 'idx_task_owner_canvas', 'idx_task_owner_due'}
+
+
+class MockOwner:
+    def __init__(self, id: int):
+        self.id = id
+
+
+@pytest.fixture(autouse=True)
+def seed_tasks(app):
+    # Give the query planner enough rows that a table scan is clearly worse than an index
+    for owner in OWNERS:
+        for i in range(10):
+            task = models.Task(owner=owner, task_type=models.TaskType.assignment,
+                               canvas_id=owner * 100 + i, todoist_id=f'{owner}-{i}',
+                               due_date=datetime(2999, 1, i + 1, 12))
+            models.db.session.add(task)
+            models.db.session.flush()
+            subtask = models.SubTask(owner=owner, task_id=task.id, todoist_id=f'{owner}-{i}-s',
+                                     name='subtask', shared_with=[])
+            models.db.session.add(subtask)
+            models.db.session.flush()
+            models.db.session.add(models.SubTaskShared(owner=OWNERS[-1 - OWNERS.index(owner)],
+                                                       subtask_id=subtask.id,
+                                                       todoist_original=subtask.todoist_id,
+                                                       todoist_id=f'{owner}-{i}-r'))
+    models.db.session.commit()
+
+    yield
+
+    # Remove the rows again so that other tests start from an empty database
+    models.db.session.rollback()
+    models.SubTaskShared.query.filter(models.SubTaskShared.owner.in_(OWNERS)).delete()
+    models.SubTask.query.filter(models.SubTask.owner.in_(OWNERS)).delete()
+    models.Task.query.filter(models.Task.owner.in_(OWNERS)).delete()
+    models.db.session.commit()
+
+
+@contextmanager
+def capture_queries():
+    """
+    Capture every SQL statement that is executed inside the `with` block, together with its
+    parameters.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    engine = models.db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def explain(statement: str, parameters) -> str:
+    """
+    Explain a statement and return a description of its query plan that includes the names of the
+    indexes it uses.
+    """
+    engine = models.db.engine
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            return '\n'.join(row[-1] for row in rows)
+
+        rows = conn.exec_driver_sql('EXPLAIN ' + statement, parameters).mappings().all()
+        return '\n'.join(f"{row['table']} {row['type']} {row['key']}" for row in rows)
+
+
+def find_statement(statements: list, *fragments: str) -> tuple:
+    for statement, parameters in statements:
+        if all(fragment in statement for fragment in fragments):
+            return statement, parameters
+
+    raise AssertionError(f'No statement contains {fragments}')
+
+
+def assert_uses_index(plan: str, indexes: set[str]):
+    assert any(index in plan for index in indexes), plan
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_task_by_todoist_id():
+    owner = MockOwner(OWNERS[0])
+
+    with capture_queries() as statements:
+        task = queries.get_task_or_subtask_by_todoist_id(owner, f'{OWNERS[0]}-3')
+    assert task is not None
+
+    plan = explain(*find_statement(statements, 'FROM tasks'))
+    assert_uses_index(plan, {'idx_task_owner_todoist'})
+
+
+def test_subtask_by_todoist_id():
+    owner = MockOwner(OWNERS[0])
+
+    with capture_queries() as statements:
+        subtask = queries.get_task_or_subtask_by_todoist_id(owner, f'{OWNERS[0]}-3-s')
+    assert isinstance(subtask, models.SubTask)
+
+    plan = explain(*find_statement(statements, 'FROM subtasks'))
+    assert_uses_index(plan, {'idx_subtask_owner_todoist'})
+
+
+def test_shared_subtask_by_todoist_id():
+    # The last owner received every subtask of the first owner
+    owner = MockOwner(OWNERS[-1])
+
+    with capture_queries() as statements:
+        subtask = queries.get_task_or_subtask_by_todoist_id(owner, f'{OWNERS[0]}-3-s')
+    assert isinstance(subtask, models.SubTask)
+
+    plan = explain(*find_statement(statements, 'JOIN shared_subtasks'))
+    assert_uses_index(plan, {'idx_shared_owner_subtask'})
+
+
+@pytest.mark.parametrize('todoist_id,table,index', [
+    (f'{OWNERS[0]}-3', 'FROM tasks', 'idx_task_todoist'),
+    (f'{OWNERS[0]}-3-s', 'FROM subtasks', 'idx_subtask_todoist'),
+    (f'{OWNERS[0]}-3-r', 'JOIN shared_subtasks', 'idx_shared_todoist'),
+])
+def test_any_owner_by_todoist_id(todoist_id, table, index):
+    # The Todoist webhook doesn't know the owner of the task
+    with capture_queries() as statements:
+        task = queries.get_by_todoist_id(todoist_id)
+    assert task is not None
+
+    plan = explain(*find_statement(statements, table))
+    assert_uses_index(plan, {index})
+
+
+def test_non_canvas_tasks():
+    owner = MockOwner(OWNERS[1])
+
+    with capture_queries() as statements:
+        queries.get_non_canvas_tasks(owner, until=datetime(2999, 2, 1))
+
+    plan = explain(*find_statement(statements, 'FROM tasks', 'due_date >'))
+    assert_uses_index(plan, {'idx_task_owner_due', 'idx_task_owner_canvas'})
+
+
+def test_next_due_date():
+    with capture_queries() as statements:
+        next_due = queries.get_next_due_date(OWNERS[1])
+    assert next_due is not None
+
+    plan = explain(*find_statement(statements, 'FROM tasks'))
+    assert_uses_index(plan, {'idx_task_owner_due'})
+
+
+def test_descriptions_and_custom_due_dates():
+    owner = MockOwner(OWNERS[2])
+    canvas_ids = [OWNERS[2] * 100 + i for i in range(3)]
+
+    with capture_queries() as statements:
+        descriptions = queries.get_descriptions_by_canvas_ids(owner, canvas_ids)
+        queries.get_custom_due_dates_by_ids(owner, canvas_ids)
+    assert set(descriptions) == set(canvas_ids)
+
+    plan = explain(*find_statement(statements, 'tasks.description', 'FROM tasks'))
+    assert_uses_index(plan, {'idx_task_owner_canvas', 'idx_canvas_owner'})
+
+    plan = explain(*find_statement(statements, 'tasks.custom_due_date', 'FROM tasks'))
+    assert_uses_index(plan, {'idx_task_owner_canvas', 'idx_canvas_owner'})
+
+
+def test_sync_task_status():
+    owner = MockOwner(OWNERS[3])
+
+    with capture_queries() as statements:
+        queries.sync_task_status(owner, {f'{OWNERS[3]}-1', f'{OWNERS[3]}-2'})
+
+    plan = explain(*find_statement(statements, 'UPDATE tasks'))
+    assert_uses_index(plan, OWNER_TASK_INDEXES)
+
+    plan = explain(*find_statement(statements, 'FROM subtasks', 'subtasks.owner ='))
+    assert_uses_index(plan, {'idx_subtask_owner_todoist'})
+
+    # Only the open tasks are incomplete
+    statuses = {task.todoist_id: task.status
+                for task in models.Task.query.filter(models.Task.owner == owner.id)}
+    assert statuses[f'{OWNERS[3]}-1'] == models.TaskStatus.Incomplete
+    assert statuses[f'{OWNERS[3]}-0'] == models.TaskStatus.Completed
@@ -0,0 +1,141 @@
+"""
+A series of tests for the per-request instrumentation and the Server-Timing header.
+"""
+
+from datetime import timedelta
+from types import SimpleNamespace
+from flask import url_for
+import gevent
+import logging
+import pytest
+import requests
+from sqlalchemy import text
+
+import utils.instrumentation as instrumentation
+import utils.models as models
+import utils.queries as queries
+import utils.settings as settings
+
+from .test_courses import fake_login, MockCanvas, MockTodoistAPI
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(queries, 'Canvas', MockCanvas)
+    monkeypatch.setattr(queries, 'TodoistAPI', MockTodoistAPI)
+
+
+@pytest.fixture
+def metrics():
+    """Measure the test as if it were a request."""
+    instrumentation._start_request()
+    yield instrumentation.get_current_metrics()
+    instrumentation._teardown_request(None)
+
+
+def parse_server_timing(header: str) -> dict[str, dict[str, str]]:
+    timings = {}
+    for metric in header.split(', '):
+        name, *params = metric.split(';')
+        timings[name] = dict(param.split('=', 1) for param in params)
+    return timings
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_query_metrics(app, metrics):
+    models.db.session.execute(text('SELECT 1'))
+    models.db.session.execute(text('SELECT 2'))
+    assert metrics.db_count == 2
+    assert metrics.db_time > 0
+
+
+def test_spans_and_calls(metrics):
+    with settings.time_it('\nLogin:'):
+        with instrumentation.record_call('todoist'):
+            gevent.sleep(0.01)
+    with settings.time_it('\nLogin:'):
+        pass
+
+    # Spans with the same name are added together
+    assert list(metrics.spans) == ['Login']
+    assert metrics.spans['Login'] >= 0.01
+    assert metrics.external['todoist'][0] == 1
+
+    timings = parse_server_timing(metrics.server_timing())
+    assert timings['todoist']['desc'] == '"1 calls"'
+    assert timings['login']['desc'] == '"Login"'
+    assert 'total' in timings
+
+
+def test_spawned_greenlets(metrics):
+    def call_canvas():
+        with instrumentation.record_call('canvas'):
+            pass
+
+    gevent.joinall([instrumentation.spawn(call_canvas) for _ in range(3)], raise_error=True)
+    # Greenlets that don't copy the context are not measured
+    gevent.spawn(call_canvas).join()
+    assert metrics.external['canvas'][0] == 3
+
+
+def test_instrument_session(metrics):
+    session = requests.Session()
+    instrumentation.instrument_session(session, 'canvas')
+
+    response = SimpleNamespace(url='https://canvas.test/api/v1/courses/42/assignments?page=2',
+                               status_code=200, elapsed=timedelta(milliseconds=250))
+    for hook in session.hooks['response']:
+        hook(response)
+    assert metrics.external['canvas'] == [1, 0.25]
+    assert instrumentation.EXTERNAL_CALLS.get('canvas', '/api/v1/courses/:id/assignments', 200) \
+        >= 1
+
+
+def test_no_request():
+    # Nothing is recorded outside of a request
+    with settings.time_it('Outside'):
+        with instrumentation.record_call('todoist'):
+            pass
+    assert instrumentation.get_current_metrics() is None
+
+
+def test_server_timing_header(client, caplog):
+    fake_login(client)
+
+    with caplog.at_level(logging.INFO, logger='utils.instrumentation'):
+        resp = client.get(url_for('api_v1.filters.get_filters'))
+    assert resp.status_code == 200
+
+    timings = parse_server_timing(resp.headers['Server-Timing'])
+    assert int(timings['db']['desc'].strip('"').split()[0]) > 0
+    assert float(timings['total']['dur']) >= float(timings['db']['dur'])
+
+    log = [record.getMessage() for record in caplog.records if '"path"' in record.getMessage()]
+    assert '"endpoint": "api_v1.filters.get_filters"' in log[-1]
+    assert '"db_queries": ' in log[-1]
+
+
+def test_login_spans(client):
+    fake_login(client)
+    client.post(url_for('authentication.logout'))
+
+    resp = client.post(url_for('authentication.login'),
+                       json={'username': 'test', 'password': 'testtesttesttest'})
+    assert resp.status_code == 200
+
+    timings = parse_server_timing(resp.headers['Server-Timing'])
+    assert 'login' in timings
+    assert 'decrypting-and-encrypting-tokens' in timings
+    assert 'total-time-for-login-function' in timings
@@ -0,0 +1,117 @@
+"""
+A series of tests for the metrics exported by the /metrics endpoint.
+"""
+
+from flask import url_for
+import pytest
+
+import utils.crypto as crypto
+import utils.instrumentation as instrumentation
+import utils.metrics as metrics
+import utils.queries as queries
+
+from .test_courses import fake_login, MockCanvas, MockTodoistAPI
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+ADMIN_TOKEN = 'admin-token'
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(queries, 'Canvas', MockCanvas)
+    monkeypatch.setattr(queries, 'TodoistAPI', MockTodoistAPI)
+
+
+@pytest.fixture
+def admin_token(tmp_path, monkeypatch):
+    token_file = tmp_path / 'admin_token.txt'
+    token_file.write_text(f'{ADMIN_TOKEN}\n')
+    monkeypatch.setenv('ADMIN_TOKEN_FILE', str(token_file))
+    return ADMIN_TOKEN
+
+
+def get_metrics(client) -> str:
+    resp = client.get(url_for('admin.get_metrics'),
+                      headers={'Authorization': f'Bearer {ADMIN_TOKEN}'})
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/plain'
+    return resp.get_data(as_text=True)
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_histogram():
+    histogram = metrics.Histogram('test_histogram_seconds', 'A histogram for testing.',
+                                  ('route',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, '/a')
+    histogram.observe(0.5, '/a')
+    histogram.observe(5, '/a')
+    assert histogram.get('/a') == 3
+
+    lines = metrics.render().splitlines()
+    assert '# TYPE test_histogram_seconds histogram' in lines
+    assert 'test_histogram_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_histogram_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'test_histogram_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_histogram_seconds_sum{route="/a"} 5.55' in lines
+    assert 'test_histogram_seconds_count{route="/a"} 3' in lines
+
+    with pytest.raises(ValueError):
+        histogram.observe(1)
+
+
+def test_external_calls():
+    calls = instrumentation.EXTERNAL_CALLS
+    before = calls.get('todoist', '/rest/v2/tasks/:id/close', 204)
+
+    with instrumentation.record_call('todoist',
+                                     'https://api.todoist.com/rest/v2/tasks/6X7rM8997g3RQmvh/close'
+                                     ) as call:
+        call.status = 204
+    with pytest.raises(ConnectionError):
+        with instrumentation.record_call('todoist', 'https://api.todoist.com/rest/v2/tasks'):
+            raise ConnectionError
+
+    assert calls.get('todoist', '/rest/v2/tasks/:id/close', 204) == before + 1
+    assert calls.get('todoist', '/rest/v2/tasks', 'error') >= 1
+
+
+def test_scrypt_duration():
+    count = crypto.SCRYPT_DURATION.get()
+    crypto.generate_key('seed')
+    assert crypto.SCRYPT_DURATION.get() == count + 1
+
+
+def test_metrics_requires_token(client, monkeypatch, admin_token):
+    assert client.get(url_for('admin.get_metrics')).status_code == 401
+    assert client.get(url_for('admin.get_metrics'),
+                      headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    # The endpoint doesn't exist without an admin token
+    monkeypatch.delenv('ADMIN_TOKEN_FILE')
+    assert client.get(url_for('admin.get_metrics'),
+                      headers={'Authorization': f'Bearer {admin_token}'}).status_code == 404
+
+
+def test_metrics_endpoint(client, admin_token):
+    fake_login(client)
+    client.get(url_for('api_v1.filters.get_filters'))
+
+    text = get_metrics(client)
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/filters",' \
+        'status="200"}' in text
+    assert 'canvas_cache_hit_ratio{function="get_all_courses"}' in text
+    assert 'scrypt_duration_seconds_count ' in text
+    assert 'db_pool_in_use ' in text
+    assert 'gevent_threadpool_threads ' in text
+    assert 'http_requests_in_flight 1' in text
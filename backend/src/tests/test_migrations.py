@@ -0,0 +1,144 @@
+"""
+A series of tests for the schema migration system. Each test uses its own SQLite database file.
+"""
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+import migrations.__main__ as migrations_cli
+from migrations import runner
+from utils.models import db
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    return tmp_path / 'migrations.db'
+
+
+@pytest.fixture
+def engine(db_file):
+    engine = create_engine(f'sqlite:///{db_file}')
+    yield engine
+    engine.dispose()
+
+
+def get_indexes(engine, table: str) -> set[str]:
+    return {index['name'] for index in inspect(engine).get_indexes(table)}
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_upgrade_empty_database(engine):
+    applied = runner.upgrade(engine)
+    assert [migration.version for migration in applied] == [1, 2, 3, 4, 5, 6, 7, 8]
+
+    with engine.connect() as conn:
+        assert runner.get_current_version(conn) == runner.get_latest_version()
+    # The migrations create every table, column, and index of the models
+    for table in db.metadata.tables.values():
+        assert {column.name for column in table.columns} \
+            == {column['name'] for column in inspect(engine).get_columns(table.name)}
+        assert {index.name for index in table.indexes} <= get_indexes(engine, table.name)
+    runner.check_version(engine)
+
+    # Nothing is applied twice
+    assert runner.upgrade(engine) == []
+
+
+def test_baseline_is_frozen(engine):
+    # The baseline creates the tables as they were before migrations, later changes are left to
+    # the migrations that own them
+    runner.upgrade(engine, target=1)
+    tables = set(inspect(engine).get_table_names())
+    assert {'users', 'tasks', 'subtasks', 'shared_subtasks', 'filters'} <= tables
+    assert not tables & {'sync_states', 'sync_courses', 'user_events', 'user_sessions'}
+    assert 'idx_task_owner_due' not in get_indexes(engine, 'tasks')
+    due_date = next(column for column in inspect(engine).get_columns('tasks')
+                    if column['name'] == 'due_date')
+    assert 'VARCHAR' in str(due_date['type'])
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (login_id, username, password, canvas_id, "
+                          "canvas_name, canvas_token_password, todoist_token_password) "
+                          "VALUES ('A', 'a', 'p', '1', 'n', 'c', 't')"))
+        conn.execute(text("INSERT INTO tasks (owner, task_type, status, due_date) "
+                          "VALUES (1, 'assignment', 'Incomplete', '2024-11-01 12:00:00')"))
+
+    applied = runner.upgrade(engine)
+    assert [migration.version for migration in applied] == [2, 3, 4, 5, 6, 7, 8]
+    assert 'idx_task_owner_due' in get_indexes(engine, 'tasks')
+    assert {'sync_states', 'sync_courses', 'user_events', 'user_sessions'} \
+        <= set(inspect(engine).get_table_names())
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT due_date FROM tasks')).scalar() \
+            == '2024-11-01 16:00:00.000000'
+
+
+def test_upgrade_legacy_database(engine):
+    # Databases created by `db.create_all()` have no version and may be missing indexes
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text('DROP INDEX idx_task_owner_due'))
+        conn.execute(text('DROP INDEX idx_shared_owner_subtask'))
+        conn.execute(text('ALTER TABLE sync_states DROP COLUMN pending_at'))
+        conn.execute(text("INSERT INTO tasks (owner, task_type, status, due_date) "
+                          "VALUES (1, 'assignment', 'Incomplete', '2024-11-01 12:00:00')"))
+
+    with pytest.raises(runner.SchemaVersionError):
+        runner.check_version(engine)
+
+    runner.upgrade(engine)
+    runner.check_version(engine)
+
+    assert 'idx_task_owner_due' in get_indexes(engine, 'tasks')
+    assert 'idx_shared_owner_subtask' in get_indexes(engine, 'shared_subtasks')
+    assert 'pending_at' in {column['name'] for column in inspect(engine).get_columns('sync_states')}
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT due_date FROM tasks')).scalar() \
+            == '2024-11-01 16:00:00.000000'
+
+
+def test_upgrade_to_version(engine):
+    applied = runner.upgrade(engine, target=2)
+    assert [migration.version for migration in applied] == [1, 2]
+
+    with pytest.raises(runner.SchemaVersionError):
+        runner.check_version(engine)
+
+    # Stamping marks the remaining migrations as applied without running them
+    runner.stamp(engine, runner.get_latest_version())
+    runner.check_version(engine)
+
+
+def test_check_schema_upgrades_sqlite(engine):
+    # SQLite database files, such as the local development database, are upgraded at startup
+    runner.check_schema(engine)
+    runner.check_version(engine)
+
+
+def test_cli(db_file, tmp_path, monkeypatch, capsys):
+    conn_file = tmp_path / 'connection_string.txt'
+    conn_file.write_text(f'sqlite:///{db_file}\n')
+    monkeypatch.setenv('DB_CONN_FILE', str(conn_file))
+
+    assert migrations_cli.main(['check']) == 1
+    assert migrations_cli.main(['upgrade']) == 0
+    assert migrations_cli.main(['check']) == 0
+
+    capsys.readouterr()
+    assert migrations_cli.main(['current']) == 0
+    assert capsys.readouterr().out.strip() == str(runner.get_latest_version())
+
+    assert migrations_cli.main(['history']) == 0
+    assert 'pending' not in capsys.readouterr().out
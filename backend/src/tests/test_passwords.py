@@ -0,0 +1,113 @@
+"""
+A series of tests for the password hashing policy.
+"""
+
+from argon2 import PasswordHasher
+from flask import url_for
+import pytest
+
+import api.auth.authentication as authentication
+import calibrate_passwords
+import utils.models as models
+import utils.passwords as passwords
+import utils.queries as queries
+
+from .test_courses import MockCanvas, MockTodoistAPI
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(queries, 'Canvas', MockCanvas)
+    monkeypatch.setattr(queries, 'TodoistAPI', MockTodoistAPI)
+
+
+# Cheap parameters, so that the tests don't spend their time hashing
+CHEAP = {'time_cost': 1, 'memory_cost': 64, 'parallelism': 1}
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_calibrate():
+    # Every time cost fits a generous budget, up to the highest one tried
+    time_cost, measurements = passwords.calibrate(10.0, 64, 1, samples=1, max_time_cost=3)
+    assert time_cost == 3
+    assert [measured for measured, _ in measurements] == [1, 2, 3]
+
+    # The search stops at the first time cost over the budget, but never chooses less than 1
+    time_cost, measurements = passwords.calibrate(0.0, 64, 1, samples=1)
+    assert time_cost == 1
+    assert len(measurements) == 1
+
+
+def test_calibrate_command(capsys):
+    assert calibrate_passwords.main(['--budget', '10', '--memory-cost', '64',
+                                     '--parallelism', '1', '--samples', '1']) == 0
+    output = capsys.readouterr().out
+    assert 'ARGON2_TIME_COST=20' in output
+    assert 'ARGON2_MEMORY_COST=64' in output
+
+    assert calibrate_passwords.main(['--budget', '0', '--memory-cost', '64', '--samples', '1']) == 1
+
+
+def test_replace_password_hash(app):
+    user = models.User(login_id=models.gen_unique_login_id(), username='rehash_unit',
+                       password='old', canvas_id='-1', canvas_name='canvas_test',
+                       canvas_token_password=b'unused', todoist_token_password=b'unused')
+    models.db.session.add(user)
+    models.db.session.commit()
+
+    # A hash is only replaced if the password didn't change since it was read
+    assert not queries.replace_password_hash(user.id, 'changed', 'new')
+    assert queries.replace_password_hash(user.id, 'old', 'new')
+    models.db.session.refresh(user)
+    assert user.password == 'new'
+
+    models.db.session.delete(user)
+    models.db.session.commit()
+
+#################################################################
+#                                                               #
+#                        ENDPOINT TESTS                         #
+#                                                               #
+#################################################################
+
+
+def test_rehash_on_login(client, monkeypatch):
+    credentials = {'username': 'rehash_user', 'password': 'rehashrehashrehash'}
+    resp = client.post(url_for('authentication.sign_up'),
+                       json=credentials | {'canvasToken': 'ctoken', 'todoistToken': 'ttoken'})
+    assert resp.status_code == 200
+
+    # Hash the password like an older version with weaker parameters did
+    user = queries.get_user_by_username('rehash_user')
+    old_hash = PasswordHasher(**CHEAP).hash(credentials['password'])
+    user.password = old_hash
+    models.db.session.commit()
+
+    rehashes = []
+    monkeypatch.setattr(authentication, 'rehash_in_background',
+                        lambda *args: rehashes.append(passwords.rehash_in_background(*args)))
+
+    # The sign in doesn't wait for the new hash
+    resp = client.post(url_for('authentication.login'), json=credentials)
+    assert resp.status_code == 200
+    assert len(rehashes) == 1
+
+    rehashes[0].join()
+    models.db.session.refresh(user)
+    assert user.password != old_hash
+    assert not models.password_hasher.check_needs_rehash(user.password)
+    models.password_hasher.verify(user.password, credentials['password'])
+
+    models.db.session.delete(user)
+    models.db.session.commit()
@@ -0,0 +1,142 @@
+"""
+A series of tests for profiling requests and downloading the profiles.
+"""
+
+from flask import url_for
+import gevent
+import greenlet
+import marshal
+import pytest
+
+import utils.profiling as profiling
+
+from .test_metrics import ADMIN_TOKEN, admin_token  # noqa: F401
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROFILE_DIR', str(tmp_path / 'profiles'))
+    return tmp_path / 'profiles'
+
+
+def admin_get(client, endpoint: str, **values):
+    return client.get(url_for(endpoint, **values),
+                      headers={'Authorization': f'Bearer {ADMIN_TOKEN}'})
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_profile_request(client, profile_dir, admin_token):  # noqa: F811
+    resp = client.get(url_for('authentication.auth_status'), headers={'X-Profile': admin_token})
+    profile_id = resp.headers['X-Profile-Id']
+
+    profiles = admin_get(client, 'admin.get_profiles').json
+    assert [profile['id'] for profile in profiles] == [profile_id]
+    assert profiles[0]['path'] == '/api/auth/status'
+    assert profiles[0]['status'] == resp.status_code
+    assert profiles[0]['profiler'] in ('pyinstrument', 'cProfile')
+
+    resp = admin_get(client, 'admin.download_profile', profile_id=profile_id)
+    assert resp.status_code == 200
+    assert 'attachment' in resp.headers['Content-Disposition']
+    if profiles[0]['profiler'] == 'cProfile':
+        assert marshal.loads(resp.data)
+
+    assert admin_get(client, 'admin.download_profile', profile_id='../secrets').status_code == 404
+    assert admin_get(client, 'admin.download_profile', profile_id='1-0000abcd').status_code == 404
+
+
+def test_profile_requires_token(client, profile_dir, admin_token):  # noqa: F811
+    resp = client.get(url_for('authentication.auth_status'), headers={'X-Profile': 'wrong'})
+    assert 'X-Profile-Id' not in resp.headers
+    assert profiling.list_profile_ids() == []
+
+
+def test_sample_rate(client, profile_dir, monkeypatch):
+    monkeypatch.setenv('PROFILE_SAMPLE_RATE', '1')
+    assert 'X-Profile-Id' in client.get(url_for('authentication.auth_status')).headers
+
+    monkeypatch.setenv('PROFILE_SAMPLE_RATE', '0')
+    assert 'X-Profile-Id' not in client.get(url_for('authentication.auth_status')).headers
+    assert len(profiling.list_profile_ids()) == 1
+
+
+def test_response_is_closed(profile_dir, monkeypatch):
+    monkeypatch.setenv('PROFILE_SAMPLE_RATE', '1')
+    closed = []
+
+    class Response(list):
+        def close(self):
+            closed.append(True)
+
+    def app(environ, start_response):
+        start_response('200 OK', [])
+        return Response([b'body'])
+
+    # The middleware consumes profiled responses itself, so it must close them as well
+    middleware = profiling.ProfilingMiddleware(app)
+    body = middleware({'PATH_INFO': '/api/auth/status'}, lambda *args: None)
+    assert body == [b'body']
+    assert closed == [True]
+
+
+def test_event_stream_is_not_buffered(profile_dir, admin_token):  # noqa: F811
+    def events():
+        while True:
+            yield b'data: {}\n\n'
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/event-stream; charset=utf-8')])
+        return events()
+
+    # Clients such as curl or a proxy don't send exactly `Accept: text/event-stream`, so the
+    # endless stream is recognized by its response instead
+    middleware = profiling.ProfilingMiddleware(app)
+    headers = []
+
+    def start_response(status, response_headers, exc_info=None):
+        headers.extend(response_headers)
+
+    body = middleware({'PATH_INFO': '/api/v1/user/events', 'HTTP_ACCEPT': '*/*',
+                       profiling.PROFILE_HEADER: admin_token}, start_response)
+    assert next(body) == b'data: {}\n\n'
+    assert profiling.PROFILE_ID_HEADER not in dict(headers)
+    assert not middleware.profiling
+    assert profiling.list_profile_ids() == []
+
+
+def test_ring_buffer(profile_dir, monkeypatch):
+    monkeypatch.setenv('PROFILE_LIMIT', '2')
+    profile_ids = [profiling.new_profile_id() for _ in range(3)]
+    for profile_id in profile_ids:
+        profiling.save_profile(profile_id, b'profile', 'prof', {})
+
+    # Only the newest profiles are kept
+    assert profiling.list_profile_ids() == profile_ids[1:]
+    assert len(list(profile_dir.iterdir())) == 4
+    assert profiling.get_profile_path(profile_ids[0]) is None
+
+
+def test_switch_counter():
+    def wait():
+        counter = profiling.watch_switches(greenlet.getcurrent())
+        gevent.sleep(0.01)
+        gevent.sleep(0)
+        profiling.unwatch_switches(counter)
+        return counter
+
+    counter = gevent.spawn(wait).get()
+    assert counter.switches == 2
+    assert counter.waited >= 0.01
+    assert greenlet.gettrace() is None
@@ -0,0 +1,111 @@
+"""
+A series of tests for the production server in server.py.
+"""
+
+import http.client
+import os
+from pathlib import Path
+import signal
+import subprocess
+import sys
+import time
+
+import gevent
+import pytest
+import requests
+
+from server import BOOT_ERROR, _Server, create_listener
+
+SRC_DIR = Path(__file__).resolve().parents[1]
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+def hello_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'hello']
+
+
+@pytest.fixture
+def server_env():
+    # The server runs from backend/src, so the secrets set by conftest need absolute paths
+    env = dict(os.environ)
+    for name in ('TODOIST_SECRET', 'DB_CONN_FILE', 'SESSION_SECRET_FILE', 'TODO_SECRET_FILE'):
+        env[name] = os.path.abspath(env[name])
+    return env
+
+
+def start_server(env: dict, workers: int) -> tuple[subprocess.Popen, str]:
+    with create_listener('127.0.0.1', 0) as listener:
+        port = listener.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'server', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers)],
+        cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}/api/auth/status'
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=5)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('The server did not start')
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_stop_closes_idle_connections():
+    listener = create_listener('127.0.0.1', 0)
+    server = _Server(listener, hello_app, log=None)
+    server.start()
+
+    connection = http.client.HTTPConnection('127.0.0.1', listener.getsockname()[1])
+    connection.request('GET', '/')
+    assert connection.getresponse().read() == b'hello'
+
+    # The keep-alive connection is idle, so stopping doesn't wait for the timeout
+    start = time.monotonic()
+    gevent.spawn(server.stop, timeout=5).join()
+    assert time.monotonic() - start < 1
+    assert not server.pool
+
+
+def test_reload_and_stop(server_env):
+    process, url = start_server(server_env, workers=2)
+    try:
+        session = requests.Session()
+        assert session.get(url).status_code == 200
+
+        # Requests keep succeeding while the workers are replaced
+        process.send_signal(signal.SIGHUP)
+        statuses = []
+        for _ in range(30):
+            statuses.append(session.get(url, timeout=10).status_code)
+            time.sleep(0.05)
+        assert statuses == [200] * 30
+
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
+    finally:
+        process.kill()
+
+
+def test_boot_error(server_env):
+    server_env['SESSION_SECRET_FILE'] = '/nonexistent/session_secret.txt'
+    process = subprocess.run(
+        [sys.executable, '-m', 'server', '--host', '127.0.0.1', '--port', '0'],
+        cwd=SRC_DIR, env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        timeout=30)
+    assert process.returncode == BOOT_ERROR
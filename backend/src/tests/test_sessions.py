@@ -0,0 +1,97 @@
+"""
+A series of tests for the API keys of signed in sessions, which are stored in the database.
+"""
+
+from datetime import timedelta
+
+import flask
+from flask import url_for
+import pytest
+
+import utils.models as models
+import utils.queries as queries
+import utils.session as session
+from utils.crypto import decrypt_str
+from utils.settings import utc_now
+
+from .test_courses import fake_login, MockCanvas, MockTodoistAPI
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(queries, 'Canvas', MockCanvas)
+    monkeypatch.setattr(queries, 'TodoistAPI', MockTodoistAPI)
+
+
+def forget_user():
+    # Requests of the test client share the test's app context, where Flask-Login keeps the user it
+    # loaded, so the next request only loads the user again without it
+    flask.g.pop('_login_user', None)
+
+
+def get_sessions() -> list[models.UserSession]:
+    user = queries.get_user_by_username('test')
+    return models.UserSession.query.filter_by(owner=user.id).all()
+
+#################################################################
+#                                                               #
+#                        ENDPOINT TESTS                         #
+#                                                               #
+#################################################################
+
+
+def test_session_is_shared(client, app):
+    fake_login(client)
+    sessions = get_sessions()
+    assert len(sessions) >= 1
+    # The database alone doesn't hold the tokens
+    assert b'ctoken' not in sessions[-1].canvas_token_session
+
+    # Another connection, which another worker may accept, serves the same session
+    other_client = app.test_client()
+    other_client.set_cookie('session', client.get_cookie('session').value)
+    assert other_client.get(url_for('api_v1.filters.get_filters')).status_code == 200
+
+    # Signing out removes the session's tokens, so its cookie can't be used anymore
+    assert client.post(url_for('authentication.logout')).status_code == 200
+    assert len(get_sessions()) == len(sessions) - 1
+    assert other_client.get(url_for('api_v1.filters.get_filters')).status_code == 401
+
+
+def test_session_expires(client):
+    fake_login(client)
+    assert client.get(url_for('api_v1.filters.get_filters')).status_code == 200
+
+    user_session = get_sessions()[-1]
+    session_id = user_session.id
+    user_session.created_at = utc_now() - timedelta(days=8)
+    models.db.session.commit()
+    forget_user()
+    assert client.get(url_for('api_v1.filters.get_filters')).status_code == 401
+
+    # Expired sessions are removed when a user signs in
+    fake_login(client)
+    assert models.db.session.get(models.UserSession, session_id) is None
+
+
+def test_remove_every_session(client, app):
+    fake_login(client)
+
+    with app.test_request_context():
+        user = queries.get_user_by_username('test')
+        assert session.store_api_keys(user, 'ctoken', 'ttoken')
+        assert session.load_api_keys(user)
+        assert decrypt_str(user.canvas_token_session, flask.session[session.SECRET_KEY]) == 'ctoken'
+
+        # Changing the password signs out every session, including the one of the client
+        assert session.remove_api_keys(user, every_session=True) >= 2
+        assert not session.load_api_keys(user)
+
+    forget_user()
+    assert client.get(url_for('api_v1.filters.get_filters')).status_code == 401
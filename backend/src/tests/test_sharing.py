@@ -0,0 +1,234 @@
+"""
+A series of tests for sharing subtasks between users. Every sharing operation must cost a single
+database round-trip, which is enforced by counting the statements that are executed.
+"""
+
+from contextlib import contextmanager
+import gevent
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import event
+
+import utils.models as models
+import utils.sharing as sharing
+import utils.todoist as todoist
+
+from .test_indexes import capture_queries
+from .test_tasks import MockRequests, MockSyncRequests
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+CANVAS_ID = 7201
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(todoist, 'requests', MockRequests())
+
+
+@pytest.fixture
+def sharing_data(app):
+    """Two users with a task for the same assignment, where the first user has a subtask."""
+    users = []
+    for name in ('sharing_owner', 'sharing_recipient', 'sharing_stranger'):
+        user = models.User(login_id=models.gen_unique_login_id(), username=name, password='hash',
+                           canvas_id='-1', canvas_name=name, canvas_token_password=b'unused',
+                           todoist_token_password=f'{name}-token'.encode())
+        models.db.session.add(user)
+        users.append(user)
+    models.db.session.flush()
+
+    owner_task = models.Task(owner=users[0].id, task_type=models.TaskType.assignment,
+                             canvas_id=CANVAS_ID, todoist_id='owner-task')
+    recipient_task = models.Task(owner=users[1].id, task_type=models.TaskType.assignment,
+                                 canvas_id=CANVAS_ID, todoist_id='recipient-task')
+    models.db.session.add_all([owner_task, recipient_task])
+    models.db.session.flush()
+
+    subtask = models.SubTask(owner=users[0].id, task_id=owner_task.id, todoist_id='owner-sub',
+                             name='shared subtask', shared_with=[])
+    models.db.session.add(subtask)
+    models.db.session.commit()
+
+    # Plain objects so that reading an ID never lazily loads an expired row
+    data = SimpleNamespace(
+        owner=SimpleNamespace(id=users[0].id),
+        recipient=SimpleNamespace(id=users[1].id),
+        stranger=SimpleNamespace(id=users[2].id),
+        subtask=SimpleNamespace(id=subtask.id, owner=users[0].id, todoist_id='owner-sub'),
+    )
+    yield data
+
+    # Remove the rows again so that other tests start from an empty database
+    models.db.session.rollback()
+    user_ids = [data.owner.id, data.recipient.id, data.stranger.id]
+    models.UserEvent.query.filter(models.UserEvent.owner.in_(user_ids)).delete()
+    models.SubTaskInvitation.query.filter(models.SubTaskInvitation.owner.in_(user_ids)).delete()
+    models.SubTaskShared.query.filter(models.SubTaskShared.owner.in_(user_ids)).delete()
+    models.SubTask.query.filter(models.SubTask.owner.in_(user_ids)).delete()
+    models.Task.query.filter(models.Task.owner.in_(user_ids)).delete()
+    models.User.query.filter(models.User.id.in_(user_ids)).delete()
+    models.db.session.commit()
+
+
+@contextmanager
+def assert_round_trips(expected: int, commits: int = 0):
+    """
+    Assert that the `with` block executes exactly the expected number of SQL statements and
+    commits.
+    """
+    committed = []
+
+    def on_commit(conn):
+        committed.append(conn)
+
+    engine = models.db.engine
+    event.listen(engine, 'commit', on_commit)
+    try:
+        with capture_queries() as statements:
+            yield statements
+    finally:
+        event.remove(engine, 'commit', on_commit)
+
+    assert len(statements) == expected, '\n'.join(statement for statement, _ in statements)
+    assert len(committed) == commits
+
+
+def invite(data) -> int:
+    assert sharing.send_subtask_invitation(data.owner, data.recipient, data.subtask.id)
+    return models.SubTaskInvitation.query.filter_by(recipient_id=data.recipient.id).one().id
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_send_invitation(sharing_data):
+    with assert_round_trips(1, commits=1):
+        assert sharing.send_subtask_invitation(sharing_data.owner, sharing_data.recipient,
+                                               sharing_data.subtask.id)
+
+    # Only the owner of the subtask can share it
+    with assert_round_trips(1, commits=1):
+        assert not sharing.send_subtask_invitation(sharing_data.recipient, sharing_data.owner,
+                                                   sharing_data.subtask.id)
+
+    # The recipient needs a task for the same assignment
+    assert not sharing.send_subtask_invitation(sharing_data.owner, sharing_data.stranger,
+                                               sharing_data.subtask.id)
+    assert models.SubTaskInvitation.query.filter_by(owner=sharing_data.owner.id).count() == 1
+
+
+def test_invitation_notifications(sharing_data):
+    invitation_id = invite(sharing_data)
+
+    with assert_round_trips(1):
+        notifications = sharing.get_invitation_notifications(sharing_data.recipient)
+    assert notifications == [{
+        'title': 'You received a subtask invitation!',
+        'author_name': 'sharing_owner',
+        'subtask_name': 'shared subtask',
+        'invitation_id': invitation_id,
+    }]
+
+    with assert_round_trips(1):
+        assert sharing.get_invitation_original(sharing_data.recipient, invitation_id).id \
+            == sharing_data.owner.id
+    assert sharing.get_invitation_notifications(sharing_data.stranger) == []
+
+
+def test_accept_invitation(sharing_data):
+    invitation_id = invite(sharing_data)
+
+    # Other users can't see the invitation
+    assert sharing.get_invitation_details(sharing_data.stranger, invitation_id) is None
+
+    with assert_round_trips(1):
+        invitation = sharing.get_invitation_details(sharing_data.recipient, invitation_id)
+    assert invitation.name == 'shared subtask'
+    assert invitation.recipient_todoist_id == 'recipient-task'
+
+    # Creating the shared subtask, updating shared_with, and deleting the invitation is one
+    # transaction
+    with assert_round_trips(3, commits=1):
+        assert sharing.accept_invitation(sharing_data.recipient, invitation, 'recipient-sub')
+
+    assert models.db.session.get(models.SubTaskInvitation, invitation_id) is None
+    assert models.db.session.get(models.SubTask, sharing_data.subtask.id).shared_with \
+        == [sharing_data.recipient.id]
+
+    with assert_round_trips(1):
+        statuses = sharing.get_all_shared_todoist_status(sharing_data.recipient)
+    assert statuses == [('recipient-sub', models.TaskStatus.Incomplete)]
+
+    with assert_round_trips(1):
+        members = sharing.get_shared_subtask_members(sharing_data.subtask)
+    assert sorted(members) == [
+        (sharing_data.owner.id, 'owner-sub', b'sharing_owner-token'),
+        (sharing_data.recipient.id, 'recipient-sub', b'sharing_recipient-token'),
+    ]
+
+
+def test_add_shared_subtask(sharing_data):
+    invitation_id = invite(sharing_data)
+    recipient = models.db.session.get(models.User, sharing_data.recipient.id)
+    recipient_id = recipient.id
+
+    # One read for the invitation and one transaction to accept it
+    with assert_round_trips(4, commits=1):
+        assert todoist.add_shared_subtask(recipient, 'ttoken', invitation_id, True)
+
+    shared = models.SubTaskShared.query.filter_by(owner=recipient_id).one()
+    assert shared.subtask_id == sharing_data.subtask.id
+
+
+def test_decline_invitation(sharing_data):
+    invitation_id = invite(sharing_data)
+
+    with assert_round_trips(1, commits=1):
+        assert todoist.add_shared_subtask(sharing_data.recipient, 'ttoken', invitation_id, False)
+
+    assert models.db.session.get(models.SubTaskInvitation, invitation_id) is None
+    assert not sharing.decline_invitation(sharing_data.recipient, invitation_id)
+
+
+def test_set_statuses(sharing_data, monkeypatch):
+    invitation = sharing.get_invitation_details(sharing_data.recipient, invite(sharing_data))
+    assert sharing.accept_invitation(sharing_data.recipient, invitation, 'recipient-sub')
+    mock_requests = MockSyncRequests()
+    monkeypatch.setattr(todoist, 'requests', mock_requests)
+    monkeypatch.setattr(todoist, 'decrypt_str_upgrade',
+                        lambda token, secret, kdf: (token.decode(), None))
+    statuses = {'recipient-task': models.TaskStatus.Completed,
+                'owner-sub': models.TaskStatus.Completed,
+                'missing': models.TaskStatus.Completed}
+
+    # One read for the tasks and one for the members, one transaction for the statuses, and one
+    # for the other member's event
+    with assert_round_trips(5, commits=2):
+        results = todoist.set_statuses(sharing_data.recipient, 'ttoken', statuses)
+    assert results == {'recipient-task': True, 'owner-sub': True, 'missing': False}
+
+    # The recipient's Todoist changes their copy of the shared subtask
+    assert mock_requests.requests == 1
+    assert [command['args']['id'] for command in mock_requests.commands] == \
+        ['recipient-task', 'recipient-sub']
+    assert models.db.session.get(models.SubTask, sharing_data.subtask.id).status \
+        == models.TaskStatus.Completed
+
+    # The owner's copy is changed in the background
+    gevent.sleep(0)
+    assert mock_requests.requests == 2
+    assert mock_requests.commands[-1]['args']['id'] == 'owner-sub'
+    assert models.UserEvent.query.filter_by(owner=sharing_data.owner.id).count() == 1
+
+    # Tasks that already have the status aren't sent to Todoist
+    assert todoist.set_statuses(sharing_data.recipient, 'ttoken', statuses)['owner-sub']
+    assert mock_requests.requests == 2
@@ -0,0 +1,159 @@
+"""
+A series of tests for scheduling and running background syncs.
+"""
+
+from datetime import datetime, timedelta
+import pytest
+
+import sync_daemon
+import utils.canvas as utils_canvas
+import utils.models as models
+import utils.queries as queries
+import utils.todoist as todoist
+from utils.crypto import decrypt_str, encrypt_str, get_todo_secret, FORMAT_VERSION, KDF_HKDF, \
+    KDF_SCRYPT
+
+from .test_courses import MockCanvas
+from .test_tasks import MockResponse
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(utils_canvas, 'Canvas', MockCanvas)
+    monkeypatch.setattr(todoist, 'requests', FakeTodoist())
+
+
+class FakeTodoist:
+    """A stand-in for the Todoist sync API that reports a single open item."""
+    def __init__(self):
+        self.calls = []
+
+    def post(self, url: str, json={}, data={}, headers={}, timeout=None):
+        self.calls.append(url)
+        if url == 'https://api.todoist.com/sync/v9/sync':
+            return MockResponse(200, {'items': [{'id': '1', 'checked': False}]})
+
+        raise ValueError
+
+
+def add_sync_user(username: str, kdf: int = KDF_HKDF) -> models.User:
+    user = models.User(login_id=models.gen_unique_login_id(), username=username,
+                       password='hash', canvas_id='-1', canvas_name='canvas_test',
+                       canvas_token_password=b'unused',
+                       todoist_token_password=encrypt_str('ttoken', get_todo_secret(),
+                                                          kdf).to_bytes())
+    models.db.session.add(user)
+    models.db.session.commit()
+
+    assert queries.store_sync_credentials(user,
+                                          encrypt_str('ctoken', get_todo_secret(), kdf).to_bytes())
+    return user
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_job_priority():
+    now = datetime(2024, 11, 1)
+    later = sync_daemon.SyncJob(1, now, next_due_at=now + timedelta(days=3))
+    sooner = sync_daemon.SyncJob(2, now, next_due_at=now + timedelta(hours=2))
+    nothing_due = sync_daemon.SyncJob(3, now)
+    changed = sync_daemon.SyncJob(4, now, next_due_at=now + timedelta(days=3),
+                                  last_change_at=now)
+
+    # Sooner due dates come first, ties are broken by the most recent change
+    assert sorted([nothing_due, later, changed, sooner]) == [sooner, changed, later, nothing_due]
+
+
+def test_next_run_at(app):
+    scheduler = sync_daemon.SyncScheduler(app, interval=400, workers=1)
+    now = datetime(2024, 11, 1, 12)
+
+    # Users that were never synced are due immediately
+    state = models.SyncState(owner=1)
+    assert scheduler.next_run_at(state, now) == now
+
+    # Users are synced every interval by default
+    state.last_synced_at = now
+    state.last_change_at = now - timedelta(days=1)
+    assert scheduler.next_run_at(state, now) == now + timedelta(seconds=400)
+
+    # Users whose last sync changed something are synced twice as often
+    state.last_change_at = now
+    assert scheduler.next_run_at(state, now) == now + timedelta(seconds=200)
+
+    # Users with an assignment due soon are synced four times as often
+    state.next_due_at = now + timedelta(hours=1)
+    assert scheduler.next_run_at(state, now) == now + timedelta(seconds=100)
+
+    # Users whose courses changed since their last sync are due immediately
+    state.pending_at = now + timedelta(minutes=1)
+    assert scheduler.next_run_at(state, now) == now
+
+
+def test_run_once(app):
+    user = add_sync_user('sync_daemon_user')
+    scheduler = sync_daemon.SyncScheduler(app, interval=900, workers=2)
+
+    # The user was never synced, so they are synced right away
+    stats = scheduler.run_once()
+    report = stats.report()
+    assert report['synced'] >= 1
+    assert report['errors'] == 0
+    assert report['users_per_minute'] > 0
+
+    state = queries.get_sync_state(user)
+    models.db.session.refresh(state)
+    assert state.last_synced_at is not None
+    assert state.last_error is None
+
+    # Right after a sync the user is not due again
+    assert user.id not in [job.user_id for job in scheduler.due_jobs()]
+
+    # Once the interval has passed, the user is due again
+    later = state.last_synced_at + timedelta(seconds=901)
+    assert user.id in [job.user_id for job in scheduler.due_jobs(later)]
+
+
+def test_run_once_error(app, monkeypatch):
+    user = add_sync_user('sync_daemon_error')
+
+    def failing_add_update_tasks(user_id, canvas_key, todoist_key):
+        raise ValueError('Canvas is down')
+    monkeypatch.setattr(todoist, 'add_update_tasks', failing_add_update_tasks)
+
+    scheduler = sync_daemon.SyncScheduler(app, interval=900, workers=2)
+    stats = scheduler.run_once()
+    assert stats.errors >= 1
+    assert stats.error_rate() > 0
+
+    state = queries.get_sync_state(user)
+    models.db.session.refresh(state)
+    assert state.last_error == 'ValueError: Canvas is down'
+
+
+def test_run_once_upgrades_tokens(app):
+    # Tokens encrypted with scrypt are re-encrypted with HKDF when they are first read
+    user = add_sync_user('sync_daemon_scrypt', kdf=KDF_SCRYPT)
+    scheduler = sync_daemon.SyncScheduler(app, interval=900, workers=1)
+    scheduler.run_once()
+
+    state = queries.get_sync_state(user)
+    models.db.session.refresh(user)
+    models.db.session.refresh(state)
+    header = bytes((FORMAT_VERSION, KDF_HKDF))
+    assert user.todoist_token_password.startswith(header)
+    assert state.canvas_token_server.startswith(header)
+    assert decrypt_str(user.todoist_token_password, get_todo_secret()) == 'ttoken'
+    assert decrypt_str(state.canvas_token_server, get_todo_secret()) == 'ctoken'
+    assert state.last_error is None
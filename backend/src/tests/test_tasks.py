@@ -1,12 +1,15 @@
 from flask import url_for
+import json as json_lib
 import pytest
 
 import utils.canvas as utils_canvas
+import utils.models as models
 import utils.queries as queries
 import utils.session as session
 import utils.todoist as todoist
 
 from .test_courses import fake_login, MockCanvas, MockTodoistAPI
+from .test_indexes import capture_queries
 
 #################################################################
 #                                                               #
@@ -37,7 +40,7 @@ def mock_get_task_by_canvas_id(current_user, canvas_id, dict=False):
 
 
 class MockRequests:
-    def post(self, url: str, json={}, data={}, headers=[]):
+    def post(self, url: str, json={}, data={}, headers=[], timeout=None):
         match url:
             case 'https://api.todoist.com/rest/v2/tasks':
                 return MockResponse(200, {'id': 1})
@@ -124,3 +127,128 @@ def test_add_subtask(client, monkeypatch):
     assert type(resp.json) is dict
     assert resp.json['id'] == 1
     assert resp.json['success'] is True
+
+
+class MockSyncRequests:
+    """Records the commands sent to the Todoist sync API."""
+    def __init__(self):
+        self.commands = []
+        self.requests = 0
+
+    def post(self, url: str, json={}, data={}, headers=[], timeout=None):
+        if url == 'https://api.todoist.com/sync/v9/sync':
+            commands = json_lib.loads(data['commands'])
+            self.commands.extend(commands)
+            self.requests += 1
+            mapping = {command['temp_id']: f'td{i}' for i, command in enumerate(commands)
+                       if 'temp_id' in command}
+            status = {command['uuid']: 'ok' for command in commands}
+            return MockResponse(200, {'temp_id_mapping': mapping, 'sync_status': status})
+
+        raise ValueError
+
+
+def test_add_update_tasks_skips_unchanged_courses(app, monkeypatch):
+    mock_assignments = {
+        1: [{'id': 101, 'name': 'hw1', 'due_at': '2999-01-01T12:00:00Z'}],
+        2: [{'id': 201, 'name': 'hw2', 'due_at': '2999-01-02T12:00:00Z'},
+            {'id': 202, 'name': 'undated', 'due_at': None}],
+    }
+    mock_requests = MockSyncRequests()
+    monkeypatch.setattr(todoist, 'requests', mock_requests)
+    monkeypatch.setattr(todoist, 'get_all_courses', lambda key: [{'id': 1}, {'id': 2}])
+    monkeypatch.setattr(todoist, 'get_course_assignments',
+                        lambda course_id, key: [dict(a) for a in mock_assignments[course_id]])
+    monkeypatch.setattr(todoist, 'course_fingerprints', todoist.CourseFingerprintStore())
+    store = todoist.course_fingerprints
+
+    # The first sync adds every dated assignment
+    assert todoist.add_update_tasks(9001, 'ctoken', 'ttoken') == 2
+    assert store.processed == 2 and store.skipped == 0
+    assert [command['type'] for command in mock_requests.commands] == ['item_add', 'item_add']
+
+    # Nothing changed, so every course is skipped without contacting Todoist
+    mock_requests.commands.clear()
+    assert todoist.add_update_tasks(9001, 'ctoken', 'ttoken') == 0
+    assert store.processed == 2 and store.skipped == 2
+    assert mock_requests.commands == []
+
+    # Only the course whose assignment moved is processed again
+    mock_assignments[2][0]['due_at'] = '2999-01-03T12:00:00Z'
+    assert todoist.add_update_tasks(9001, 'ctoken', 'ttoken') == 1
+    assert store.processed == 3 and store.skipped == 3
+    assert [command['type'] for command in mock_requests.commands] == ['item_update']
+
+    # Other users are not affected by this user's fingerprints
+    assert not store.is_unchanged(9002, 1, store.fingerprints[9001][1])
+
+
+def test_add_subtasks_bulk(client, monkeypatch):
+    mock_requests = MockSyncRequests()
+    monkeypatch.setattr(todoist, 'requests', mock_requests)
+    fake_login(client)
+    owner = queries.get_user_by_username('test')
+    task = models.Task(owner=owner.id, task_type=models.TaskType.assignment, canvas_id=7501,
+                       todoist_id='bulk-parent')
+    models.db.session.add(task)
+    models.db.session.commit()
+
+    subtasks = [
+        {'canvas_id': 7501, 'name': f'step {i}', 'description': 'desc', 'status': i % 2,
+         'due_date': '2999-01-01T12:00'}
+        for i in range(3)
+    ]
+
+    # A subtask of an assignment without a task is refused before contacting Todoist
+    resp = client.post(url_for('api_v1.tasks.add_subtasks_user'),
+                       json={'subtasks': subtasks + [dict(subtasks[0], canvas_id=7502)]})
+    assert resp.status_code == 400
+    assert mock_requests.requests == 0
+
+    with capture_queries() as statements:
+        resp = client.post(url_for('api_v1.tasks.add_subtasks_user'), json={'subtasks': subtasks})
+    assert resp.status_code == 200
+    assert resp.json['success'] is True
+
+    # Every subtask is created and the completed one closed with one request and one insert
+    assert mock_requests.requests == 1
+    assert [command['type'] for command in mock_requests.commands] == \
+        ['item_add', 'item_add', 'item_close', 'item_add']
+    assert mock_requests.commands[2]['args']['id'] == mock_requests.commands[1]['temp_id']
+    assert len([s for s, _ in statements if s.startswith('INSERT INTO subtasks')]) == 1
+
+    created = resp.json['subtasks']
+    assert [subtask['todoist_id'] for subtask in created] == ['td0', 'td1', 'td3']
+    statuses = [models.db.session.get(models.SubTask, subtask['id']).status for subtask in created]
+    assert statuses == [models.TaskStatus.Incomplete, models.TaskStatus.Completed,
+                        models.TaskStatus.Incomplete]
+
+    too_many = {'subtasks': [subtasks[0]] * (todoist.MAX_BULK_SUBTASKS + 1)}
+    assert client.post(url_for('api_v1.tasks.add_subtasks_user'), json=too_many).status_code == 400
+
+
+def test_set_statuses(client, monkeypatch):
+    mock_requests = MockSyncRequests()
+    monkeypatch.setattr(todoist, 'requests', mock_requests)
+    fake_login(client)
+    owner = queries.get_user_by_username('test')
+    models.db.session.add_all([
+        models.Task(owner=owner.id, task_type=models.TaskType.assignment, canvas_id=7601 + i,
+                    todoist_id=f'bulk-status-{i}')
+        for i in range(3)
+    ])
+    models.db.session.commit()
+
+    # Mark every task of a course as done with one request
+    tasks = [{'todoist_id': f'bulk-status-{i}', 'status': 1} for i in range(3)]
+    resp = client.post(url_for('api_v1.tasks.set_statuses'), json={'tasks': tasks})
+    assert resp.status_code == 200
+    assert resp.json['success'] is True
+    assert mock_requests.requests == 1
+    assert {command['type'] for command in mock_requests.commands} == {'item_close'}
+
+    resp = client.post(url_for('api_v1.tasks.set_statuses'),
+                       json={'tasks': [{'todoist_id': 'bulk-status-0', 'status': 2}]})
+    assert resp.status_code == 400
+    resp = client.post(url_for('api_v1.tasks.set_statuses'), json={'tasks': []})
+    assert resp.status_code == 400
@@ -0,0 +1,404 @@
+"""
+A series of tests for the Canvas and Todoist webhooks. The Canvas tests replay Canvas Live Events
+and Caliper events that were recorded from Canvas, see the `payloads` folder.
+"""
+
+import base64
+from datetime import timedelta
+from flask import url_for
+import gevent
+import hashlib
+import hmac
+import json
+from pathlib import Path
+import pytest
+import time
+from types import SimpleNamespace
+
+import sync_daemon
+import utils.canvas as utils_canvas
+import utils.invalidations as invalidations
+import utils.models as models
+import utils.queries as queries
+import utils.todoist as todoist
+import utils.webhooks as webhooks
+from utils.crypto import decrypt_str, get_todo_secret, FORMAT_VERSION, KDF_HKDF, KDF_SCRYPT
+from utils.settings import utc_now
+
+from .test_courses import MockCanvas
+from .test_sync_daemon import add_sync_user
+from .test_tasks import MockResponse
+
+PAYLOAD_DIR = Path(__file__).parent / 'payloads'
+
+WEBHOOK_SECRET = 'canvas-webhook-secret'
+TODOIST_SECRET = 'todoist-client-secret'
+
+#################################################################
+#                                                               #
+#                           MOCK DATA                           #
+#                                                               #
+#################################################################
+
+
+@pytest.fixture(autouse=True)
+def init_test(monkeypatch):
+    monkeypatch.setattr(utils_canvas, 'Canvas', MockCanvas)
+
+
+@pytest.fixture
+def webhook_secret(tmp_path, monkeypatch):
+    secret_file = tmp_path / 'canvas_webhook_secret.txt'
+    secret_file.write_text(f'{WEBHOOK_SECRET}\n')
+    monkeypatch.setenv('CANVAS_WEBHOOK_SECRET_FILE', str(secret_file))
+    return WEBHOOK_SECRET
+
+
+@pytest.fixture
+def todoist_webhook(tmp_path, monkeypatch):
+    secret_file = tmp_path / 'todoist_secret.txt'
+    secret_file.write_text(f'{TODOIST_SECRET}\n')
+    monkeypatch.setenv('TODOIST_SECRET', str(secret_file))
+    monkeypatch.setenv('TODOIST_WEBHOOK', 'ON')
+    webhooks.recent_deliveries.clear()
+
+
+@pytest.fixture
+def todoist_tasks(app):
+    """A task, and a subtask shared between its owner and a second user."""
+    owner, recipient = [
+        models.User(login_id=models.gen_unique_login_id(), username=name, password='hash',
+                    canvas_id='-1', canvas_name=name, canvas_token_password=b'unused',
+                    todoist_token_password=b'unused')
+        for name in ('todoist_webhook_owner', 'todoist_webhook_recipient')
+    ]
+    models.db.session.add_all([owner, recipient])
+    models.db.session.flush()
+    task = models.Task(owner=owner.id, task_type=models.TaskType.assignment, canvas_id=7301,
+                       todoist_id='wh-task')
+    models.db.session.add(task)
+    models.db.session.flush()
+    subtask = models.SubTask(owner=owner.id, task_id=task.id, todoist_id='wh-sub', name='subtask',
+                             shared_with=[recipient.id])
+    models.db.session.add(subtask)
+    models.db.session.flush()
+    models.db.session.add(models.SubTaskShared(owner=recipient.id, subtask_id=subtask.id,
+                                               todoist_original='wh-sub', todoist_id='wh-copy'))
+    models.db.session.commit()
+    yield task, subtask
+
+    models.db.session.rollback()
+    models.SubTaskShared.query.filter_by(subtask_id=subtask.id).delete()
+    models.SubTask.query.filter_by(id=subtask.id).delete()
+    models.Task.query.filter_by(id=task.id).delete()
+    models.User.query.filter(models.User.id.in_([owner.id, recipient.id])).delete()
+    models.db.session.commit()
+
+
+def load_payload(name: str) -> dict:
+    return json.loads((PAYLOAD_DIR / f'{name}.json').read_text())
+
+
+def replay(client, name: str, secret: str = WEBHOOK_SECRET):
+    return client.post(url_for('webhooks.receive_canvas_events'), json=load_payload(name),
+                       headers={'Authorization': f'Bearer {secret}'})
+
+
+def send_todoist_event(client, event: str, todoist_id: str, delivery_id: str | None = None,
+                       secret: str = TODOIST_SECRET, **item):
+    body = json.dumps({'event_name': event, 'event_data': {'id': todoist_id, **item}}).encode()
+    signature = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest())
+    headers = {'X-Todoist-Hmac-SHA256': signature.decode(), 'Content-Type': 'application/json'}
+    if delivery_id is not None:
+        headers['X-Todoist-Delivery-ID'] = delivery_id
+    return client.post(url_for('webhooks.receive_todoist_event'), data=body, headers=headers)
+
+
+class MockPropagation:
+    """Records the shared subtasks that would be sent to Todoist."""
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, members, status):
+        self.calls.append(([todoist_id for _, todoist_id, _ in members], status))
+
+
+#################################################################
+#                                                               #
+#                           UNIT TESTS                          #
+#                                                               #
+#################################################################
+
+
+def test_parse_live_events():
+    assert webhooks.parse_canvas_events(load_payload('canvas_assignment_updated')) == [
+        webhooks.CanvasChange('assignment_updated', course_id=1, assignment_id=2)
+    ]
+    assert webhooks.parse_canvas_events(load_payload('canvas_submission_created')) == [
+        webhooks.CanvasChange('submission_created', course_id=1, assignment_id=3, user_id=42)
+    ]
+
+
+def test_parse_caliper_events():
+    # Events that don't change assignments or submissions, like navigation, are left out
+    assert webhooks.parse_canvas_events(load_payload('caliper_assignment_created')) == [
+        webhooks.CanvasChange('assignment_created', course_id=1, assignment_id=5)
+    ]
+
+
+def test_invalidate_course():
+    utils_canvas.get_course_assignments('webhook_key', '1')
+    utils_canvas.get_course_assignments('webhook_key', '2')
+    utils_canvas.get_course('webhook_key', '1')
+
+    assert utils_canvas.invalidate_course(1) >= 2
+    assert ('webhook_key', '1') not in utils_canvas.get_course_assignments.cache
+    assert ('webhook_key', '1') not in utils_canvas.get_course.cache
+    # Other courses stay cached
+    assert ('webhook_key', '2') in utils_canvas.get_course_assignments.cache
+
+
+def test_invalidate_key():
+    utils_canvas.get_course_assignments('webhook_key_a', '1')
+    utils_canvas.get_course_assignments('webhook_key_b', '1')
+
+    assert utils_canvas.invalidate_key('webhook_key_a') == 1
+    assert ('webhook_key_b', '1') in utils_canvas.get_course_assignments.cache
+
+
+def test_shared_invalidation(app, monkeypatch):
+    this_process = invalidations.InvalidationReader(poll_interval=0)
+    other_process = invalidations.InvalidationReader(poll_interval=0)
+    monkeypatch.setattr(invalidations, 'reader', this_process)
+    this_process.poll()
+    other_process.poll()
+
+    utils_canvas.get_course_assignments('webhook_key', '3')
+    assert invalidations.invalidate_course(3) == 1
+    assert ('webhook_key', '3') not in utils_canvas.get_course_assignments.cache
+
+    # Every other process removes the same results, the process that stored the invalidation
+    # already did
+    utils_canvas.get_course_assignments('webhook_key', '3')
+    assert this_process.poll() == 0
+    assert ('webhook_key', '3') in utils_canvas.get_course_assignments.cache
+    assert other_process.poll() == 1
+    assert ('webhook_key', '3') not in utils_canvas.get_course_assignments.cache
+    assert other_process.poll() == 0
+
+
+def test_prune_invalidations(app):
+    models.db.session.add(models.CacheInvalidation(course_id=4, assignments=True,
+                                                   created_at=utc_now() - timedelta(days=1)))
+    models.db.session.commit()
+
+    # Invalidations are kept for as long as Canvas results are cached
+    assert invalidations.prune() >= 1
+    assert models.CacheInvalidation.query.filter_by(course_id=4).count() == 0
+
+#################################################################
+#                                                               #
+#                        ENDPOINT TESTS                         #
+#                                                               #
+#################################################################
+
+
+def test_webhook_authentication(client, webhook_secret):
+    resp = replay(client, 'canvas_assignment_updated', secret='wrong-secret')
+    assert resp.status_code == 401
+
+    resp = client.post(url_for('webhooks.receive_canvas_events'), data='not json',
+                       headers={'Authorization': f'Bearer {webhook_secret}'})
+    assert resp.status_code == 400
+
+
+def test_webhook_disabled(client, monkeypatch):
+    monkeypatch.delenv('CANVAS_WEBHOOK_SECRET_FILE', raising=False)
+
+    resp = replay(client, 'canvas_assignment_updated')
+    assert resp.status_code == 404
+
+
+def test_replay_assignment_updated(app, client, webhook_secret):
+    user = add_sync_user('webhook_course_user')
+    queries.update_sync_courses(user, [1, 2])
+    other = add_sync_user('webhook_other_user')
+    queries.update_sync_courses(other, [2])
+    utils_canvas.get_course_assignments('webhook_key', '1')
+
+    resp = replay(client, 'canvas_assignment_updated')
+
+    assert resp.status_code == 200
+    assert resp.json['events'] == 1
+    assert resp.json['invalidated'] >= 1
+    assert resp.json['scheduled'] == 1
+    assert ('webhook_key', '1') not in utils_canvas.get_course_assignments.cache
+    # The other server processes remove the course's results as well
+    assert models.CacheInvalidation.query.filter_by(course_id=1).count() >= 1
+
+    # Only the user in the course is synced right away, even if they were just synced
+    scheduler = sync_daemon.SyncScheduler(app, interval=900, workers=1)
+    later = utc_now() + timedelta(seconds=1)
+    for owner in (user, other):
+        state = queries.get_sync_state(owner)
+        state.last_synced_at = utc_now() - timedelta(minutes=1)
+    models.db.session.commit()
+    due = [job.user_id for job in scheduler.due_jobs(later)]
+    assert user.id in due
+    assert other.id not in due
+
+
+def test_replay_submission_created(client, webhook_secret):
+    user = add_sync_user('webhook_submitter')
+    user.canvas_id = '42'
+    models.db.session.commit()
+
+    resp = replay(client, 'canvas_submission_created')
+
+    assert resp.status_code == 200
+    assert resp.json['scheduled'] == 1
+    state = queries.get_sync_state(user)
+    models.db.session.refresh(state)
+    assert state.pending_at is not None
+
+
+def test_todoist_signature():
+    body = b'{"event_name": "item:completed"}'
+    signature = base64.b64encode(hmac.new(b'secret', body, hashlib.sha256).digest()).decode()
+
+    assert webhooks.verify_todoist_signature(body, signature, 'secret')
+    assert not webhooks.verify_todoist_signature(body, signature, 'other-secret')
+    assert not webhooks.verify_todoist_signature(body + b' ', signature, 'secret')
+    assert not webhooks.verify_todoist_signature(body, '', 'secret')
+
+
+def test_propagate_shared_status(monkeypatch):
+    urls = []
+
+    class RecordingRequests:
+        def post(self, url, headers={}, timeout=None, **kwargs):
+            urls.append(url)
+            if 'broken' in url:
+                raise ConnectionError
+            return MockResponse(204, {})
+
+    monkeypatch.setattr(todoist, 'requests', RecordingRequests())
+    monkeypatch.setattr(todoist, 'decrypt_str_upgrade',
+                        lambda token, secret, kdf: (token.decode(), None))
+
+    # A member that can't be reached doesn't stop the others
+    todoist.propagate_shared_status([(1, 'broken', b'a'), (2, 'copy', b'b')],
+                                    models.TaskStatus.Completed)
+    assert urls[-1] == f'{todoist.BASE_URL}/rest/v2/tasks/copy/close'
+
+    todoist.propagate_shared_status([(2, 'copy', b'b')], models.TaskStatus.Incomplete)
+    assert urls[-1] == f'{todoist.BASE_URL}/rest/v2/tasks/copy/reopen'
+
+
+def test_propagate_upgrades_tokens(app, monkeypatch):
+    sent_headers = []
+
+    class RecordingRequests:
+        def post(self, url, headers={}, timeout=None, **kwargs):
+            sent_headers.append(headers)
+            return MockResponse(204, {})
+
+    # Members' tokens encrypted with scrypt are re-encrypted with HKDF when they are first read
+    user = add_sync_user('propagate_scrypt', kdf=KDF_SCRYPT)
+    monkeypatch.setattr(todoist, 'requests', RecordingRequests())
+    todoist.propagate_shared_status([(user.id, 'copy', user.todoist_token_password)],
+                                    models.TaskStatus.Completed)
+    assert sent_headers == [{'Authorization': 'Bearer ttoken'}]
+
+    models.db.session.refresh(user)
+    assert user.todoist_token_password.startswith(bytes((FORMAT_VERSION, KDF_HKDF)))
+    assert decrypt_str(user.todoist_token_password, get_todo_secret()) == 'ttoken'
+
+
+def test_reconcile_interval(todoist_webhook, monkeypatch):
+    posts = []
+
+    class RecordingRequests:
+        def post(self, url, data={}, headers={}, timeout=None, **kwargs):
+            posts.append(url)
+            return MockResponse(401, {})
+
+    monkeypatch.setattr(todoist, 'requests', RecordingRequests())
+    user = SimpleNamespace(id=7302)
+
+    # With the webhook, every task is only pulled once per TODOIST_RECONCILE_INTERVAL
+    todoist.last_reconciled[user.id] = time.monotonic()
+    todoist.sync_task_status(user, 'ttoken')
+    assert posts == []
+
+    monkeypatch.setenv('TODOIST_RECONCILE_INTERVAL', '0')
+    todoist.sync_task_status(user, 'ttoken')
+    assert len(posts) == 1
+
+
+def test_todoist_webhook_authentication(client, todoist_webhook):
+    resp = send_todoist_event(client, 'item:completed', 'wh-task', secret='wrong-secret')
+    assert resp.status_code == 401
+
+
+def test_todoist_webhook_disabled(client, todoist_webhook, monkeypatch):
+    monkeypatch.setenv('TODOIST_WEBHOOK', 'OFF')
+
+    resp = send_todoist_event(client, 'item:completed', 'wh-task')
+    assert resp.status_code == 404
+
+
+def test_todoist_task_events(client, todoist_webhook, todoist_tasks):
+    task, _ = todoist_tasks
+
+    resp = send_todoist_event(client, 'item:completed', 'wh-task', delivery_id='d1')
+    assert resp.json['result'] == 'updated'
+    assert models.db.session.get(models.Task, task.id).status == models.TaskStatus.Completed
+
+    # Todoist retries deliveries, which are only applied once
+    resp = send_todoist_event(client, 'item:completed', 'wh-task', delivery_id='d1')
+    assert resp.json['result'] == 'duplicate'
+
+    resp = send_todoist_event(client, 'item:updated', 'wh-task', checked=False)
+    assert resp.json['result'] == 'updated'
+    assert models.db.session.get(models.Task, task.id).status == models.TaskStatus.Incomplete
+
+    resp = send_todoist_event(client, 'item:uncompleted', 'wh-task')
+    assert resp.json['result'] == 'unchanged'
+    assert send_todoist_event(client, 'item:added', 'wh-task').json['result'] == 'ignored'
+    assert send_todoist_event(client, 'item:completed', 'missing').json['result'] == 'unknown'
+
+
+def test_todoist_failed_delivery(client, todoist_webhook, todoist_tasks, monkeypatch):
+    task, _ = todoist_tasks
+    update_status = queries.update_task_or_subtask_status
+    monkeypatch.setattr(queries, 'update_task_or_subtask_status', lambda task, status: False)
+
+    # A delivery that couldn't be saved fails, so that Todoist retries it
+    resp = send_todoist_event(client, 'item:completed', 'wh-task', delivery_id='d2')
+    assert resp.status_code == 500
+    assert resp.json['result'] == 'error'
+
+    monkeypatch.setattr(queries, 'update_task_or_subtask_status', update_status)
+    resp = send_todoist_event(client, 'item:completed', 'wh-task', delivery_id='d2')
+    assert resp.status_code == 200
+    assert resp.json['result'] == 'updated'
+    assert models.db.session.get(models.Task, task.id).status == models.TaskStatus.Completed
+
+
+def test_todoist_shared_subtask(client, todoist_webhook, todoist_tasks, monkeypatch):
+    _, subtask = todoist_tasks
+    propagation = MockPropagation()
+    monkeypatch.setattr(todoist, 'propagate_shared_status', propagation)
+
+    # The recipient completed their copy, so the original is sent to the owner's Todoist
+    resp = send_todoist_event(client, 'item:completed', 'wh-copy')
+    assert resp.json['result'] == 'updated'
+    gevent.sleep(0)
+
+    assert models.db.session.get(models.SubTask, subtask.id).status == models.TaskStatus.Completed
+    assert propagation.calls == [(['wh-sub'], models.TaskStatus.Completed)]
+
+    # Both members' dashboards are told about the change
+    published = models.UserEvent.query.filter_by(kind='subtask').all()
+    assert {event.owner for event in published} == {subtask.owner, *subtask.shared_with}
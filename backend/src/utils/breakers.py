@@ -0,0 +1,246 @@
+"""
+This file provides circuit breakers for Canvas and Todoist. A breaker watches the calls made to its
+API in the last BREAKER_WINDOW seconds. Once at least BREAKER_MIN_CALLS were made and
+BREAKER_FAILURE_RATE of them failed, the breaker opens and calls fail immediately with CircuitOpen
+instead of waiting on an API that is struggling. After BREAKER_RESET_TIMEOUT seconds, the breaker
+is half-open and lets a single call through: if it succeeds the breaker closes, otherwise it opens
+again.
+
+Calls fail if they can't connect, time out, or get a 5xx or 429 response. Other errors, such as an
+invalid API key, are the user's and don't count against the API.
+
+Cached Canvas functions fall back to their last result while Canvas is unavailable, see
+`stale_fallback`.
+"""
+
+
+from contextlib import contextmanager
+import collections
+import functools
+import time
+from types import SimpleNamespace
+
+from cachetools.keys import hashkey
+from lru import LRU
+import requests
+
+from utils.deadlines import DeadlineExceeded, TimeoutAdapter, mark_partial
+from utils.metrics import Counter, Gauge
+from utils.settings import get_breaker_window, get_breaker_min_calls, get_breaker_failure_rate, \
+    get_breaker_reset_timeout
+
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# The value of the breaker state gauge for each state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = Gauge('circuit_breaker_state',
+                      'The state of each API\'s circuit breaker: 0 closed, 1 half-open, 2 open.',
+                      ('upstream',))
+BREAKER_TRANSITIONS = Counter('circuit_breaker_transitions_total',
+                              'The number of times a circuit breaker changed to a state.',
+                              ('upstream', 'state'))
+BREAKER_REJECTED = Counter('circuit_breaker_rejected_total',
+                           'The number of calls failed by an open circuit breaker.', ('upstream',))
+STALE_RESULTS = Counter('canvas_stale_results_total',
+                        'The number of expired cached results served because Canvas was '
+                        'unavailable.', ('function',))
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an API whose circuit breaker is open."""
+    pass
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker for one API. The thresholds default to the BREAKER_* environment variables.
+
+    :param upstream: The name of the API, such as 'canvas' or 'todoist'.
+    """
+    def __init__(self, upstream: str, window: float | None = None, min_calls: int | None = None,
+                 failure_rate: float | None = None, reset_timeout: float | None = None):
+        self.upstream = upstream
+        self.window = window if window is not None else get_breaker_window()
+        self.min_calls = min_calls if min_calls is not None else get_breaker_min_calls()
+        self.failure_rate = failure_rate if failure_rate is not None else get_breaker_failure_rate()
+        self.reset_timeout = reset_timeout if reset_timeout is not None \
+            else get_breaker_reset_timeout()
+
+        # (time, failed) for every call in the window, oldest first
+        self.outcomes = collections.deque()
+        self.failures = 0
+        self.opened_at = 0.0
+        # Whether the single call allowed by a half-open breaker is in flight
+        self.probing = False
+        self.state = CLOSED
+        BREAKER_STATE.set(STATE_VALUES[CLOSED], upstream)
+
+    def _change_state(self, state: str):
+        self.state = state
+        BREAKER_STATE.set(STATE_VALUES[state], self.upstream)
+        BREAKER_TRANSITIONS.inc(self.upstream, state)
+
+    def _forget_old_outcomes(self, now: float):
+        while self.outcomes and self.outcomes[0][0] < now - self.window:
+            _, failed = self.outcomes.popleft()
+            self.failures -= failed
+
+    def before_call(self):
+        """
+        Check that a call may be made. A half-open breaker lets one call through at a time.
+
+        :raises CircuitOpen: If the breaker is open, or half-open with a call in flight.
+        """
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._change_state(HALF_OPEN)
+
+        if self.state == OPEN or (self.state == HALF_OPEN and self.probing):
+            BREAKER_REJECTED.inc(self.upstream)
+            raise CircuitOpen(f'{self.upstream} is unavailable, try again later')
+
+        if self.state == HALF_OPEN:
+            self.probing = True
+
+    def record(self, failed: bool):
+        """
+        Record the outcome of a call that `before_call` allowed.
+
+        :param failed: Whether the call failed because of the API.
+        """
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self.probing = False
+            if failed:
+                self.opened_at = now
+                self._change_state(OPEN)
+            else:
+                self.outcomes.clear()
+                self.failures = 0
+                self._change_state(CLOSED)
+            return
+
+        self.outcomes.append((now, failed))
+        self.failures += failed
+        self._forget_old_outcomes(now)
+        if self.state == CLOSED and len(self.outcomes) >= self.min_calls \
+                and self.failures >= self.failure_rate * len(self.outcomes):
+            self.opened_at = now
+            self._change_state(OPEN)
+
+    def cancel(self):
+        """Forget a call that `before_call` allowed but that was never made."""
+        if self.state == HALF_OPEN:
+            self.probing = False
+
+    @contextmanager
+    def call(self):
+        """
+        Guard a call made in the `with` block. Set `status` on the yielded object to the HTTP status
+        code of the response; calls that raise a `requests` exception count as failures.
+
+        :raises CircuitOpen: If the breaker doesn't allow the call.
+        """
+        self.before_call()
+        outcome = SimpleNamespace(status=None)
+        try:
+            yield outcome
+        except requests.RequestException:
+            self.record(True)
+            raise
+        except BaseException:
+            self.cancel()
+            raise
+        self.record(is_failure(outcome.status))
+
+
+def is_failure(status: int | None) -> bool:
+    """
+    Check if an HTTP status code means that the API failed, rather than the request.
+
+    :param status: The status code, or None if it is unknown.
+    :return bool: True for 5xx and 429 responses.
+    """
+    return status is not None and (status >= 500 or status == 429)
+
+
+# One breaker per API, shared by every request handled by this process
+CANVAS = CircuitBreaker('canvas')
+TODOIST = CircuitBreaker('todoist')
+
+
+#################################################################
+#                                                               #
+#                        OUTBOUND CALLS                         #
+#                                                               #
+#################################################################
+
+
+class BreakerAdapter(TimeoutAdapter):
+    """
+    A `requests` transport adapter that guards every call with a circuit breaker, for sessions whose
+    requests are made by an SDK, such as canvasapi's. Calls also use the current request's timeout,
+    see utils.deadlines.
+
+    :param breaker: The circuit breaker of the API.
+    """
+    def __init__(self, breaker: CircuitBreaker, *args, **kwargs):
+        self.breaker = breaker
+        super().__init__(breaker.upstream, *args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        with self.breaker.call() as outcome:
+            response = super().send(request, *args, **kwargs)
+            outcome.status = response.status_code
+        return response
+
+
+def guard_session(session, breaker: CircuitBreaker):
+    """
+    Guard every call made by a `requests.Session` with a circuit breaker and the current request's
+    timeout.
+
+    :param session: The session.
+    :param breaker: The circuit breaker of the API.
+    """
+    adapter = BreakerAdapter(breaker)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+# Errors that mean the API is unavailable, rather than that the request was wrong
+UNAVAILABLE_ERRORS = (CircuitOpen, DeadlineExceeded, requests.RequestException)
+
+
+def stale_fallback(func):
+    """
+    Keep the last result of a cached function for each set of arguments, and return it if the API is
+    unavailable once the cached result expired. Responses that use such a result are marked as
+    partial, see utils.deadlines.
+
+    :param func: The cached function.
+    :return: The wrapped function, which keeps the `cache_info` of the cached function.
+    """
+    cache = getattr(func, 'cache', None)
+    stale = LRU(getattr(cache, 'maxsize', None) or 128)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = hashkey(*args, **kwargs)
+        try:
+            result = func(*args, **kwargs)
+        except UNAVAILABLE_ERRORS:
+            if key not in stale:
+                raise
+            STALE_RESULTS.inc(func.__name__)
+            mark_partial()
+            return stale[key]
+
+        stale[key] = result
+        return result
+
+    wrapper.stale = stale
+    return wrapper
@@ -1,19 +1,82 @@
-from cachetools import cached, TTLCache
-from canvasapi import Canvas
-from canvasapi.assignment import Assignment
-from canvasapi.calendar_event import CalendarEvent
-from canvasapi.course import Course
-from canvasapi.current_user import CurrentUser
-from canvasapi.submission import Submission
+from __future__ import annotations
+
+from array import array
+from cachetools import cached, TLRUCache
+from cachetools.keys import hashkey
+from gevent.lock import Semaphore
+from itertools import islice
+from lru import LRU
+import math
 import os.path
 import tempfile
+from typing import NamedTuple, TYPE_CHECKING
 
-from utils.settings import get_canvas_url, get_canvas_cache_time
-import gevent
+import utils.breakers as breakers
+import utils.deadlines as deadlines
+from utils.instrumentation import instrument_session, spawn
+from utils.lazy import LazyClass
+from utils.metrics import Family, register_collector
+from utils.settings import get_canvas_url, get_canvas_cache_time, get_canvas_roster_cache_time, \
+    get_canvas_conversation_cache_time, get_canvas_conversation_fetches, get_canvas_grade_check_time
 
+# canvasapi is slow to import, so it is only imported once the first client is created
+Canvas = LazyClass('canvasapi', 'Canvas')
+if TYPE_CHECKING:
+    from canvasapi.assignment import Assignment
+    from canvasapi.calendar_event import CalendarEvent
+    from canvasapi.course import Course
+    from canvasapi.current_user import CurrentUser
+    from canvasapi.submission import Submission
+    from flask import Flask
 
-BASE_URL = get_canvas_url()
-CACHE_TIME = get_canvas_cache_time()
+# The settings of this module, and the functions that read them from the environment
+SETTINGS = {
+    'CANVAS_BASE_URL': get_canvas_url,
+    'CANVAS_API_CACHE_TIME': get_canvas_cache_time,
+    'CANVAS_ROSTER_CACHE_TIME': get_canvas_roster_cache_time,
+    'CANVAS_CONVERSATION_CACHE_TIME': get_canvas_conversation_cache_time,
+    'CANVAS_CONVERSATION_FETCHES': get_canvas_conversation_fetches,
+    'CANVAS_GRADE_CHECK_TIME': get_canvas_grade_check_time,
+}
+# The settings given in the app's config, see init_app
+_config = {}
+
+# How many of a user's most recently active conversations are checked for new messages
+RECENT_CONVERSATIONS = 100
+
+
+def init_app(app: Flask):
+    """
+    Use the Canvas settings in an app's config, see SETTINGS. Settings that aren't in the config are
+    read from the environment variables of the same name whenever they are used.
+
+    :param app: The Flask app.
+    """
+    _config.clear()
+    _config.update({name: app.config[name] for name in SETTINGS if name in app.config})
+
+
+def get_setting(name: str) -> str | int:
+    """
+    Get a Canvas setting from the app's config, or from the environment.
+
+    :param name: The name of the setting, one of SETTINGS.
+    :return str | int: The value of the setting.
+    """
+    return _config[name] if name in _config else SETTINGS[name]()
+
+
+def _timed_cache(setting: str = 'CANVAS_API_CACHE_TIME', maxsize: int = 128) -> TLRUCache:
+    # Results expire after the number of seconds in a setting, which is read whenever a result is
+    # stored so that it follows the app's config
+    return TLRUCache(maxsize=maxsize, ttu=lambda key, value, now: now + get_setting(setting))
+
+
+# Conversations and the time of their last message, by API key and conversation ID
+conversation_cache = _timed_cache('CANVAS_CONVERSATION_CACHE_TIME', maxsize=1024)
+
+# When each course was last graded, by API key and course ID, see get_last_graded_at_no_cache
+last_graded = LRU(1024)
 
 # Custom parameters to get from the Canvas API for course requests
 # Specified here to ensure standardization.
@@ -22,7 +85,36 @@ CUSTOM_COURSE_PARAMS = [
 ]
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+def connect(canvas_key: str) -> Canvas:
+    """
+    Create a Canvas client for a user whose requests are recorded in the current request's metrics.
+
+    :param canvas_key: The API key that should be used.
+    :return Canvas: The Canvas client.
+    """
+    return guard_client(Canvas(get_setting('CANVAS_BASE_URL'), canvas_key))
+
+
+def guard_client(canvas: Canvas) -> Canvas:
+    """
+    Record the requests of a Canvas client in the current request's metrics, give them what is left
+    of the request's budget as their timeout, and guard them with the Canvas circuit breaker.
+
+    :param canvas: The Canvas client.
+    :return Canvas: The same client.
+    """
+    # canvasapi doesn't expose its requests.Session, so reach through the name-mangled requester
+    requester = getattr(canvas, '_Canvas__requester', None)
+    if requester is not None:
+        instrument_session(requester._session, 'canvas')
+        # Every call uses what is left of the current request's budget as its timeout, and fails
+        # fast while Canvas is unavailable
+        breakers.guard_session(requester._session, breakers.CANVAS)
+    return canvas
+
+
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_all_courses(canvas_key: str) -> list[Course]:
     """
     Returns a list of all active courses for a user. These results are cached for an amount of time
@@ -32,7 +124,7 @@ def get_all_courses(canvas_key: str) -> list[Course]:
     :param canvas_key: The API key that should be used.
     :return list[Course]: A list of canvasapi Courses that are active.
     """
-    # Call no_cache version. Due to the TTLCache, the body of the function will only be executed
+    # Call no_cache version. Due to the cache, the body of the function will only be executed
     # if there is no entry in the cache or if the entry has expired.
     return get_all_courses_no_cache(canvas_key)
 
@@ -45,14 +137,15 @@ def get_all_courses_no_cache(canvas_key: str) -> list[Course]:
     :param canvas_key: The API key that should be used.
     :return list[Course]: A list of canvasapi Courses that are active.
     """
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     current_courses = canvas.get_courses(enrollment_state='active',
                                          include=CUSTOM_COURSE_PARAMS)
 
     return [course for course in current_courses]
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_course(canvas_key: str, course_id: str) -> Course:
     """
     Returns a course by its ID. These results are cached for an amount of time determined by
@@ -75,13 +168,14 @@ def get_course_no_cache(canvas_key: str, course_id: str) -> Course:
     :param course_id: The ID of the course to retrieve.
     :return Course: The course with the given ID.
     """
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     course = canvas.get_course(course_id, include=CUSTOM_COURSE_PARAMS)
 
     return course
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_graded_assignments(canvas_key: str, course_id: str) -> list[Submission]:
     """
     Returns all graded submissions for a course. These results are cached for an amount of time
@@ -104,14 +198,15 @@ def get_graded_assignments_no_cache(canvas_key: str, course_id: str) -> list[Sub
     :param course_id: The ID of the course to retrieve graded assignments for.
     :return list[Submission]: A list of canvasapi Submissions for graded assignments.
     """
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     assignments = canvas.get_course(course_id)\
         .get_multiple_submissions(workflow_state='graded', include=['assignment'])
 
     return [assignment for assignment in assignments]
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_course_assignments(canvas_key: str, course: str | Course) -> list[Assignment]:
     """
     Returns all assignments for a course. These results are cached for an amount of time determined
@@ -135,13 +230,14 @@ def get_course_assignments_no_cache(canvas_key: str, course: str | Course) -> li
     :return list[Assignment]: A list of canvasapi Assignments for the course.
     """
     if type(course) is str or type(course) is int:
-        course = Canvas(BASE_URL, str(canvas_key)).get_course(course)
+        course = connect(str(canvas_key)).get_course(course)
     course_assignments = course.get_assignments()
 
     return [assignment for assignment in course_assignments]
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_course_assignment(canvas_key: str, course_id: str, assignment_id: str) -> Assignment:
     """
     Returns the assignment with the given ID from the given course. These results are cached for an
@@ -167,13 +263,14 @@ def get_course_assignment_no_cache(canvas_key: str, course_id: str, assignment_i
     :param assignment_id: The ID of the assignment.
     :return Assignment: The assignment with the given ID.
     """
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     assignment = canvas.get_course(course_id).get_assignment(assignment_id)
 
     return assignment
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_current_user(canvas_key: str) -> CurrentUser:
     """
     Returns the profile of the user associated with the given Canvas API key. These results are
@@ -194,7 +291,7 @@ def get_current_user_no_cache(canvas_key: str) -> CurrentUser:
     :param canvas_key: The API key that should be used.
     :return CurrentUser: The profile associated with the API key.
     """
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     profile = canvas.get_current_user()
 
     return profile
@@ -214,18 +311,20 @@ def get_all_calendar_events(canvas_key: str, start_date: str, end_date: str, lim
     :return: A list of merged calendar events from the specified event types within the date range.
     """
     greenlets = [
-        gevent.spawn(get_calendar_events, canvas_key, start_date, end_date, limit, event_type)
+        spawn(get_calendar_events, canvas_key, start_date, end_date, limit, event_type)
         for event_type in event_types
     ]
-    gevent.joinall(greenlets)
+    # Event types that don't arrive within the request's budget are left out
+    finished = deadlines.join(greenlets)
 
     merged_events = []
-    for greenlet in greenlets:
+    for greenlet in finished:
         merged_events.extend(greenlet.get())
     return merged_events
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_calendar_events(canvas_key: str, start_date: str, end_date: str, limit: int = 50,
                         type='assignment') -> list[CalendarEvent]:
     """
@@ -259,7 +358,7 @@ def get_calendar_events_no_cache(canvas_key: str, start_date: str, end_date: str
     # Get course ids in a way that the calendar API can understand
     courses = [f'course_{course.id}' for course in courses]
 
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     assignments = canvas.get_calendar_events(
         context_codes=courses,
         start_date=start_date,
@@ -268,10 +367,13 @@ def get_calendar_events_no_cache(canvas_key: str, start_date: str, end_date: str
         type=type
     )
 
-    return assignments
+    # The PaginatedList only calls Canvas when iterated, so this must happen in this function, where
+    # the request's budget and the breaker apply, rather than in the caller
+    return list(assignments)
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_undated_assignments(canvas_key: str, course_id: str) -> list[Assignment]:
     """
     Returns all undated assignments associated with the given Canvas course. These results are
@@ -307,7 +409,8 @@ def get_undated_assignments_no_cache(canvas_key: str, course_id: str) -> list[As
     return assignments
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_missing_submissions(canvas_key: str, course_ids: frozenset[int]):
     """
     Get missings submissions for a set of courses using the given API key. These results are cached
@@ -336,10 +439,11 @@ def get_missing_submissions_no_cache(canvas_key: str, course_ids: frozenset[int]
     user = get_current_user(canvas_key)
     missing_submissions = user.get_missing_submissions(course_ids=course_ids)
 
-    return missing_submissions
+    return list(missing_submissions)
 
 
-@cached(cache=TTLCache(maxsize=128, ttl=CACHE_TIME))
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
 def get_course_submissions(canvas_key: str, course_id: int):
     """
     Get all submissions for a course using the given API key. These results are cached
@@ -365,8 +469,7 @@ def get_course_submissions_no_cache(canvas_key: str, course_id: int):
     course = get_course(canvas_key, course_id)
     submissions = course.get_multiple_submissions()
 
-    # Actually a PaginatedList, not a list, but it's a useful lie
-    return submissions
+    return list(submissions)
 
 
 def download_submissions(submissions: list[Submission]):
@@ -407,13 +510,46 @@ def download_submissions_no_cache(submissions: list[Submission]):
 
 def get_professor_info(canvas_key: str, course_id: str) -> list[dict]:
     """
-    This function is used to get the id and name of all teachers and TAs for a course.
+    This function is used to get the id and name of all teachers and TAs for a course. The roster of
+    a course is the same for every user, so it is cached once per course, see get_course_roster, for
+    the users that are enrolled in the course. Other users fetch it with their own key, so that
+    Canvas decides if they may see it.
+
+    :param canvas_key: The API key that should be used.
+    :param course_id: The ID of the course to retrieve the users from.
+    :return list[dict]: A list of dictionaries with the id and name of each teacher and TAs
+    """
+    if any(_same_course(course, course_id) for course in get_all_courses(canvas_key)):
+        return get_course_roster(canvas_key, course_id)
+    return get_professor_info_no_cache(canvas_key, course_id)
+
+
+@breakers.stale_fallback
+@cached(cache=_timed_cache('CANVAS_ROSTER_CACHE_TIME', maxsize=256),
+        key=lambda canvas_key, course_id: hashkey(str(course_id)), info=True)
+def get_course_roster(canvas_key: str, course_id: str) -> list[dict]:
+    """
+    Returns the teachers and TAs of a course. These results are cached for every user of the course
+    for an amount of time determined by utils.settings.get_canvas_roster_cache_time. Only use it for
+    users that are enrolled in the course.
+
+    :param canvas_key: The API key that should be used if the roster isn't cached.
+    :param course_id: The ID of the course to retrieve the users from.
+    :return list[dict]: A list of dictionaries with the id and name of each teacher and TAs
+    """
+    return get_professor_info_no_cache(canvas_key, course_id)
+
+
+def get_professor_info_no_cache(canvas_key: str, course_id: str) -> list[dict]:
+    """
+    Returns the teachers and TAs of a course. These results are not cached. If possible, use
+    get_professor_info to improve server response times.
 
     :param canvas_key: The API key that should be used.
     :param course_id: The ID of the course to retrieve the users from.
     :return list[dict]: A list of dictionaries with the id and name of each teacher and TAs
     """
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     user_list = canvas.get_course(course_id).get_users(enrollment_type=['teacher', 'ta'])
     fields = ['id', 'name']
     return [{field: getattr(user, field, None) for field in fields} for user in user_list]
@@ -431,7 +567,7 @@ def send_message(canvas_key: str, recipients: list, subject: str, body: str,
     :param conv_exists: A boolean to determine if a new conversation should be created.
     :return int: The ID of the conversation that the message was sent part of.
     """
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     result = canvas.create_conversation(recipients=recipients, subject=subject, body=body,
                                         force_new=not conv_exists, group_conversation=True)
 
@@ -447,47 +583,200 @@ def send_reply(canvas_key: str, conv_id: str, body: str) -> int:
     :param body: The body of the reply.
     :return int: The ID of the conversation that the reply was sent part of.
     """
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     result = canvas.get_conversation(conv_id).add_message(body=body)
+    conversation_cache.pop((canvas_key, conv_id), None)
     return getattr(result, 'id', None)
 
 
-def get_conversations_from_ids(canvas_key: str, convs_id: str) -> list[dict]:
+def get_conversations_from_ids(canvas_key: str, convs_id: list[int]) -> list[dict]:
     """
-    This function is used to get all the conversations for a course.
+    This function is used to get all the conversations for a course. Conversations are cached for
+    an amount of time determined by utils.settings.get_canvas_conversation_cache_time, but are
+    fetched again once the user's most recent conversations show a newer last message. Other
+    conversations are fetched concurrently, CANVAS_CONVERSATION_FETCHES at a time.
 
     :param canvas_key: The API key that should be used.
     :param convs_id: The ID of the conversations to retrieve.
     :return list[dict]: A list of conversations.
     """
-    canvas = Canvas(BASE_URL, canvas_key)
-    all_conversations = []
+    canvas = connect(canvas_key)
+    cached = {id: conversation_cache[(canvas_key, id)] for id in convs_id
+              if (canvas_key, id) in conversation_cache}
+    # Checking for new messages takes one request, so it is skipped if nothing is cached
+    last_message_at = _get_last_message_times(canvas) if cached else {}
+
+    conversations = {}
+    missing = []
     for id in convs_id:
-        conv = canvas.get_conversation(id)
-        messages = getattr(conv, 'messages', None)
-        participants = getattr(conv, 'participants', None)
-        if not messages or not participants:
-            continue
-        all_conversations.append({'id': id, 'subject': getattr(conv, 'subject', None),
-                                  'messages': messages, 'participants': participants})
-    return all_conversations
+        # Conversations that aren't among the most recent ones didn't get a message since
+        if id in cached and last_message_at.get(id, cached[id][0]) == cached[id][0]:
+            conversations[id] = cached[id][1]
+        else:
+            missing.append(id)
+
+    fetches = Semaphore(get_setting('CANVAS_CONVERSATION_FETCHES'))
+
+    def fetch(id: int) -> tuple[str | None, dict | None]:
+        with fetches:
+            return _get_conversation(canvas, id)
+
+    greenlets = [spawn(fetch, id) for id in missing]
+    # Conversations that don't arrive within the request's budget are left out
+    finished = set(deadlines.join(greenlets))
+    for id, greenlet in zip(missing, greenlets):
+        if greenlet in finished:
+            fetched = greenlet.get()
+            conversation_cache[(canvas_key, id)] = fetched
+            conversations[id] = fetched[1]
+
+    return [conversations[id] for id in convs_id if conversations.get(id) is not None]
+
+
+def _get_last_message_times(canvas: Canvas) -> dict[int, str | None]:
+    # Canvas lists conversations by their last message, so one page holds every recent change
+    conversations = canvas.get_conversations(per_page=RECENT_CONVERSATIONS)
+    return {conversation.id: getattr(conversation, 'last_message_at', None)
+            for conversation in islice(conversations, RECENT_CONVERSATIONS)}
+
+
+def _get_conversation(canvas: Canvas, id: int) -> tuple[str | None, dict | None]:
+    conv = canvas.get_conversation(id)
+    messages = getattr(conv, 'messages', None)
+    participants = getattr(conv, 'participants', None)
+    if not messages or not participants:
+        return (getattr(conv, 'last_message_at', None), None)
+    return (getattr(conv, 'last_message_at', None),
+            {'id': id, 'subject': getattr(conv, 'subject', None), 'messages': messages,
+             'participants': participants})
+
+
+class GradedGroup(NamedTuple):
+    """
+    An assignment group of a course with the user's scores, stored as compact arrays with one entry
+    per assignment instead of the canvasapi objects.
+    """
+    name: str | None
+    weight: float | None
+    ids: array
+    names: tuple[str | None, ...]
+    # NaN when the assignment has no score, or no maximum score
+    scores: array
+    max_scores: array
+    # 1 if the assignment is omitted from the final grade, 0 otherwise
+    omit: bytes
 
 
 def get_weighted_graded_assignments_for_course(canvas_key: str, course_id: str)\
+        -> list[GradedGroup] | None:
+    """
+    Returns the assignment groups of a course with their grade weight and the user's scores. These
+    results are cached for an amount of time determined by utils.settings.get_canvas_cache_time,
+    but are fetched again once get_last_graded_at finds a newer grade. New grades are therefore
+    seen within utils.settings.get_canvas_grade_check_time, or as soon as the Canvas webhook
+    reports them.
+
+    :param canvas_key: The API key that should be used.
+    :param course_id: The ID of the course to retrieve the assignment groups from.
+    :return list[GradedGroup] | None: The assignment groups, or None if the course doesn't exist.
+    """
+    graded_at = get_last_graded_at(canvas_key, course_id)
+    return get_graded_groups(canvas_key, course_id, graded_at)
+
+
+@breakers.stale_fallback
+@cached(cache=_timed_cache('CANVAS_GRADE_CHECK_TIME', maxsize=256), info=True)
+def get_last_graded_at(canvas_key: str, course_id: str) -> str:
+    """
+    Returns when the newest grade of a course was given. These results are cached for an amount of
+    time determined by utils.settings.get_canvas_grade_check_time, which is much shorter than for
+    other Canvas results. If live information is needed, get_last_graded_at_no_cache should be used
+    instead.
+
+    :param canvas_key: The API key that should be used.
+    :param course_id: The ID of the course to check.
+    :return str: When the newest grade was given, or an empty string if nothing was graded.
+    """
+    return get_last_graded_at_no_cache(canvas_key, course_id)
+
+
+def get_last_graded_at_no_cache(canvas_key: str, course_id: str) -> str:
+    """
+    Returns when the newest grade of a course was given. These results are not cached, but only the
+    submissions graded since the last check are fetched. If possible, use get_last_graded_at to
+    improve server response times.
+
+    :param canvas_key: The API key that should be used.
+    :param course_id: The ID of the course to check.
+    :return str: When the newest grade was given, or an empty string if nothing was graded.
+    """
+    key = hashkey(canvas_key, str(course_id))
+    previous = last_graded.get(key, '')
+    params = {'graded_since': previous} if previous else {}
+
+    canvas = connect(canvas_key)
+    submissions = canvas.get_course(course_id)\
+        .get_multiple_submissions(workflow_state='graded', **params)
+    graded_at = max((getattr(submission, 'graded_at', None) or '' for submission in submissions),
+                    default='')
+
+    last_graded[key] = max(previous, graded_at)
+    return last_graded[key]
+
+
+@breakers.stale_fallback
+@cached(cache=_timed_cache(), info=True)
+def get_graded_groups(canvas_key: str, course_id: str, graded_at: str) -> list[GradedGroup] | None:
+    """
+    Returns the assignment groups of a course as compact arrays. These results are cached for each
+    time the course was last graded, see get_weighted_graded_assignments_for_course.
+
+    :param canvas_key: The API key that should be used.
+    :param course_id: The ID of the course to retrieve the assignment groups from.
+    :param graded_at: When the newest grade of the course was given.
+    :return list[GradedGroup] | None: The assignment groups, or None if the course doesn't exist.
+    """
+    groups = get_weighted_graded_assignments_for_course_no_cache(canvas_key, course_id)
+    if groups is None:
+        return None
+
+    return [_to_graded_group(group) for group in groups]
+
+
+def get_weighted_graded_assignments_for_course_no_cache(canvas_key: str, course_id: str)\
         -> list[object] | None:
     """
     This function is used to get all the graded assignments for a course with their grade weight.
+    These results are not cached. If possible, use get_weighted_graded_assignments_for_course to
+    improve server response times.
 
     :param canvas_key: The API key that should be used.
     :param course_id: The ID of the course to retrieve the graded assignments from.
-    :return list[dict]: A list of graded assignments.
+    :return list[object] | None: The canvasapi AssignmentGroups, with their assignments and the
+    user's submissions.
     """
-    canvas = Canvas(BASE_URL, canvas_key)
+    canvas = connect(canvas_key)
     course = canvas.get_course(course_id)
     if getattr(course, 'name', None) is None:
         return None
     grade_weight_group = course.get_assignment_groups(include=['assignments', 'submission'])
-    return grade_weight_group
+    return list(grade_weight_group)
+
+
+def _to_graded_group(group: object) -> GradedGroup:
+    assignments = getattr(group, 'assignments', [])
+    scores = [(assignment.get('submission') or {}).get('score') for assignment in assignments]
+    max_scores = [assignment.get('points_possible') for assignment in assignments]
+
+    return GradedGroup(
+        name=getattr(group, 'name', None),
+        weight=getattr(group, 'group_weight', None),
+        ids=array('q', [assignment.get('id') or 0 for assignment in assignments]),
+        names=tuple(assignment.get('name') for assignment in assignments),
+        scores=array('d', [math.nan if score is None else score for score in scores]),
+        max_scores=array('d', [math.nan if score is None else score for score in max_scores]),
+        omit=bytes(bool(assignment.get('omit_from_final_grade')) for assignment in assignments),
+    )
 
 
 def course_to_dict(course: Course, fields: list[str] | None = None) -> dict[str, str | None]:
@@ -532,3 +821,107 @@ def assignment_to_dict(assignment: Assignment, fields: list[str] | None = None)\
         ]
 
     return {field: getattr(assignment, field, None) for field in fields}
+
+
+#################################################################
+#                                                               #
+#                         INVALIDATION                          #
+#                                                               #
+#################################################################
+
+# The functions whose results are kept in a timed cache
+CACHED_FUNCTIONS = [
+    get_all_courses, get_course, get_graded_assignments, get_course_assignments,
+    get_course_assignment, get_current_user, get_calendar_events, get_undated_assignments,
+    get_missing_submissions, get_course_submissions, get_graded_groups, get_last_graded_at,
+    get_course_roster
+]
+
+
+# The cached functions whose second argument is a course or the ID of a course
+COURSE_FUNCTIONS = [
+    get_course, get_graded_assignments, get_course_assignments, get_course_assignment,
+    get_undated_assignments, get_course_submissions, get_graded_groups, get_last_graded_at
+]
+
+
+def _same_course(course: str | int | Course, course_id: int) -> bool:
+    return str(getattr(course, 'id', course)) == str(course_id)
+
+
+def invalidate_course(course_id: int, assignments: bool = True) -> int:
+    """
+    Remove every cached result about a course, for every user, so that the next lookup asks Canvas.
+    Calendar events aren't cached by course, so every cached assignment event is removed as well
+    when assignments changed.
+
+    :param course_id: The ID of the course that changed in Canvas.
+    :param assignments: Whether the course's assignments changed, rather than only submissions.
+    :return int: The number of cached results that were removed.
+    """
+    removed = 0
+    for function in COURSE_FUNCTIONS:
+        removed += _remove_keys(function, lambda key: len(key) > 1
+                                and _same_course(key[1], course_id))
+
+    # get_missing_submissions(canvas_key, course_ids)
+    removed += _remove_keys(get_missing_submissions, lambda key: len(key) > 1
+                            and any(_same_course(course, course_id) for course in key[1]))
+
+    # get_calendar_events(canvas_key, start_date, end_date, limit, type)
+    if assignments:
+        removed += _remove_keys(get_calendar_events,
+                                lambda key: len(key) < 5 or key[4] == 'assignment')
+    return removed
+
+
+def invalidate_key(canvas_key: str) -> int:
+    """
+    Remove every cached result that was fetched with a Canvas API key.
+
+    :param canvas_key: The API key.
+    :return int: The number of cached results that were removed.
+    """
+    removed = 0
+    for function in CACHED_FUNCTIONS:
+        removed += _remove_keys(function, lambda key: len(key) > 0 and key[0] == canvas_key)
+    return removed
+
+
+def _remove_keys(function, matches) -> int:
+    cache = function.cache
+    keys = [key for key in list(cache.keys()) if matches(key)]
+    for key in keys:
+        cache.pop(key, None)
+    return len(keys)
+
+
+#################################################################
+#                                                               #
+#                            METRICS                            #
+#                                                               #
+#################################################################
+
+def _collect_cache_metrics() -> list[Family]:
+    hits, misses, sizes, ratios = [], [], [], []
+    for function in CACHED_FUNCTIONS:
+        info = function.cache_info()
+        labels = {'function': function.__name__}
+        lookups = info.hits + info.misses
+        hits.append((labels, info.hits))
+        misses.append((labels, info.misses))
+        sizes.append((labels, info.currsize))
+        ratios.append((labels, info.hits / lookups if lookups else 0))
+
+    return [
+        Family('canvas_cache_hits_total', 'counter',
+               'The number of Canvas API results served from the cache.', hits),
+        Family('canvas_cache_misses_total', 'counter',
+               'The number of Canvas API results that were not cached.', misses),
+        Family('canvas_cache_size', 'gauge', 'The number of cached Canvas API results.', sizes),
+        Family('canvas_cache_hit_ratio', 'gauge',
+               'The fraction of lookups served from the cache since the server started.', ratios),
+    ]
+
+
+register_collector(_collect_cache_metrics)
@@ -1,14 +1,34 @@
 """
-This file provides utilities for encrypting and decrypting arbitrary data. This does not contain any
-functions specific to this application.
+This file provides utilities for encrypting and decrypting arbitrary data. Apart from reading the
+server secret, see get_todo_secret, and measuring how long scrypt takes with utils.metrics, it
+doesn't contain anything specific to this application.
 """
 
 
 from Crypto.Cipher import AES
-from Crypto.Protocol.KDF import scrypt
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF, scrypt
 from Crypto.Random import get_random_bytes
 import sys
 import os
+import time
+
+from utils.metrics import Histogram
+
+
+SCRYPT_DURATION = Histogram('scrypt_duration_seconds', 'How long deriving a key with scrypt takes.',
+                            buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0))
+
+# The first byte of ciphertexts in the current format. Older ciphertexts have no header and always
+# used scrypt
+FORMAT_VERSION = 1
+# How the key of a ciphertext is derived, which is the second byte of its header. Passwords need a
+# slow KDF, but secrets that are already random, like the server secret, only need HKDF
+KDF_LEGACY = 0
+KDF_SCRYPT = 1
+KDF_HKDF = 2
+KDFS = (KDF_SCRYPT, KDF_HKDF)
+HEADER_SIZE = 2
 
 # Import Self from the correct place depending on the Python version
 if sys.version_info[0] == 3 and sys.version_info[1] >= 11:
@@ -21,7 +41,8 @@ class Ciphertext:
     """
     A representation of AES-OCB (256 bit) encrypted ciphertext. Can be converted to and from bytes.
     """
-    def __init__(self, tag: bytes, nonce: bytes, salt: bytes, ciphertext: bytes) -> Self:
+    def __init__(self, tag: bytes, nonce: bytes, salt: bytes, ciphertext: bytes,
+                 kdf: int = KDF_LEGACY) -> Self:
         """
         Initialize a Ciphertext.
 
@@ -29,12 +50,15 @@ class Ciphertext:
         :param nonce: The nonce used to encrypt the ciphertext.
         :param salt: The salt used to derive the encryption key.
         :param ciphertext: The ciphertext itself.
-        :raises ValueError: If any argument is not bytes.
+        :param kdf: How the encryption key was derived. KDF_LEGACY ciphertexts are converted to
+        bytes without a header.
+        :raises ValueError: If any argument is not bytes, or kdf is unknown.
         """
         if type(tag) is not bytes or \
            type(nonce) is not bytes or \
            type(salt) is not bytes or \
-           type(ciphertext) is not bytes:
+           type(ciphertext) is not bytes or \
+           (kdf != KDF_LEGACY and kdf not in KDFS):
 
             raise ValueError()
 
@@ -42,6 +66,7 @@ class Ciphertext:
         self.nonce = nonce
         self.salt = salt
         self.ciphertext = ciphertext
+        self.kdf = kdf
 
     def to_bytes(self) -> bytes:
         """
@@ -50,7 +75,8 @@ class Ciphertext:
         return bytes(self)
 
     def __bytes__(self):
-        return self.tag + self.nonce + self.salt + self.ciphertext
+        header = b'' if self.kdf == KDF_LEGACY else bytes((FORMAT_VERSION, self.kdf))
+        return header + self.tag + self.nonce + self.salt + self.ciphertext
 
     def __eq__(self, other):
         if type(other) is not Ciphertext:
@@ -59,17 +85,26 @@ class Ciphertext:
         return self.tag == other.tag and \
             self.nonce == other.nonce and \
             self.salt == other.salt and \
-            self.ciphertext == other.ciphertext
+            self.ciphertext == other.ciphertext and \
+            self.kdf == other.kdf
 
     @staticmethod
-    def from_bytes(data: bytes) -> Self:
+    def from_bytes(data: bytes, legacy: bool = False) -> Self:
         """
         Convert bytes to a Ciphertext.
 
         :param data: The bytes to convert into a Ciphertext.
+        :param legacy: If True, the bytes are read as a ciphertext without a header even if they
+        start like one. A legacy ciphertext starts with its random tag, so about one in 30000 of
+        them look like they have a header.
         :return Self: The Ciphertext created from the bytes.
         :raises InvalidCipherBytesException: If the bytes clearly do not represent a Ciphertext.
         """
+        kdf = KDF_LEGACY
+        if not legacy and _has_header(data):
+            kdf = data[1]
+            data = data[HEADER_SIZE:]
+
         # If there are less than 47 bytes, the bytes can't possibly be ciphertext
         # 16 bytes for the tag, 15 bytes for the nonce, 16 bytes for the salt
         if len(data) < 16 + 15 + 16:
@@ -80,7 +115,12 @@ class Ciphertext:
         salt = data[16+15:16+15+16]     # Next 16 bytes are the salt
         ciphertext = data[16+15+16:]    # Everything else is the ciphertext
 
-        return Ciphertext(tag, nonce, salt, ciphertext)
+        return Ciphertext(tag, nonce, salt, ciphertext, kdf)
+
+
+def _has_header(data: bytes) -> bool:
+    return len(data) >= HEADER_SIZE + 16 + 15 + 16 and data[0] == FORMAT_VERSION and \
+        data[1] in KDFS
 
 
 class InvalidCipherBytesException(Exception):
@@ -91,27 +131,31 @@ class InvalidCipherBytesException(Exception):
     pass
 
 
-def encrypt_str(data: str, password: str) -> Ciphertext:
+def encrypt_str(data: str, password: str, kdf: int = KDF_SCRYPT) -> Ciphertext:
     """
     Encrypt some data with the specified password using 256-bit AES-OCB.
 
     :param data: The date to encrypt.
     :param password: The password to encrypt the data with.
+    :param kdf: How the key is derived from the password. Use KDF_HKDF only for random secrets,
+    such as the server secret, which HKDF derives a key from in microseconds. Passwords must use
+    KDF_SCRYPT, which takes about 100 ms.
     :return Ciphertext: The encrypted data as a Ciphertext.
     """
     # Generate a key from the password
-    key, salt = _derive_key(password)
+    key, salt = _derive_key(password, kdf=kdf)
 
     # Encrypt the data
     cipher = AES.new(key, AES.MODE_OCB)
     ciphertext, tag = cipher.encrypt_and_digest(data.encode())
 
-    return Ciphertext(tag, cipher.nonce, salt, ciphertext)
+    return Ciphertext(tag, cipher.nonce, salt, ciphertext, kdf)
 
 
 def decrypt_str(ciphertext: Ciphertext | bytes, password: str) -> str:
     """
-    Decrypt some data with the specified password using 256-bit AES-OCB.
+    Decrypt some data with the specified password using 256-bit AES-OCB. The key is derived the
+    same way it was when the data was encrypted.
 
     :param ciphertext: Either a Ciphertext object or bytes respresenting a Ciphertext object.
     :param password: The password to decrypt the data with.
@@ -120,33 +164,79 @@ def decrypt_str(ciphertext: Ciphertext | bytes, password: str) -> str:
     Ciphertext.
     :raises ValueError: If the given password is incorrect or the ciphertext has been modified.
     """
-    if type(ciphertext) is bytes:
-        ciphertext = Ciphertext.from_bytes(ciphertext)
+    return _decrypt(ciphertext, password)[0]
 
-    # Generate a key from the password and salt
-    key, salt = _derive_key(password, ciphertext.salt)
 
-    # Decrypt the data
-    cipher = AES.new(key, AES.MODE_OCB, nonce=ciphertext.nonce)
-    data = cipher.decrypt_and_verify(ciphertext.ciphertext, ciphertext.tag)
+def decrypt_str_upgrade(ciphertext: Ciphertext | bytes, password: str, kdf: int)\
+        -> tuple[str, Ciphertext | None]:
+    """
+    Decrypt some data like `decrypt_str`, and re-encrypt it if it wasn't encrypted in the current
+    format with the given KDF. The caller should store the new ciphertext in place of the old one.
 
-    return data.decode()
+    :param ciphertext: The Ciphertext or bytes to decrypt.
+    :param password: The password to decrypt the data with.
+    :param kdf: The KDF the data should be encrypted with.
+    :return tuple[str, Ciphertext | None]: The decrypted data, and the data encrypted with the
+    given KDF, or None if it already was.
+    :raises InvalidCipherBytesException: If ciphertext is bytes and clearly does not represent a
+    Ciphertext.
+    :raises ValueError: If the given password is incorrect or the ciphertext has been modified.
+    """
+    data, used_kdf = _decrypt(ciphertext, password)
+    if used_kdf == kdf:
+        return (data, None)
+
+    return (data, encrypt_str(data, password, kdf))
 
 
-def reencrypt_str(ciphertext: Ciphertext | bytes, old_password: str, new_password: str)\
-        -> Ciphertext:
+def reencrypt_str(ciphertext: Ciphertext | bytes, old_password: str, new_password: str,
+                  kdf: int = KDF_SCRYPT) -> Ciphertext:
     """
     Decrypt some data, then re-encrypted it with a new password.
 
     :param ciphertext: The Ciphertext or bytes to re-encrypt.
     :param old_password: The password that will currently decrypt the data.
     :param new_password: The password that the data will be re-encrypted with.
+    :param kdf: How the key is derived from the new password, see `encrypt_str`.
     :raises InvalidCipherBytesException: If ciphertext is bytes and clearly does not represent a
     Ciphertext.
     :raises ValueError: If the given password is incorrect or the ciphertext has been modified.
     """
     data = decrypt_str(ciphertext, old_password)
-    return encrypt_str(data, new_password)
+    return encrypt_str(data, new_password, kdf)
+
+
+def _decrypt(ciphertext: Ciphertext | bytes, password: str) -> tuple[str, int]:
+    """
+    Decrypt some data, and tell which KDF it was encrypted with.
+
+    :param ciphertext: Either a Ciphertext object or bytes respresenting a Ciphertext object.
+    :param password: The password to decrypt the data with.
+    :return tuple[str, int]: The decrypted data and the KDF of the ciphertext.
+    """
+    if type(ciphertext) is not bytes:
+        return (_decrypt_ciphertext(ciphertext, password), ciphertext.kdf)
+
+    parsed = Ciphertext.from_bytes(ciphertext)
+    try:
+        return (_decrypt_ciphertext(parsed, password), parsed.kdf)
+    except ValueError:
+        # The bytes may be a legacy ciphertext whose tag happens to look like a header
+        if parsed.kdf == KDF_LEGACY:
+            raise
+        parsed = Ciphertext.from_bytes(ciphertext, legacy=True)
+        return (_decrypt_ciphertext(parsed, password), parsed.kdf)
+
+
+def _decrypt_ciphertext(ciphertext: Ciphertext, password: str) -> str:
+    # Generate a key from the password and salt
+    key, salt = _derive_key(password, ciphertext.salt, ciphertext.kdf)
+
+    # Decrypt the data
+    cipher = AES.new(key, AES.MODE_OCB, nonce=ciphertext.nonce)
+    data = cipher.decrypt_and_verify(ciphertext.ciphertext, ciphertext.tag)
+
+    return data.decode()
 
 
 def generate_key(seed: str | None = None) -> bytes:
@@ -163,21 +253,31 @@ def generate_key(seed: str | None = None) -> bytes:
     return get_random_bytes(32)
 
 
-def _derive_key(password: str, salt: str | None = None) -> tuple[bytes, bytes]:
+def _derive_key(password: str, salt: str | None = None, kdf: int = KDF_SCRYPT)\
+        -> tuple[bytes, bytes]:
     """
     Derive a key from a password to encrypt some data.
 
     :param password: The password to derive the key from.
     :param salt: If specified, the salt used to derive the key. If None, a 16 byte salt is randomly
     generated.
+    :param kdf: The KDF to derive the key with. KDF_LEGACY uses scrypt.
     :return tuple[bytes, bytes]: The derived key as bytes and the salt used to derive it.
     """
     if salt is None:
         salt = get_random_bytes(16)
 
+    if kdf == KDF_HKDF:
+        # The salt makes every ciphertext use its own key
+        return (HKDF(password.encode(), 32, salt, SHA256), salt)
+
+    start = time.perf_counter()
     # Values for scrypt chosen from:
     # https://cheatsheetseries.owasp.org/cheatsheets/Password_Storage_Cheat_Sheet.html#scrypt
-    return (scrypt(password, salt, 32, N=2**17, r=8, p=1), salt)
+    key = scrypt(password, salt, 32, N=2**17, r=8, p=1)
+    SCRYPT_DURATION.observe(time.perf_counter() - start)
+
+    return (key, salt)
 
 
 def get_todo_secret():
@@ -0,0 +1,197 @@
+"""
+This file gives every request a time budget for calling Canvas and Todoist, set by REQUEST_BUDGET.
+Every outbound call uses what is left of the budget as its timeout, capped by OUTBOUND_TIMEOUT, so
+a slow Canvas instance can't hold a greenlet and its connection for longer than the budget. Calls
+made outside of a request, such as by the sync daemon, only use OUTBOUND_TIMEOUT.
+
+Handlers that fan out to several calls use `join`, which stops waiting when the budget runs out and
+returns the results that arrived in time. Such responses have an `X-Partial-Response` header.
+"""
+
+
+from contextlib import contextmanager
+import contextvars
+import time
+
+from flask import Flask, Response
+import gevent
+from requests.adapters import HTTPAdapter
+
+from utils.metrics import Counter
+from utils.settings import get_outbound_timeout, get_request_budget
+
+
+PARTIAL_HEADER = 'X-Partial-Response'
+
+DEADLINES_EXCEEDED = Counter('deadline_exceeded_total',
+                             'The number of calls and fan-outs cut short because their request ran '
+                             'out of time, by where it happened.', ('where',))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when an outbound call is made after the request's time budget ran out."""
+    pass
+
+
+class _Budget:
+    def __init__(self, seconds: float):
+        self.deadline = time.monotonic() + seconds
+        self.partial = False
+
+
+# The budget of the request handled by the current greenlet. Greenlets started with
+# utils.instrumentation.spawn share the budget of the request that started them.
+_current_budget: contextvars.ContextVar[_Budget | None] = \
+    contextvars.ContextVar('current_budget', default=None)
+
+
+#################################################################
+#                                                               #
+#                            BUDGETS                            #
+#                                                               #
+#################################################################
+
+
+@contextmanager
+def budget(seconds: float):
+    """
+    Give the code in the `with` block a time budget for its outbound calls.
+
+    :param seconds: The time budget in seconds.
+    """
+    token = _current_budget.set(_Budget(seconds))
+    try:
+        yield
+    finally:
+        _current_budget.reset(token)
+
+
+def remaining() -> float | None:
+    """
+    Get the time left in the current request's budget.
+
+    :return float | None: The number of seconds left, which is negative if the budget ran out, or
+    None if there is no budget.
+    """
+    current = _current_budget.get()
+    if current is None:
+        return None
+    return current.deadline - time.monotonic()
+
+
+def get_timeout(where: str = 'call') -> float:
+    """
+    Get the timeout of an outbound call: the time left in the budget, capped by OUTBOUND_TIMEOUT.
+
+    :param where: What the timeout is for, such as 'canvas' or 'todoist', for the metrics.
+    :raises DeadlineExceeded: If the budget ran out.
+    :return float: The timeout in seconds.
+    """
+    timeout = get_outbound_timeout()
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        DEADLINES_EXCEEDED.inc(where)
+        raise DeadlineExceeded(f'The request ran out of time before calling {where}')
+    return min(left, timeout)
+
+
+def join(greenlets: list[gevent.Greenlet]) -> list[gevent.Greenlet]:
+    """
+    Wait for greenlets until they are done or the budget runs out. Greenlets that aren't done by
+    then are killed and the response is marked as partial, so that the caller can use the results
+    of the greenlets that finished.
+
+    :param greenlets: The greenlets to wait for.
+    :return list[Greenlet]: The greenlets that finished in time, in the order they were given.
+    """
+    left = remaining()
+    gevent.joinall(greenlets, timeout=max(left, 0) if left is not None else None)
+    finished = [glet for glet in greenlets if glet.dead]
+    if len(finished) == len(greenlets):
+        return finished
+
+    DEADLINES_EXCEEDED.inc('join')
+    gevent.killall([glet for glet in greenlets if not glet.dead], block=False)
+    mark_partial()
+    return finished
+
+
+def mark_partial():
+    """Mark the current request's response as partial, because some data didn't arrive in time."""
+    current = _current_budget.get()
+    if current is not None:
+        current.partial = True
+
+
+#################################################################
+#                                                               #
+#                        OUTBOUND CALLS                         #
+#                                                               #
+#################################################################
+
+
+class TimeoutAdapter(HTTPAdapter):
+    """
+    A `requests` transport adapter that applies the current request's timeout to every call, for
+    sessions whose requests are made by an SDK, such as canvasapi's.
+
+    :param where: The name of the API, such as 'canvas', for the metrics.
+    """
+    def __init__(self, where: str, *args, **kwargs):
+        self.where = where
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        budget_timeout = get_timeout(self.where)
+        if timeout is None or isinstance(timeout, tuple):
+            timeout = budget_timeout
+        else:
+            timeout = min(timeout, budget_timeout)
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def limit_session(session, where: str):
+    """
+    Apply the current request's timeout to every call made by a `requests.Session`.
+
+    :param session: The session.
+    :param where: The name of the API, such as 'canvas', for the metrics.
+    """
+    adapter = TimeoutAdapter(where)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+#################################################################
+#                                                               #
+#                           REQUESTS                            #
+#                                                               #
+#################################################################
+
+
+def _start_request():
+    _current_budget.set(_Budget(get_request_budget()))
+
+
+def _finish_request(response: Response) -> Response:
+    current = _current_budget.get()
+    if current is not None and current.partial:
+        response.headers[PARTIAL_HEADER] = 'true'
+    return response
+
+
+def _teardown_request(exception):
+    _current_budget.set(None)
+
+
+def init_app(app: Flask):
+    """
+    Give every request handled by an app a time budget.
+
+    :param app: The Flask app.
+    """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,259 @@
+"""
+This file streams live updates to the dashboard with server-sent events, so that it doesn't have to
+poll for them. An event is published when a collaborator toggles a shared subtask, when an
+invitation arrives, and when a background sync changed a user's tasks.
+
+Events are stored in the user_events table, because they may be published by the sync daemon or by
+another server process than the one holding the user's stream. While a process has open streams,
+a single greenlet reads the events that are newer than the last one it saw every
+EVENT_POLL_INTERVAL seconds, and hands them to the streams of their users. Events published by the
+same process are read right away. Every process keeps at most EVENT_STREAMS streams open, and each
+stream sends a heartbeat after EVENT_HEARTBEAT idle seconds.
+"""
+
+
+from datetime import timedelta
+import json
+import logging
+from typing import Iterable, Iterator
+
+from flask import Flask
+import gevent
+from gevent.event import Event
+from gevent.queue import Empty, Full, Queue
+from sqlalchemy import delete, func, insert, select
+
+from utils.metrics import Counter, Gauge
+from utils.models import UserEvent, db
+from utils.settings import get_event_streams, get_event_heartbeat, get_event_poll_interval, \
+    get_event_retention, utc_now
+
+
+logger = logging.getLogger(__name__)
+
+# The most events a stream holds before its client reads them, and the most read in one poll
+QUEUE_SIZE = 100
+BATCH_SIZE = 500
+# How many polls pass between two removals of expired events
+PRUNE_EVERY = 60
+# How long browsers wait before reconnecting a closed stream, in milliseconds
+RETRY_MS = 5000
+
+STREAMS_OPEN = Gauge('event_streams_open', 'The number of open event streams.')
+STREAMS_REJECTED = Counter('event_streams_rejected_total',
+                           'The number of event streams refused because EVENT_STREAMS were open.')
+EVENTS_PUBLISHED = Counter('user_events_published_total',
+                           'The number of dashboard events published, by kind.', ('kind',))
+EVENTS_DROPPED = Counter('user_events_dropped_total',
+                         'The number of events not sent because a stream fell behind.')
+
+
+class StreamLimitReached(Exception):
+    """Raised when a process already has EVENT_STREAMS event streams open."""
+    pass
+
+
+def publish(owners: Iterable[int], kind: str, data: dict):
+    """
+    Publish an event to the open streams of some users. Events are best effort, a failure is
+    logged and doesn't affect the caller.
+
+    :param owners: The IDs of the users the event is for.
+    :param kind: The kind of the event, which is the name of the event in the stream.
+    :param data: The JSON data of the event.
+    """
+    publish_all([(owners, kind, data)])
+
+
+def publish_all(events: list[tuple[Iterable[int], str, dict]]):
+    """
+    Publish several events with a single write, like `publish`.
+
+    :param events: The owners, kind, and data of every event.
+    """
+    created_at = utc_now()
+    rows = [{'owner': owner, 'kind': kind, 'data': data, 'created_at': created_at}
+            for owners, kind, data in events for owner in set(owners)]
+    if not rows:
+        return
+
+    try:
+        db.session.execute(insert(UserEvent), rows)
+        db.session.commit()
+    except Exception as ex:
+        db.session.rollback()
+        logger.warning('Could not publish %d events: %s', len(rows), ex)
+        return
+
+    for row in rows:
+        EVENTS_PUBLISHED.inc(row['kind'])
+    hub.wakeup.set()
+
+
+def format_event(event: UserEvent) -> str:
+    """
+    Format an event as a server-sent event. The ID lets browsers resume after reconnecting.
+
+    :param event: The event.
+    :return str: The event in the text/event-stream format.
+    """
+    return f'id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(event.data)}\n\n'
+
+
+class EventHub:
+    """
+    The open event streams of this process, by user, and the greenlet that reads new events for
+    them.
+
+    :param limit: The most streams that may be open. Defaults to EVENT_STREAMS.
+    :param poll_interval: The seconds between two reads of new events. Defaults to
+    EVENT_POLL_INTERVAL.
+    """
+    def __init__(self, limit: int | None = None, poll_interval: float | None = None):
+        self.limit = limit if limit is not None else get_event_streams()
+        self.poll_interval = poll_interval if poll_interval is not None \
+            else get_event_poll_interval()
+        self.channels: dict[int, set[Queue]] = {}
+        self.open = 0
+        # The ID of the newest event that was read
+        self.cursor: int | None = None
+        self.polls = 0
+        self.wakeup = Event()
+        self.poller: gevent.Greenlet | None = None
+
+    def subscribe(self, app: Flask, user_id: int) -> Queue:
+        """
+        Open a stream for a user. The first stream starts reading new events.
+
+        :param app: The app, whose database the events are read from.
+        :param user_id: The ID of the user.
+        :return Queue: The queue that receives the user's new events, formatted.
+        :raises StreamLimitReached: If the most streams are already open.
+        """
+        if self.open >= self.limit:
+            STREAMS_REJECTED.inc()
+            raise StreamLimitReached
+
+        if self.cursor is None:
+            self.cursor = db.session.execute(select(func.max(UserEvent.id))).scalar() or 0
+        queue = Queue(QUEUE_SIZE)
+        self.channels.setdefault(user_id, set()).add(queue)
+        self.open += 1
+        STREAMS_OPEN.set(self.open)
+
+        if self.poller is None or self.poller.dead:
+            self.poller = gevent.spawn(self._run, app)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: Queue):
+        """
+        Close a stream. The last stream stops reading new events.
+
+        :param user_id: The ID of the user.
+        :param queue: The queue returned by `subscribe`.
+        """
+        queues = self.channels.get(user_id)
+        if queues is None or queue not in queues:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.channels[user_id]
+        self.open -= 1
+        STREAMS_OPEN.set(self.open)
+        # Events published while no stream is open are only read by reconnecting streams
+        if self.open == 0:
+            self.cursor = None
+
+    def poll(self) -> int:
+        """
+        Read the events published since the last poll and hand them to the streams of their users.
+
+        :return int: The number of events read.
+        """
+        events = db.session.execute(
+            select(UserEvent).where(UserEvent.id > self.cursor).order_by(UserEvent.id)
+            .limit(BATCH_SIZE)
+        ).scalars().all()
+
+        for event in events:
+            self.cursor = event.id
+            text = format_event(event)
+            for queue in self.channels.get(event.owner, ()):
+                try:
+                    queue.put_nowait(text)
+                except Full:
+                    EVENTS_DROPPED.inc()
+
+        self.polls += 1
+        if self.polls % PRUNE_EVERY == 0:
+            prune()
+        return len(events)
+
+    def _run(self, app: Flask):
+        # Runs in its own greenlet, outside of any request
+        while self.channels:
+            self.wakeup.clear()
+            with app.app_context():
+                try:
+                    # A full batch means more events are waiting
+                    while self.poll() == BATCH_SIZE:
+                        pass
+                except Exception as ex:
+                    db.session.rollback()
+                    logger.warning('Could not read events: %s', ex)
+            self.wakeup.wait(self.poll_interval)
+        self.poller = None
+
+
+# The event streams of this process
+hub = EventHub()
+
+
+def get_missed_events(user_id: int, last_event_id: int) -> list[UserEvent]:
+    """
+    Get the events a user's stream missed while it was reconnecting.
+
+    :param user_id: The ID of the user.
+    :param last_event_id: The ID of the last event the stream received.
+    :return list[UserEvent]: The user's newer events that weren't removed yet.
+    """
+    return db.session.execute(
+        select(UserEvent).where(UserEvent.owner == user_id, UserEvent.id > last_event_id)
+        .order_by(UserEvent.id).limit(QUEUE_SIZE)
+    ).scalars().all()
+
+
+def prune() -> int:
+    """
+    Remove the events that are older than EVENT_RETENTION seconds.
+
+    :return int: The number of events removed.
+    """
+    cutoff = utc_now() - timedelta(seconds=get_event_retention())
+    result = db.session.execute(delete(UserEvent).where(UserEvent.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+
+def stream(user_id: int, queue: Queue, missed: list[str], heartbeat: float | None = None)\
+        -> Iterator[str]:
+    """
+    Stream a user's events until the client goes away.
+
+    :param user_id: The ID of the user.
+    :param queue: The queue returned by `hub.subscribe`.
+    :param missed: The formatted events the stream missed while reconnecting.
+    :param heartbeat: The idle seconds before a heartbeat is sent. Defaults to EVENT_HEARTBEAT.
+    :return Iterator[str]: The text of the stream.
+    """
+    heartbeat = heartbeat if heartbeat is not None else get_event_heartbeat()
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        yield from missed
+        while True:
+            try:
+                yield queue.get(timeout=heartbeat)
+            except Empty:
+                yield ': heartbeat\n\n'
+    finally:
+        hub.unsubscribe(user_id, queue)
@@ -0,0 +1,211 @@
+"""
+This file computes grades for the grade simulator on the server. A course's assignment groups are
+kept as NumPy arrays with one entry per assignment, so that the current grade, the contribution of
+each group, and any number of what-if scenarios are computed with a few array operations.
+
+Grades are computed like the grade simulator always did: a group's percentage is the sum of its
+counted scores over the sum of their maximum scores, rounded to two decimals, and the grade is the
+average of the percentages of the groups with a counted assignment, weighted by the groups' weights.
+Assignments that are omitted from the final grade or don't have a score don't count.
+"""
+
+
+from __future__ import annotations
+
+import math
+import sys
+
+import numpy as np
+
+import utils.canvas as canvas
+
+# Import Self from the correct place depending on the Python version
+if sys.version_info[0] == 3 and sys.version_info[1] >= 11:
+    from typing import Self
+else:
+    from typing_extensions import Self
+
+
+# The lowest percentage of each letter grade
+LETTER_THRESHOLDS = (('A', 90.0), ('B', 80.0), ('C', 70.0), ('D', 60.0))
+
+
+class CourseGrades:
+    """
+    The assignment groups of a course for one student, as arrays.
+
+    :param names: The name of every group.
+    :param weights: The weight of every group.
+    :param ids: The ID of every assignment.
+    :param groups: The index of the group of every assignment.
+    :param scores: The score of every assignment, NaN if it has none.
+    :param max_scores: The maximum score of every assignment.
+    :param omit: Whether every assignment is omitted from the final grade.
+    """
+    def __init__(self, names: list[str | None], weights: np.ndarray, ids: list[int],
+                 groups: np.ndarray, scores: np.ndarray, max_scores: np.ndarray, omit: np.ndarray):
+        self.names = names
+        self.weights = weights
+        self.ids = ids
+        self.scores = scores
+        self.max_scores = max_scores
+        self.omit = omit
+        # Summing the columns of a matrix with this one-hot matrix sums them by group
+        self.membership = np.zeros((len(ids), len(names)))
+        self.membership[np.arange(len(ids)), groups] = 1.0
+        self.columns = {assignment_id: i for i, assignment_id in enumerate(ids)}
+
+    @staticmethod
+    def from_groups(graded_groups: list[canvas.GradedGroup]) -> Self:
+        """
+        Convert the assignment groups returned by
+        canvas.get_weighted_graded_assignments_for_course.
+
+        :param graded_groups: The assignment groups, with the user's scores.
+        :return Self: The CourseGrades of the groups.
+        """
+        sizes = [len(group.ids) for group in graded_groups]
+        return CourseGrades(
+            [group.name for group in graded_groups],
+            np.array([group.weight or 0.0 for group in graded_groups], dtype=float),
+            [assignment_id for group in graded_groups for assignment_id in group.ids],
+            np.repeat(np.arange(len(graded_groups)), sizes),
+            _concatenate([group.scores for group in graded_groups], float),
+            # Assignments without a maximum score add nothing to their group's maximum
+            np.nan_to_num(_concatenate([group.max_scores for group in graded_groups], float)),
+            _concatenate([group.omit for group in graded_groups], bool))
+
+    def scenarios(self, overrides: list[dict[int, float]]) -> np.ndarray:
+        """
+        Create what-if scenarios from the student's scores.
+
+        :param overrides: The scores to replace in every scenario, by assignment ID. Unknown
+        assignments are ignored.
+        :return np.ndarray: The scores of every scenario, one row per scenario.
+        """
+        scores = np.tile(self.scores, (len(overrides), 1))
+        for row, override in enumerate(overrides):
+            for assignment_id, score in override.items():
+                column = self.columns.get(assignment_id)
+                if column is not None:
+                    scores[row, column] = math.nan if score is None else score
+        return scores
+
+    def grades(self, scores: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the grade of several scenarios at once.
+
+        :param scores: The scores of every scenario, one row per scenario.
+        :return tuple[np.ndarray, np.ndarray]: The grade of every scenario, and the percentage of
+        every group in every scenario, NaN for groups that don't count.
+        """
+        counted = ~self.omit & ~np.isnan(scores)
+        earned = np.where(counted, scores, 0.0) @ self.membership
+        possible = np.where(counted, self.max_scores, 0.0) @ self.membership
+
+        active = possible > 0
+        percents = np.full(earned.shape, math.nan)
+        np.divide(earned * 100, possible, out=percents, where=active)
+        # Round half up to two decimals, like Math.round in the grade simulator
+        percents = np.floor(percents * 100 + 0.5) / 100
+
+        weights = np.where(active, self.weights, 0.0)
+        total_weight = weights.sum(axis=1)
+        weighted = np.where(active, percents, 0.0) * weights
+        grades = np.zeros(len(scores))
+        np.divide(weighted.sum(axis=1), total_weight, out=grades, where=total_weight > 0)
+        return (grades, percents)
+
+    def needed(self, scores: np.ndarray, thresholds: list[float]) -> np.ndarray:
+        """
+        Compute the percentage the student needs on each remaining assignment, which is every
+        counted assignment without a score, to reach each threshold in several scenarios.
+
+        The grade grows linearly with that percentage, apart from rounding, so it is interpolated
+        between scoring nothing and scoring everything on the remaining assignments.
+
+        :param scores: The scores of every scenario, one row per scenario.
+        :param thresholds: The grades to reach.
+        :return np.ndarray: The percentage needed for every threshold in every scenario, 0 if the
+        threshold is reached anyway, above 100 if it can't be reached without extra credit, and
+        NaN if no assignment remains.
+        """
+        remaining = ~self.omit & np.isnan(scores)
+        lowest = np.where(remaining, 0.0, scores)
+        highest = np.where(remaining, self.max_scores, scores)
+        grades, _ = self.grades(np.concatenate((lowest, highest)))
+        low, high = grades[:len(scores), None], grades[len(scores):, None]
+
+        spread = np.broadcast_to(high - low, (len(scores), len(thresholds)))
+        needed = np.full(spread.shape, math.nan)
+        np.divide(np.asarray(thresholds) - low, spread, out=needed, where=spread > 0)
+        return np.maximum(needed, 0.0) * 100
+
+    def summarize(self, overrides: list[dict[int, float]]) -> list[dict]:
+        """
+        Compute the grade, the percentage and contribution of every group, and the percentage
+        needed for every letter grade of several what-if scenarios.
+
+        :param overrides: The scores to replace in every scenario, by assignment ID.
+        :return list[dict]: The summary of every scenario.
+        """
+        scores = self.scenarios(overrides)
+        grades, percents = self.grades(scores)
+        needed = self.needed(scores, [threshold for _, threshold in LETTER_THRESHOLDS])
+
+        weights = np.where(np.isnan(percents), 0.0, self.weights)
+        total_weight = weights.sum(axis=1, keepdims=True)
+        contributions = np.zeros(percents.shape)
+        np.divide(np.nan_to_num(percents) * weights, total_weight, out=contributions,
+                  where=total_weight > 0)
+
+        return [{
+            'grade': round(float(grades[row]), 2),
+            'groups': [{
+                'name': name,
+                'weight': float(self.weights[i]),
+                'percent': _to_json(percents[row, i]),
+                'contribution': round(float(contributions[row, i]), 2),
+            } for i, name in enumerate(self.names)],
+            'needed': [{
+                'letter': letter,
+                'threshold': threshold,
+                'percent': _to_json(needed[row, i]),
+                'reached': bool(grades[row] >= threshold) if math.isnan(needed[row, i])
+                else bool(needed[row, i] == 0),
+            } for i, (letter, threshold) in enumerate(LETTER_THRESHOLDS)],
+        } for row in range(len(scores))]
+
+    def summary(self) -> dict:
+        """
+        Summarize the student's actual scores, see `summarize`.
+
+        :return dict: The summary.
+        """
+        return self.summarize([{}])[0]
+
+
+def _concatenate(buffers: list, dtype: type) -> np.ndarray:
+    # The compact arrays are read without copying them, and only copied once into the result
+    return np.concatenate([np.frombuffer(buffer, dtype=dtype) for buffer in buffers]
+                          or [np.empty(0, dtype=dtype)])
+
+
+def _to_json(value: float) -> float | None:
+    return None if math.isnan(value) else round(float(value), 2)
+
+
+def get_course_grades(canvas_key: str, course_id: str) -> CourseGrades | None:
+    """
+    Returns the grades of a course for the user. The assignment groups they are computed from are
+    cached, see canvas.get_weighted_graded_assignments_for_course, and converting them takes
+    microseconds.
+
+    :param canvas_key: The API key that should be used.
+    :param course_id: The ID of the course.
+    :return CourseGrades | None: The grades, or None if the course doesn't exist.
+    """
+    graded_groups = canvas.get_weighted_graded_assignments_for_course(canvas_key, course_id)
+    if graded_groups is None:
+        return None
+    return CourseGrades.from_groups(graded_groups)
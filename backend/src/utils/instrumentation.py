@@ -0,0 +1,298 @@
+"""
+This file measures where each request spends its time: how many SQL statements it executes and how
+long they take, how many calls it makes to Canvas and Todoist, and how long each `time_it` span
+takes. The totals are returned in a `Server-Timing` header and logged as one JSON line per request.
+Request latencies and outbound calls are also exported by the `/metrics` endpoint, see
+utils.metrics.
+"""
+
+
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import re
+import time
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from flask import Flask, Response, request
+import gevent
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.metrics import Counter, Gauge, Histogram
+
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds',
+                             'How long requests take to handle, by route.',
+                             ('method', 'route', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight',
+                           'The number of requests currently being handled by a greenlet.')
+EXTERNAL_CALLS = Counter('external_calls_total',
+                         'The number of calls made to Canvas and Todoist, by endpoint and status.',
+                         ('service', 'endpoint', 'status'))
+EXTERNAL_CALL_DURATION = Histogram('external_call_duration_seconds',
+                                   'How long calls to Canvas and Todoist take, by endpoint.',
+                                   ('service', 'endpoint'))
+
+# The metrics of the request being handled by the current greenlet, if any
+_current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Collects the SQL statements, outbound API calls, and spans of a single request.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        # Service name -> [number of calls, total seconds]
+        self.external = {}
+        # Span name -> total seconds, in the order the spans were first entered
+        self.spans = {}
+
+    def record_query(self, seconds: float):
+        """
+        Record a SQL statement.
+
+        :param seconds: How long the statement took to execute.
+        """
+        self.db_count += 1
+        self.db_time += seconds
+
+    def record_call(self, service: str, seconds: float):
+        """
+        Record a call to an external API.
+
+        :param service: The name of the API, such as 'canvas' or 'todoist'.
+        :param seconds: How long the call took.
+        """
+        calls = self.external.setdefault(service, [0, 0.0])
+        calls[0] += 1
+        calls[1] += seconds
+
+    def record_span(self, name: str, seconds: float):
+        """
+        Record a span of code. Spans with the same name are added together.
+
+        :param name: The name of the span.
+        :param seconds: How long the span took.
+        """
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        """Returns the number of seconds since the request started."""
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """
+        Format the metrics as the value of a `Server-Timing` header. Durations are in milliseconds.
+
+        :return str: The header value.
+        """
+        metrics = [f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"']
+        for service, (count, seconds) in self.external.items():
+            metrics.append(f'{service};dur={seconds * 1000:.1f};desc="{count} calls"')
+        for name, seconds in self.spans.items():
+            description = name.replace('"', "'")
+            metrics.append(f'{_metric_name(name)};dur={seconds * 1000:.1f};desc="{description}"')
+        metrics.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def to_dict(self) -> dict:
+        """
+        Summarize the metrics for a log line. Durations are in milliseconds.
+
+        :return dict: The number of SQL statements and external calls, and their durations.
+        """
+        summary = {
+            'duration_ms': round(self.elapsed() * 1000, 1),
+            'db_queries': self.db_count,
+            'db_ms': round(self.db_time * 1000, 1),
+        }
+        for service, (count, seconds) in self.external.items():
+            summary[f'{service}_calls'] = count
+            summary[f'{service}_ms'] = round(seconds * 1000, 1)
+        if self.spans:
+            summary['spans'] = {name: round(seconds * 1000, 1)
+                                for name, seconds in self.spans.items()}
+        return summary
+
+
+def _metric_name(name: str) -> str:
+    """Turn a span name into a token that is valid as a Server-Timing metric name."""
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-') or 'span'
+
+
+def get_current_metrics() -> RequestMetrics | None:
+    """
+    Get the metrics of the request being handled by the current greenlet.
+
+    :return RequestMetrics | None: The metrics, or None if no request is being measured.
+    """
+    return _current_metrics.get()
+
+
+#################################################################
+#                                                               #
+#                      SPANS AND API CALLS                      #
+#                                                               #
+#################################################################
+
+
+@contextmanager
+def span(name: str):
+    """
+    Measure how long the `with` block takes and record it in the current request's metrics.
+
+    :param name: The name of the span.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current_metrics.get()
+        if metrics is not None:
+            metrics.record_span(name, time.perf_counter() - start)
+
+
+@contextmanager
+def record_call(service: str, url: str = ''):
+    """
+    Measure an outbound API call made in the `with` block and record it in the current request's
+    metrics and in the `/metrics` counters. Set `status` on the yielded object to the HTTP status
+    code of the response; calls that raise an exception are counted with the status 'error'.
+
+    :param service: The name of the API, such as 'canvas' or 'todoist'.
+    :param url: The URL that is called.
+    """
+    call = SimpleNamespace(status='error')
+    start = time.perf_counter()
+    try:
+        yield call
+    finally:
+        _record_call(service, url, call.status, time.perf_counter() - start)
+
+
+def instrument_session(session, service: str):
+    """
+    Record every response received by a `requests.Session` as a call to an external API. This
+    counts each page of a paginated Canvas list separately.
+
+    :param session: The session to instrument.
+    :param service: The name of the API, such as 'canvas' or 'todoist'.
+    """
+    def on_response(response, *args, **kwargs):
+        _record_call(service, response.url, response.status_code,
+                     response.elapsed.total_seconds())
+
+    session.hooks['response'].append(on_response)
+
+
+def _record_call(service: str, url: str, status: int | str, seconds: float):
+    endpoint = _endpoint_name(url)
+    EXTERNAL_CALLS.inc(service, endpoint, status)
+    EXTERNAL_CALL_DURATION.observe(seconds, service, endpoint)
+
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.record_call(service, seconds)
+
+
+def _endpoint_name(url: str) -> str:
+    """Get the path of a URL with every segment that looks like an ID replaced by ':id'."""
+    path = urlsplit(url).path
+    if not path:
+        return 'unknown'
+    return '/'.join(':id' if _ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+
+
+# Canvas IDs are numbers, Todoist IDs are numbers or long alphanumeric strings
+_ID_SEGMENT = re.compile(r'^(\d+|(?=.*\d)[A-Za-z0-9_-]{8,})$')
+
+
+def spawn(function, *args, **kwargs) -> gevent.Greenlet:
+    """
+    Spawn a greenlet that records its SQL statements and API calls in the current request's
+    metrics. Greenlets started with `gevent.spawn` begin with an empty context and are not measured.
+
+    :param function: The function to run in the greenlet.
+    :return Greenlet: The started greenlet.
+    """
+    return gevent.spawn(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+#################################################################
+#                                                               #
+#                     DATABASE AND REQUESTS                     #
+#                                                               #
+#################################################################
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current_metrics.get()
+    start = getattr(context, '_instrumentation_start', None)
+    if metrics is not None and start is not None:
+        metrics.record_query(time.perf_counter() - start)
+
+
+def instrument_engine(engine: Engine):
+    """
+    Record every SQL statement executed by an engine in the current request's metrics.
+
+    :param engine: The engine to instrument.
+    """
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _start_request():
+    _current_metrics.set(RequestMetrics())
+    REQUESTS_IN_FLIGHT.inc()
+
+
+def _finish_request(response: Response) -> Response:
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return response
+
+    # Label by the route rather than the path so that IDs don't create a series per request
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_DURATION.observe(metrics.elapsed(), request.method, route, response.status_code)
+
+    response.headers['Server-Timing'] = metrics.server_timing()
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        **metrics.to_dict(),
+    }))
+    return response
+
+
+def _teardown_request(exception):
+    if _current_metrics.get() is not None:
+        REQUESTS_IN_FLIGHT.inc(amount=-1)
+    _current_metrics.set(None)
+
+
+def init_app(app: Flask):
+    """
+    Measure every request handled by an app.
+
+    :param app: The Flask app.
+    """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
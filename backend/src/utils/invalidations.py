@@ -0,0 +1,157 @@
+"""
+This file shares the Canvas cache invalidations of the Canvas webhook between server processes.
+Every process has its own cache of Canvas results, but only one of them receives a webhook event, so
+the course that changed is also stored in the cache_invalidations table.
+
+Before a process handles a request, it reads the invalidations that are newer than the last one it
+saw, at most every CACHE_INVALIDATION_POLL_INTERVAL seconds, and removes the same cached results.
+Invalidations are kept for as long as Canvas results are cached, after which the results they are
+about have expired anyway.
+"""
+
+
+from datetime import timedelta
+import logging
+import time
+
+from flask import Flask
+from sqlalchemy import delete, func, insert, select
+
+import utils.canvas as canvas
+from utils.metrics import Counter
+from utils.models import CacheInvalidation, db
+from utils.settings import get_cache_invalidation_poll_interval, utc_now
+
+
+logger = logging.getLogger(__name__)
+
+# The most invalidations read in one poll
+BATCH_SIZE = 500
+# How many polls pass between two removals of expired invalidations
+PRUNE_EVERY = 60
+
+INVALIDATIONS_APPLIED = Counter('cache_invalidations_applied_total',
+                                'The number of Canvas cache invalidations of other server '
+                                'processes that were applied.')
+
+
+class InvalidationReader:
+    """
+    Reads the cache invalidations of other server processes and removes the cached results they
+    are about from this process.
+
+    :param poll_interval: The seconds between two reads of new invalidations. Defaults to
+    CACHE_INVALIDATION_POLL_INTERVAL.
+    """
+    def __init__(self, poll_interval: float | None = None):
+        self.poll_interval = poll_interval
+        # The ID of the newest invalidation that was read
+        self.cursor: int | None = None
+        # The IDs of the invalidations this process stored, which were applied already
+        self.own: set[int] = set()
+        self.last_poll: float | None = None
+        self.polls = 0
+
+    def poll(self) -> int:
+        """
+        Apply the invalidations stored by other processes since the last poll. The first poll only
+        finds the newest invalidation, since the caches of a new process are empty.
+
+        :return int: The number of invalidations applied.
+        """
+        if self.cursor is None:
+            self.cursor = db.session.execute(select(func.max(CacheInvalidation.id))).scalar() or 0
+            self.own.clear()
+            return 0
+
+        invalidations = db.session.execute(
+            select(CacheInvalidation).where(CacheInvalidation.id > self.cursor)
+            .order_by(CacheInvalidation.id).limit(BATCH_SIZE)
+        ).scalars().all()
+
+        applied = 0
+        for invalidation in invalidations:
+            self.cursor = invalidation.id
+            if invalidation.id in self.own:
+                self.own.discard(invalidation.id)
+                continue
+            canvas.invalidate_course(invalidation.course_id, invalidation.assignments)
+            applied += 1
+        INVALIDATIONS_APPLIED.inc(amount=applied)
+
+        self.polls += 1
+        if self.polls % PRUNE_EVERY == 0:
+            prune()
+        return applied
+
+    def poll_if_due(self):
+        """
+        Poll for new invalidations unless the last poll was less than the poll interval ago. Errors
+        are logged, the request goes on with the results this process has cached.
+        """
+        interval = self.poll_interval if self.poll_interval is not None \
+            else get_cache_invalidation_poll_interval()
+        now = time.monotonic()
+        if self.last_poll is not None and now - self.last_poll < interval:
+            return
+
+        self.last_poll = now
+        try:
+            # A full batch means more invalidations are waiting
+            while self.poll() == BATCH_SIZE:
+                pass
+        except Exception as ex:
+            db.session.rollback()
+            logger.warning('Could not read cache invalidations: %s', ex)
+
+
+# The cache invalidations of this process
+reader = InvalidationReader()
+
+
+def init_app(app: Flask):
+    """
+    Apply the cache invalidations of other server processes before the requests of an app.
+
+    :param app: The Flask app.
+    """
+    app.before_request(_apply_invalidations)
+
+
+def _apply_invalidations():
+    reader.poll_if_due()
+
+
+def invalidate_course(course_id: int, assignments: bool = True) -> int:
+    """
+    Remove every cached result about a course, see utils.canvas.invalidate_course, and have every
+    other server process remove them as well. Sharing the invalidation is best effort, a failure
+    is logged and the other processes keep their results until they expire.
+
+    :param course_id: The ID of the course that changed in Canvas.
+    :param assignments: Whether the course's assignments changed, rather than only submissions.
+    :return int: The number of cached results that were removed from this process.
+    """
+    removed = canvas.invalidate_course(course_id, assignments)
+    try:
+        result = db.session.execute(insert(CacheInvalidation).values(
+            course_id=course_id, assignments=assignments, created_at=utc_now()))
+        db.session.commit()
+        reader.own.add(result.inserted_primary_key[0])
+    except Exception as ex:
+        db.session.rollback()
+        logger.warning('Could not share the invalidation of course %s: %s', course_id, ex)
+    return removed
+
+
+def prune() -> int:
+    """
+    Remove the invalidations that are older than the Canvas cache time.
+
+    :return int: The number of invalidations removed.
+    """
+    cutoff = utc_now() - timedelta(seconds=canvas.get_setting('CANVAS_API_CACHE_TIME'))
+    result = db.session.execute(delete(CacheInvalidation)
+                                .where(CacheInvalidation.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
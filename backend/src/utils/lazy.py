@@ -0,0 +1,39 @@
+"""
+This file provides stand-ins for classes of SDKs that are slow to import, such as canvasapi and
+todoist_api_python, so that creating the app doesn't import them. The SDK is imported the first
+time the stand-in is called.
+"""
+
+
+import importlib
+
+
+class LazyClass:
+    """
+    Stands in for a class that is imported on first use. Calling the stand-in creates an instance
+    of the class, so `Canvas = LazyClass('canvasapi', 'Canvas')` can be used like the class itself.
+    Tests can still replace the stand-in with monkeypatch.
+
+    :param module: The name of the module that defines the class.
+    :param name: The name of the class.
+    """
+    def __init__(self, module: str, name: str):
+        self.module = module
+        self.name = name
+        self._cls = None
+
+    def load(self) -> type:
+        """
+        Import the class.
+
+        :return type: The class.
+        """
+        if self._cls is None:
+            self._cls = getattr(importlib.import_module(self.module), self.name)
+        return self._cls
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<LazyClass {self.module}.{self.name}>'
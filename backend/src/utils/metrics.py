@@ -0,0 +1,227 @@
+"""
+This file provides counters, gauges, and histograms for the backend's internals, and renders them in
+the Prometheus text exposition format for the `/metrics` endpoint. Modules define their metrics when
+they are imported; values that are already tracked elsewhere, such as cache sizes, are read by
+collectors when the metrics are rendered.
+"""
+
+
+from typing import Callable, NamedTuple
+import math
+
+import gevent
+
+
+class Family(NamedTuple):
+    """A metric and its samples, as returned by a collector."""
+    name: str
+    type: str
+    documentation: str
+    # (labels, value) pairs, histograms add the suffix of the sample name such as '_bucket'
+    samples: list[tuple]
+
+
+# Every metric and collector in this process, in the order they were defined
+_metrics = []
+_collectors = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        _metrics.append(self)
+
+    def _key(self, label_values: tuple) -> tuple:
+        if len(label_values) != len(self.labels):
+            raise ValueError(f'{self.name} expects the labels {self.labels}')
+        return tuple(str(value) for value in label_values)
+
+    def get(self, *label_values) -> float:
+        """
+        Get the current value for a set of labels.
+
+        :return float: The value, or 0 if nothing was recorded for the labels.
+        """
+        return self.values.get(self._key(label_values), 0)
+
+    def collect(self) -> list[Family]:
+        samples = [(dict(zip(self.labels, key)), value) for key, value in self.values.items()]
+        return [Family(self.name, self.type, self.documentation, samples)]
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, such as the number of calls to an API.
+    """
+    type = 'counter'
+
+    def inc(self, *label_values, amount: float = 1):
+        """
+        Increase the counter for a set of labels.
+
+        :param amount: How much to increase the counter by. Defaults to 1.
+        """
+        key = self._key(label_values)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, such as the number of requests in flight.
+    """
+    type = 'gauge'
+
+    def set(self, value: float, *label_values):
+        """
+        Set the gauge for a set of labels.
+
+        :param value: The new value.
+        """
+        self.values[self._key(label_values)] = value
+
+    def inc(self, *label_values, amount: float = 1):
+        """
+        Increase the gauge for a set of labels. Use a negative amount to decrease it.
+
+        :param amount: How much to increase the gauge by. Defaults to 1.
+        """
+        key = self._key(label_values)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """
+    Counts observations, such as request durations in seconds, in cumulative buckets.
+
+    :param buckets: The upper bounds of the buckets. An infinite bucket is always added.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, *label_values):
+        """
+        Record an observation for a set of labels.
+
+        :param value: The observed value.
+        """
+        key = self._key(label_values)
+        if key not in self.values:
+            # Bucket counts, then the sum and count of the observations
+            self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts, _, _ = state = self.values[key]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        state[1] += value
+        state[2] += 1
+
+    def get(self, *label_values) -> int:
+        """
+        Get the number of observations for a set of labels.
+
+        :return int: The number of observations.
+        """
+        state = self.values.get(self._key(label_values))
+        return state[2] if state else 0
+
+    def collect(self) -> list[Family]:
+        samples = []
+        for key, (counts, total, count) in self.values.items():
+            labels = dict(zip(self.labels, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append(({**labels, 'le': _format_value(bound)}, bucket_count, '_bucket'))
+            samples.append((labels, total, '_sum'))
+            samples.append((labels, count, '_count'))
+        return [Family(self.name, self.type, self.documentation, samples)]
+
+
+def register_collector(collect: Callable[[], list[Family]]):
+    """
+    Register a function that is called every time the metrics are rendered. Use it for values that
+    are already tracked somewhere else.
+
+    :param collect: A function returning a list of Family.
+    """
+    _collectors.append(collect)
+
+
+#################################################################
+#                                                               #
+#                         TEXT FORMAT                           #
+#                                                               #
+#################################################################
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_sample(name: str, labels: dict, value: float) -> str:
+    if not labels:
+        return f'{name} {_format_value(value)}'
+    label_text = ','.join(f'{label}="{_escape(str(label_value))}"'
+                          for label, label_value in labels.items())
+    return f'{name}{{{label_text}}} {_format_value(value)}'
+
+
+def render() -> str:
+    """
+    Render every metric in the Prometheus text exposition format.
+
+    :return str: The metrics, one sample per line.
+    """
+    families = [family for metric in _metrics for family in metric.collect()]
+    for collect in _collectors:
+        families.extend(collect())
+
+    lines = []
+    for family in families:
+        lines.append(f'# HELP {family.name} {_escape(family.documentation)}')
+        lines.append(f'# TYPE {family.name} {family.type}')
+        for labels, value, *suffix in family.samples:
+            lines.append(_format_sample(family.name + ''.join(suffix), labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+#################################################################
+#                                                               #
+#                            GEVENT                             #
+#                                                               #
+#################################################################
+
+
+def _collect_gevent() -> list[Family]:
+    threadpool = gevent.get_hub().threadpool
+    return [
+        Family('gevent_threadpool_max_threads', 'gauge',
+               'The maximum number of threads in the gevent hub threadpool.',
+               [({}, threadpool.maxsize)]),
+        Family('gevent_threadpool_threads', 'gauge',
+               'The number of threads currently in the gevent hub threadpool.',
+               [({}, threadpool.size)]),
+        Family('gevent_threadpool_tasks', 'gauge',
+               'The number of tasks queued or running in the gevent hub threadpool.',
+               [({}, len(threadpool))]),
+    ]
+
+
+register_collector(_collect_gevent)
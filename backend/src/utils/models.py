@@ -1,17 +1,22 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from argon2 import PasswordHasher
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum, Index, JSON
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Enum, Index, JSON, DateTime
 from sqlalchemy.inspection import inspect
 from sqlalchemy.orm import relationship
 import string
 import random
 import enum
 
+from utils.settings import get_argon2_time_cost, get_argon2_memory_cost, get_argon2_parallelism
+
 
 # Initialize SQLAlchemy and Password hasher
 db = SQLAlchemy()
-password_hasher = PasswordHasher()
+# Hashes made with other parameters are replaced when their user signs in, see utils/passwords.py
+password_hasher = PasswordHasher(time_cost=get_argon2_time_cost(),
+                                 memory_cost=get_argon2_memory_cost(),
+                                 parallelism=get_argon2_parallelism())
 
 
 # Class Model to return queries as dict
@@ -137,12 +142,22 @@ class Task(ModelMixin, db.Model):
         :type canvas_id: str
         :param todoist_id: The ID of the task in Todoist, if one exists.
         :type todoist_id: str | None
-        :param due_date: The due date of the task in format `%Y-%m-%d %H:%M:%S`, if one exists.
-        :type due_date: str | None
+        :param due_date: The due date of the task in UTC, if one exists.
+        :type due_date: datetime | None
+        :param custom_due_date: A due date set by the user for an undated assignment, in UTC.
+        :type custom_due_date: datetime | None
     """
     __tablename__ = 'tasks'
     __table_args__ = (
         Index('idx_canvas_owner', 'canvas_id', 'owner'),
+        # Lookups by Todoist ID, such as toggling a task
+        Index('idx_task_owner_todoist', 'owner', 'todoist_id'),
+        # Lookups of a user's Canvas tasks, such as descriptions and custom due dates
+        Index('idx_task_owner_canvas', 'owner', 'canvas_id'),
+        # Due date ranges, such as upcoming non-Canvas tasks
+        Index('idx_task_owner_due', 'owner', 'due_date'),
+        # Lookups by Todoist ID alone, such as from the Todoist webhook
+        Index('idx_task_todoist', 'todoist_id'),
     )
 
     # Table primary key
@@ -154,12 +169,13 @@ class Task(ModelMixin, db.Model):
     # IDs for Canvas and Todoist
     canvas_id = Column(Integer, unique=False, nullable=True)
     todoist_id = Column(String(15), unique=False, nullable=True)
-    due_date = Column(String(12), unique=False, nullable=True)
+    # Due dates are stored as naive UTC datetimes
+    due_date = Column(DateTime, unique=False, nullable=True)
     # If it's complete
     status = Column(Enum(TaskStatus), nullable=False, default=TaskStatus.Incomplete)
 
     # Custom due date set by user
-    custom_due_date = Column(String(20), unique=False, nullable=True)
+    custom_due_date = Column(DateTime, unique=False, nullable=True)
 
     # Name and description for if the task is not associated with a Canvas assignment
     name = Column(String(100), unique=False, nullable=True)
@@ -184,12 +200,16 @@ class SubTask(ModelMixin, db.Model):
         :type description: str | None
         :param status: The status of the SubTask, as defined by `SubTaskStatus`.
         :type status: SubTaskStatus
-        :param due_date: The due date of the task in format `%Y-%m-%d %H:%M:%S`, if one exists.
-        :type due_date: str | None
+        :param due_date: The due date of the subtask in UTC, if one exists.
+        :type due_date: datetime | None
     """
     __tablename__ = 'subtasks'
     __table_args__ = (
         Index('idx_task_id_owner', 'task_id', 'owner'),
+        # Lookups by Todoist ID and syncing a user's subtasks
+        Index('idx_subtask_owner_todoist', 'owner', 'todoist_id'),
+        # Lookups by Todoist ID alone, such as from the Todoist webhook
+        Index('idx_subtask_todoist', 'todoist_id'),
     )
 
     id = Column(Integer, primary_key=True)
@@ -199,7 +219,7 @@ class SubTask(ModelMixin, db.Model):
     name = Column(String(150), nullable=False)
     description = Column(String(500), nullable=True)
     status = Column(Enum(TaskStatus), nullable=False, default=TaskStatus.Incomplete)
-    due_date = Column(String(12), nullable=True)
+    due_date = Column(DateTime, nullable=True)
     shared_with = Column(JSON, nullable=True, default=[])
 
     task = relationship('Task', back_populates='subtasks')
@@ -222,6 +242,10 @@ class SubTaskShared(ModelMixin, db.Model):
     __tablename__ = 'shared_subtasks'
     __table_args__ = (
         Index('idx_owner_subtask_id', 'subtask_id', 'owner'),
+        # Lookups of every subtask shared with a user
+        Index('idx_shared_owner_subtask', 'owner', 'subtask_id'),
+        # Lookups of the original of a shared copy, such as from the Todoist webhook
+        Index('idx_shared_todoist', 'todoist_id'),
     )
     id = Column(Integer, primary_key=True)
     owner = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -301,3 +325,151 @@ class Filter(ModelMixin, db.Model):
     id = Column(Integer, primary_key=True)
     owner = Column(Integer, ForeignKey('users.id'), nullable=False)
     filter = Column(String(50), nullable=False)
+
+
+class SyncState(ModelMixin, db.Model):
+    """
+    A new SyncState instance. Tracks what the sync daemon needs to schedule background syncs for a
+    user.
+        :param id: The auto-generated table ID.
+        :type id: int
+        :param owner: The ID of the User that is synced.
+        :type owner: int
+        :param canvas_token_server: The Canvas token encrypted with the server secret, if the user
+        opted into background syncing.
+        :type canvas_token_server: str | None
+        :param last_synced_at: When the last background sync started, in UTC.
+        :type last_synced_at: datetime | None
+        :param last_change_at: When a sync last changed something in Todoist, in UTC.
+        :type last_change_at: datetime | None
+        :param next_due_at: The due date of the user's next assignment, in UTC.
+        :type next_due_at: datetime | None
+        :param last_error: A short description of the last failed sync, if the last sync failed.
+        :type last_error: str | None
+        :param pending_at: When a Canvas webhook last reported a change to the user's courses, in
+        UTC. The user is synced right away if this is after the last sync.
+        :type pending_at: datetime | None
+    """
+    __tablename__ = 'sync_states'
+
+    id = Column(Integer, primary_key=True)
+    owner = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), unique=True,
+                   nullable=False)
+    canvas_token_server = Column(String(200), nullable=True)
+    last_synced_at = Column(DateTime, nullable=True)
+    last_change_at = Column(DateTime, nullable=True)
+    next_due_at = Column(DateTime, nullable=True)
+    last_error = Column(String(200), nullable=True)
+    pending_at = Column(DateTime, nullable=True)
+
+
+class SyncCourse(ModelMixin, db.Model):
+    """
+    A new SyncCourse instance. Records which Canvas courses a background sync found for a user, so
+    that Canvas webhooks can schedule a sync for every user in a course that changed.
+        :param id: The auto-generated table ID.
+        :type id: int
+        :param owner: The ID of the User that is synced.
+        :type owner: int
+        :param course_id: The ID of the course in Canvas.
+        :type course_id: int
+    """
+    __tablename__ = 'sync_courses'
+    __table_args__ = (
+        db.UniqueConstraint('owner', 'course_id'),
+        # Lookups of every user in a course, when a Canvas webhook reports a change
+        Index('idx_sync_course', 'course_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    owner = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    course_id = Column(Integer, nullable=False)
+
+
+class UserEvent(ModelMixin, db.Model):
+    """
+    A new UserEvent instance. An update for a user's dashboard, which is sent to their open event
+    streams. Events are kept for EVENT_RETENTION seconds so that streams can catch up after
+    reconnecting.
+        :param id: The auto-generated table ID, which orders the events.
+        :type id: int
+        :param owner: The ID of the User the event is for.
+        :type owner: int
+        :param kind: The kind of the event, such as 'subtask', 'invitation', or 'sync'.
+        :type kind: str
+        :param data: The JSON data of the event.
+        :type data: dict
+        :param created_at: When the event was published, in UTC.
+        :type created_at: datetime
+    """
+    __tablename__ = 'user_events'
+    __table_args__ = (
+        # Events a stream missed while it reconnected
+        Index('idx_user_event_owner', 'owner', 'id'),
+        # Removing expired events
+        Index('idx_user_event_created', 'created_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    owner = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    kind = Column(String(20), nullable=False)
+    data = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
+class UserSession(ModelMixin, db.Model):
+    """
+    A new UserSession instance. The API keys of a signed in session, encrypted with a random secret
+    that only the session's cookie holds, so that every worker process can serve the session.
+        :param id: The auto-generated table ID.
+        :type id: int
+        :param owner: The ID of the User that signed in.
+        :type owner: int
+        :param secret_hash: The SHA-256 hash of the session's secret, which identifies the session.
+        :type secret_hash: str
+        :param canvas_token_session: The Canvas token, encrypted with the session's secret.
+        :type canvas_token_session: str
+        :param todoist_token_session: The Todoist token, encrypted with the session's secret.
+        :type todoist_token_session: str
+        :param created_at: When the user signed in, in UTC.
+        :type created_at: datetime
+    """
+    __tablename__ = 'user_sessions'
+    __table_args__ = (
+        # Signing out of every session
+        Index('idx_user_session_owner', 'owner'),
+        # Removing expired sessions
+        Index('idx_user_session_created', 'created_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    owner = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    secret_hash = Column(String(64), unique=True, nullable=False)
+    canvas_token_session = Column(String(200), nullable=False)
+    todoist_token_session = Column(String(200), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
+class CacheInvalidation(ModelMixin, db.Model):
+    """
+    A new CacheInvalidation instance. A Canvas course whose cached results were removed because the
+    Canvas webhook reported a change, so that every other server process removes them as well.
+        :param id: The auto-generated table ID, which orders the invalidations.
+        :type id: int
+        :param course_id: The ID of the course in Canvas.
+        :type course_id: int
+        :param assignments: Whether the course's assignments changed, rather than only submissions.
+        :type assignments: bool
+        :param created_at: When the change was reported, in UTC.
+        :type created_at: datetime
+    """
+    __tablename__ = 'cache_invalidations'
+    __table_args__ = (
+        # Removing expired invalidations
+        Index('idx_cache_invalidation_created', 'created_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    course_id = Column(Integer, nullable=False)
+    assignments = Column(Boolean, nullable=False)
+    created_at = Column(DateTime, nullable=False)
@@ -0,0 +1,119 @@
+"""
+This file keeps password hashes in line with the argon2 parameters set by ARGON2_TIME_COST,
+ARGON2_MEMORY_COST, and ARGON2_PARALLELISM, and measures which parameters fit a latency budget.
+
+Hashing a password costs as much as verifying it, so a hash made with other parameters is replaced
+after its user signed in, in gevent's threadpool, instead of making the sign in wait for it.
+"""
+
+
+import logging
+import statistics
+import time
+
+from argon2 import PasswordHasher
+from flask import Flask
+import gevent
+
+from utils.instrumentation import spawn
+from utils.metrics import Counter, Histogram
+import utils.models as models
+import utils.queries as queries
+
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_HASH_DURATION = Histogram('password_hash_duration_seconds',
+                                   'How long hashing a password with argon2 takes.',
+                                   buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0))
+PASSWORD_REHASHES = Counter('password_rehashes_total',
+                            'The number of outdated password hashes that were replaced, by '
+                            'outcome.', ('outcome',))
+
+
+def hash_password(hasher: PasswordHasher, password: str) -> str:
+    """
+    Hash a password and record how long it took.
+
+    :param hasher: The hasher with the argon2 parameters to use.
+    :param password: The password to hash.
+    :return str: The encoded hash, which includes its parameters.
+    """
+    start = time.perf_counter()
+    password_hash = hasher.hash(password)
+    PASSWORD_HASH_DURATION.observe(time.perf_counter() - start)
+    return password_hash
+
+
+def rehash_in_background(app: Flask, user_id: int, old_hash: str, password: str)\
+        -> gevent.Greenlet:
+    """
+    Replace a user's outdated password hash with one made with the current parameters. The hash is
+    computed in a thread of gevent's threadpool, so that it blocks neither the request nor other
+    greenlets. A failure is logged, the hash is then replaced at the next sign in.
+
+    :param app: The app, whose database the hash is stored in.
+    :param user_id: The ID of the user.
+    :param old_hash: The user's current hash, which the password was verified against.
+    :param password: The user's password.
+    :return Greenlet: The greenlet replacing the hash.
+    """
+    return spawn(_rehash, app, user_id, old_hash, password)
+
+
+def _rehash(app: Flask, user_id: int, old_hash: str, password: str):
+    try:
+        new_hash = gevent.get_hub().threadpool.apply(hash_password,
+                                                     (models.password_hasher, password))
+        with app.app_context():
+            # The password may have changed while hashing, then the new hash is discarded
+            outcome = 'replaced' if queries.replace_password_hash(user_id, old_hash, new_hash) \
+                else 'discarded'
+    except Exception as ex:
+        logger.warning('Could not rehash the password of user %s: %s', user_id, ex)
+        outcome = 'error'
+    PASSWORD_REHASHES.inc(outcome)
+
+
+def measure(hasher: PasswordHasher, samples: int = 5) -> float:
+    """
+    Measure how long hashing a password takes with some argon2 parameters on this machine.
+
+    :param hasher: The hasher with the parameters to measure.
+    :param samples: The number of hashes to time.
+    :return float: The median duration in seconds.
+    """
+    durations = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.hash('calibration password')
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def calibrate(budget: float, memory_cost: int, parallelism: int, samples: int = 5,
+              max_time_cost: int = 20) -> tuple[int, list[tuple[int, float]]]:
+    """
+    Find the highest argon2 time cost whose hashes take at most a latency budget on this machine.
+    The memory cost and parallelism are kept, because they should be chosen from the memory and
+    cores available to each sign in.
+
+    :param budget: The longest a hash may take, in seconds.
+    :param memory_cost: The memory to use, in KiB.
+    :param parallelism: The number of threads to use.
+    :param samples: The number of hashes to time for each time cost.
+    :param max_time_cost: The highest time cost to try.
+    :return tuple[int, list[tuple[int, float]]]: The chosen time cost, which is at least 1 even if
+    that exceeds the budget, and the median duration of every time cost that was measured.
+    """
+    chosen = 1
+    measurements = []
+    for time_cost in range(1, max_time_cost + 1):
+        duration = measure(PasswordHasher(time_cost=time_cost, memory_cost=memory_cost,
+                                          parallelism=parallelism), samples)
+        measurements.append((time_cost, duration))
+        if duration > budget:
+            break
+        chosen = time_cost
+
+    return (chosen, measurements)
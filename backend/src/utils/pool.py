@@ -0,0 +1,146 @@
+"""
+This file configures the database connection pool and records how long requests wait for a
+connection and how many connections are in use.
+"""
+
+
+import logging
+import time
+from gevent import monkey
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from utils.metrics import Family, register_collector
+from utils.settings import get_db_pool_size, get_db_max_overflow, get_db_pool_timeout, \
+    get_db_pool_recycle, is_db_pool_pre_ping_enabled
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """
+    Aggregates connection pool checkouts so that wait times and pool usage can be reported.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget every recorded checkout."""
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def record_checkout(self, wait: float, in_use: int):
+        """
+        Record a successful checkout.
+
+        :param wait: How many seconds the checkout waited for a connection.
+        :param in_use: The number of connections in use after the checkout.
+        """
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.in_use = in_use
+        self.peak_in_use = max(self.peak_in_use, in_use)
+
+    def report(self) -> dict:
+        """
+        Summarize the recorded checkouts.
+
+        :return dict: The number of checkouts and timeouts, the average and maximum wait in seconds,
+        and the current and peak number of connections in use.
+        """
+        return {
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'avg_wait': self.total_wait / self.checkouts if self.checkouts else 0.0,
+            'max_wait': self.max_wait,
+            'in_use': self.in_use,
+            'peak_in_use': self.peak_in_use,
+        }
+
+
+# Statistics for every instrumented pool in this process
+pool_stats = PoolStats()
+
+
+def _collect_pool_metrics() -> list[Family]:
+    stats = pool_stats
+    return [
+        Family('db_pool_checkouts_total', 'counter',
+               'The number of database connections checked out of the pool.',
+               [({}, stats.checkouts)]),
+        Family('db_pool_timeouts_total', 'counter',
+               'The number of times a request gave up waiting for a database connection.',
+               [({}, stats.timeouts)]),
+        Family('db_pool_wait_seconds_total', 'counter',
+               'The total time spent waiting for a database connection.',
+               [({}, stats.total_wait)]),
+        Family('db_pool_max_wait_seconds', 'gauge',
+               'The longest time spent waiting for a database connection.',
+               [({}, stats.max_wait)]),
+        Family('db_pool_in_use', 'gauge', 'The number of database connections in use.',
+               [({}, stats.in_use)]),
+        Family('db_pool_peak_in_use', 'gauge',
+               'The highest number of database connections in use at once.',
+               [({}, stats.peak_in_use)]),
+    ]
+
+
+register_collector(_collect_pool_metrics)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A QueuePool that records checkout wait times and the number of connections in use. QueuePool
+    waits on `threading` primitives, which gevent patches in app.py, so a greenlet that waits for a
+    connection yields to the other greenlets instead of blocking the whole process.
+    """
+    stats = pool_stats
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            conn = super().connect()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+
+        self.stats.record_checkout(time.perf_counter() - start, self.checkedout())
+        return conn
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self.stats.in_use = self.checkedout()
+
+
+def get_engine_options(database_uri: str) -> dict:
+    """
+    Get the SQLAlchemy engine options for a database, based on the DB_POOL_* environment variables.
+    In-memory SQLite databases only exist for a single connection, so they keep their default pool.
+
+    :param database_uri: The URI of the database.
+    :return dict: The options to pass to `create_engine`, or SQLALCHEMY_ENGINE_OPTIONS.
+    """
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+
+    if not monkey.is_module_patched('threading'):
+        logger.warning('threading is not patched by gevent, waiting for a database connection '
+                       'will block every greenlet')
+
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': get_db_pool_size(),
+        'max_overflow': get_db_max_overflow(),
+        'pool_timeout': get_db_pool_timeout(),
+        # MariaDB closes connections that are idle for longer than wait_timeout
+        'pool_recycle': get_db_pool_recycle(),
+        'pool_pre_ping': is_db_pool_pre_ping_enabled(),
+    }
@@ -0,0 +1,321 @@
+"""
+This file provides an opt-in profiler for single requests. A request is profiled if its X-Profile
+header holds the admin token, or at random with the rate set by PROFILE_SAMPLE_RATE. The profile
+is taken with pyinstrument if it is installed, or with cProfile otherwise, and records how often
+the request's greenlet switched out and how long it waited to be resumed. Profiles are kept in a
+directory that only holds the most recent PROFILE_LIMIT profiles.
+"""
+
+
+import cProfile
+import hmac
+import json
+import marshal
+import os
+import random
+import re
+import time
+import uuid
+
+import greenlet
+
+from utils.settings import get_admin_token, get_profile_sample_rate, get_profile_dir, \
+    get_profile_limit
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# Profile IDs are generated by new_profile_id, anything else is rejected before touching the disk
+_PROFILE_ID = re.compile(r'^\d+-[0-9a-f]{8}$')
+
+
+#################################################################
+#                                                               #
+#                       GREENLET SWITCHES                       #
+#                                                               #
+#################################################################
+
+
+class SwitchCounter:
+    """
+    Counts how often a greenlet switches to another greenlet and how long it waits before it is
+    switched back to. Waiting includes I/O, such as Canvas calls, and other requests' greenlets.
+
+    :param glet: The greenlet to watch.
+    """
+    def __init__(self, glet: greenlet.greenlet):
+        self.greenlet = glet
+        self.switches = 0
+        self.waited = 0.0
+        self._switched_out = None
+
+    def on_switch(self, origin: greenlet.greenlet, target: greenlet.greenlet):
+        if origin is self.greenlet and target is not self.greenlet:
+            self.switches += 1
+            self._switched_out = time.perf_counter()
+        elif target is self.greenlet and self._switched_out is not None:
+            self.waited += time.perf_counter() - self._switched_out
+            self._switched_out = None
+
+
+# Greenlet -> SwitchCounter of every request being profiled
+_counters = {}
+_previous_trace = None
+
+
+def _trace(event: str, args: tuple):
+    if event in ('switch', 'throw'):
+        origin, target = args
+        for glet in (origin, target):
+            counter = _counters.get(glet)
+            if counter is not None:
+                counter.on_switch(origin, target)
+
+    if _previous_trace is not None:
+        _previous_trace(event, args)
+
+
+def watch_switches(glet: greenlet.greenlet) -> SwitchCounter:
+    """
+    Start counting the switches of a greenlet. Call `unwatch_switches` when done.
+
+    :param glet: The greenlet to watch.
+    :return SwitchCounter: The counter for the greenlet.
+    """
+    global _previous_trace
+    if not _counters:
+        _previous_trace = greenlet.settrace(_trace)
+
+    counter = SwitchCounter(glet)
+    _counters[glet] = counter
+    return counter
+
+
+def unwatch_switches(counter: SwitchCounter):
+    """
+    Stop counting the switches of a greenlet. The greenlet trace is removed once no greenlet is
+    watched.
+
+    :param counter: The counter returned by `watch_switches`.
+    """
+    global _previous_trace
+    _counters.pop(counter.greenlet, None)
+    if not _counters and greenlet.gettrace() is _trace:
+        greenlet.settrace(_previous_trace)
+        _previous_trace = None
+
+
+#################################################################
+#                                                               #
+#                            STORAGE                            #
+#                                                               #
+#################################################################
+
+
+def new_profile_id() -> str:
+    """
+    Generate the ID of a new profile. IDs start with the time so that sorting them sorts the
+    profiles from oldest to newest.
+
+    :return str: The profile ID.
+    """
+    return f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+
+
+def save_profile(profile_id: str, data: bytes, extension: str, metadata: dict):
+    """
+    Store a profile and delete the oldest profiles beyond PROFILE_LIMIT.
+
+    :param profile_id: The ID of the profile, from `new_profile_id`.
+    :param data: The profile.
+    :param extension: The file extension of the profile, such as 'html' or 'prof'.
+    :param metadata: A description of the profiled request.
+    """
+    directory = get_profile_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(directory, f'{profile_id}.{extension}'), 'wb') as file:
+        file.write(data)
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as file:
+        json.dump({'id': profile_id, 'file': f'{profile_id}.{extension}', **metadata}, file)
+
+    for old_id in list_profile_ids()[:-get_profile_limit()]:
+        for name in os.listdir(directory):
+            if name.startswith(old_id + '.'):
+                os.remove(os.path.join(directory, name))
+
+
+def list_profile_ids() -> list[str]:
+    """
+    List the IDs of every stored profile, from oldest to newest.
+
+    :return list[str]: The profile IDs.
+    """
+    directory = get_profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name.removesuffix('.json') for name in os.listdir(directory)
+                  if name.endswith('.json'))
+
+
+def get_profile_metadata(profile_id: str) -> dict | None:
+    """
+    Get the description of a stored profile.
+
+    :param profile_id: The ID of the profile.
+    :return dict | None: The metadata of the profile, or None if it doesn't exist.
+    """
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(get_profile_dir(), f'{profile_id}.json'), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def get_profile_path(profile_id: str) -> str | None:
+    """
+    Get the path of a stored profile.
+
+    :param profile_id: The ID of the profile.
+    :return str | None: The path of the profile file, or None if it doesn't exist.
+    """
+    metadata = get_profile_metadata(profile_id)
+    if metadata is None:
+        return None
+    path = os.path.join(get_profile_dir(), metadata['file'])
+    return path if os.path.isfile(path) else None
+
+
+#################################################################
+#                                                               #
+#                           MIDDLEWARE                          #
+#                                                               #
+#################################################################
+
+
+def should_profile(environ: dict) -> bool:
+    """
+    Determine if a request should be profiled.
+
+    :param environ: The WSGI environment of the request.
+    :return bool: True if the X-Profile header holds the admin token or the request was sampled.
+    """
+    header = environ.get(PROFILE_HEADER)
+    if header:
+        token = get_admin_token()
+        return token is not None and hmac.compare_digest(header.encode(), token.encode())
+
+    sample_rate = get_profile_sample_rate()
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+class _Profiler:
+    """Wraps pyinstrument or cProfile so that both produce a downloadable file."""
+    def __init__(self):
+        if pyinstrument is not None:
+            self.profiler = pyinstrument.Profiler()
+            self.extension = 'html'
+        else:
+            self.profiler = cProfile.Profile()
+            self.extension = 'prof'
+
+    def start(self):
+        if pyinstrument is not None:
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self) -> bytes:
+        if pyinstrument is not None:
+            self.profiler.stop()
+            return self.profiler.output_html().encode()
+
+        self.profiler.disable()
+        # Marshal the stats the same way dump_stats does, so that pstats and snakeviz can load them
+        self.profiler.create_stats()
+        return marshal.dumps(self.profiler.stats)
+
+
+class ProfilingMiddleware:
+    """
+    WSGI middleware that profiles the requests selected by `should_profile`. The ID of the stored
+    profile is returned in the X-Profile-Id header, and the profile can be downloaded from
+    `/admin/profiles/<id>`. The profiler samples the whole thread, so code run by other greenlets
+    while the request waits also shows up. The greenlet switch counts tell how long that was.
+
+    :param wsgi_app: The WSGI app to profile.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        # Profilers hook the whole thread, which every greenlet shares, so only one request is
+        # profiled at a time
+        self.profiling = False
+
+    def __call__(self, environ: dict, start_response):
+        # Don't profile downloading profiles. Event streams are left out in _profile.
+        if self.profiling or environ.get('PATH_INFO', '').startswith('/admin/') \
+                or not should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+
+        self.profiling = True
+        try:
+            return self._profile(environ, start_response)
+        finally:
+            self.profiling = False
+
+    def _profile(self, environ: dict, start_response):
+
+        profile_id = new_profile_id()
+        status_code = []
+        streaming = []
+
+        def profiled_start_response(status, headers, exc_info=None):
+            status_code.append(int(status.split(' ', 1)[0]))
+            headers = list(headers)
+            # Event streams never finish, so they are sent as they are and not profiled
+            if any(name.lower() == 'content-type' and value.startswith('text/event-stream')
+                   for name, value in headers):
+                streaming.append(True)
+            else:
+                headers.append((PROFILE_ID_HEADER, profile_id))
+            return start_response(status, headers, exc_info)
+
+        profiler = _Profiler()
+        counter = watch_switches(greenlet.getcurrent())
+        start = time.perf_counter()
+        profiler.start()
+        response = None
+        try:
+            response = self.wsgi_app(environ, profiled_start_response)
+            if streaming:
+                return response
+            # Consume the response so that the whole request is profiled
+            body = list(response)
+        finally:
+            # The body was consumed here, so closing the response is up to the middleware, which
+            # runs the callbacks registered with call_on_close and closes files sent with send_file
+            if not streaming and hasattr(response, 'close'):
+                response.close()
+            data = profiler.stop()
+            duration = time.perf_counter() - start
+            unwatch_switches(counter)
+
+        save_profile(profile_id, data, profiler.extension, {
+            'method': environ.get('REQUEST_METHOD'),
+            'path': environ.get('PATH_INFO'),
+            'status': status_code[0] if status_code else None,
+            'duration_ms': round(duration * 1000, 1),
+            'greenlet_switches': counter.switches,
+            'greenlet_wait_ms': round(counter.waited * 1000, 1),
+            'profiler': 'pyinstrument' if pyinstrument is not None else 'cProfile',
+            'created_at': time.time(),
+        })
+        return body
@@ -1,11 +1,22 @@
+import gevent
+import utils.breakers as breakers
+import utils.canvas as canvas_api
+import utils.deadlines as deadlines
 import utils.models as models
-from utils.crypto import decrypt_str, encrypt_str, get_todo_secret
-from canvasapi import Canvas
-from todoist_api_python.api import TodoistAPI
+from utils.crypto import decrypt_str, encrypt_str, get_todo_secret, KDF_HKDF
+from utils.instrumentation import record_call
+from utils.sharing import get_all_shared_todoist_status
+from utils.lazy import LazyClass
 from requests.exceptions import HTTPError
-from sqlalchemy import select, or_
+from sqlalchemy import delete, insert, literal, select, update, or_, func
+from sqlalchemy.engine import Row
 import sqlalchemy.exc
 from datetime import datetime
+from utils.settings import utc_now, format_local_date, get_todoist_url
+
+# The SDKs are only needed to check the tokens of new users
+Canvas = LazyClass('canvasapi', 'Canvas')
+TodoistAPI = LazyClass('todoist_api_python.api', 'TodoistAPI')
 
 #########################################################################
 #                                                                       #
@@ -25,23 +36,18 @@ def add_user(username: str, password: str, canvas_token: str, todoist_token: str
     :return bool: Returns True if the user was added, False otherwise.
     """
     try:
-        # Check that the Canvas token is valid
-        canvas_user = Canvas('https://uncc.instructure.com', canvas_token).get_current_user()
+        # Check that the Canvas token is valid, within the request's budget like other Canvas calls
+        canvas = canvas_api.guard_client(Canvas(canvas_api.get_setting('CANVAS_BASE_URL'),
+                                                canvas_token))
+        canvas_user = canvas.get_current_user()
         canvas_id = getattr(canvas_user, 'id', None)
         canvas_name = getattr(canvas_user, 'name', None)
         if canvas_id is None or canvas_name is None:
             return False
 
         # Check that the Todoist token is valid
-        try:
-            # This will almost certainly fail, but the way it fails will show if the token is valid
-            # If it happens to succeed, then that means the token is valid
-            TodoistAPI(todoist_token).get_task(task_id='0')
-        except HTTPError as ex:
-            # 401 indicates Forbidden, API key is bad
-            # Non-401 error indicates that the API key is good
-            if ex.response.status_code == 401:
-                return False
+        if not _is_valid_todoist_token(todoist_token):
+            return False
 
         # This Canvas user is already associated with an existing user (prevents multiple account
         # with different tokens)
@@ -50,7 +56,7 @@ def add_user(username: str, password: str, canvas_token: str, todoist_token: str
 
         # Encrypt canvas and todoist token with password
         canvas_token_password = encrypt_str(canvas_token, password).to_bytes()
-        todoist_token_password = encrypt_str(todoist_token, get_todo_secret()).to_bytes()
+        todoist_token_password = encrypt_str(todoist_token, get_todo_secret(), KDF_HKDF).to_bytes()
 
         # Hash the password
         pw_hash = models.password_hasher.hash(password)
@@ -68,6 +74,55 @@ def add_user(username: str, password: str, canvas_token: str, todoist_token: str
         return False
 
 
+def _is_valid_todoist_token(todoist_token: str) -> bool:
+    """
+    Check a Todoist token. The Todoist SDK doesn't use the sessions of utils.todoist, so the call is
+    bounded by the current request's budget, guarded by the Todoist circuit breaker, and recorded in
+    the request's metrics here instead.
+
+    :param todoist_token: The Todoist API key.
+    :return bool: True if Todoist accepted the token.
+    """
+    url = f'{get_todoist_url()}/rest/v2/tasks/0'
+    timeout = gevent.Timeout(deadlines.get_timeout('todoist'),
+                             deadlines.DeadlineExceeded('Checking the Todoist token took too long'))
+    with timeout, breakers.TODOIST.call() as outcome, record_call('todoist', url) as call:
+        try:
+            # This will almost certainly fail, but the way it fails will show if the token is valid
+            # If it happens to succeed, then that means the token is valid
+            TodoistAPI(todoist_token).get_task(task_id='0')
+            call.status = outcome.status = 200
+        except HTTPError as ex:
+            call.status = outcome.status = ex.response.status_code
+
+    # 401 indicates Forbidden, API key is bad
+    # Non-401 error indicates that the API key is good
+    return call.status != 401
+
+
+def replace_password_hash(user_id: int, old_hash: str, new_hash: str) -> bool:
+    """
+    Replace a user's password hash with a hash of the same password. Nothing is replaced if the
+    password was changed since the old hash was read.
+
+    :param user_id: The ID of the user.
+    :param old_hash: The hash that was read.
+    :param new_hash: The new hash of the same password.
+    :return bool: True if the hash was replaced, False otherwise.
+    """
+    try:
+        result = models.db.session.execute(
+            update(models.User).where(models.User.id == user_id, models.User.password == old_hash)
+            .values(password=new_hash)
+        )
+        models.db.session.commit()
+        return result.rowcount == 1
+    except Exception:
+        models.db.session.rollback()
+
+        return False
+
+
 def does_username_exists(username: str) -> bool:
     """
     Check if a user with the given username exists in the database.
@@ -171,8 +226,8 @@ def get_user_by_login_id(login_id: str, dict=False) -> models.User | dict | None
 
 
 def add_or_return_task(owner: models.User | int, canvas_id: str | None,
-                       todoist_id: str | None = None, due_date: str = None, name: str | None = None,
-                       desc: str | None = None) -> models.Task:
+                       todoist_id: str | None = None, due_date: datetime | None = None,
+                       name: str | None = None, desc: str | None = None) -> models.Task:
     """
     Add a new task to the database or return the task if it already exists.
 
@@ -181,6 +236,7 @@ def add_or_return_task(owner: models.User | int, canvas_id: str | None,
     API.
     :param todoist_id: The ID of the task in Todoist, if a task exists. If no ID is provided, no
     Todoist task is linked to the Canvas task at this time.
+    :param due_date: The due date of the task as a naive UTC datetime, if one exists.
     :return Task: The Task that was added.
     :raises Exception: If the Task could not be added to the database.
     """
@@ -239,12 +295,12 @@ def update_task_description(task: models.Task, description: str) -> None:
         raise e
 
 
-def set_task_duedate(task: models.Task, due_date: str) -> None:
+def set_task_duedate(task: models.Task, due_date: datetime) -> None:
     """
     Update a task to have a new due_date in the database
 
     :param Task: A Task in the database.
-    :param due_date: The updated due_date of the task.
+    :param due_date: The updated due_date of the task, as a naive UTC datetime.
     """
     try:
         task.due_date = due_date
@@ -296,23 +352,45 @@ def get_task_by_canvas_id(owner: models.User, canvas_id: str, dict=False)\
     return task
 
 
-def get_non_canvas_tasks(owner: models.User, dict=False) -> list[models.Task] | list[dict]:
+def get_tasks_by_canvas_ids(owner: models.User, canvas_ids: list[int]) -> dict[int, models.Task]:
+    """
+    Retrieve the tasks of several Canvas assignments with a single query.
+
+    :param owner: The owner of the tasks.
+    :param canvas_ids: The Canvas IDs of the assignments.
+    :return dict[int, Task]: The tasks by Canvas ID. Assignments without a task are left out.
+    """
+    if not canvas_ids:
+        return {}
+
+    tasks = models.Task.query.filter(
+        models.Task.owner == owner.id,
+        models.Task.canvas_id.in_(canvas_ids)
+    ).all()
+    return {task.canvas_id: task for task in tasks}
+
+
+def get_non_canvas_tasks(owner: models.User, dict=False, until: datetime | None = None)\
+        -> list[models.Task] | list[dict]:
     """
     Retrieves all tasks that do not have a Canvas ID and that are due in the future.
 
     :param owner: The owner of the tasks.
     :param dict: If True, return the tasks as a list of dictionaries. Defaults to False.
+    :param until: If given, only return tasks due at or before this naive UTC datetime.
     :return list[Task] or list[dict]: A list of Tasks that have no Canvas ID or a list of the Tasks
     as dicts if dict is True.
     """
-
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    tasks = models.Task.query.filter(
+    # The due date window is a range scan over idx_task_owner_due
+    filters = [
         models.Task.owner == owner.id,
+        models.Task.due_date > utc_now(),
         models.Task.canvas_id == None,  # noqa: E711, using 'is' breaks comparison here
-        models.Task.due_date > now
-    ).all()
+    ]
+    if until is not None:
+        filters.append(models.Task.due_date <= until)
+
+    tasks = models.Task.query.filter(*filters).order_by(models.Task.due_date).all()
     if dict:
         return [dict(task) for task in tasks]
     return tasks
@@ -342,14 +420,20 @@ def get_task_or_subtask_by_todoist_id(owner: models.User, todoist_id: str, dict=
         else:
             return task
 
-    # Check for a matching subtask
+    # Check for a matching subtask owned by the user
     subtask = models.SubTask.query.filter(
-        or_(
-            models.SubTask.owner == owner.id,
-            models.SubTask.shared_with.contains([owner.id])
-        ),
+        models.SubTask.owner == owner.id,
         models.SubTask.todoist_id == todoist_id
     ).first()
+
+    # Check for a matching subtask shared with the user
+    if subtask is None:
+        subtask = models.SubTask.query\
+            .join(models.SubTaskShared, models.SubTaskShared.subtask_id == models.SubTask.id)\
+            .filter(
+                models.SubTaskShared.owner == owner.id,
+                models.SubTask.todoist_id == todoist_id
+            ).first()
     if subtask:
         if dict:
             return dict(subtask)
@@ -360,6 +444,79 @@ def get_task_or_subtask_by_todoist_id(owner: models.User, todoist_id: str, dict=
     return None
 
 
+def get_statuses_by_todoist_ids(owner: models.User, todoist_ids: list[str]) -> list[Row]:
+    """
+    Retrieve the status of several tasks and subtasks by their Todoist IDs with a single query.
+    Like `get_task_or_subtask_by_todoist_id`, subtasks shared with the owner are included.
+
+    :param owner: The owner of the tasks.
+    :param todoist_ids: The Todoist IDs of the tasks and subtasks.
+    :return list[Row]: A row with the kind ('task' or 'subtask'), id, todoist_id, and status of
+    every task and subtask that was found.
+    """
+    if not todoist_ids:
+        return []
+
+    tasks = select(literal('task').label('kind'), models.Task.id, models.Task.todoist_id,
+                   models.Task.status)\
+        .where(models.Task.owner == owner.id, models.Task.todoist_id.in_(todoist_ids))
+    shared_with_owner = select(models.SubTaskShared.subtask_id)\
+        .where(models.SubTaskShared.owner == owner.id)
+    subtasks = select(literal('subtask'), models.SubTask.id, models.SubTask.todoist_id,
+                      models.SubTask.status)\
+        .where(models.SubTask.todoist_id.in_(todoist_ids),
+               or_(models.SubTask.owner == owner.id, models.SubTask.id.in_(shared_with_owner)))
+    return models.db.session.execute(tasks.union_all(subtasks)).all()
+
+
+def set_task_statuses(changes: list[tuple[str, int, models.TaskStatus]]) -> bool:
+    """
+    Set the status of several tasks and subtasks with one update per table and status, and a
+    single commit.
+
+    :param changes: The kind ('task' or 'subtask'), ID, and new status of every task and subtask.
+    :return bool: True if the statuses were saved, False otherwise.
+    """
+    try:
+        for kind, model in (('task', models.Task), ('subtask', models.SubTask)):
+            for status in models.TaskStatus:
+                ids = [id for change_kind, id, change_status in changes
+                       if change_kind == kind and change_status == status]
+                if ids:
+                    models.db.session.execute(
+                        update(model).where(model.id.in_(ids)).values(status=status)
+                    )
+        models.db.session.commit()
+        return True
+    except Exception:
+        models.db.session.rollback()
+
+    return False
+
+
+def get_by_todoist_id(todoist_id: str) -> models.Task | models.SubTask | None:
+    """
+    Retrieve the task or subtask of any user by its Todoist ID. Todoist IDs are unique across
+    users, so this is meant for callers that don't know the owner, such as the Todoist webhook.
+
+    :param todoist_id: The ID of the task, subtask, or copy of a shared subtask in Todoist.
+    :return Task | SubTask | None: The task or subtask, the original subtask for a copy of a shared
+    subtask, or None if no task has the Todoist ID.
+    """
+    task = models.Task.query.filter(models.Task.todoist_id == todoist_id).first()
+    if task is not None:
+        return task
+
+    subtask = models.SubTask.query.filter(models.SubTask.todoist_id == todoist_id).first()
+    if subtask is not None:
+        return subtask
+
+    return models.SubTask.query\
+        .join(models.SubTaskShared, models.SubTaskShared.subtask_id == models.SubTask.id)\
+        .filter(models.SubTaskShared.todoist_id == todoist_id)\
+        .first()
+
+
 def get_descriptions_by_canvas_ids(owner: models.User, canvas_ids: list[int])\
         -> dict[int, str | None]:
     """
@@ -371,47 +528,54 @@ def get_descriptions_by_canvas_ids(owner: models.User, canvas_ids: list[int])\
     :return dict[int, str|None]: Returns a dict that maps between the ids and the descriptions. If a
     task has no description, its entry is None.
     """
-    canvas_tasks: list[models.Task] = models.Task.query.filter(
-        models.Task.canvas_id.in_(canvas_ids),
-        models.Task.owner == owner.id
+    # Only select the needed columns so rows aren't loaded as full Tasks
+    canvas_tasks = models.db.session.execute(
+        select(models.Task.canvas_id, models.Task.description).where(
+            models.Task.owner == owner.id,
+            models.Task.canvas_id.in_(canvas_ids)
+        )
     ).all()
 
     description_lookup = dict()
-    for task in canvas_tasks:
-        description_lookup[task.canvas_id] = task.description
+    for canvas_id, description in canvas_tasks:
+        description_lookup[canvas_id] = description
 
     return description_lookup
 
 
-def get_custom_due_dates_by_ids(owner: models.User, canvas_ids: list[int]) -> dict[int, str | None]:
+def get_custom_due_dates_by_ids(owner: models.User, canvas_ids: list[int])\
+        -> dict[int, datetime | None]:
     """
     Retrieves any custom due dates set by the user for the given tasks' Canvas IDs and returns a
     dict that maps between the ids and the due dates.
 
     :param owner: The owner of the tasks.
     :param canvas_ids: The Canvas IDs of the tasks that should have custom due dates retrieved.
-    :return dict[int, str|None]: Returns a dict that maps between the ids and the due dates. If a
-    task has no custom due date, its entry is None.
-    """
-    due_dates: list[models.Task] = models.Task.query.filter(
-        models.Task.canvas_id.in_(canvas_ids),
-        models.Task.owner == owner.id
+    :return dict[int, datetime|None]: Returns a dict that maps between the ids and the due dates,
+    as naive UTC datetimes. If a task has no custom due date, its entry is None.
+    """
+    # Only select the needed columns so rows aren't loaded as full Tasks
+    due_dates = models.db.session.execute(
+        select(models.Task.canvas_id, models.Task.custom_due_date).where(
+            models.Task.owner == owner.id,
+            models.Task.canvas_id.in_(canvas_ids)
+        )
     ).all()
 
     due_date_lookup = dict()
-    for task in due_dates:
-        due_date_lookup[task.canvas_id] = task.custom_due_date
+    for canvas_id, custom_due_date in due_dates:
+        due_date_lookup[canvas_id] = custom_due_date
 
     return due_date_lookup
 
 
-def set_custom_due_date_by_id(owner: models.User, canvas_id: int, due_date: str):
+def set_custom_due_date_by_id(owner: models.User, canvas_id: int, due_date: datetime):
     """
     Sets a custom due date for the task with the given Canvas ID.
 
     :param owner: The owner of the task.
     :param canvas_id: The Canvas ID of the task to update.
-    :param due_date: The custom due date to set.
+    :param due_date: The custom due date to set, as a naive UTC datetime.
     :raises ValueError: If the given Canvas ID doesn't correspond to a task.
     """
     task = get_task_by_canvas_id(owner, canvas_id)
@@ -438,16 +602,23 @@ def sync_task_status(owner: models.User, open_task_ids: list[int])\
     :return list[str] | None: A list of shared subtasks that were found, or None if an error
     occurred.
     """
-    # Handle tasks
+    # Handle tasks with two bulk updates instead of loading every task
+    open_ids = list(open_task_ids)
     try:
-        tasks: list[tuple[models.Task]] = models.db.session\
-            .execute(select(models.Task).where(models.Task.owner == owner.id))
-        for (task,) in tasks:
-            if task.todoist_id in open_task_ids:
-                task.status = models.TaskStatus.Incomplete
-            else:
-
-                task.status = models.TaskStatus.Completed
+        models.db.session.execute(
+            update(models.Task)
+            .where(models.Task.owner == owner.id, models.Task.todoist_id.in_(open_ids))
+            .values(status=models.TaskStatus.Incomplete)
+        )
+        models.db.session.execute(
+            update(models.Task)
+            .where(
+                models.Task.owner == owner.id,
+                or_(models.Task.todoist_id == None,  # noqa: E711
+                    models.Task.todoist_id.not_in(open_ids))
+            )
+            .values(status=models.TaskStatus.Completed)
+        )
         models.db.session.commit()
     except Exception:
 
@@ -480,93 +651,6 @@ def sync_task_status(owner: models.User, open_task_ids: list[int])\
         return None
 
 
-def compose_invitations(invitations: list[models.SubTaskInvitation]) -> list[dict]:
-    """
-    Compose a list of invitations into a list of dictionaries.
-
-    :param invitations: A list of subtask invitations.
-    :return list[dict]: A list of dictionaries representing the subtask invitations.
-    """
-    title = 'You received a subtask invitation!'
-    subtask_ids = [invitation.subtask_id for invitation in invitations]
-    owner_ids = [invitation.owner for invitation in invitations]
-
-    # Fetch all required SubTask and User data in bulk
-    subtasks = {subtask.id: subtask.name
-                for subtask in models.SubTask.query.filter(models.SubTask.id.in_(subtask_ids))}
-    owners = {user.id: user.username
-              for user in models.User.query.filter(models.User.id.in_(owner_ids))}
-
-    return [{
-            'title': title,
-            'author_name': owners[invitation.owner],
-            'subtask_name': subtasks[invitation.subtask_id],
-            'invitation_id': invitation.id
-            }
-            for invitation in invitations
-            ]
-
-
-def get_all_shared_todoist_status(owner: models.User) -> list[tuple[str, models.TaskStatus]]:
-    """
-    Retrieve all shared subtasks for a user and return the todoist ID and status of all
-    shared subtask with owner as the recipient
-
-    :param owner: The owner of the shared subtasks.
-    :return tuple[str, TaskStatus]: The todoist ID and status of all shared subtask with owner as
-    the recipient.
-    """
-    todoist_status = []
-    shared_subtasks = models.SubTaskShared.query.filter_by(owner=owner.id).all()
-    for shared_subtask in shared_subtasks:
-        todoist_status.append((shared_subtask.todoist_id, shared_subtask.subtask.status))
-    return todoist_status
-
-
-def get_shared_subtasks(owner: models.User, dict=False) -> list[models.SubTask] | list[dict]:
-    """
-    Retrieve all shared subtasks for a user.
-
-    :param owner: The owner of the shared subtasks.
-    :param dict: If True, return the subtasks as a list of dictionaries. Defaults to False.
-    :return list[SubTask] or list[dict]: A list of shared subtasks or a list of dictionaries
-    if dict is True.
-    """
-    shared_subtasks = models.SubTaskShared.query.filter_by(owner=owner.id).all()
-    if dict:
-        return [subtask.to_dict() for subtask in shared_subtasks]
-    return shared_subtasks
-
-
-def get_shared_users_subtask(subtask: models.SubTask) -> list[int, str] | None:
-    """
-    This function retrieve all the users a shared subtask has been shared with (including the
-    original owner).
-    Together with their todoist ID for the shared subtask in their todoist.
-
-    :param subtask: The subtask to retrieve the shared users for.
-    :return list[int, str] | None: A list of user IDs and their todoist ID for the shared subtask.
-    """
-    user_todoist = []
-    shared_subtasks = models.SubTaskShared.query.filter_by(subtask_id=subtask.id).all()
-    for shared_subtask in shared_subtasks:
-        user_todoist.append((shared_subtask.owner, shared_subtask.todoist_id))
-    user_todoist.append((subtask.owner, subtask.todoist_id))
-
-    return user_todoist
-
-
-def get_original_from_shared_subtask(owner: models.User) -> models.SubTask | None:
-    """
-    Get all the subtasks that have been shared with the user, and of those shared subtasks returns
-    the original subtask.
-    """
-    shared_subtasks = models.SubTaskShared.query.filter_by(owner=owner.id).all()
-    for shared_subtask in shared_subtasks:
-        if shared_subtask.todoist_id is None:
-            return models.SubTask.query.get(shared_subtask.subtask_id)
-    return None
-
 #########################################################################
 #                                                                       #
 #                               SUBTASKS                                #
@@ -577,7 +661,7 @@ def get_original_from_shared_subtask(owner: models.User) -> models.SubTask | Non
 def create_subtask(owner: models.User, task_id: int, subtask_name: str, todoist_id: int = None,
                    subtask_desc: str = None,
                    subtask_status: models.TaskStatus = models.TaskStatus.Incomplete,
-                   subtask_date: str = None) -> int | bool:
+                   subtask_date: datetime = None) -> int | bool:
     """
     Creates a subtask under a specified task for the current user in the database.
 
@@ -587,7 +671,8 @@ def create_subtask(owner: models.User, task_id: int, subtask_name: str, todoist_
         subtask_name (str): The name of the subtask (must not be empty or blank).
         subtask_desc (str, optional): A description of the subtask. Defaults to None.
         subtask_status (SubStatus): The status of the subtask (defaults to Incomplete).
-        subtask_date (str, optional): The due date for the subtask. Defaults to None.
+        subtask_date (datetime, optional): The due date for the subtask as a naive UTC datetime.
+        Defaults to None.
 
     Returns:
         int | False: The ID of the subtask if the subtask was successfully created, False otherwise.
@@ -605,6 +690,40 @@ def create_subtask(owner: models.User, task_id: int, subtask_name: str, todoist_
     return False
 
 
+def create_subtasks(owner: models.User, subtasks: list[dict]) -> list[int] | bool:
+    """
+    Creates several subtasks for the current user in the database with a single write. Their IDs
+    are read back with a single query by their Todoist IDs, which are unique.
+
+    :param owner: The user creating the subtasks. Only the owner of a task can add subtasks.
+    :param subtasks: The subtasks, each a dict with the task_id, todoist_id, name, description,
+    status, and due_date arguments of `create_subtask`. Every subtask must have a Todoist ID.
+    :return list[int] | False: The IDs of the subtasks in the order they were given, or False if the
+    subtasks couldn't be created.
+    """
+    if not subtasks:
+        return []
+
+    rows = [{'owner': owner.id, 'task_id': subtask['task_id'], 'todoist_id': subtask['todoist_id'],
+             'name': subtask['name'], 'description': subtask['description'],
+             'status': subtask['status'], 'due_date': subtask['due_date'], 'shared_with': []}
+            for subtask in subtasks]
+    try:
+        # Without RETURNING, the rows are sent as one executemany
+        models.db.session.execute(insert(models.SubTask), rows)
+        subtask_ids = dict(models.db.session.execute(
+            select(models.SubTask.todoist_id, models.SubTask.id).where(
+                models.SubTask.owner == owner.id,
+                models.SubTask.todoist_id.in_([row['todoist_id'] for row in rows]))
+        ).all())
+        models.db.session.commit()
+        return [subtask_ids[row['todoist_id']] for row in rows]
+    except Exception:
+        models.db.session.rollback()
+
+    return False
+
+
 def get_subtask_by_id(owner: models.User, id: int, dict=False) -> models.SubTask | dict | None:
     """
     Retrieve a subtask by its database ID.
@@ -670,7 +789,7 @@ def get_subtasks_for_tasks(current_user: models.User, canvas_ids: list[str],
                 'name': name,
                 'description': description,
                 'status': status.value or 0,
-                'due_date': due_date,
+                'due_date': format_local_date(due_date, '%Y-%m-%d %H:%M'),
                 'todoist_id': todoist_id,
                 'author': current_user.id == owner
             })
@@ -718,142 +837,6 @@ def invert_subtask_status(subtask: models.SubTask) -> bool:
     return False
 
 
-def send_subtask_invitation(owner: models.User, recipient: models.User, subtask_id: int) -> bool:
-    """
-    Send an invitation to a user to join a subtask.
-
-    :param owner: The owner of the subtask.
-    :param recipient: The recipient of the invitation.
-    :param task_id: The ID of the task.
-    :param subtask_id: The ID of the subtask.
-    :return bool: True if the invitation was sent, False otherwise.
-    """
-    try:
-
-        subtask = models.SubTask.query.get(subtask_id)
-        if not recipient or not subtask or subtask.owner != owner.id:
-            return False
-
-        recipient_has_task = models.Task.query.filter_by(owner=recipient.id,
-                                                         canvas_id=subtask.task.canvas_id).first()
-        if not recipient_has_task:
-            return False
-
-        task_invitation = models.SubTaskInvitation(owner=owner.id, recipient_id=recipient.id,
-                                                   subtask_id=subtask.id)
-        models.db.session.add(task_invitation)
-        models.db.session.commit()
-        return True
-    except Exception:
-
-        models.db.session.rollback()
-        return False
-
-
-def get_subtask_invitations(recipient: models.User, dict=False)\
-        -> list[models.SubTaskInvitation] | list[dict]:
-    """
-    Retrieve all subtask invitations for a user.
-
-    :param recipient: The recipient of the subtask invitations.
-    :param dict: If True, return the subtask invitations as a list of dictionaries. Defaults to
-    False.
-    :return list[TaskInvitation] or list[dict]: A list of subtask invitations or a list of
-    dictionaries if dict is True.
-    """
-    invitations = models.SubTaskInvitation.query.filter_by(recipient_id=recipient.id).all()
-    if dict:
-        return [invitation.to_dict() for invitation in invitations]
-    return invitations
-
-
-def get_invitation_original(owner: models.User, invitation_id: int) -> models.User | None:
-    """
-    Get the original owner that an invitation is associated with.
-
-    :param owner: The recipient of the invitation.
-    :param invitation_id: The ID of the invitation.
-    :return SubTask | None: The original subtask that the invitation is associated with.
-    """
-    invitation = models.SubTaskInvitation.query.get(invitation_id)
-    if not invitation or invitation.recipient_id != owner.id:
-        return None
-    return models.User.query.get(invitation.owner)
-
-
-def get_invitation_subtask(owner: models.User, invitation_id: int) -> models.SubTask | None:
-    """
-    Get the subtask that an invitation is associated with.
-
-    :param owner: The recipient of the invitation.
-    :param invitation_id: The ID of the invitation.
-    :return SubTask | None: The subtask that the invitation is associated with.
-    """
-    invitation = models.SubTaskInvitation.query.get(invitation_id)
-    if not invitation or invitation.recipient_id != owner.id:
-
-        return None
-    return models.SubTask.query.get(invitation.subtask_id)
-
-
-def get_recipient_task(owner: models.User, subtask: models.SubTask) -> models.Task | None:
-    """
-    Get the task that a subtask is associated with for the recipient.
-
-    :param owner: The recipient of the subtask.
-    :param subtask: The subtask to get the task for.
-    :return Task | None: The task that the subtask is associated with.
-    """
-    return models.Task.query.filter_by(owner=owner.id, canvas_id=subtask.task.canvas_id).first()
-
-
-def create_shared_subtask(owner: models.User, subtask: models.SubTask, todoist_id: str) -> bool:
-    """
-    Creates a shared subtask.
-
-    :param owner: The person accepnting or regecting the invitation.
-    :param subtask: The subtask to share.
-    :param todoist_id: The todoist ID of the shared subtask.
-    :return bool: True if the shared subtask was created, False otherwise.
-    """
-    try:
-        shared_subtask = models.SubTaskShared(owner=owner.id, subtask_id=subtask.id,
-                                              todoist_original=subtask.todoist_id,
-                                              todoist_id=todoist_id)
-
-        # SQLalchemy is stupid and doesn't realize a change was made to a list
-        original_subtask = models.SubTask.query.get(subtask.id)
-        new_list = original_subtask.shared_with.copy()
-        new_list.append(owner.id)
-        original_subtask.shared_with = new_list
-
-        models.db.session.add(original_subtask)
-        models.db.session.add(shared_subtask)
-        models.db.session.commit()
-
-        return True
-    except Exception:
-        models.db.session.rollback()
-
-        return False
-
-
-def delete_invitation(owner: models.User, invitation_id: int) -> None:
-    """
-    Delete a subtask invitation.
-
-    :param owner: The recipient of the invitation.
-    :param invitation_id: The ID of the invitation.
-    """
-    try:
-        invitation = models.SubTaskInvitation.query.get(invitation_id)
-        if invitation and invitation.recipient_id == owner.id:
-            models.db.session.delete(invitation)
-            models.db.session.commit()
-    except Exception:
-        models.db.session.rollback()
-
-
 #########################################################################
 #                                                                       #
 #                           CONVERSATION                                #
@@ -1020,6 +1003,262 @@ def delete_filter(owner: models.User, filter: str) -> int | None:
     return None
 
 
+#########################################################################
+#                                                                       #
+#                               SESSIONS                                #
+#                                                                       #
+#########################################################################
+
+
+def add_user_session(owner: models.User, secret_hash: str, canvas_token_session: bytes,
+                     todoist_token_session: bytes) -> bool:
+    """
+    Store the API keys of a new session, encrypted with the session's secret.
+
+    :param owner: The user that signed in.
+    :param secret_hash: The SHA-256 hash of the session's secret.
+    :param canvas_token_session: The Canvas token encrypted with the session's secret.
+    :param todoist_token_session: The Todoist token encrypted with the session's secret.
+    :return bool: True if the session was stored, False otherwise.
+    """
+    try:
+        models.db.session.add(models.UserSession(owner=owner.id, secret_hash=secret_hash,
+                                                 canvas_token_session=canvas_token_session,
+                                                 todoist_token_session=todoist_token_session,
+                                                 created_at=utc_now()))
+        models.db.session.commit()
+        return True
+    except Exception:
+        models.db.session.rollback()
+
+        return False
+
+
+def get_user_session(owner: models.User, secret_hash: str, created_after: datetime)\
+        -> models.UserSession | None:
+    """
+    Retrieve a session of a user that didn't expire yet.
+
+    :param owner: The user the session belongs to.
+    :param secret_hash: The SHA-256 hash of the session's secret.
+    :param created_after: Sessions created before this time, in UTC, have expired.
+    :return UserSession | None: The session, or None if it doesn't exist or expired.
+    """
+    return models.db.session.execute(
+        select(models.UserSession).where(models.UserSession.owner == owner.id,
+                                         models.UserSession.secret_hash == secret_hash,
+                                         models.UserSession.created_at >= created_after)
+    ).scalar_one_or_none()
+
+
+def delete_user_sessions(owner: models.User, secret_hash: str | None = None) -> int:
+    """
+    Delete one session of a user, or all of them.
+
+    :param owner: The user the sessions belong to.
+    :param secret_hash: The SHA-256 hash of the secret of the session to delete. Deletes every
+    session of the user if None.
+    :return int: The number of sessions deleted.
+    """
+    query = delete(models.UserSession).where(models.UserSession.owner == owner.id)
+    if secret_hash is not None:
+        query = query.where(models.UserSession.secret_hash == secret_hash)
+    result = models.db.session.execute(query)
+    models.db.session.commit()
+    return result.rowcount
+
+
+def delete_expired_user_sessions(created_before: datetime) -> int:
+    """
+    Delete the sessions of every user that expired.
+
+    :param created_before: Sessions created before this time, in UTC, have expired.
+    :return int: The number of sessions deleted.
+    """
+    result = models.db.session.execute(
+        delete(models.UserSession).where(models.UserSession.created_at < created_before))
+    models.db.session.commit()
+    return result.rowcount
+
+
+#########################################################################
+#                                                                       #
+#                                 SYNC                                  #
+#                                                                       #
+#########################################################################
+
+
+def get_sync_state(owner: models.User) -> models.SyncState | None:
+    """
+    Retrieve the background sync state for a user.
+
+    :param owner: The user to retrieve the sync state for.
+    :return SyncState | None: The user's sync state, or None if the user was never scheduled.
+    """
+    return models.SyncState.query.filter_by(owner=owner.id).first()
+
+
+def store_sync_credentials(owner: models.User, canvas_token_server: bytes) -> bool:
+    """
+    Store the user's Canvas token encrypted with the server secret so that the sync daemon can sync
+    the user while they are signed out.
+
+    :param owner: The user the token belongs to.
+    :param canvas_token_server: The Canvas token encrypted with the server secret.
+    :return bool: True if the token was stored, False otherwise.
+    """
+    try:
+        state = get_sync_state(owner)
+        if state is None:
+            state = models.SyncState(owner=owner.id)
+            models.db.session.add(state)
+        state.canvas_token_server = canvas_token_server
+        models.db.session.commit()
+        return True
+    except Exception:
+        models.db.session.rollback()
+
+        return False
+
+
+def store_server_tokens(owner: models.User, todoist_token_password: bytes | None = None,
+                        canvas_token_server: bytes | None = None) -> bool:
+    """
+    Replace the user's tokens that are encrypted with the server secret, for example after they were
+    re-encrypted in the current ciphertext format.
+
+    :param owner: The user the tokens belong to.
+    :param todoist_token_password: The Todoist token encrypted with the server secret, if it
+    changed.
+    :param canvas_token_server: The Canvas token encrypted with the server secret, if it changed.
+    :return bool: True if the tokens were stored, False otherwise.
+    """
+    try:
+        if todoist_token_password is not None:
+            owner.todoist_token_password = todoist_token_password
+        if canvas_token_server is not None:
+            get_sync_state(owner).canvas_token_server = canvas_token_server
+        models.db.session.commit()
+        return True
+    except Exception:
+        models.db.session.rollback()
+
+        return False
+
+
+def get_sync_candidates() -> list[tuple[models.User, models.SyncState]]:
+    """
+    Retrieve every user that has a Canvas token stored for background syncing, together with their
+    sync state.
+
+    :return list[tuple[User, SyncState]]: The users that can be synced and their sync states.
+    """
+    rows = models.db.session.execute(
+        select(models.User, models.SyncState)
+        .join(models.SyncState, models.SyncState.owner == models.User.id)
+        .where(models.SyncState.canvas_token_server != None)  # noqa: E711
+    ).all()
+    return [(user, state) for user, state in rows]
+
+
+def get_next_due_date(owner: models.User | int) -> datetime | None:
+    """
+    Get the due date of the user's next task that is not yet due.
+
+    :param owner: The User or the ID of the User who owns the tasks.
+    :return datetime | None: The next due date as a naive UTC datetime, or None if no task is due
+    in the future.
+    """
+    owner = getattr(owner, 'id', owner)
+
+    return models.db.session.execute(
+        select(func.min(models.Task.due_date))
+        .where(models.Task.owner == owner, models.Task.due_date > utc_now())
+    ).scalar()
+
+
+def update_sync_state(owner: models.User | int, synced_at: datetime, changed: bool,
+                      next_due_at: datetime | None, error: str | None = None) -> None:
+    """
+    Record the outcome of a background sync for a user.
+
+    :param owner: The User or the ID of the User that was synced.
+    :param synced_at: When the sync started, as a naive UTC datetime.
+    :param changed: If the sync changed anything in Todoist.
+    :param next_due_at: The due date of the user's next task, as a naive UTC datetime.
+    :param error: A description of the error if the sync failed, None otherwise.
+    """
+    owner = getattr(owner, 'id', owner)
+    try:
+        state = models.SyncState.query.filter_by(owner=owner).first()
+        if state is None:
+            return
+        state.last_synced_at = synced_at
+        if changed:
+            state.last_change_at = synced_at
+        if error is None:
+            state.next_due_at = next_due_at
+        state.last_error = error[:200] if error else None
+        models.db.session.commit()
+    except Exception:
+        models.db.session.rollback()
+
+
+def update_sync_courses(owner: models.User | int, course_ids: list[int]) -> None:
+    """
+    Record the Canvas courses that a background sync found for a user, replacing the previous ones.
+
+    :param owner: The User or the ID of the User that was synced.
+    :param course_ids: The IDs of the user's courses in Canvas.
+    """
+    owner = getattr(owner, 'id', owner)
+    try:
+        models.SyncCourse.query.filter_by(owner=owner).delete()
+        models.db.session.add_all(models.SyncCourse(owner=owner, course_id=int(course_id))
+                                  for course_id in set(course_ids))
+        models.db.session.commit()
+    except Exception:
+        models.db.session.rollback()
+
+
+def mark_sync_pending(course_id: int | None = None, assignment_id: int | None = None,
+                      canvas_user_id: int | None = None) -> int:
+    """
+    Schedule a background sync right away for every user affected by a change in Canvas: the users
+    whose last sync found the course, who have a task for the assignment, or who are the Canvas
+    user.
+
+    :param course_id: The ID of the course that changed in Canvas.
+    :param assignment_id: The ID of the assignment that changed in Canvas.
+    :param canvas_user_id: The ID of the Canvas user whose submission changed.
+    :return int: The number of users that were scheduled.
+    """
+    conditions = []
+    if course_id is not None:
+        conditions.append(models.SyncState.owner.in_(
+            select(models.SyncCourse.owner).where(models.SyncCourse.course_id == course_id)))
+    if assignment_id is not None:
+        conditions.append(models.SyncState.owner.in_(
+            select(models.Task.owner).where(models.Task.canvas_id == assignment_id)))
+    if canvas_user_id is not None:
+        conditions.append(models.SyncState.owner.in_(
+            select(models.User.id).where(models.User.canvas_id == str(canvas_user_id))))
+    if not conditions:
+        return 0
+
+    try:
+        result = models.db.session.execute(
+            update(models.SyncState)
+            .where(or_(*conditions), models.SyncState.canvas_token_server != None)  # noqa: E711
+            .values(pending_at=utc_now())
+        )
+        models.db.session.commit()
+        return result.rowcount
+    except Exception:
+        models.db.session.rollback()
+        return 0
+
+
 #########################################################################
 #                                                                       #
 #    THIS IS PURELY FOR TESTING DON'T USE THESE FUNCTIONS OTHERWISE     #
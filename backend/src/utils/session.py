@@ -1,13 +1,94 @@
 """
 This file provides utilities for reading data from the session. This includes functions that rely on
 application-specific state, such as the `User` class.
+
+The API keys of a session are stored in the database, encrypted with a random secret that only the
+session's cookie holds. Every worker process can therefore serve every session, and sessions survive
+reloading the server, while the database alone is not enough to decrypt the keys.
 """
 
 
+from datetime import timedelta
+import hashlib
+import secrets
+
 from flask import session
 from flask_login import current_user
 
-from utils.crypto import decrypt_str
+from utils.crypto import decrypt_str, encrypt_str, KDF_HKDF
+import utils.models as models
+import utils.queries as queries
+from utils.settings import get_session_lifetime, utc_now
+
+
+# The session key that holds the secret the session's API keys are encrypted with
+SECRET_KEY = 'api_key_secret'
+
+
+def _hash_secret(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def store_api_keys(user: models.User, canvas_token: str, todoist_token: str) -> bool:
+    """
+    Encrypt the API keys of a user that signed in with a new secret, store the secret in the
+    session, and the encrypted keys in the database. Expired sessions of every user are removed.
+
+    :param user: The user that signed in.
+    :param canvas_token: The user's Canvas API key.
+    :param todoist_token: The user's Todoist API key.
+    :return bool: True if the keys were stored, False otherwise.
+    """
+    # The secret is random, so keys are derived from it with HKDF instead of a slow password hash
+    secret = secrets.token_urlsafe(32)
+    stored = queries.add_user_session(user, _hash_secret(secret),
+                                      encrypt_str(canvas_token, secret, KDF_HKDF).to_bytes(),
+                                      encrypt_str(todoist_token, secret, KDF_HKDF).to_bytes())
+    if not stored:
+        return False
+
+    session[SECRET_KEY] = secret
+    queries.delete_expired_user_sessions(utc_now() - timedelta(seconds=get_session_lifetime()))
+    return True
+
+
+def load_api_keys(user: models.User) -> bool:
+    """
+    Load the encrypted API keys of the current session into `user.canvas_token_session` and
+    `user.todoist_token_session`.
+
+    :param user: The user the session belongs to.
+    :return bool: True if the keys were loaded, False if the session has none or expired.
+    """
+    secret = session.get(SECRET_KEY)
+    if secret is None:
+        return False
+
+    user_session = queries.get_user_session(
+        user, _hash_secret(secret), utc_now() - timedelta(seconds=get_session_lifetime()))
+    if user_session is None:
+        return False
+
+    user.canvas_token_session = user_session.canvas_token_session
+    user.todoist_token_session = user_session.todoist_token_session
+    return True
+
+
+def remove_api_keys(user: models.User, every_session: bool = False) -> int:
+    """
+    Remove the API keys of the current session of a user, or of all their sessions.
+
+    :param user: The user the sessions belong to.
+    :param every_session: Whether to remove the keys of every session of the user.
+    :return int: The number of sessions whose keys were removed.
+    """
+    if every_session:
+        return queries.delete_user_sessions(user)
+
+    secret = session.pop(SECRET_KEY, None)
+    if secret is None:
+        return 0
+    return queries.delete_user_sessions(user, _hash_secret(secret))
 
 
 def decrypt_api_keys() -> tuple[str, str]:
@@ -15,19 +96,19 @@ def decrypt_api_keys() -> tuple[str, str]:
     Decrypts the API keys for the current user. Returns them as (canvas_key, todoist_key).
 
     :return tuple[str, str]: The Canvas API key and the Todoist API key.
-    :raises ValueError: If session does not have an _id or current_user has no encrypted API keys.
+    :raises ValueError: If session does not have a secret or current_user has no encrypted API keys.
     """
-    # If the session doesn't have an ID, can't decrypt keys
-    if '_id' not in session:
+    # If the session doesn't have a secret, can't decrypt keys
+    if SECRET_KEY not in session:
         raise ValueError
-    session_id = session['_id']
+    secret = session[SECRET_KEY]
 
     # If current user doesn't have API keys encrypted w/ session key, can't decrypt keys
     if current_user.canvas_token_session is None or current_user.todoist_token_session is None:
         raise ValueError
 
-    canvas_token = decrypt_str(current_user.canvas_token_session, session_id)
-    todoist_token = decrypt_str(current_user.todoist_token_session, session_id)
+    canvas_token = decrypt_str(current_user.canvas_token_session, secret)
+    todoist_token = decrypt_str(current_user.todoist_token_session, secret)
 
     return (canvas_token, todoist_token)
 
@@ -37,19 +118,19 @@ def decrypt_canvas_key() -> str:
     Decrypts the Canvas API keys for the current user.
 
     :returns str: The Canvas API key.
-    :raises ValueError: If session does not have an _id or current_user has no encrypted Canvas API
-    key.
+    :raises ValueError: If session does not have a secret or current_user has no encrypted Canvas
+    API key.
     """
-    # If the session doesn't have an ID, can't decrypt key
-    if '_id' not in session:
+    # If the session doesn't have a secret, can't decrypt key
+    if SECRET_KEY not in session:
         raise ValueError
-    session_id = session['_id']
+    secret = session[SECRET_KEY]
 
     # If current user doesn't have a Canvas API key encrypted w/ session key, can't decrypt key
     if current_user.canvas_token_session is None:
         raise ValueError
 
-    return decrypt_str(current_user.canvas_token_session, session_id)
+    return decrypt_str(current_user.canvas_token_session, secret)
 
 
 def decrypt_todoist_key() -> str:
@@ -57,16 +138,16 @@ def decrypt_todoist_key() -> str:
     Decrypts the Todoist API keys for the current user.
 
     :returns str: The Todoist API key.
-    :raises ValueError: If session does not have an _id or current_user has no encrypted Todoist API
-    key.
+    :raises ValueError: If session does not have a secret or current_user has no encrypted Todoist
+    API key.
     """
-    # If the session doesn't have an ID, can't decrypt key
-    if '_id' not in session:
+    # If the session doesn't have a secret, can't decrypt key
+    if SECRET_KEY not in session:
         raise ValueError
-    session_id = session['_id']
+    secret = session[SECRET_KEY]
 
     # If current user doesn't have a Canvas API key encrypted w/ session key, can't decrypt key
     if current_user.todoist_token_session is None:
         raise ValueError
 
-    return decrypt_str(current_user.todoist_token_session, session_id)
+    return decrypt_str(current_user.todoist_token_session, secret)
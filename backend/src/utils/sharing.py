@@ -0,0 +1,298 @@
+"""
+This file provides database access for sharing subtasks between users. Every read is a single
+joined `select()` that only loads the columns it needs, and every write is a single transaction.
+"""
+
+
+from sqlalchemy import select, insert, update, delete, literal
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import aliased
+
+import utils.models as models
+
+
+#########################################################################
+#                                                                       #
+#                              INVITATIONS                              #
+#                                                                       #
+#########################################################################
+
+
+def send_subtask_invitation(owner: models.User, recipient: models.User, subtask_id: int) -> bool:
+    """
+    Send an invitation to a user to join a subtask. The invitation is only created if the owner
+    owns the subtask and the recipient has a task for the same Canvas assignment.
+
+    :param owner: The owner of the subtask.
+    :param recipient: The recipient of the invitation.
+    :param subtask_id: The ID of the subtask.
+    :return bool: True if the invitation was sent, False otherwise.
+    """
+    if not recipient:
+        return False
+
+    original_task = aliased(models.Task)
+    recipient_task = aliased(models.Task)
+
+    # Check the subtask and the recipient's task while inserting the invitation
+    invitable = select(literal(owner.id), literal(recipient.id), models.SubTask.id)\
+        .join(original_task, original_task.id == models.SubTask.task_id)\
+        .join(recipient_task, (recipient_task.canvas_id == original_task.canvas_id)
+              & (recipient_task.owner == recipient.id))\
+        .where(models.SubTask.id == subtask_id, models.SubTask.owner == owner.id)\
+        .limit(1)
+
+    try:
+        result = models.db.session.execute(
+            insert(models.SubTaskInvitation).from_select(
+                ['owner', 'recipient_id', 'subtask_id'], invitable
+            )
+        )
+        models.db.session.commit()
+        return result.rowcount == 1
+    except Exception:
+        models.db.session.rollback()
+        return False
+
+
+def get_invitation_notifications(recipient: models.User) -> list[dict]:
+    """
+    Retrieve all subtask invitations for a user, composed as notifications.
+
+    :param recipient: The recipient of the subtask invitations.
+    :return list[dict]: A list of dictionaries representing the subtask invitations.
+    """
+    title = 'You received a subtask invitation!'
+
+    invitations = models.db.session.execute(
+        select(models.SubTaskInvitation.id, models.User.username, models.SubTask.name)
+        .join(models.User, models.User.id == models.SubTaskInvitation.owner)
+        .join(models.SubTask, models.SubTask.id == models.SubTaskInvitation.subtask_id)
+        .where(models.SubTaskInvitation.recipient_id == recipient.id)
+        .order_by(models.SubTaskInvitation.id)
+    ).all()
+
+    return [{
+            'title': title,
+            'author_name': author_name,
+            'subtask_name': subtask_name,
+            'invitation_id': invitation_id
+            }
+            for invitation_id, author_name, subtask_name in invitations
+            ]
+
+
+def get_invitation_original(recipient: models.User, invitation_id: int) -> models.User | None:
+    """
+    Get the user that sent an invitation.
+
+    :param recipient: The recipient of the invitation.
+    :param invitation_id: The ID of the invitation.
+    :return User | None: The user that sent the invitation, or None if the invitation doesn't
+    exist or belongs to someone else.
+    """
+    return models.db.session.execute(
+        select(models.User)
+        .join(models.SubTaskInvitation, models.SubTaskInvitation.owner == models.User.id)
+        .where(models.SubTaskInvitation.id == invitation_id,
+               models.SubTaskInvitation.recipient_id == recipient.id)
+    ).scalar()
+
+
+def get_invitation_details(recipient: models.User, invitation_id: int) -> Row | None:
+    """
+    Get everything needed to accept an invitation: the shared subtask and the recipient's task for
+    the same Canvas assignment.
+
+    :param recipient: The recipient of the invitation.
+    :param invitation_id: The ID of the invitation.
+    :return Row | None: A row with the invitation_id, subtask_id, name, description, due_date,
+    status, todoist_id, and shared_with of the subtask, and the recipient_todoist_id of the
+    recipient's task. None if the invitation doesn't exist, belongs to someone else, or the
+    recipient has no matching task.
+    """
+    original_task = aliased(models.Task)
+    recipient_task = aliased(models.Task)
+
+    return models.db.session.execute(
+        select(
+            models.SubTaskInvitation.id.label('invitation_id'),
+            models.SubTask.id.label('subtask_id'),
+            models.SubTask.name,
+            models.SubTask.description,
+            models.SubTask.due_date,
+            models.SubTask.status,
+            models.SubTask.todoist_id,
+            models.SubTask.shared_with,
+            recipient_task.todoist_id.label('recipient_todoist_id'),
+        )
+        .join(models.SubTask, models.SubTask.id == models.SubTaskInvitation.subtask_id)
+        .join(original_task, original_task.id == models.SubTask.task_id)
+        .join(recipient_task, (recipient_task.canvas_id == original_task.canvas_id)
+              & (recipient_task.owner == recipient.id))
+        .where(models.SubTaskInvitation.id == invitation_id,
+               models.SubTaskInvitation.recipient_id == recipient.id)
+        .limit(1)
+    ).first()
+
+
+def accept_invitation(recipient: models.User, invitation: Row, todoist_id: str) -> bool:
+    """
+    Record that a recipient accepted an invitation: create their shared subtask, add them to the
+    subtask's shared_with list, and delete the invitation, all in one transaction.
+
+    :param recipient: The recipient of the invitation.
+    :param invitation: The invitation, as returned by `get_invitation_details`.
+    :param todoist_id: The ID of the recipient's copy of the subtask in Todoist.
+    :return bool: True if the shared subtask was created, False otherwise.
+    """
+    shared_with = list(invitation.shared_with or [])
+    shared_with.append(recipient.id)
+
+    try:
+        models.db.session.execute(
+            insert(models.SubTaskShared).values(owner=recipient.id,
+                                                subtask_id=invitation.subtask_id,
+                                                todoist_original=invitation.todoist_id,
+                                                todoist_id=todoist_id)
+        )
+        models.db.session.execute(
+            update(models.SubTask)
+            .where(models.SubTask.id == invitation.subtask_id)
+            .values(shared_with=shared_with)
+        )
+        models.db.session.execute(
+            delete(models.SubTaskInvitation)
+            .where(models.SubTaskInvitation.id == invitation.invitation_id)
+        )
+        models.db.session.commit()
+        return True
+    except Exception:
+        models.db.session.rollback()
+        return False
+
+
+def decline_invitation(recipient: models.User, invitation_id: int) -> bool:
+    """
+    Delete a subtask invitation without accepting it.
+
+    :param recipient: The recipient of the invitation.
+    :param invitation_id: The ID of the invitation.
+    :return bool: True if the invitation was deleted, False if it doesn't exist.
+    """
+    try:
+        result = models.db.session.execute(
+            delete(models.SubTaskInvitation)
+            .where(models.SubTaskInvitation.id == invitation_id,
+                   models.SubTaskInvitation.recipient_id == recipient.id)
+        )
+        models.db.session.commit()
+        return result.rowcount == 1
+    except Exception:
+        models.db.session.rollback()
+        return False
+
+
+#########################################################################
+#                                                                       #
+#                            SHARED SUBTASKS                            #
+#                                                                       #
+#########################################################################
+
+
+def get_all_shared_todoist_status(owner: models.User) -> list[tuple[str, models.TaskStatus]]:
+    """
+    Retrieve the todoist ID and status of every shared subtask with owner as the recipient.
+
+    :param owner: The recipient of the shared subtasks.
+    :return list[tuple[str, TaskStatus]]: The todoist ID of the recipient's copy and the status of
+    the original subtask.
+    """
+    rows = models.db.session.execute(
+        select(models.SubTaskShared.todoist_id, models.SubTask.status)
+        .join(models.SubTask, models.SubTask.id == models.SubTaskShared.subtask_id)
+        .where(models.SubTaskShared.owner == owner.id)
+    ).all()
+    return [(todoist_id, status) for todoist_id, status in rows]
+
+
+def get_shared_subtasks(owner: models.User, dict=False) -> list[models.SubTaskShared] | list[dict]:
+    """
+    Retrieve all shared subtasks for a user.
+
+    :param owner: The recipient of the shared subtasks.
+    :param dict: If True, return the subtasks as a list of dictionaries. Defaults to False.
+    :return list[SubTaskShared] or list[dict]: A list of shared subtasks or a list of dictionaries
+    if dict is True.
+    """
+    shared_subtasks = models.db.session.execute(
+        select(models.SubTaskShared).where(models.SubTaskShared.owner == owner.id)
+    ).scalars().all()
+    if dict:
+        return [subtask.to_dict() for subtask in shared_subtasks]
+    return shared_subtasks
+
+
+def get_shared_subtask_members(subtask: models.SubTask) -> list[tuple[int, str, bytes]]:
+    """
+    Retrieve every user a subtask is shared with, including the original owner, together with the
+    ID of their copy of the subtask in Todoist and their encrypted Todoist token.
+
+    :param subtask: The subtask to retrieve the members of.
+    :return list[tuple[int, str, bytes]]: The user ID, Todoist ID of the subtask, and the Todoist
+    token encrypted with the server secret of every member.
+    """
+    recipients = select(models.User.id, models.SubTaskShared.todoist_id,
+                        models.User.todoist_token_password)\
+        .join(models.SubTaskShared, models.SubTaskShared.owner == models.User.id)\
+        .where(models.SubTaskShared.subtask_id == subtask.id)
+    original_owner = select(models.User.id, literal(subtask.todoist_id),
+                            models.User.todoist_token_password)\
+        .where(models.User.id == subtask.owner)
+
+    rows = models.db.session.execute(recipients.union_all(original_owner)).all()
+    return [(user_id, todoist_id, token) for user_id, todoist_id, token in rows]
+
+
+def get_members_of_subtasks(subtask_ids: list[int]) -> dict[int, list[tuple[int, str, bytes]]]:
+    """
+    Retrieve the members of several subtasks at once, like `get_shared_subtask_members`.
+
+    :param subtask_ids: The IDs of the subtasks.
+    :return dict[int, list[tuple[int, str, bytes]]]: The user ID, Todoist ID of the subtask, and the
+    Todoist token encrypted with the server secret of every member, by subtask ID. A subtask that
+    isn't shared only has its owner.
+    """
+    if not subtask_ids:
+        return {}
+
+    recipients = select(models.SubTaskShared.subtask_id, models.User.id,
+                        models.SubTaskShared.todoist_id, models.User.todoist_token_password)\
+        .join(models.SubTaskShared, models.SubTaskShared.owner == models.User.id)\
+        .where(models.SubTaskShared.subtask_id.in_(subtask_ids))
+    original_owners = select(models.SubTask.id, models.User.id, models.SubTask.todoist_id,
+                             models.User.todoist_token_password)\
+        .join(models.SubTask, models.SubTask.owner == models.User.id)\
+        .where(models.SubTask.id.in_(subtask_ids))
+
+    members = {}
+    for subtask_id, user_id, todoist_id, token in \
+            models.db.session.execute(recipients.union_all(original_owners)).all():
+        members.setdefault(subtask_id, []).append((user_id, todoist_id, token))
+    return members
+
+
+def get_original_from_shared_subtask(owner: models.User) -> models.SubTask | None:
+    """
+    Get the original subtask of the first subtask shared with the user that has no copy in Todoist.
+
+    :param owner: The recipient of the shared subtasks.
+    :return SubTask | None: The original subtask, or None if every shared subtask is in Todoist.
+    """
+    return models.db.session.execute(
+        select(models.SubTask)
+        .join(models.SubTaskShared, models.SubTaskShared.subtask_id == models.SubTask.id)
+        .where(models.SubTaskShared.owner == owner.id,
+               models.SubTaskShared.todoist_id == None)  # noqa: E711
+        .limit(1)
+    ).scalar()
@@ -4,26 +4,124 @@ This file provides utilities for adding tasks to Todoist.
 
 
 from datetime import datetime
-import gevent
+from lru import LRU
+import hashlib
+import logging
 import requests
+import time
 import uuid
 import json
 from typing import Literal
 
 from api.v1.courses import get_all_courses, get_course_assignments
+import utils.breakers as breakers
+import utils.deadlines as deadlines
+import utils.events as events
+from utils.instrumentation import record_call, spawn
 from utils.models import User, TaskStatus, Task, SubTask
-from utils.settings import localize_date, date_passed, time_it, is_valid_date
-from utils.crypto import decrypt_str, get_todo_secret
+from utils.settings import time_it, is_valid_date, utc_now, parse_canvas_date, parse_local_date, \
+    format_local_date, get_todoist_url, get_todoist_reconcile_interval, is_todoist_webhook_enabled
+from utils.crypto import decrypt_str_upgrade, get_todo_secret, KDF_HKDF
 import utils.queries as queries
+import utils.sharing as sharing
 
 
-def add_update_tasks(user_id: int, canvas_key: str, todoist_key: str):
+BASE_URL = get_todoist_url()
+
+# Todoist accepts at most 100 commands in a sync request, and a completed subtask takes two
+MAX_BULK_SUBTASKS = 50
+MAX_BULK_STATUSES = 100
+
+logger = logging.getLogger(__name__)
+
+# When each of the most recently synced users last had every task pulled from Todoist
+last_reconciled = LRU(1000)
+
+
+class CourseFingerprintStore:
+    """
+    Remembers a fingerprint of every course's assignments for each user, so that courses whose
+    assignments have not changed since the last sync can be skipped entirely. Only the most recently
+    synced users are remembered.
+
+    :param max_users: The maximum number of users to remember fingerprints for.
+    """
+    def __init__(self, max_users: int = 1000):
+        self.fingerprints = LRU(max_users)
+        self.skipped = 0
+        self.processed = 0
+
+    def is_unchanged(self, user_id: int, course_id: int, fingerprint: str) -> bool:
+        """
+        Check if a course's assignments are unchanged since they were last synced for a user.
+
+        :param user_id: The ID of the user being synced.
+        :param course_id: The ID of the course in Canvas.
+        :param fingerprint: The fingerprint of the course's current assignments.
+        :return bool: True if the course was synced with the same fingerprint before.
+        """
+        return self.fingerprints.get(user_id, {}).get(course_id) == fingerprint
+
+    def update(self, user_id: int, fingerprints: dict[int, str]):
+        """
+        Record the fingerprints of courses that were successfully synced for a user.
+
+        :param user_id: The ID of the user that was synced.
+        :param fingerprints: A dict mapping course IDs to the fingerprints that were synced.
+        """
+        if not fingerprints:
+            return
+        user_fingerprints = dict(self.fingerprints.get(user_id, {}))
+        user_fingerprints.update(fingerprints)
+        self.fingerprints[user_id] = user_fingerprints
+
+    def forget(self, user_id: int, course_id: int | None = None):
+        """
+        Forget the fingerprints for a user so that their courses are fully synced next time.
+
+        :param user_id: The ID of the user.
+        :param course_id: If specified, only forget the fingerprint for this course.
+        """
+        if user_id not in self.fingerprints:
+            return
+        if course_id is None:
+            del self.fingerprints[user_id]
+        else:
+            user_fingerprints = dict(self.fingerprints[user_id])
+            user_fingerprints.pop(course_id, None)
+            self.fingerprints[user_id] = user_fingerprints
+
+
+# Fingerprints of the assignments that were last synced for each user and course
+course_fingerprints = CourseFingerprintStore()
+
+
+def _post(url: str, **kwargs) -> requests.Response:
+    """
+    Send a POST request to Todoist and record it in the current request's metrics. The request
+    times out when the current request's budget runs out, see utils.deadlines, and fails with
+    CircuitOpen while Todoist is unavailable, see utils.breakers.
+
+    :param url: The Todoist API URL.
+    :return Response: The response from Todoist.
     """
-    Add all missing tasks for a given user or update them if the due date has changed.
+    kwargs.setdefault('timeout', deadlines.get_timeout('todoist'))
+    with breakers.TODOIST.call() as outcome, record_call('todoist', url) as call:
+        response = requests.post(url, **kwargs)
+        call.status = outcome.status = response.status_code
+    return response
+
+
+def add_update_tasks(user_id: int, canvas_key: str, todoist_key: str) -> int:
+    """
+    Add all missing tasks for a given user or update them if the due date has changed. Courses whose
+    assignments are unchanged since the last sync are skipped without touching the database or
+    Todoist.
 
     :param user_id: The primary key for the current user.
     :param canvas_key: The Canvas API key for the current user.
     :param todoist_key: The Todoist API key for the current user.
+    :return int: The number of tasks that were added to or updated in Todoist.
     """
 
     # Get all courses from canvas
@@ -31,31 +129,48 @@ def add_update_tasks(user_id: int, canvas_key: str, todoist_key: str):
         courses = get_all_courses(canvas_key)
 
         greenlets = [
-            gevent.spawn(get_course_assignments, course['id'], canvas_key) for course in courses
+            spawn(get_course_assignments, course['id'], canvas_key) for course in courses
         ]
-        gevent.joinall(greenlets)
+        # Courses that don't arrive within the request's budget are synced next time
+        finished = deadlines.join(greenlets)
 
-    # Creates list of all assignments
+    # Creates list of all assignments in courses that changed since the last sync
     with time_it("      Create assignments list: "):
-        all_assignments = [assignment for greenlet in greenlets for assignment in greenlet.value]
+        changed_courses = {}
+        all_assignments = []
+        for course, greenlet in zip(courses, greenlets):
+            if greenlet not in finished:
+                continue
+            assignments = greenlet.value or []
+            fingerprint = _get_course_fingerprint(assignments)
+            if course_fingerprints.is_unchanged(user_id, course['id'], fingerprint):
+                course_fingerprints.skipped += 1
+                continue
+
+            course_fingerprints.processed += 1
+            changed_courses[course['id']] = fingerprint
+            all_assignments.extend(assignments)
+
         # I may have a better alternative for the sorting
         all_assignments.sort(key=_get_assignment_date_or_default)
 
     todoist_queue = []  # Command queue to send to todoist
     temp_ids = {}       # temp map for updating the todoist_id after sending the request to todoist
 
-    todoist_url = 'https://api.todoist.com/sync/v9/sync'
+    todoist_url = f'{BASE_URL}/sync/v9/sync'
     headers = {"Authorization": f"Bearer {todoist_key}"}
 
     with time_it("      Creating Tasks: "):
+        now = utc_now()
         for assignment in all_assignments:
-            # Only consider assignments where due date has not already passed
+            # Assignments without a due date can't be added to Todoist
             due_date_str = assignment.get('due_at')
-            if due_date_str:
-                date_aware = localize_date(datetime.strptime(due_date_str, '%Y-%m-%dT%H:%M:%SZ'))
+            if not due_date_str:
+                continue
 
-            if not date_passed(date_aware):
-                due_date = date_aware.strftime('%Y-%m-%d %H:%M:%S')
+            # Only consider assignments where due date has not already passed
+            due_date = parse_canvas_date(due_date_str)
+            if due_date > now:
                 # Creates tasks in the database if they dont exist / update them, and creates the
                 # todoist queue
                 add_tasks_to_database(assignment, due_date, user_id, todoist_queue, temp_ids)
@@ -78,15 +193,21 @@ def add_update_tasks(user_id: int, canvas_key: str, todoist_key: str):
                     task_id = temp_ids[temp_id]
                     queries.update_task_id(task_id, final_id)
 
+    # Only remember the courses once they are in Todoist, so a failed sync is retried in full
+    course_fingerprints.update(user_id, changed_courses)
+
+    return len(todoist_queue)
 
-def add_tasks_to_database(assignment: dict, due_date: str, owner: User | int, todoist_queue: list,
+
+def add_tasks_to_database(assignment: dict, due_date: datetime, owner: User | int,
+                          todoist_queue: list,
                           temp_ids: dict):
     """
     Adds tasks to the database and prepares them for synchronization with Todoist.
 
     Args:
         assignment (dict): A dictionary containing assignment details, including 'id' and 'name'.
-        due_date (str): The due date for the task in string format.
+        due_date (datetime): The due date for the task as a naive UTC datetime.
         owner (User | int): The owner of the task, which can be a User object or an integer user ID.
         todoist_queue (list): A list that stores tasks to be added or updated in Todoist.
         temp_ids (dict): A dictionary mapping temporary task IDs to their corresponding database
@@ -111,7 +232,7 @@ def add_tasks_to_database(assignment: dict, due_date: str, owner: User | int, to
             "uuid": str(uuid.uuid4()),
             "args": {
                 "content": assignment['name'],
-                "due": {"date": due_date},
+                "due": {"date": format_local_date(due_date)},
                 "labels": ["assignment"]
             }
         }
@@ -129,7 +250,7 @@ def add_tasks_to_database(assignment: dict, due_date: str, owner: User | int, to
             "uuid": str(uuid.uuid4()),
             "args": {
                 "id": task.todoist_id,
-                "due": {"date": due_date},
+                "due": {"date": format_local_date(due_date)},
             }
         }
         # Put the command in the queue that will be sent to Todoist
@@ -138,7 +259,7 @@ def add_tasks_to_database(assignment: dict, due_date: str, owner: User | int, to
         queries.set_task_duedate(task, due_date)
 
 
-def add_task(current_user: User, todoist_key: str, task_name: str,  due_date: str,
+def add_task(current_user: User, todoist_key: str, task_name: str, due_date: datetime,
              task_desc: str | None = None, canvas_id: int | None = None) -> int | Literal[False]:
     """
     Creates a task for the current user in both Todoist and the database. This may be associated
@@ -148,14 +269,15 @@ def add_task(current_user: User, todoist_key: str, task_name: str,  due_date: st
         current_user (User): The user creating the task.
         todoist_key (str): The Todoist API key for the current user.
         task_name (str): The name of the task.
-        due_date (str): The due date of the assignment.
+        due_date (datetime): The due date of the assignment as a naive UTC datetime.
         task_desc (str | None): The description for the assignment, optional.
         canvas_id (str | None): The ID of the assignment in Canvas, optional.
 
     Returns:
         int | Literal[False]: The database ID if the task was added and False otherwise.
     """
-    body = {'content': task_name, 'due_string': due_date, 'labels': ['assignment']}
+    body = {'content': task_name, 'due_string': format_local_date(due_date),
+            'labels': ['assignment']}
 
     # Set the description if one was provided
     if task_desc:
@@ -166,7 +288,7 @@ def add_task(current_user: User, todoist_key: str, task_name: str,  due_date: st
         "Content-Type": "application/json"
     }
 
-    resp = requests.post('https://api.todoist.com/rest/v2/tasks', json=body, headers=headers)
+    resp = _post(f'{BASE_URL}/rest/v2/tasks', json=body, headers=headers)
 
     if resp.status_code != 200:
 
@@ -222,7 +344,7 @@ def add_subtask(current_user: User, todoist_key: str, canvas_id: str, subtask_na
             }
 
             # Create subtask and receive the todoist id
-            response_data = _send_post_todoist("https://api.todoist.com/rest/v2/tasks",
+            response_data = _send_post_todoist(f"{BASE_URL}/rest/v2/tasks",
                                                json.dumps(body), header)
             if response_data:
                 todoist_id = response_data.get('id', None)
@@ -231,8 +353,8 @@ def add_subtask(current_user: User, todoist_key: str, canvas_id: str, subtask_na
 
                 # If subtask is already marked as complete, close it
                 if subtask_status == TaskStatus.Completed:
-                    response = requests.post(
-                        f"https://api.todoist.com/rest/v2/tasks/{todoist_id}/close",
+                    response = _post(
+                        f"{BASE_URL}/rest/v2/tasks/{todoist_id}/close",
                         headers={"Authorization": f"Bearer {todoist_key}"}
                     )
                     # Failure to mark subtask as complete
@@ -242,7 +364,7 @@ def add_subtask(current_user: User, todoist_key: str, canvas_id: str, subtask_na
                 # Create subtask in database
                 new_subtask_id = queries.create_subtask(current_user, task.id, subtask_name,
                                                         todoist_id, subtask_desc, subtask_status,
-                                                        due_date)
+                                                        parse_local_date(due_date))
                 return new_subtask_id, todoist_id
         except Exception:
             pass
@@ -250,13 +372,90 @@ def add_subtask(current_user: User, todoist_key: str, canvas_id: str, subtask_na
     return False
 
 
+def add_subtasks(current_user: User, todoist_key: str, subtasks: list[dict])\
+        -> list[tuple[int, str] | None] | Literal[False]:
+    """
+    Creates several subtasks for the current user with a single Todoist sync request and a single
+    database write. Subtasks that are already complete are closed in the same request.
+
+    :param current_user: The user creating the subtasks. Only the owner of a task can add subtasks.
+    :param todoist_key: The Todoist API key for the current user.
+    :param subtasks: At most MAX_BULK_SUBTASKS subtasks, each a dict with the canvas_id of its
+    assignment, a name, a description, a status, and a due_date, like the arguments of
+    `add_subtask`.
+    :return list[tuple[int, str] | None] | False: The ID and Todoist ID of every subtask in the
+    order they were given, or None for a subtask that Todoist refused. False if a subtask is
+    invalid or Todoist couldn't be reached, in which case nothing is created.
+    """
+    tasks = queries.get_tasks_by_canvas_ids(current_user, [int(subtask['canvas_id'])
+                                                           for subtask in subtasks])
+    commands = []
+    new_subtasks = []   # The temp_id, the uuid of the close command, and the subtask
+    for subtask in subtasks:
+        task = tasks.get(int(subtask['canvas_id']))
+        due_date = is_valid_date(subtask['due_date'])
+        if task is None or not task.todoist_id or not due_date:
+            return False
+
+        temp_id = str(uuid.uuid4())
+        commands.append({
+            "type": "item_add",
+            "temp_id": temp_id,
+            "uuid": str(uuid.uuid4()),
+            "args": {
+                "content": subtask['name'],
+                "description": subtask['description'] or '',
+                "due": {"date": format_local_date(parse_local_date(due_date))},
+                "parent_id": task.todoist_id,
+            }
+        })
+        # A command can refer to a task created earlier in the same request by its temp_id
+        close_uuid = None
+        if subtask['status'] == TaskStatus.Completed:
+            close_uuid = str(uuid.uuid4())
+            commands.append({"type": "item_close", "uuid": close_uuid, "args": {"id": temp_id}})
+
+        new_subtasks.append((temp_id, close_uuid, {
+            'task_id': task.id, 'name': subtask['name'], 'description': subtask['description'],
+            'status': subtask['status'], 'due_date': parse_local_date(due_date)
+        }))
+
+    try:
+        response_data = _send_post_todoist(f'{BASE_URL}/sync/v9/sync',
+                                           {'commands': json.dumps(commands)},
+                                           {"Authorization": f"Bearer {todoist_key}"})
+    except Exception:
+        return False
+
+    temp_id_mapping = response_data.get('temp_id_mapping') or {}
+    sync_status = response_data.get('sync_status') or {}
+    created = []
+    for temp_id, close_uuid, subtask in new_subtasks:
+        subtask['todoist_id'] = temp_id_mapping.get(temp_id)
+        # Failure to mark the subtask as complete
+        if close_uuid is not None and sync_status.get(close_uuid) != 'ok':
+            subtask['status'] = TaskStatus.Incomplete
+        if subtask['todoist_id'] is not None:
+            created.append(subtask)
+
+    subtask_ids = queries.create_subtasks(current_user, created)
+    if subtask_ids is False:
+        return False
+
+    subtask_ids = iter(subtask_ids)
+    return [(next(subtask_ids), subtask['todoist_id'])
+            if subtask['todoist_id'] is not None else None for _, _, subtask in new_subtasks]
+
+
 def add_shared_subtask(current_user: User, todoist_key: str, invitation_id: int, accept: bool)\
         -> bool:
-    subtask = queries.get_invitation_subtask(current_user, invitation_id)
-    recipient_task = queries.get_recipient_task(current_user, subtask)
-    subtask_status = subtask.status
+    if not accept:
+        return sharing.decline_invitation(current_user, invitation_id)
 
-    if accept and subtask and recipient_task:
+    # The subtask and the recipient's task are loaded together with the invitation
+    subtask = sharing.get_invitation_details(current_user, invitation_id)
+    if subtask:
+        subtask_status = subtask.status
 
         try:
             header = {
@@ -266,12 +465,12 @@ def add_shared_subtask(current_user: User, todoist_key: str, invitation_id: int,
             body = {
                 "content": subtask.name,
                 "description": subtask.description,
-                "due_date": subtask.due_date,
-                "parent_id": recipient_task.todoist_id,
+                "due_date": format_local_date(subtask.due_date, '%Y-%m-%d %H:%M'),
+                "parent_id": subtask.recipient_todoist_id,
             }
 
             # Create subtask and receive the todoist id
-            response_data = _send_post_todoist("https://api.todoist.com/rest/v2/tasks",
+            response_data = _send_post_todoist(f"{BASE_URL}/rest/v2/tasks",
                                                json.dumps(body), header)
             if response_data:
 
@@ -281,8 +480,8 @@ def add_shared_subtask(current_user: User, todoist_key: str, invitation_id: int,
 
                 # If subtask is already marked as complete, close it
                 if subtask_status == TaskStatus.Completed:
-                    response = requests.post(
-                        f"https://api.todoist.com/rest/v2/tasks/{todoist_id}/close",
+                    response = _post(
+                        f"{BASE_URL}/rest/v2/tasks/{todoist_id}/close",
                         headers={"Authorization": f"Bearer {todoist_key}"}
                     )
                     # Failure to mark subtask as complete
@@ -290,9 +489,7 @@ def add_shared_subtask(current_user: User, todoist_key: str, invitation_id: int,
                         subtask_status = TaskStatus.Incomplete
 
                 # Create subtask in database
-                queries.create_shared_subtask(current_user, subtask, todoist_id)
-                queries.delete_invitation(current_user, invitation_id)
-                return True
+                return sharing.accept_invitation(current_user, subtask, todoist_id)
         except Exception:
             pass
 
@@ -320,8 +517,8 @@ def close_task(current_user: User, todoist_key: str, todoist_task_id: str) -> bo
         return False
 
     # Mark task as complete in Todoist
-    response = requests.post(f"https://api.todoist.com/rest/v2/tasks/{todoist_task_id}/close",
-                             headers={"Authorization": f"Bearer {todoist_key}"})
+    response = _post(f"{BASE_URL}/rest/v2/tasks/{todoist_task_id}/close",
+                     headers={"Authorization": f"Bearer {todoist_key}"})
 
     # Per documation, 204 indicates success
     if response.status_code == 204:
@@ -353,8 +550,8 @@ def open_task(current_user: User, todoist_key: str, todoist_task_id: str) -> boo
         return False
 
     # Mark task as in progress in Todoist
-    response = requests.post(f"https://api.todoist.com/rest/v2/tasks/{todoist_task_id}/reopen",
-                             headers={"Authorization": f"Bearer {todoist_key}"})
+    response = _post(f"{BASE_URL}/rest/v2/tasks/{todoist_task_id}/reopen",
+                     headers={"Authorization": f"Bearer {todoist_key}"})
     if response.status_code == 204:
         queries.update_task_or_subtask_status(task, TaskStatus.Incomplete)
 
@@ -406,22 +603,22 @@ def toggle_shared_subtask(current_user: User, todoist_key: str, task: SubTask) -
     """
     if isinstance(task, SubTask) and len(task.shared_with) > 0 and\
             (current_user.id in task.shared_with or current_user.id == task.owner):
-        # Get all users part of the shared subtask
-        user_todoist_ids = queries.get_shared_users_subtask(task)
+        # Get all users part of the shared subtask, with their Todoist tokens
+        members = sharing.get_shared_subtask_members(task)
 
         results = []
-        for user_id, todoist_id in user_todoist_ids:
-            # Get the todoist id of their subtask on todoist
-            encrypted_todoist_api = queries.get_user_todoist_api(user_id)
-            todoist_key = decrypt_str(encrypted_todoist_api, get_todo_secret())
+        for user_id, todoist_id, encrypted_todoist_api in members:
+            todoist_key = _decrypt_member_key(user_id, encrypted_todoist_api)
 
             # Toggle the status of the shared subtask for each user in todoist
             results.append(toggle_shared_subtask_todoist(todoist_key, todoist_id, task))
 
-        if any(results):
-            return queries.invert_subtask_status(task)
-        else:
-            return False
+        if any(results) and queries.invert_subtask_status(task):
+            # Show the new status on the other members' dashboards right away
+            events.publish([user_id for user_id, _, _ in members if user_id != current_user.id],
+                           'subtask', {'id': task.id, 'status': task.status.value})
+            return True
+        return False
 
 
 def toggle_shared_subtask_todoist(todoist_key: str, todoist_task_id: str, task: Task) -> bool:
@@ -433,19 +630,117 @@ def toggle_shared_subtask_todoist(todoist_key: str, todoist_task_id: str, task:
     :task: The shared subtask object.
     """
     if task.status == TaskStatus.Completed:
-        response = requests.post(f"https://api.todoist.com/rest/v2/tasks/{todoist_task_id}/reopen",
-                                 headers={"Authorization": f"Bearer {todoist_key}"})
+        response = _post(f"{BASE_URL}/rest/v2/tasks/{todoist_task_id}/reopen",
+                         headers={"Authorization": f"Bearer {todoist_key}"})
         if response.status_code == 204:
             return True
 
     elif task.status == TaskStatus.Incomplete:
-        response = requests.post(f"https://api.todoist.com/rest/v2/tasks/{todoist_task_id}/close",
-                                 headers={"Authorization": f"Bearer {todoist_key}"})
+        response = _post(f"{BASE_URL}/rest/v2/tasks/{todoist_task_id}/close",
+                         headers={"Authorization": f"Bearer {todoist_key}"})
         if response.status_code == 204:
             return True
     return False
 
 
+def set_statuses(current_user: User, todoist_key: str, statuses: dict[str, TaskStatus])\
+        -> dict[str, bool]:
+    """
+    Sets the status of several tasks and subtasks for the current user. They are found with a
+    single query, changed in Todoist with a single sync request, and saved with a single commit.
+    The copies of shared subtasks are changed in the Todoist of the other members in the
+    background, with one request per member.
+
+    :param current_user: The user that owns the tasks and subtasks, or was shared the subtasks.
+    :param todoist_key: The Todoist API key for the current user.
+    :param statuses: The new status of at most MAX_BULK_STATUSES tasks and subtasks, by Todoist ID.
+    :return dict[str, bool]: Whether each task or subtask has its new status, by Todoist ID.
+    """
+    results = {todoist_id: False for todoist_id in statuses}
+    changed = []
+    for row in queries.get_statuses_by_todoist_ids(current_user, list(statuses)):
+        if row.status == statuses[row.todoist_id]:
+            results[row.todoist_id] = True
+        else:
+            changed.append(row)
+
+    members = sharing.get_members_of_subtasks([row.id for row in changed
+                                               if row.kind == 'subtask'])
+    # The ID of each task in the current user's Todoist, which is their copy of a shared subtask
+    own_ids = {}
+    for row in changed:
+        own_ids[row.todoist_id] = next((todoist_id for user_id, todoist_id, _
+                                        in members.get(row.id, []) if user_id == current_user.id),
+                                       row.todoist_id)
+
+    try:
+        closed = _send_status_commands(todoist_key, [(own_ids[row.todoist_id],
+                                                      statuses[row.todoist_id])
+                                                     for row in changed])
+    except Exception:
+        return results
+
+    done = [row for row in changed if own_ids[row.todoist_id] in closed]
+    if not queries.set_task_statuses([(row.kind, row.id, statuses[row.todoist_id])
+                                      for row in done]):
+        return results
+
+    for row in done:
+        results[row.todoist_id] = True
+    _propagate_statuses(current_user, [(row.id, statuses[row.todoist_id]) for row in done],
+                        members)
+    return results
+
+
+def _propagate_statuses(current_user: User, changes: list[tuple[int, TaskStatus]],
+                        members: dict[int, list[tuple[int, str, bytes]]]):
+    # Group the copies of the shared subtasks that changed by member
+    batches = {}
+    published = []
+    for subtask_id, status in changes:
+        others = [member for member in members.get(subtask_id, [])
+                  if member[0] != current_user.id]
+        for user_id, todoist_id, encrypted_todoist_key in others:
+            if todoist_id is not None:
+                batches.setdefault(user_id, (user_id, encrypted_todoist_key, []))[2]\
+                    .append((todoist_id, status))
+        if others:
+            published.append(([user_id for user_id, _, _ in others], 'subtask',
+                              {'id': subtask_id, 'status': status.value}))
+
+    if batches:
+        spawn(propagate_shared_statuses, list(batches.values()))
+    # Show the new statuses on the other members' dashboards right away
+    events.publish_all(published)
+
+
+def _send_status_commands(todoist_key: str, changes: list[tuple[str, TaskStatus]]) -> set[str]:
+    """
+    Close or reopen several tasks with a single Todoist sync request.
+
+    :param todoist_key: The Todoist API key of the user the tasks belong to.
+    :param changes: The Todoist ID and new status of every task.
+    :return set[str]: The Todoist IDs of the tasks that Todoist changed.
+    """
+    # Copies of shared subtasks that aren't in Todoist yet can't be changed
+    changes = [(todoist_id, status) for todoist_id, status in changes if todoist_id is not None]
+    if not changes:
+        return set()
+
+    commands = [{
+        "type": "item_close" if status == TaskStatus.Completed else "item_uncomplete",
+        "uuid": str(uuid.uuid4()),
+        "args": {"id": todoist_id}
+    } for todoist_id, status in changes]
+    response_data = _send_post_todoist(f'{BASE_URL}/sync/v9/sync',
+                                       {'commands': json.dumps(commands)},
+                                       {"Authorization": f"Bearer {todoist_key}"})
+
+    sync_status = response_data.get('sync_status') or {}
+    return {command['args']['id'] for command in commands
+            if sync_status.get(command['uuid']) == 'ok'}
+
+
 def update_task_description(todoist_key: str, task: Task, description: str) -> bool:
     """
     Updates a task's description in Todoist and in the database.
@@ -463,8 +758,8 @@ def update_task_description(todoist_key: str, task: Task, description: str) -> b
 
     try:
         data = {'description': description}
-        response = requests.post(
-            f'https://api.todoist.com/rest/v2/tasks/{task.todoist_id}',
+        response = _post(
+            f'{BASE_URL}/rest/v2/tasks/{task.todoist_id}',
             data=json.dumps(data),
             headers={"Authorization": f"Bearer {todoist_key}", "Content-Type": "application/json"}
         )
@@ -482,13 +777,22 @@ def update_task_description(todoist_key: str, task: Task, description: str) -> b
 def sync_task_status(current_user: User, todoist_key: str):
     """
     Syncs the status of tasks and subtasks in the database with Todoist. The Todoist status will
-    override the database status.
+    override the database status. While the Todoist webhook keeps statuses up to date, this full
+    pull only runs once every TODOIST_RECONCILE_INTERVAL seconds per user, to catch missed events.
+
+    :param current_user: The user whose tasks should be synced.
+    :param todoist_key: The Todoist API key of the user.
     """
+    last_pull = last_reconciled.get(current_user.id)
+    if is_todoist_webhook_enabled() and last_pull is not None \
+            and time.monotonic() - last_pull < get_todoist_reconcile_interval():
+        return
+
     # TODO: allow non-* sync token to decrase overhead
     # Sync token will return completed tasks
-    response = requests.post('https://api.todoist.com/sync/v9/sync',
-                             data={'sync_token': '*', 'resource_types': '["items"]'},
-                             headers={'Authorization': f'Bearer {todoist_key}'})
+    response = _post(f'{BASE_URL}/sync/v9/sync',
+                     data={'sync_token': '*', 'resource_types': '["items"]'},
+                     headers={'Authorization': f'Bearer {todoist_key}'})
 
     if not response.ok:
 
@@ -503,6 +807,7 @@ def sync_task_status(current_user: User, todoist_key: str):
 
     shared_todoists = queries.sync_task_status(current_user, open_tasks)
     update_shared_todoist_status(todoist_key, shared_todoists, open_tasks)
+    last_reconciled[current_user.id] = time.monotonic()
 
 
 def update_shared_todoist_status(todoist_key: str, shared_tasks: list[tuple[str, TaskStatus]],
@@ -521,11 +826,56 @@ def update_shared_todoist_status(todoist_key: str, shared_tasks: list[tuple[str,
     for todoist_id, status in shared_tasks:
         if todoist_id in open_tasks:
             if status == TaskStatus.Completed:
-                requests.post(f"https://api.todoist.com/rest/v2/tasks/{todoist_id}/close",
-                              headers=header)
+                _post(f"{BASE_URL}/rest/v2/tasks/{todoist_id}/close",
+                      headers=header)
         elif status == TaskStatus.Incomplete:
-            requests.post(f"https://api.todoist.com/rest/v2/tasks/{todoist_id}/reopen",
-                          headers=header)
+            _post(f"{BASE_URL}/rest/v2/tasks/{todoist_id}/reopen",
+                  headers=header)
+
+
+def _decrypt_member_key(user_id: int, encrypted_todoist_key: bytes) -> str:
+    todoist_key, upgraded = decrypt_str_upgrade(encrypted_todoist_key, get_todo_secret(), KDF_HKDF)
+    # Tokens encrypted before the server secret used HKDF are replaced on first use
+    if upgraded is not None:
+        queries.store_server_tokens(queries.get_user_by_id(user_id),
+                                    todoist_token_password=upgraded.to_bytes())
+    return todoist_key
+
+
+def propagate_shared_status(members: list[tuple[int, str, bytes]], status: TaskStatus):
+    """
+    Set the status of every member's copy of a shared subtask in Todoist. A member that fails is
+    logged and skipped, the next full pull of their tasks corrects it.
+
+    :param members: The members of the shared subtask, as returned by
+    sharing.get_shared_subtask_members.
+    :param status: The status of the shared subtask.
+    """
+    action = 'close' if status == TaskStatus.Completed else 'reopen'
+    for user_id, todoist_id, encrypted_todoist_key in members:
+        try:
+            todoist_key = _decrypt_member_key(user_id, encrypted_todoist_key)
+            _post(f"{BASE_URL}/rest/v2/tasks/{todoist_id}/{action}",
+                  headers={"Authorization": f"Bearer {todoist_key}"})
+        except Exception as ex:
+            logger.warning('Could not %s shared subtask %s: %s', action, todoist_id, ex)
+
+
+def propagate_shared_statuses(batches: list[tuple[int, bytes, list[tuple[str, TaskStatus]]]]):
+    """
+    Set the status of the copies of several shared subtasks in the Todoist of other members, with
+    one request per member. A member that fails is logged and skipped, the next full pull of their
+    tasks corrects it.
+
+    :param batches: The ID of each member, their Todoist token encrypted with the server secret, and
+    the Todoist ID and new status of each of their copies.
+    """
+    for user_id, encrypted_todoist_key, changes in batches:
+        try:
+            todoist_key = _decrypt_member_key(user_id, encrypted_todoist_key)
+            _send_status_commands(todoist_key, changes)
+        except Exception as ex:
+            logger.warning('Could not update %d shared subtasks: %s', len(changes), ex)
 
 
 def _send_post_todoist(todoist_url, body, headers):
@@ -542,7 +892,7 @@ def _send_post_todoist(todoist_url, body, headers):
         raise an exception.
     """
     with time_it("      Send Todoist request: "):
-        response = requests.post(todoist_url, data=body, headers=headers)
+        response = _post(todoist_url, data=body, headers=headers)
     response_data = response.json()
     if not response.ok:
         raise Exception
@@ -550,6 +900,20 @@ def _send_post_todoist(todoist_url, body, headers):
     return response_data
 
 
+def _get_course_fingerprint(assignments: list[dict]) -> str:
+    """
+    Compute a fingerprint of the parts of a course's assignments that are synced to Todoist.
+
+    :param assignments: The course's assignments, as returned by get_course_assignments.
+    :return str: A hash of every assignment's ID, name, and due date.
+    """
+    synced_fields = sorted(
+        (str(assignment.get('id')), str(assignment.get('name')), str(assignment.get('due_at')))
+        for assignment in assignments
+    )
+    return hashlib.blake2b(repr(synced_fields).encode(), digest_size=16).hexdigest()
+
+
 def _get_assignment_date_or_default(assignment: dict, default: str = '~') -> str:
     """
     Get the due date of an assignment. If the due date is None, return a default value instead.
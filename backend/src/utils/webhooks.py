@@ -0,0 +1,258 @@
+"""
+This file turns the events that Canvas sends to the backend's webhook into cache invalidations and
+background syncs. Canvas can deliver its Live Events in either the Canvas format or the IMS Caliper
+format, both are understood.
+
+An assignment that is created, updated, or deleted removes every cached result about its course
+in every server process, see utils/invalidations.py, so the next request for it asks Canvas. It
+also schedules a sync right away for every user whose last background sync found the course. A
+submission only affects the user who submitted it.
+
+Todoist sends the tasks that are completed, reopened, or edited to its own webhook. The status of
+the task or subtask with the event's Todoist ID is saved, and a change to a shared subtask is sent
+to the copy of every other member in the background.
+"""
+
+
+import base64
+from dataclasses import dataclass
+import hashlib
+import hmac
+from lru import LRU
+import re
+
+import utils.events as events
+from utils.instrumentation import spawn
+import utils.invalidations as invalidations
+from utils.metrics import Counter
+from utils.models import SubTask, TaskStatus
+import utils.queries as queries
+import utils.sharing as sharing
+import utils.todoist as todoist
+
+
+# Canvas Live Events and the Caliper action and object type that correspond to them
+ASSIGNMENT_EVENTS = {'assignment_created', 'assignment_updated', 'assignment_deleted'}
+SUBMISSION_EVENTS = {'submission_created', 'submission_updated'}
+CALIPER_EVENTS = {
+    ('Created', 'AssignableDigitalResource'): 'assignment_created',
+    ('Modified', 'AssignableDigitalResource'): 'assignment_updated',
+    ('Deleted', 'AssignableDigitalResource'): 'assignment_deleted',
+    ('Submitted', 'Attempt'): 'submission_created',
+    ('Modified', 'Attempt'): 'submission_updated',
+}
+
+# Canvas identifies objects in Caliper events with URNs such as urn:instructure:canvas:course:123
+_CALIPER_ID = re.compile(r'^urn:instructure:canvas:(\w+):(\d+)$')
+# Live Events may use global IDs, which add the ID of the Canvas shard times 10^13 to the local ID
+_SHARD_FACTOR = 10 ** 13
+
+WEBHOOK_EVENTS = Counter('canvas_webhook_events_total',
+                         'The number of events received by the Canvas webhook, by event name.',
+                         ('event',))
+
+
+@dataclass
+class CanvasChange:
+    """
+    A change in Canvas reported by a webhook event.
+
+    :param event: The name of the Live Event, such as 'assignment_updated'.
+    :param course_id: The ID of the course that changed.
+    :param assignment_id: The ID of the assignment that changed, if known.
+    :param user_id: The ID of the Canvas user who submitted, for submission events.
+    """
+    event: str
+    course_id: int
+    assignment_id: int | None = None
+    user_id: int | None = None
+
+
+def _local_id(value) -> int | None:
+    if value is None:
+        return None
+    match = _CALIPER_ID.match(str(value))
+    if match is not None:
+        value = match.group(2)
+    try:
+        return int(value) % _SHARD_FACTOR
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_live_event(event: dict) -> CanvasChange | None:
+    metadata = event.get('metadata') or {}
+    body = event.get('body') or {}
+    name = metadata.get('event_name')
+    if name not in ASSIGNMENT_EVENTS and name not in SUBMISSION_EVENTS:
+        return None
+
+    course_id = _local_id(body.get('context_id') or metadata.get('context_id'))
+    if course_id is None:
+        return None
+    user_id = _local_id(body.get('user_id')) if name in SUBMISSION_EVENTS else None
+    return CanvasChange(name, course_id, _local_id(body.get('assignment_id')), user_id)
+
+
+def _parse_caliper_event(event: dict) -> CanvasChange | None:
+    item = event.get('object') or {}
+    name = CALIPER_EVENTS.get((event.get('action'), item.get('type')))
+    if name is None:
+        return None
+
+    course_id = _local_id((event.get('group') or {}).get('id'))
+    if course_id is None:
+        return None
+    if name in SUBMISSION_EVENTS:
+        assignment_id = _local_id((item.get('assignable') or {}).get('id'))
+        user_id = _local_id((event.get('actor') or {}).get('id'))
+        return CanvasChange(name, course_id, assignment_id, user_id)
+    return CanvasChange(name, course_id, _local_id(item.get('id')))
+
+
+def parse_canvas_events(payload: dict | list) -> list[CanvasChange]:
+    """
+    Read the changes from a webhook payload. A payload is a Live Event, a list of Live Events, or a
+    Caliper envelope with its events in `data`. Events that don't affect assignments or submissions
+    are left out.
+
+    :param payload: The JSON body of the webhook request.
+    :return list[CanvasChange]: The changes, in the order they appear in the payload.
+    """
+    if isinstance(payload, dict):
+        events = payload['data'] if isinstance(payload.get('data'), list) else [payload]
+    else:
+        events = payload
+
+    changes = []
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        if 'metadata' in event:
+            change = _parse_live_event(event)
+        else:
+            change = _parse_caliper_event(event)
+        WEBHOOK_EVENTS.inc(change.event if change is not None else 'ignored')
+        if change is not None:
+            changes.append(change)
+    return changes
+
+
+def apply_canvas_change(change: CanvasChange) -> tuple[int, int]:
+    """
+    Remove the cached results a change affects and schedule a background sync for the users it
+    affects.
+
+    :param change: The change reported by Canvas.
+    :return tuple[int, int]: The number of cached results removed and of users scheduled.
+    """
+    if change.event in SUBMISSION_EVENTS:
+        removed = invalidations.invalidate_course(change.course_id, assignments=False)
+        scheduled = queries.mark_sync_pending(canvas_user_id=change.user_id) \
+            if change.user_id is not None else 0
+        return removed, scheduled
+
+    removed = invalidations.invalidate_course(change.course_id)
+    scheduled = queries.mark_sync_pending(course_id=change.course_id,
+                                          assignment_id=change.assignment_id)
+    return removed, scheduled
+
+
+#################################################################
+#                                                               #
+#                            TODOIST                            #
+#                                                               #
+#################################################################
+
+
+# The Todoist events that change the status of a task, and the status they set. Edits carry the
+# status in the task's `checked` field.
+TODOIST_EVENTS = {
+    'item:completed': TaskStatus.Completed,
+    'item:uncompleted': TaskStatus.Incomplete,
+    'item:updated': None,
+}
+
+# Todoist retries deliveries that time out, the IDs of recent deliveries catch the duplicates
+recent_deliveries = LRU(1000)
+
+TODOIST_WEBHOOK_EVENTS = Counter('todoist_webhook_events_total',
+                                 'The number of events received by the Todoist webhook, by result.',
+                                 ('result',))
+
+
+def verify_todoist_signature(body: bytes, signature: str, secret: str) -> bool:
+    """
+    Check that a request to the Todoist webhook was signed by Todoist. Todoist signs the body with
+    HMAC-SHA256, using the app's client secret as the key, and sends the base64 encoded digest.
+
+    :param body: The raw body of the request.
+    :param signature: The X-Todoist-Hmac-SHA256 header of the request.
+    :param secret: The client secret of the Todoist app.
+    :return bool: True if the signature matches the body, False otherwise.
+    """
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode())
+
+
+def _todoist_status(event: str, item: dict) -> TaskStatus | None:
+    status = TODOIST_EVENTS[event]
+    if status is None and 'checked' in item:
+        status = TaskStatus.Completed if item['checked'] else TaskStatus.Incomplete
+    return status
+
+
+def _apply_todoist_event(payload: dict, delivery_id: str | None) -> str:
+    if delivery_id is not None and delivery_id in recent_deliveries:
+        return 'duplicate'
+
+    result = _save_todoist_status(payload)
+    # A delivery that failed is left out, so that Todoist's retry is handled
+    if delivery_id is not None and result != 'error':
+        recent_deliveries[delivery_id] = True
+    return result
+
+
+def _save_todoist_status(payload: dict) -> str:
+    event = payload.get('event_name')
+    item = payload.get('event_data')
+    if event not in TODOIST_EVENTS or not isinstance(item, dict) or 'id' not in item:
+        return 'ignored'
+
+    status = _todoist_status(event, item)
+    if status is None:
+        return 'ignored'
+    todoist_id = str(item['id'])
+    task = queries.get_by_todoist_id(todoist_id)
+    if task is None:
+        return 'unknown'
+    if task.status == status:
+        return 'unchanged'
+    if not queries.update_task_or_subtask_status(task, status):
+        return 'error'
+
+    if isinstance(task, SubTask):
+        events.publish([task.owner, *task.shared_with], 'subtask',
+                       {'id': task.id, 'status': status.value})
+    # Every other member's copy of a shared subtask is updated without holding up Todoist
+    if isinstance(task, SubTask) and task.shared_with:
+        others = [member for member in sharing.get_shared_subtask_members(task)
+                  if member[1] != todoist_id]
+        spawn(todoist.propagate_shared_status, others, status)
+    return 'updated'
+
+
+def apply_todoist_event(payload: dict, delivery_id: str | None = None) -> str:
+    """
+    Save the status of the task or subtask a Todoist event is about.
+
+    :param payload: The JSON body of the webhook request.
+    :param delivery_id: The X-Todoist-Delivery-ID header of the request, if it was sent.
+    :return str: What was done with the event: 'updated', 'unchanged' if the status was already
+    saved, 'unknown' if no task has the Todoist ID, 'duplicate' if the delivery was already handled,
+    'ignored' for events that don't change a status, or 'error' if the status couldn't be saved.
+    Deliveries are only remembered once they were handled, so one that failed can be retried.
+    """
+    result = _apply_todoist_event(payload, delivery_id)
+    TODOIST_WEBHOOK_EVENTS.inc(result)
+    return result
@@ -144,6 +144,13 @@ export class CanvasService {
         this.dueAssignments$.next(this.dueAssignments);
     }
 
+    // Fetch the due assignments and their subtasks again, even if they were fetched recently
+    async refreshDueAssignments() {
+        this.dueAssignmentsLastUpdated = 0;
+        await this.getDueAssignments();
+        await this.getSubTasks(this.dueAssignments);
+    }
+
     async addFakeAssignment(assignment: Assignment) {
         if (assignment.due_at) {
             this.dueAssignments.push(assignment);
@@ -8,6 +8,7 @@ import { HttpClient } from '@angular/common/http';
 
 
 export interface GradeAssignment {
+    id?: number;
     name: string;
     max_score: number;
     score: number;
@@ -1,4 +1,4 @@
-import { Component, OnInit, Renderer2 } from '@angular/core';
+import { Component, OnDestroy, OnInit, Renderer2 } from '@angular/core';
 import { CommonModule } from '@angular/common';
 import { FormBuilder, FormGroup, Validators, ReactiveFormsModule } from '@angular/forms';
 import { OrderByPipe } from '../pipes/date.pipe';
@@ -83,7 +83,7 @@ export interface AddSubtaskBody {
     templateUrl: './dashboard.component.html',
     styleUrl: './dashboard.component.scss',
 })
-export class DashboardComponent implements OnInit {
+export class DashboardComponent implements OnInit, OnDestroy {
     private previousDropdown: HTMLElement | null = null;
 
     subtaskFormDisplay = false;
@@ -112,6 +112,8 @@ export class DashboardComponent implements OnInit {
     notification_url = getBackendURL() + '/api/v1/user/get_notifications';
     respond_invitation = getBackendURL() + '/api/v1/user/invitation_response';
     notification_dismiss = getBackendURL() + '/api/v1/user/dismiss_notification';
+    events_url = getBackendURL() + '/api/v1/user/events';
+    private events?: EventSource;
 
 
     sectionCollapseUpcoming = false;
@@ -160,6 +162,11 @@ export class DashboardComponent implements OnInit {
             this.canvasService.getUndatedAssignments();
         });
         this.fetchNotifications();
+        this.listenForEvents();
+    }
+
+    ngOnDestroy() {
+        this.events?.close();
     }
 
     fetchNotifications() {
@@ -169,6 +176,23 @@ export class DashboardComponent implements OnInit {
             });
     }
 
+    // Updates pushed by the backend: a collaborator toggled a shared subtask, an invitation
+    // arrived, or a background sync changed the tasks. The browser reconnects on its own.
+    listenForEvents() {
+        this.events = new EventSource(this.events_url, { withCredentials: true });
+        this.events.addEventListener('invitation', () => this.fetchNotifications());
+        this.events.addEventListener('subtask', (event: MessageEvent) => {
+            const data: { id: number, status: number } = JSON.parse(event.data);
+            for (const assignment of this.assignments) {
+                for (const subtask of assignment.subtasks ?? []) {
+                    if (subtask.id === data.id) {
+                        subtask.status = data.status;
+                    }
+                }
+            }
+        });
+        this.events.addEventListener('sync', () => this.canvasService.refreshDueAssignments());
+    }
 
     /********************************************
     *
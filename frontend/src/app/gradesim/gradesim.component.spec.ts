@@ -1,6 +1,7 @@
 import { ComponentFixture, TestBed } from '@angular/core/testing';
 import { GradesimComponent } from './gradesim.component';
 import { CourseLog } from '../courses/courses.component';
+import { provideHttpClient } from '@angular/common/http';
 
 
 describe('GradesimComponent', () => {
@@ -9,7 +10,8 @@ describe('GradesimComponent', () => {
 
     beforeEach(async () => {
         await TestBed.configureTestingModule({
-            imports: [GradesimComponent]
+            imports: [GradesimComponent],
+            providers: [provideHttpClient()]
         })
             .compileComponents();
 
@@ -2,8 +2,29 @@ import { Component, EventEmitter, Input, OnInit, Output } from '@angular/core';
 import { CommonModule } from '@angular/common';
 import { Course, CourseLog, GradeAssignment } from '../courses/courses.component';
 import { ChangeDetectorRef } from '@angular/core';
+import { HttpClient } from '@angular/common/http';
+import { getBackendURL } from '../../config';
 
+export interface GradeGroup {
+    name: string;
+    weight: number;
+    percent: number | null;
+    contribution: number;
+}
 
+export interface GradeNeeded {
+    letter: string;
+    threshold: number;
+    percent: number | null;
+    reached: boolean;
+}
+
+// A grade computed by the backend, for the actual scores or a what-if scenario
+export interface GradeSummary {
+    grade: number;
+    groups: GradeGroup[];
+    needed: GradeNeeded[];
+}
 
 @Component({
     selector: 'app-gradesim',
@@ -16,12 +37,35 @@ export class GradesimComponent implements OnInit {
     @Input() full_course?: Course;
     @Output() closeGradeSimAction = new EventEmitter();
     log_course?: Course;
+    summary?: GradeSummary;
+    // The scores the user entered, by assignment ID
+    private overrides: Record<number, number> = {};
 
-    constructor(private cdr: ChangeDetectorRef) {
+    constructor(private cdr: ChangeDetectorRef, private http: HttpClient) {
     }
 
     ngOnInit(): void {
         this.log_course = this.full_course;
+        if (this.log_course) {
+            this.http.get<GradeSummary>(this.gradesUrl(), { withCredentials: true }).subscribe({
+                next: (summary) => this.summary = summary,
+                error: (error) => console.error('Failed to fetch the grade summary', error)
+            });
+        }
+    }
+
+    private gradesUrl(): string {
+        return `${getBackendURL()}/api/v1/courses/${this.log_course?.id}/grades`;
+    }
+
+    // Asks the backend what is needed for each letter grade with the scores the user entered
+    private simulate() {
+        const body = { scenarios: [this.overrides] };
+        this.http.post<GradeSummary[]>(`${this.gradesUrl()}/simulate`, body, { withCredentials: true })
+            .subscribe({
+                next: (summaries) => this.summary = summaries[0],
+                error: (error) => console.error('Failed to simulate grades', error)
+            });
     }
 
     closeGradeSimForm() {
@@ -74,5 +118,9 @@ export class GradesimComponent implements OnInit {
             const finalGrade = this.calculateFinalGrade(this.log_course.gradelog);
             document.getElementById('potentialScore')!.innerText = `Final Grade: ${finalGrade.toFixed(2)}%`;
         }
+        if (assignment.id !== undefined) {
+            this.overrides[assignment.id] = newScore;
+            this.simulate();
+        }
     }
 }